@@ -9,10 +9,12 @@ from ai.router import SmartAIRouter
 from ai.evaluate import evaluate_step_outcome, replan_after_step
 from ai.content import (
     suggest_relations,
+    suggest_relations_batch,
     suggest_import_category,
     generate_arc_summary_from_chapters,
     generate_chapter_metadata,
     extract_timeline_events_from_content,
+    extract_timeline_events_batch,
     get_file_sample,
     analyze_split_strategy,
     execute_split_logic,
@@ -29,10 +31,12 @@ __all__ = [
     "evaluate_step_outcome",
     "replan_after_step",
     "suggest_relations",
+    "suggest_relations_batch",
     "suggest_import_category",
     "generate_arc_summary_from_chapters",
     "generate_chapter_metadata",
     "extract_timeline_events_from_content",
+    "extract_timeline_events_batch",
     "get_file_sample",
     "analyze_split_strategy",
     "execute_split_logic",
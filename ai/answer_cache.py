@@ -0,0 +1,264 @@
+# ai/answer_cache.py - Semantic answer cache: câu hỏi gần giống (cosine) + dữ liệu nguồn chưa đổi -> trả lời ngay
+"""
+Mỗi entry lưu: embedding câu hỏi, câu trả lời, scope (persona/model/strict/arc/context size + hash đích router đã resolve),
+tập dòng nguồn đã dùng (bible / chapter / chunk / timeline ids + updated_at lúc lưu), relation ids và data version chung (prefix).
+Khi lookup: tìm entry cùng scope có cosine >= ngưỡng, rồi kiểm tra lại updated_at của các dòng nguồn (mỗi bảng 1 query).
+Dòng bị sửa/xóa -> entry bị bỏ. Ghi biết trước id (invalidate_rows) -> bỏ ngay các entry phụ thuộc (reverse index).
+LRU + giới hạn số entry mỗi project. Dòng MỚI (chưa từng nằm trong context) không làm entry hết hạn; TTL xử lý phần này.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+ANSWER_CACHE_SIMILARITY = 0.95
+ANSWER_CACHE_MAX_PER_PROJECT = 200
+ANSWER_CACHE_TTL_SEC = 2 * 3600
+# kind -> bảng có cột updated_at (trigger schema_v7.8 cập nhật khi nội dung đổi)
+DEPENDENCY_TABLES = {
+    "bible": "story_bible",
+    "chapter": "chapters",
+    "chunk": "chunks",
+    "timeline": "timeline_events",
+}
+# kind chỉ invalidate qua invalidate_rows (không có fingerprint trong DB)
+PUSH_ONLY_KINDS = ("relation",)
+
+
+def new_used_rows() -> Dict[str, Set[str]]:
+    """Dict rỗng để build_context ghi lại các dòng nguồn đã đưa vào context."""
+    return {k: set() for k in list(DEPENDENCY_TABLES.keys()) + list(PUSH_ONLY_KINDS)}
+
+
+def track_rows(used_rows: Optional[Dict[str, Set[str]]], kind: str, ids: Iterable[Any]) -> None:
+    """Ghi id vào used_rows[kind] (bỏ qua nếu used_rows=None)."""
+    if used_rows is None:
+        return
+    bucket = used_rows.setdefault(kind, set())
+    for i in ids or []:
+        if i is not None and str(i).strip():
+            bucket.add(str(i))
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def _fetch_fingerprints(project_id: str, used_rows: Dict[str, Set[str]]) -> Optional[Dict[str, Dict[str, str]]]:
+    """{kind: {id: updated_at}} cho các dòng nguồn. None nếu lỗi DB (không dùng cache khi không kiểm chứng được)."""
+    out: Dict[str, Dict[str, str]] = {}
+    try:
+        from config import init_services
+        services = init_services()
+        if not services:
+            return None
+        supabase = services["supabase"]
+        for kind, table in DEPENDENCY_TABLES.items():
+            ids = sorted(used_rows.get(kind) or [])
+            if not ids:
+                continue
+            r = supabase.table(table).select("id, updated_at").eq("story_id", project_id).in_("id", ids).execute()
+            out[kind] = {str(row.get("id")): str(row.get("updated_at") or "") for row in (r.data or [])}
+        return out
+    except Exception as e:
+        print(f"answer_cache fingerprint error: {e}")
+        return None
+
+
+class AnswerCache:
+    """Cache câu trả lời cuối theo project; thread-safe."""
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_SIMILARITY,
+        max_per_project: int = ANSWER_CACHE_MAX_PER_PROJECT,
+        ttl_sec: int = ANSWER_CACHE_TTL_SEC,
+    ):
+        self.threshold = threshold
+        self.max_per_project = max_per_project
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries: Dict[str, "OrderedDict[int, Dict]"] = {}
+        # (project_id, kind, row_id) -> set(entry_id)
+        self._deps_index: Dict[Tuple[str, str, str], Set[int]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, project_id: str, entry_id: int) -> None:
+        bucket = self._entries.get(project_id)
+        entry = bucket.pop(entry_id, None) if bucket is not None else None
+        if not entry:
+            return
+        for kind, ids in entry["used_rows"].items():
+            for rid in ids:
+                key = (project_id, kind, rid)
+                s = self._deps_index.get(key)
+                if s is not None:
+                    s.discard(entry_id)
+                    if not s:
+                        self._deps_index.pop(key, None)
+
+    def lookup(self, project_id: str, prompt_vec: Optional[List[float]], scope: str) -> Optional[Dict]:
+        """Trả về {"answer", "prompt", "similarity", "sources"} nếu có entry hợp lệ; None nếu miss."""
+        if not project_id or not prompt_vec:
+            return None
+        from ai.router_cache import get_data_version
+        data_version = get_data_version(None)
+        now = time.time()
+        best, best_sim = None, 0.0
+        with self._lock:
+            bucket = self._entries.get(str(project_id)) or OrderedDict()
+            for entry_id, entry in list(bucket.items()):
+                if now - entry["stored_at"] > self.ttl_sec or entry["data_version"] != data_version:
+                    self._remove(str(project_id), entry_id)
+                    continue
+                if entry["scope"] != scope:
+                    continue
+                sim = _cosine(prompt_vec, entry["embedding"])
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = entry, sim
+        if best is None:
+            self.misses += 1
+            return None
+        current = _fetch_fingerprints(str(project_id), best["used_rows"])
+        if current is None or current != best["fingerprints"]:
+            with self._lock:
+                self._remove(str(project_id), best["id"])
+            self.misses += 1
+            return None
+        with self._lock:
+            bucket = self._entries.get(str(project_id))
+            if bucket is not None and best["id"] in bucket:
+                bucket.move_to_end(best["id"])
+        self.hits += 1
+        return {
+            "answer": best["answer"],
+            "prompt": best["prompt"],
+            "similarity": best_sim,
+            "sources": list(best.get("sources") or []),
+        }
+
+    def store(
+        self,
+        project_id: str,
+        prompt: str,
+        prompt_vec: Optional[List[float]],
+        scope: str,
+        answer: str,
+        used_rows: Optional[Dict[str, Set[str]]],
+        sources: Optional[List[str]] = None,
+    ) -> bool:
+        """Lưu câu trả lời. Bỏ qua nếu không có nguồn nào (câu trả lời không dựa trên dữ liệu dự án)."""
+        if not project_id or not prompt_vec or not answer:
+            return False
+        rows = {k: set(v) for k, v in (used_rows or {}).items() if v}
+        if not rows:
+            return False
+        fingerprints = _fetch_fingerprints(str(project_id), rows)
+        if fingerprints is None:
+            return False
+        from ai.router_cache import get_data_version
+        pid = str(project_id)
+        with self._lock:
+            self._next_id += 1
+            entry_id = self._next_id
+            bucket = self._entries.setdefault(pid, OrderedDict())
+            bucket[entry_id] = {
+                "id": entry_id,
+                "prompt": prompt,
+                "embedding": list(prompt_vec),
+                "scope": scope,
+                "answer": answer,
+                "used_rows": rows,
+                "fingerprints": fingerprints,
+                "data_version": get_data_version(None),
+                "sources": list(sources or []),
+                "stored_at": time.time(),
+            }
+            for kind, ids in rows.items():
+                for rid in ids:
+                    self._deps_index.setdefault((pid, kind, rid), set()).add(entry_id)
+            while len(bucket) > self.max_per_project:
+                oldest_id = next(iter(bucket))
+                self._remove(pid, oldest_id)
+        return True
+
+    def invalidate_rows(self, project_id: str, kind: str, ids: Iterable[Any]) -> int:
+        """Bỏ mọi entry phụ thuộc vào các dòng (kind, id). Trả về số entry đã bỏ."""
+        if not project_id:
+            return 0
+        pid = str(project_id)
+        removed = 0
+        with self._lock:
+            for rid in ids or []:
+                for entry_id in list(self._deps_index.get((pid, kind, str(rid)), set())):
+                    self._remove(pid, entry_id)
+                    removed += 1
+        return removed
+
+    def invalidate_project(self, project_id: str) -> None:
+        """Bỏ toàn bộ entry của project (VD: Clean chat / Refresh)."""
+        pid = str(project_id or "")
+        with self._lock:
+            for entry_id in list((self._entries.get(pid) or {}).keys()):
+                self._remove(pid, entry_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = sum(len(b) for b in self._entries.values())
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / total) if total else 0.0, "size": size}
+
+
+answer_cache = AnswerCache()
+
+
+def invalidate_answer_rows(project_id: str, kind: str, ids: Iterable[Any]) -> int:
+    """Tiện ích cho nơi ghi dữ liệu: bỏ entry phụ thuộc các dòng vừa sửa/xóa."""
+    try:
+        return answer_cache.invalidate_rows(project_id, kind, ids)
+    except Exception:
+        return 0
+
+
+def _router_target_fingerprint(router_out: Optional[Dict[str, Any]]) -> str:
+    """
+    Hash đích router đã resolve (entity, file, chapter_range). Router đã dùng lịch sử gần để resolve câu hỏi phụ thuộc
+    ngữ cảnh ("hắn là ai?" -> entity cụ thể, rewritten_query độc lập), nên không hash nguyên văn lịch sử:
+    cùng câu hỏi + cùng đích dùng lại được giữa các cuộc chat, khác đích thì không trùng.
+    """
+    import hashlib
+    import json
+    ro = router_out or {}
+    payload = {
+        "entities": sorted(str(x) for x in (ro.get("target_bible_entities") or [])),
+        "files": sorted(str(x) for x in (ro.get("target_files") or [])),
+        "chapter_range": ro.get("chapter_range"),
+        "chapter_range_mode": ro.get("chapter_range_mode"),
+        "chapter_range_count": ro.get("chapter_range_count") if ro.get("chapter_range_mode") else None,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def build_answer_scope(
+    persona_role: str,
+    model: str,
+    strict_mode: bool,
+    arc_id: Optional[str],
+    context_size: str,
+    router_out: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Scope: chỉ dùng lại câu trả lời khi cùng persona, model, strict mode, arc, context size và đích router.
+    Caller embed rewritten_query (câu hỏi độc lập router viết lại) để tra / lưu, không phải câu gốc phụ thuộc ngữ cảnh.
+    """
+    return "|".join([
+        str(persona_role or ""), str(model or ""), "strict" if strict_mode else "normal", str(arc_id or ""), str(context_size or ""),
+        _router_target_fingerprint(router_out),
+    ])
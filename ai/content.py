@@ -1,4 +1,4 @@
-# ai/content.py - suggest_relations, suggest_import_category, generate_*, extract_*, get_file_sample, analyze_split, execute_split
+# ai/content.py - suggest_relations(_batch), suggest_import_category, generate_*, extract_*, get_file_sample, analyze_split, execute_split
 import json
 import re
 from typing import Any, Dict, List, Optional
@@ -9,22 +9,27 @@ from ai.service import AIService, _get_default_tool_model
 from ai.utils import get_bible_entries
 
 
-def suggest_relations(content: str, story_id: str) -> List[Dict[str, Any]]:
+def suggest_relations(
+    content: str,
+    story_id: str,
+    entries: Optional[List[Dict[str, Any]]] = None,
+    max_chars: int = 15000,
+    raise_errors: bool = False,
+) -> List[Dict[str, Any]]:
     """
     AI quét nội dung (chương/đoạn) và so khớp với bible_index để đề xuất:
     - Quan hệ giữa hai thực thể: Source, Target, Relation_Type, Reason -> kind="relation".
     - Nhân vật tiến hóa (1-n): thực thể mới cùng gốc -> gợi ý parent_id, kind="parent".
+    entries: danh sách Bible đã fetch sẵn (batch); None -> tự gọi get_bible_entries.
+    max_chars: ký tự nội dung đưa vào prompt (phần của batch_planner truyền đúng giới hạn phần, không cắt thêm).
+    raise_errors=True: gọi API / parse lỗi -> raise thay vì trả [] (job giữ dữ liệu cũ).
     """
     if not content or not content.strip() or not story_id:
         return []
-    entries = get_bible_entries(story_id)
+    if entries is None:
+        entries = get_bible_entries(story_id)
     if not entries:
         return []
-    name_to_id = {}
-    for e in entries:
-        name = (e.get("entity_name") or "").strip()
-        if name:
-            name_to_id[name] = e.get("id")
     index_text = "\n".join([f"- {e.get('entity_name', '')}" for e in entries[:150]])
     prompt = f"""Bạn là trợ lý phân tích văn bản. Cho NỘI DUNG và DANH SÁCH THỰC THỂ (Bible) của một truyện.
 
@@ -33,7 +38,7 @@ DANH SÁCH THỰC THỂ (chính xác từ Bible):
 
 NỘI DUNG (đoạn/chương cần phân tích):
 ---
-{content[:15000]}
+{content[:max_chars]}
 ---
 
 Nhiệm vụ:
@@ -58,47 +63,124 @@ Chỉ trả về JSON, không giải thích thêm."""
         text = re.sub(r"^```\w*\n?", "", text).strip()
         text = re.sub(r"\n?```\s*$", "", text).strip()
         data = json.loads(text)
-        relations_in = data.get("relations") or []
-        parent_in = data.get("parent_suggestions") or []
-
-        def resolve_name(name: str) -> Optional[Any]:
-            n = (name or "").strip()
-            if n in name_to_id:
-                return name_to_id[n]
-            for k, vid in name_to_id.items():
-                if n in k or k in n:
-                    return vid
-            return None
-
-        out = []
-        for r in relations_in:
-            src_id = resolve_name(r.get("source") or "")
-            tgt_id = resolve_name(r.get("target") or "")
-            if src_id and tgt_id and src_id != tgt_id:
-                out.append({
-                    "kind": "relation",
-                    "source_entity_id": src_id,
-                    "target_entity_id": tgt_id,
-                    "relation_type": (r.get("relation_type") or "liên quan").strip(),
-                    "description": (r.get("reason") or "").strip(),
-                    "story_id": story_id,
-                })
-        for p in parent_in:
-            child_id = resolve_name(p.get("entity") or "")
-            parent_id = resolve_name(p.get("parent") or "")
-            if child_id and parent_id and child_id != parent_id:
-                out.append({
-                    "kind": "parent",
-                    "entity_id": child_id,
-                    "parent_entity_id": parent_id,
-                    "reason": (p.get("reason") or "").strip(),
-                })
-        return out
+        return _resolve_relation_items(data, _bible_name_index(entries), story_id)
     except Exception as e:
         print(f"suggest_relations error: {e}")
+        if raise_errors:
+            raise
         return []
 
 
+def _bible_name_index(entries: List[Dict[str, Any]]):
+    """Chỉ mục tên (chính xác / tiền tố / gần đúng) cho các entry Bible, dựng một lần mỗi lần gọi / lô."""
+    from core.entity_name_index import EntityNameIndex
+    return EntityNameIndex(entries)
+
+
+def _resolve_relation_items(data: Dict[str, Any], name_index, story_id: str) -> List[Dict[str, Any]]:
+    """{"relations", "parent_suggestions"} (tên) -> list kind=relation / kind=parent (id Bible). name_index: EntityNameIndex."""
+    relations_in = data.get("relations") or []
+    parent_in = data.get("parent_suggestions") or []
+
+    def resolve_name(name: str) -> Optional[Any]:
+        n = (name or "").strip()
+        return name_index.resolve(n) if n else None
+
+    out = []
+    for r in relations_in:
+        if not isinstance(r, dict):
+            continue
+        src_id = resolve_name(r.get("source") or "")
+        tgt_id = resolve_name(r.get("target") or "")
+        if src_id and tgt_id and src_id != tgt_id:
+            out.append({
+                "kind": "relation",
+                "source_entity_id": src_id,
+                "target_entity_id": tgt_id,
+                "relation_type": (r.get("relation_type") or "liên quan").strip(),
+                "description": (r.get("reason") or "").strip(),
+                "story_id": story_id,
+            })
+    for p in parent_in:
+        if not isinstance(p, dict):
+            continue
+        child_id = resolve_name(p.get("entity") or "")
+        parent_id = resolve_name(p.get("parent") or "")
+        if child_id and parent_id and child_id != parent_id:
+            out.append({
+                "kind": "parent",
+                "entity_id": child_id,
+                "parent_entity_id": parent_id,
+                "reason": (p.get("reason") or "").strip(),
+            })
+    return out
+
+
+def suggest_relations_batch(
+    contents_list: List[tuple],
+    story_id: str,
+    entries: Optional[List[Dict[str, Any]]] = None,
+) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+    """
+    Như suggest_relations nhưng nhiều chương trong MỘT lần gọi API; danh sách Bible fetch một lần cho cả lô.
+    contents_list: [(key, content), ...]; key = số chương hoặc "N-pK" (phần K của chương N, xem core.batch_planner).
+    Trả về {key: [item, ...]}; key model bỏ sót -> None. None nếu gọi API / parse lỗi (caller fallback từng chương).
+    """
+    contents_list = [(ch, str(c).strip()) for ch, c in (contents_list or []) if c and str(c).strip()]
+    if not contents_list or not story_id:
+        return {}
+    if entries is None:
+        entries = get_bible_entries(story_id)
+    if not entries:
+        return {ch: [] for ch, _ in contents_list}
+    out: Dict[Any, Optional[List[Dict[str, Any]]]] = {ch: None for ch, _ in contents_list}
+    key_by_str = {str(ch): ch for ch in out}
+    index_text = "\n".join([f"- {e.get('entity_name', '')}" for e in entries[:150]])
+    parts = [
+        "Bạn là trợ lý phân tích văn bản. Cho NỘI DUNG NHIỀU CHƯƠNG (mỗi chương bắt đầu bằng CHƯƠNG N:) và DANH SÁCH THỰC THỂ (Bible) của một truyện.",
+        "",
+        "DANH SÁCH THỰC THỂ (chính xác từ Bible):",
+        index_text,
+        "",
+        "---",
+    ]
+    from core.batch_planner import PLAN_SECTION_MAX_CHARS
+    for ch_num, content in contents_list:
+        parts.append(f"CHƯƠNG {ch_num}:")
+        parts.append(content[:PLAN_SECTION_MAX_CHARS["relation"]])
+        parts.append("")
+    parts.append("---")
+    parts.append(
+        "Với TỪNG chương, riêng biệt:\n"
+        "1) QUAN HỆ: các cặp thực thể có tương tác/liên quan trong chương đó: source, target, relation_type, reason.\n"
+        "2) NHÂN VẬT TIẾN HÓA (1-n): thực thể là \"phiên bản khác\" của thực thể đã có -> entity, parent, reason.\n\n"
+        'Trả về ĐÚNG MỘT JSON với key "chapters", value là mảng object: mỗi object có "chapter" (giữ nguyên key sau chữ CHƯƠNG, VD 12 hoặc "12-p2"), '
+        '"relations" (mảng {"source","target","relation_type","reason"}) và "parent_suggestions" (mảng {"entity","parent","reason"}). '
+        'Chương không có gì: "relations": [] và "parent_suggestions": []. Chỉ dùng tên có trong DANH SÁCH THỰC THỂ. Chỉ trả về JSON.'
+    )
+    try:
+        response = AIService.call_openrouter(
+            messages=[{"role": "user", "content": "\n".join(parts)}],
+            model=_get_default_tool_model(),
+            temperature=0.2,
+            max_tokens=min(16000, 2000 * len(contents_list)),
+            response_format={"type": "json_object"},
+        )
+        raw = AIService.clean_json_text((response.choices[0].message.content or "").strip())
+        obj = json.loads(raw)
+        name_index = _bible_name_index(entries)
+        for block in (obj.get("chapters") if isinstance(obj, dict) else None) or []:
+            if not isinstance(block, dict) or block.get("chapter") is None:
+                continue
+            ch = key_by_str.get(str(block.get("chapter")).strip())
+            if ch is not None:
+                out[ch] = _resolve_relation_items(block, name_index, story_id)
+        return out
+    except Exception as e:
+        print(f"suggest_relations_batch error: {e}")
+        return None
+
+
 def suggest_import_category(text: str) -> str:
     """Gợi ý prefix/category cho nội dung import (dùng LLM nhẹ)."""
     if not text or len(text.strip()) < 20:
@@ -199,8 +281,16 @@ Chỉ trả về JSON."""
         return {"summary": "", "art_style": ""}
 
 
-def extract_timeline_events_from_content(content: str, chapter_label: str = "") -> List[Dict[str, Any]]:
-    """AI trích xuất sự kiện timeline từ nội dung chương."""
+def extract_timeline_events_from_content(
+    content: str,
+    chapter_label: str = "",
+    max_chars: int = 25000,
+    raise_errors: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    AI trích xuất sự kiện timeline từ nội dung chương.
+    max_chars: ký tự nội dung đưa vào prompt; raise_errors=True: gọi API / parse lỗi -> raise thay vì trả [].
+    """
     if not content or not str(content).strip():
         return []
     try:
@@ -209,7 +299,7 @@ def extract_timeline_events_from_content(content: str, chapter_label: str = "")
         prompt = f"""Trích xuất các SỰ KIỆN theo thứ tự thời gian từ nội dung dưới đây. Mỗi sự kiện: event_order (1,2,...), title, description, raw_date, event_type (event|flashback|milestone|timeskip|other).
 
 {ctx}NỘI DUNG:
-{content[:25000]}
+{content[:max_chars]}
 
 Trả về ĐÚNG MỘT JSON với key "events" là mảng. Nếu không có sự kiện rõ ràng, trả về {{ "events": [] }}. Chỉ trả về JSON."""
         response = AIService.call_openrouter(
@@ -223,30 +313,85 @@ Trả về ĐÚNG MỘT JSON với key "events" là mảng. Nếu không có s
         raw = AIService.clean_json_text(raw)
         data = json.loads(raw)
         events = data.get("events") if isinstance(data, dict) else []
-        if not isinstance(events, list):
-            return []
-        out = []
-        for i, e in enumerate(events):
-            if not isinstance(e, dict):
-                continue
-            order = int(e.get("event_order", i + 1))
-            title = str(e.get("title", "")).strip() or f"Sự kiện {order}"
-            desc = str(e.get("description", ""))[:2000]
-            raw_date = str(e.get("raw_date", ""))[:200]
-            etype = str(e.get("event_type", "event")).lower()
-            if etype not in ("event", "flashback", "milestone", "timeskip", "other"):
-                etype = "event"
-            out.append({
-                "event_order": order,
-                "title": title,
-                "description": desc,
-                "raw_date": raw_date,
-                "event_type": etype,
-            })
-        return out
+        return _normalize_timeline_events(events)
     except Exception as ex:
         print(f"extract_timeline_events_from_content error: {ex}")
+        if raise_errors:
+            raise
+        return []
+
+
+def _normalize_timeline_events(events: Any) -> List[Dict[str, Any]]:
+    if not isinstance(events, list):
         return []
+    out = []
+    for i, e in enumerate(events):
+        if not isinstance(e, dict):
+            continue
+        order = int(e.get("event_order", i + 1))
+        title = str(e.get("title", "")).strip() or f"Sự kiện {order}"
+        desc = str(e.get("description", ""))[:2000]
+        raw_date = str(e.get("raw_date", ""))[:200]
+        etype = str(e.get("event_type", "event")).lower()
+        if etype not in ("event", "flashback", "milestone", "timeskip", "other"):
+            etype = "event"
+        out.append({
+            "event_order": order,
+            "title": title,
+            "description": desc,
+            "raw_date": raw_date,
+            "event_type": etype,
+        })
+    return out
+
+
+def extract_timeline_events_batch(contents_list: List[tuple]) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+    """
+    Trích xuất timeline cho nhiều chương trong MỘT lần gọi API.
+    contents_list: [(key, chapter_label, content), ...]; key = số chương hoặc "N-pK". Trả về {key: [event, ...]}
+    (key model bỏ sót -> None); None nếu gọi API / parse lỗi (caller fallback từng chương).
+    """
+    contents_list = [(ch, label, str(c).strip()) for ch, label, c in (contents_list or []) if c and str(c).strip()]
+    if not contents_list:
+        return {}
+    parts = [
+        "Trích xuất các SỰ KIỆN theo thứ tự thời gian, RIÊNG cho từng chương dưới đây (mỗi chương bắt đầu bằng CHƯƠNG N:). "
+        "Mỗi sự kiện: event_order (1,2,... trong chương), title, description, raw_date, event_type (event|flashback|milestone|timeskip|other).",
+        "",
+        "---",
+    ]
+    from core.batch_planner import PLAN_SECTION_MAX_CHARS
+    for ch_num, label, content in contents_list:
+        parts.append(f"CHƯƠNG {ch_num}: {label}" if label else f"CHƯƠNG {ch_num}:")
+        parts.append(content[:PLAN_SECTION_MAX_CHARS["timeline"]])
+        parts.append("")
+    parts.append("---")
+    parts.append(
+        'Trả về ĐÚNG MỘT JSON với key "chapters", value là mảng object: mỗi object có "chapter" (giữ nguyên key sau chữ CHƯƠNG, VD 12 hoặc "12-p2") '
+        'và "events" (mảng sự kiện). Chương không có sự kiện rõ ràng: "events": []. Chỉ trả về JSON.'
+    )
+    out: Dict[Any, Optional[List[Dict[str, Any]]]] = {ch: None for ch, _, _ in contents_list}
+    key_by_str = {str(ch): ch for ch in out}
+    try:
+        response = AIService.call_openrouter(
+            messages=[{"role": "user", "content": "\n".join(parts)}],
+            model=_get_default_tool_model(),
+            temperature=0.2,
+            max_tokens=min(16000, 4000 * len(contents_list)),
+            response_format={"type": "json_object"},
+        )
+        raw = AIService.clean_json_text((response.choices[0].message.content or "").strip())
+        obj = json.loads(raw)
+        for block in (obj.get("chapters") if isinstance(obj, dict) else None) or []:
+            if not isinstance(block, dict) or block.get("chapter") is None:
+                continue
+            ch = key_by_str.get(str(block.get("chapter")).strip())
+            if ch is not None:
+                out[ch] = _normalize_timeline_events(block.get("events"))
+        return out
+    except Exception as ex:
+        print(f"extract_timeline_events_batch error: {ex}")
+        return None
 
 
 def get_file_sample(file_content: str, sample_size: int = 80) -> str:
@@ -272,10 +417,42 @@ def analyze_split_strategy(
     file_content: str,
     file_type: str = "story",
     context_hint: str = "",
+    project_id: Optional[str] = None,
+    use_llm: bool = True,
 ) -> Dict[str, Any]:
-    """AI phân tích mẫu file để tìm quy luật phân cách. Trả về {"split_type": "...", "split_value": "..."}."""
+    """
+    Tìm quy luật phân cách. Trả về {"split_type", "split_value", "confidence", "source"}.
+    Thứ tự: cache (project + fingerprint) -> heuristic cục bộ -> LLM chỉ khi heuristic không chắc (và use_llm=True).
+    """
     if not file_content or not str(file_content).strip():
         return {"split_type": "by_length", "split_value": "2000"}
+    from ai.split_strategy import (
+        SPLIT_HEURISTIC_MIN_CONFIDENCE,
+        detect_split_strategy,
+        split_cache_key,
+        split_strategy_cache,
+    )
+    key = split_cache_key(project_id, file_type, context_hint, file_content)
+    cached = split_strategy_cache.get(key)
+    if cached:
+        cached["source"] = f"cache:{cached.get('source', '')}"
+        return cached
+    strategy = detect_split_strategy(file_content, file_type=file_type)
+    if strategy["confidence"] < SPLIT_HEURISTIC_MIN_CONFIDENCE and use_llm:
+        split_strategy_cache.llm_calls += 1
+        llm_strategy = _analyze_split_strategy_llm(file_content, file_type, context_hint)
+        if llm_strategy:
+            strategy = llm_strategy
+    split_strategy_cache.put(key, strategy)
+    return strategy
+
+
+def _analyze_split_strategy_llm(
+    file_content: str,
+    file_type: str = "story",
+    context_hint: str = "",
+) -> Optional[Dict[str, Any]]:
+    """AI phân tích mẫu file để tìm quy luật phân cách. None nếu lỗi (giữ kết quả heuristic)."""
     sample = get_file_sample(file_content, sample_size=80)
     try:
         model = _get_default_tool_model()
@@ -297,8 +474,8 @@ MẪU FILE:
 ---
 
 Trả về ĐÚNG MỘT JSON:
-- "split_type": "by_keyword" | "by_length" | "by_sheet"
-- "split_value": regex/keyword hoặc số ký tự
+- "split_type": "by_keyword" | "by_length" | "by_sheet" | "by_tokens"
+- "split_value": regex/keyword, số ký tự (by_length) hoặc "token_mỗi_chunk:token_overlap" (by_tokens, VD "400:60")
 
 Ví dụ: {{"split_type": "by_keyword", "split_value": "^Chương\\\\s+\\\\d+"}}
 Chỉ trả về JSON."""
@@ -312,14 +489,18 @@ Chỉ trả về JSON."""
         raw = (response.choices[0].message.content or "").strip()
         raw = AIService.clean_json_text(raw)
         data = json.loads(raw)
+        if not isinstance(data, dict):
+            from ai.llm_cache import drop_cached_response
+            drop_cached_response(response)
+            return None
         split_type = data.get("split_type", "by_length")
         split_value = str(data.get("split_value", "2000")).strip()
-        if split_type not in ["by_keyword", "by_length", "by_sheet"]:
+        if split_type not in ["by_keyword", "by_length", "by_sheet", "by_tokens"]:
             split_type = "by_length"
-        return {"split_type": split_type, "split_value": split_value}
+        return {"split_type": split_type, "split_value": split_value, "confidence": 1.0, "source": "llm"}
     except Exception as e:
         print(f"analyze_split_strategy error: {e}")
-        return {"split_type": "by_length", "split_value": "2000"}
+        return None
 
 
 def _build_smart_regex_pattern(keyword: str) -> str:
@@ -335,18 +516,144 @@ def _build_smart_regex_pattern(keyword: str) -> str:
         return rf"(?i)^\s*{re.escape(keyword)}\s*"
 
 
+# by_tokens: split_value = "target" hoặc "target:overlap" (token ước tính, AIService.estimate_tokens).
+BY_TOKENS_DEFAULT_VALUE = "400:60"
+# Đóng chunk ở cuối đoạn văn khi đã đạt tỷ lệ này của target (tránh cắt giữa đoạn khi không cần).
+BY_TOKENS_PARAGRAPH_FILL = 0.75
+# Ranh giới câu: . ! ? … (kèm dấu đóng ngoặc / nháy) rồi khoảng trắng.
+_SENTENCE_END_RE = re.compile(r"[.!?…]+[\"'”’»)\]]*(?=\s)")
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+
+
+def _parse_by_tokens_value(split_value: str) -> tuple:
+    """ "400:60" -> (400, 60); "400" -> (400, 50). Target giới hạn 50..8000, overlap < target/2."""
+    raw = str(split_value or "").strip()
+    target_s, _, overlap_s = raw.partition(":")
+    target = int(target_s) if target_s.strip().isdigit() else int(BY_TOKENS_DEFAULT_VALUE.split(":")[0])
+    target = max(50, min(target, 8000))
+    overlap = int(overlap_s) if overlap_s.strip().isdigit() else target // 8
+    return target, max(0, min(overlap, target // 2))
+
+
+def _sentence_spans(text: str) -> List[tuple]:
+    """[(start, end, ends_paragraph)] các câu (offset trong text), bỏ khoảng trắng hai đầu."""
+    spans = []
+    para_start = 0
+    for para_end, next_start in [(m.start(), m.end()) for m in _PARAGRAPH_RE.finditer(text)] + [(len(text), len(text))]:
+        para_spans = []
+        # Trong đoạn: mỗi dòng (hội thoại "- ...") là ranh giới, rồi tới ranh giới câu.
+        line_start = para_start
+        while line_start < para_end:
+            nl = text.find("\n", line_start, para_end)
+            line_end = para_end if nl < 0 else nl
+            cur = line_start
+            for m in _SENTENCE_END_RE.finditer(text, line_start, line_end):
+                para_spans.append((cur, m.end()))
+                cur = m.end()
+            para_spans.append((cur, line_end))
+            line_start = line_end + 1
+        stripped = []
+        for a, b in para_spans:
+            seg = text[a:b]
+            lead = len(seg) - len(seg.lstrip())
+            trail = len(seg) - len(seg.rstrip())
+            if b - trail > a + lead:
+                stripped.append((a + lead, b - trail))
+        for i, (a, b) in enumerate(stripped):
+            spans.append((a, b, i == len(stripped) - 1))
+        para_start = next_start
+    return spans
+
+
+def _split_long_span(text: str, a: int, b: int, max_chars: int) -> List[tuple]:
+    """Câu dài hơn target: cắt theo khoảng trắng gần nhất trước max_chars."""
+    out = []
+    while b - a > max_chars:
+        cut = text.rfind(" ", a + max_chars // 2, a + max_chars)
+        cut = cut if cut > a else a + max_chars
+        out.append((a, cut, False))
+        a = cut
+        while a < b and text[a].isspace():
+            a += 1
+    if b > a:
+        out.append((a, b, True))
+    return out
+
+
+def split_by_tokens(text: str, target_tokens: int, overlap_tokens: int, base_offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    Gom câu / đoạn thành chunk ~target_tokens. Overlap lưu bằng offset (meta.overlap_start = đầu phần ngữ cảnh
+    của chunk trước, căn theo câu), không chép text. Offset tính trên text gốc (+ base_offset).
+    """
+    est = AIService.estimate_tokens
+    max_chars = target_tokens * 4
+    units: List[tuple] = []
+    for a, b, ends_para in _sentence_spans(text):
+        if b - a > max_chars:
+            pieces = _split_long_span(text, a, b, max_chars)
+            pieces[-1] = (pieces[-1][0], pieces[-1][1], ends_para)
+            units.extend(pieces)
+        else:
+            units.append((a, b, ends_para))
+    groups: List[List[tuple]] = []
+    cur: List[tuple] = []
+    for a, b, ends_para in units:
+        # Token của cả đoạn text[start:end] (gồm khoảng trắng giữa các câu) = đúng nội dung sẽ lưu.
+        if cur and est(text[cur[0][0]:b]) > target_tokens:
+            groups.append(cur)
+            cur = []
+        cur.append((a, b, ends_para))
+        if ends_para and est(text[cur[0][0]:b]) >= target_tokens * BY_TOKENS_PARAGRAPH_FILL:
+            groups.append(cur)
+            cur = []
+    if cur:
+        groups.append(cur)
+    out = []
+    prev: List[tuple] = []
+    for i, g in enumerate(groups):
+        start, end = g[0][0], g[-1][1]
+        overlap_start = start
+        if overlap_tokens and prev:
+            for a, _, _ in reversed(prev):
+                if est(text[a:start]) > overlap_tokens:
+                    break
+                overlap_start = a
+        content = text[start:end]
+        out.append({
+            "title": f"Phần {i + 1}",
+            "content": content,
+            "order": i + 1,
+            "meta": {
+                "split_type": "by_tokens",
+                "char_start": base_offset + start,
+                "char_end": base_offset + end,
+                "overlap_start": base_offset + overlap_start,
+                "token_estimate": est(content),
+            },
+        })
+        prev = g
+    return out
+
+
 def execute_split_logic(
     file_content: str,
     split_type: str,
     split_value: str,
     debug: bool = False,
 ) -> List[Dict[str, Any]]:
-    """Cắt file bằng Python. Trả về list of {"title": str, "content": str, "order": int}."""
+    """
+    Cắt file bằng Python. Trả về list of {"title": str, "content": str, "order": int}.
+    by_tokens: thêm "meta" {char_start, char_end, overlap_start, token_estimate} (offset trên file_content gốc).
+    """
     if not file_content or not str(file_content).strip():
         return []
     content = str(file_content).strip()
     out = []
     try:
+        if split_type == "by_tokens":
+            target, overlap = _parse_by_tokens_value(split_value)
+            lead = len(str(file_content)) - len(str(file_content).lstrip())
+            return split_by_tokens(content, target, overlap, base_offset=lead)
         if split_type == "by_keyword":
             pattern_str = split_value.strip() or "---"
             is_regex = any(c in pattern_str for c in ["^", "$", "\\d", "\\s", "\\w", "\\+", "\\*", "\\?", "\\[", "\\(", "\\{"])
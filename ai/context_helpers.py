@@ -24,9 +24,17 @@ def get_archived_bible_ids(project_id: str) -> set:
 
 
 def get_related_chapter_nums(project_id: str, target_bible_entities: List[str]) -> List[int]:
-    """Lấy danh sách chapter_number có liên quan đến các entity (reverse lookup). Dùng cho fallback read_full_content khi search_context trả lời chưa đủ."""
+    """Lấy danh sách chapter_number có liên quan đến các entity (reverse lookup). Dùng cho fallback read_full_content khi search_context trả lời chưa đủ.
+    Ưu tiên chỉ mục nhắc tên (core.mention_index, top chương theo mật độ); chưa có chỉ mục thì dùng source_chapter."""
     if not project_id or not target_bible_entities:
         return []
+    try:
+        from core.mention_index import related_chapter_numbers
+        indexed = related_chapter_numbers(project_id, [str(e) for e in target_bible_entities if e])
+        if indexed:
+            return sorted(indexed)
+    except Exception as e:
+        print(f"get_related_chapter_nums mention index error: {e}")
     try:
         services = init_services()
         if not services:
@@ -115,8 +123,25 @@ def resolve_chapter_range(
 
 
 def get_entity_relations(entity_id: Any, project_id: str) -> str:
-    """Lấy quan hệ của entity: từ bảng entity_relations và parent_id từ story_bible. Trả về chuỗi dạng '> [RELATION]: ...'."""
+    """Lấy quan hệ của entity: từ bảng entity_relations và parent_id từ story_bible. Trả về chuỗi dạng '> [RELATION]: ...'.
+    Đọc từ đồ thị quan hệ cache (core.relation_graph); không dựng được đồ thị thì query trực tiếp như cũ."""
     lines = []
+    try:
+        from core.relation_graph import get_relation_graph
+        graph = get_relation_graph(project_id)
+    except Exception as e:
+        print(f"get_entity_relations graph error: {e}")
+        graph = None
+    if graph is not None:
+        eid = str(entity_id)
+        for edge in graph.neighbours(eid):
+            if edge.get("variant") and edge["target"] == eid:
+                name = graph.names.get(edge["source"]) or ""
+                if name:
+                    lines.append(f"> [RELATION]: Biến thể: {name} — {graph.descriptions.get(edge['source'], '')[:200]}...")
+            else:
+                lines.append(graph.format_edge(edge))
+        return "\n".join(lines)
     try:
         services = init_services()
         if not services:
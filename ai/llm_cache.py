@@ -0,0 +1,256 @@
+# ai/llm_cache.py - Cache response LLM tất định (opt-in theo call_site), lưu đĩa (SQLite) với TTL + giới hạn dung lượng
+"""
+Nhiều lời gọi công cụ cho cùng đầu vào lặp lại (Data Analyze chạy lại chương không đổi, replan, router cùng câu hỏi).
+AIService.call_openrouter tra cache trước khi gọi API khi call_site nằm trong LLM_CACHE_CALL_SITES (hoặc cache=True):
+- Key = sha256(model, messages, temperature, max_tokens, response_format).
+- Chỉ non-stream và temperature <= LLM_CACHE_MAX_TEMPERATURE.
+- Lưu SQLite (sống qua restart process); TTL theo call_site; vượt LLM_CACHE_MAX_BYTES thì xóa mục ít dùng gần đây nhất.
+- Thống kê hit / miss và token, chi phí tiết kiệm theo call_site (bảng stats), hiển thị ở tab Cost.
+- response_format json_object: chỉ lưu khi nội dung parse được JSON. Caller parse / kiểm tra shape thất bại
+  gọi drop_cached_response(response) để lần retry không nhận lại đúng câu trả lời hỏng.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+LLM_CACHE_DIR = os.path.join(tempfile.gettempdir(), "v_reviewer_llm_cache")
+LLM_CACHE_MAX_BYTES = 200 * 1024 * 1024
+LLM_CACHE_MAX_TEMPERATURE = 0.2
+LLM_CACHE_DEFAULT_TTL_SEC = 24 * 3600
+# call_site (tên hàm gọi call_openrouter) -> TTL giây. Chỉ các call_site này được cache (trừ khi cache=True).
+LLM_CACHE_CALL_SITES: Dict[str, int] = {
+    "_run_extract_bible_batch": 7 * 24 * 3600,
+    "_analyze_split_strategy_llm": 30 * 24 * 3600,
+    "generate_chapter_metadata": 7 * 24 * 3600,
+    "is_answer_sufficient": 24 * 3600,
+    "_verify_grounding_llm": 24 * 3600,
+    # Router / planner (temperature 0.1): prompt đã chứa lịch sử + dữ liệu project; TTL ngắn.
+    "_ai_router_pro_v2_llm": 3600,
+    "_get_plan_v7_llm": 3600,
+    # Cây tóm tắt: prompt chứa nguyên tóm tắt con / câu hỏi -> dữ liệu đổi thì key đổi.
+    "_summarize_block_llm": 30 * 24 * 3600,
+    "_map_range_llm": 24 * 3600,
+}
+# Dọn mục hết hạn / vượt dung lượng sau mỗi N lần ghi.
+LLM_CACHE_EVICT_EVERY_PUTS = 50
+
+
+def cache_key(model: str, messages: List[Dict], temperature: float, max_tokens: int, response_format: Optional[Dict]) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": round(float(temperature or 0), 4), "max_tokens": max_tokens, "response_format": response_format},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(call_site: Optional[str], temperature: float, stream: bool, cache: Optional[bool]) -> bool:
+    """cache=True/False ghi đè; None -> theo LLM_CACHE_CALL_SITES."""
+    if stream or cache is False:
+        return False
+    if float(temperature or 0) > LLM_CACHE_MAX_TEMPERATURE:
+        return False
+    return bool(cache) or (call_site or "") in LLM_CACHE_CALL_SITES
+
+
+def cached_response(content: str, model: str, finish_reason: str = "stop") -> Any:
+    """Đối tượng giống response OpenAI (choices[0].message.content); usage=None, from_cache=True."""
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+        model=model,
+        usage=None,
+        usage_record=None,
+        from_cache=True,
+    )
+
+
+class LLMResponseCache:
+    """Store SQLite thread-safe (một connection, khóa trong process)."""
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        self.path = path or os.path.join(LLM_CACHE_DIR, "responses.sqlite3")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._puts = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, call_site TEXT, model TEXT, content TEXT, finish_reason TEXT,"
+                " prompt_tokens INT, completion_tokens INT, cost REAL, size INT,"
+                " created_at REAL, expires_at REAL, last_access REAL, hits INT DEFAULT 0)"
+            )
+            try:
+                # File cache tạo trước khi có cột user_id (người ghi mục, để xóa theo user).
+                conn.execute("ALTER TABLE entries ADD COLUMN user_id TEXT")
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats ("
+                " call_site TEXT PRIMARY KEY, hits INT DEFAULT 0, misses INT DEFAULT 0,"
+                " saved_prompt_tokens INT DEFAULT 0, saved_completion_tokens INT DEFAULT 0, saved_cost REAL DEFAULT 0)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _bump_stats(self, db: sqlite3.Connection, call_site: str, hit: bool, row: Optional[tuple] = None) -> None:
+        db.execute("INSERT OR IGNORE INTO stats(call_site) VALUES (?)", (call_site,))
+        if hit and row:
+            db.execute(
+                "UPDATE stats SET hits = hits + 1, saved_prompt_tokens = saved_prompt_tokens + ?,"
+                " saved_completion_tokens = saved_completion_tokens + ?, saved_cost = saved_cost + ? WHERE call_site = ?",
+                (int(row[0] or 0), int(row[1] or 0), float(row[2] or 0), call_site),
+            )
+        else:
+            db.execute("UPDATE stats SET misses = misses + 1 WHERE call_site = ?", (call_site,))
+
+    def get(self, key: str, call_site: str = "") -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            with self._lock:
+                db = self._db()
+                row = db.execute(
+                    "SELECT content, finish_reason, prompt_tokens, completion_tokens, cost, expires_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[5] < now:
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    row = None
+                if row:
+                    db.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                self._bump_stats(db, call_site or "", bool(row), (row[2], row[3], row[4]) if row else None)
+                db.commit()
+        except Exception as e:
+            print(f"llm_cache get error: {e}")
+            return None
+        if not row:
+            return None
+        return {"content": row[0], "finish_reason": row[1] or "stop"}
+
+    def put(
+        self, key: str, call_site: str, model: str, content: str, finish_reason: str, usage_record: Optional[Dict], ttl_sec: int,
+        user_id: Optional[str] = None,
+    ) -> None:
+        now = time.time()
+        u = usage_record or {}
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO entries(key, call_site, model, content, finish_reason, prompt_tokens, completion_tokens, cost,"
+                    " size, created_at, expires_at, last_access, hits, user_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                    (
+                        key, call_site or "", model, content, finish_reason or "stop",
+                        int(u.get("prompt_tokens") or 0), int(u.get("completion_tokens") or 0), float(u.get("cost") or 0),
+                        len(content.encode("utf-8")), now, now + ttl_sec, now, str(user_id) if user_id else None,
+                    ),
+                )
+                self._puts += 1
+                if self._puts % LLM_CACHE_EVICT_EVERY_PUTS == 1:
+                    self._evict(db, now)
+                db.commit()
+        except Exception as e:
+            print(f"llm_cache put error: {e}")
+
+    def invalidate(self, key: Optional[str]) -> None:
+        """Bỏ một mục (caller không dùng được câu trả lời đã cache)."""
+        if not key:
+            return
+        try:
+            with self._lock:
+                db = self._db()
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                db.commit()
+        except Exception as e:
+            print(f"llm_cache invalidate error: {e}")
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        """Xóa mục hết hạn; vượt max_bytes -> xóa theo last_access cũ nhất tới còn ~90%."""
+        db.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            victims.append((key,))
+            freed += int(size or 0)
+            if total - freed <= target:
+                break
+        db.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+    def stats(self) -> Dict[str, Any]:
+        """{"by_call_site": [{call_site, hits, misses, hit_rate, saved_prompt_tokens, saved_completion_tokens, saved_cost}], "entries", "bytes"}."""
+        try:
+            with self._lock:
+                db = self._db()
+                rows = db.execute(
+                    "SELECT call_site, hits, misses, saved_prompt_tokens, saved_completion_tokens, saved_cost FROM stats ORDER BY hits DESC"
+                ).fetchall()
+                n, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except Exception as e:
+            print(f"llm_cache stats error: {e}")
+            return {"by_call_site": [], "entries": 0, "bytes": 0}
+        by_site = []
+        for call_site, hits, misses, sp, sc, cost in rows:
+            total = (hits or 0) + (misses or 0)
+            by_site.append({
+                "call_site": call_site,
+                "hits": hits or 0,
+                "misses": misses or 0,
+                "hit_rate": round((hits or 0) / total, 3) if total else 0.0,
+                "saved_prompt_tokens": sp or 0,
+                "saved_completion_tokens": sc or 0,
+                "saved_cost": round(float(cost or 0), 6),
+            })
+        return {"by_call_site": by_site, "entries": n, "bytes": size}
+
+    def clear(self, user_id: Optional[str] = None) -> int:
+        """user_id: chỉ xóa mục do user đó ghi (giữ stats chung). None: xóa toàn bộ mục + stats (bảo trì). Trả về số mục đã xóa."""
+        try:
+            with self._lock:
+                db = self._db()
+                if user_id:
+                    n = db.execute("DELETE FROM entries WHERE user_id = ?", (str(user_id),)).rowcount
+                else:
+                    n = db.execute("DELETE FROM entries").rowcount
+                    db.execute("DELETE FROM stats")
+                db.commit()
+                return n or 0
+        except Exception as e:
+            print(f"llm_cache clear error: {e}")
+            return 0
+
+
+llm_response_cache = LLMResponseCache()
+
+
+def ttl_for_call_site(call_site: Optional[str]) -> int:
+    return LLM_CACHE_CALL_SITES.get(call_site or "", LLM_CACHE_DEFAULT_TTL_SEC)
+
+
+def is_valid_json_content(content: str) -> bool:
+    """Nội dung json_object có parse được không (cùng cách làm sạch với caller: AIService.clean_json_text)."""
+    try:
+        from ai.service import AIService
+        json.loads(AIService.clean_json_text(content))
+        return True
+    except Exception:
+        return False
+
+
+def drop_cached_response(response: Any) -> None:
+    """Gọi ở nhánh parse lỗi của caller: bỏ mục cache đã sinh ra / trả về response này (không có key thì bỏ qua)."""
+    llm_response_cache.invalidate(getattr(response, "llm_cache_key", None))
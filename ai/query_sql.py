@@ -13,6 +13,8 @@ from ai.utils import (
 )
 
 VALID_QUERY_TARGETS = ("chapters", "rules", "bible_entity", "chunks", "timeline", "relation", "summary", "art")
+# "những gì xảy ra giữa <sự kiện A> và <sự kiện B>" -> lát cắt timeline giữa hai mốc.
+_TIMELINE_BETWEEN_RE = re.compile(r"giữa\s+(?:sự kiện\s+)?[\"'“]?(.+?)[\"'”]?\s+và\s+(?:sự kiện\s+)?[\"'“]?(.+?)[\"'”]?\s*[?.!]*$", re.IGNORECASE)
 
 
 def infer_query_target(user_prompt: str, router_result: Dict) -> str:
@@ -42,6 +44,31 @@ def infer_query_target(user_prompt: str, router_result: Dict) -> str:
     return "bible_entity"
 
 
+def _timeline_between(project_id: str, query: str) -> str:
+    """Block timeline giữa hai sự kiện nêu trong câu hỏi (theo chỉ mục timeline). "" nếu không nhận ra / không tìm thấy mốc."""
+    m = _TIMELINE_BETWEEN_RE.search((query or "").strip())
+    if not m:
+        return ""
+    try:
+        from core.timeline_index import get_timeline_index
+        index = get_timeline_index(project_id)
+        if index is None:
+            return ""
+        ev_a, ev_b = index.find(m.group(1)), index.find(m.group(2))
+        if not ev_a or not ev_b:
+            return ""
+        events = index.between(ev_a["id"], ev_b["id"], inclusive=True)
+    except Exception as e:
+        print(f"_timeline_between error: {e}")
+        return ""
+    lines = []
+    for e in events[:50]:
+        desc = (e.get("description") or "")[:200]
+        lines.append(f"- [{e.get('event_order', '')}] {e.get('title') or ''}: {desc}")
+    header = f"\n--- TIMELINE (query_Sql) - giữa \"{ev_a.get('title')}\" và \"{ev_b.get('title')}\" ---\n"
+    return header + "\n".join(lines)
+
+
 def build_query_sql_context(
     router_result: Dict, project_id: str, arc_id: Optional[str] = None
 ) -> Tuple[str, str]:
@@ -128,6 +155,9 @@ def build_query_sql_context(
 
     if query_target == "timeline":
         ch_tuple = tuple(chapter_range) if chapter_range and len(chapter_range) >= 2 else None
+        between = _timeline_between(project_id, router_result.get("rewritten_query") or "")
+        if between:
+            return between, "🔍 Query SQL"
         events = get_timeline_events(project_id, limit=50, chapter_range=ch_tuple, arc_id=arc_id)
         if not events:
             return "\n--- TIMELINE (query_Sql) ---\nChưa có sự kiện timeline nào." + (" (có thể chưa extract cho khoảng chương này.)" if ch_tuple else ""), "🔍 Query SQL"
@@ -148,6 +178,14 @@ def build_query_sql_context(
         if not raw_list:
             return "\n--- QUAN HỆ (query_Sql) ---\nKhông tìm thấy entity tương ứng.", "🔍 Query SQL"
         main_id = raw_list[0].get("id")
+        if len(entities) >= 2 and entities[1]:
+            # "A và B liên quan thế nào": chỉ đưa chuỗi quan hệ ngắn nhất, không dump mọi cạnh.
+            other = HybridSearch.smart_search_hybrid_raw(str(entities[1]).strip(), project_id, top_k=1)
+            if other and other[0].get("id") and other[0].get("id") != main_id:
+                from core.relation_graph import describe_relation_path
+                path_text = describe_relation_path(project_id, main_id, other[0]["id"])
+                if path_text:
+                    return "\n--- QUAN HỆ (query_Sql) ---\n" + path_text, "🔍 Query SQL"
         rel_text = get_entity_relations(main_id, project_id)
         block = "\n--- QUAN HỆ (query_Sql) ---\n" + (rel_text.strip() if rel_text else "Chưa có quan hệ nào cho entity này.")
         return block, "🔍 Query SQL"
@@ -6,6 +6,8 @@ from typing import Dict
 from config import Config
 
 from ai.context_helpers import get_mandatory_rules
+from ai.llm_cache import drop_cached_response
+from ai.router_cache import router_cache
 from ai.context_schema import (
     infer_default_context_needs,
     normalize_context_needs,
@@ -85,8 +87,17 @@ class SmartAIRouter:
 
     @staticmethod
     def ai_router_pro_v2(user_prompt: str, chat_history_text: str, project_id: str = None) -> Dict:
-        """Router V2: Phân tích Intent và Target Files, có inject bible_index để nhận diện ý định."""
+        """Router V2 có cache (prompt + lịch sử + data version). Kết quả có thêm _router_cache: hit|miss."""
         chat_history_text = cap_chat_history_to_tokens(chat_history_text or "")
+        return router_cache.get_or_compute(
+            "router", user_prompt, chat_history_text, project_id,
+            lambda: SmartAIRouter._ai_router_pro_v2_llm(user_prompt, chat_history_text, project_id),
+            should_cache=lambda r: not str(r.get("reason", "")).startswith("Router error"),
+        )
+
+    @staticmethod
+    def _ai_router_pro_v2_llm(user_prompt: str, chat_history_text: str, project_id: str = None) -> Dict:
+        """Router V2: Phân tích Intent và Target Files, có inject bible_index để nhận diện ý định."""
         rules_context = ""
         bible_index = ""
         prefix_setup_str = ""
@@ -214,6 +225,7 @@ Bạn là AI Điều Phối Viên (Router) cho hệ thống V7-Universal. Nhiệ
             {"role": "system", "content": "Bạn là AI Router thông minh. Chỉ trả về JSON."},
             {"role": "user", "content": router_prompt}
         ]
+        response = None
         try:
             response = AIService.call_openrouter(
                 messages=messages,
@@ -273,6 +285,7 @@ Bạn là AI Điều Phối Viên (Router) cho hệ thống V7-Universal. Nhiệ
             return result
         except Exception as e:
             print(f"Router error: {e}")
+            drop_cached_response(response)
             return {
                 "intent": "chat_casual",
                 "context_needs": [], "context_priority": [],
@@ -285,6 +298,15 @@ Bạn là AI Điều Phối Viên (Router) cho hệ thống V7-Universal. Nhiệ
 
     @staticmethod
     def get_plan_v7(user_prompt: str, chat_history_text: str, project_id: str = None) -> Dict:
+        """V7 Planner có cache (prompt + lịch sử + data version). Kết quả có thêm _router_cache: hit|miss."""
+        return router_cache.get_or_compute(
+            "planner", user_prompt, cap_chat_history_to_tokens(chat_history_text or ""), project_id,
+            lambda: SmartAIRouter._get_plan_v7_llm(user_prompt, chat_history_text, project_id),
+            should_cache=lambda r: not str(r.get("analysis", "")).startswith("Router error"),
+        )
+
+    @staticmethod
+    def _get_plan_v7_llm(user_prompt: str, chat_history_text: str, project_id: str = None) -> Dict:
         """V7 Agentic Planner: Trả về plan (mảng bước) thay vì single intent."""
         rules_context = ""
         bible_index = ""
@@ -320,6 +342,7 @@ Trả về ĐÚNG MỘT JSON:
 {{ "analysis": "...", "plan": [ {{ "step_id": 1, "intent": "...", "args": {{ "query_refined": "...", "context_needs": [], "target_files": [], "target_bible_entities": [], "chapter_range": null, "chapter_range_mode": null, "chapter_range_count": 5, "data_operation_type": "", "data_operation_target": "", "query_target": "" }}, "dependency": null }} ], "verification_required": true }}
 Chỉ trả về JSON."""
 
+        response = None
         try:
             response = AIService.call_openrouter(
                 messages=[
@@ -336,10 +359,12 @@ Chỉ trả về JSON."""
             data = json.loads(content)
         except Exception as e:
             print(f"Planner V7 error: {e}")
+            drop_cached_response(response)
             single = SmartAIRouter.ai_router_pro_v2(user_prompt, chat_history_text, project_id)
             return SmartAIRouter._single_intent_to_plan(single, user_prompt)
-        plan = data.get("plan")
+        plan = data.get("plan") if isinstance(data, dict) else None
         if not plan or not isinstance(plan, list):
+            drop_cached_response(response)
             single = SmartAIRouter.ai_router_pro_v2(user_prompt, chat_history_text, project_id)
             return SmartAIRouter._single_intent_to_plan(single, user_prompt)
         analysis = data.get("analysis", "")
@@ -0,0 +1,169 @@
+# ai/router_cache.py - Cache kết quả Router / Planner theo (prompt chuẩn hóa, hash lịch sử, data version của project)
+"""
+Câu hỏi lặp lại (hoặc fallback ai_router_pro_v2 trong get_plan_v7) không gọi lại LLM.
+Key = kind + prompt chuẩn hóa + sha1(lịch sử đã cap) + project_id + data version.
+Data version tăng khi ghi Bible / chương / prefix (bump_data_version) -> key cũ tự hết hiệu lực.
+Có TTL + LRU và gộp request đang chạy (2 request giống nhau đồng thời chỉ gọi LLM 1 lần).
+"""
+import copy
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+ROUTER_CACHE_TTL_SEC = 900
+ROUTER_CACHE_MAX_ENTRIES = 256
+# Chờ tối đa (giây) khi một request giống hệt đang được tính ở thread khác.
+ROUTER_CACHE_INFLIGHT_WAIT_SEC = 60
+
+_versions_lock = threading.Lock()
+_data_versions: Dict[str, int] = {}
+# Version chung (bảng bible_prefix_config không gắn project): tăng -> mọi key cũ hết hiệu lực.
+_global_version = 0
+
+
+def bump_data_version(project_id: Optional[str] = None) -> None:
+    """Tăng data version của project (sau khi ghi Bible/chương). project_id=None: tăng version chung (prefix)."""
+    global _global_version
+    with _versions_lock:
+        if project_id:
+            _data_versions[str(project_id)] = _data_versions.get(str(project_id), 0) + 1
+        else:
+            _global_version += 1
+
+
+def get_data_version(project_id: Optional[str]) -> str:
+    """Data version hiện tại dạng 'global.project' (dùng làm một phần của cache key)."""
+    with _versions_lock:
+        return f"{_global_version}.{_data_versions.get(str(project_id or ''), 0)}"
+
+
+def normalize_prompt(text: str) -> str:
+    """Chuẩn hóa prompt: strip, lower, gộp khoảng trắng, bỏ dấu câu cuối câu."""
+    t = re.sub(r"\s+", " ", (text or "").strip().lower())
+    return t.rstrip(" ?!.…")
+
+
+class RouterCache:
+    """LRU + TTL cho output router/planner, thread-safe, có gộp request đang chạy."""
+
+    def __init__(self, max_entries: int = ROUTER_CACHE_MAX_ENTRIES, ttl_sec: int = ROUTER_CACHE_TTL_SEC):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, prompt: str, history_text: str, project_id: Optional[str]) -> str:
+        history_hash = hashlib.sha1((history_text or "").encode("utf-8")).hexdigest()
+        raw = "\x1f".join([
+            kind,
+            normalize_prompt(prompt),
+            history_hash,
+            str(project_id or ""),
+            get_data_version(project_id),
+        ])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _get_fresh(self, key: str) -> Optional[Any]:
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        stored_at, value = item
+        if time.time() - stored_at > self.ttl_sec:
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self,
+        kind: str,
+        prompt: str,
+        history_text: str,
+        project_id: Optional[str],
+        compute: Callable[[], Any],
+        should_cache: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Trả về (bản copy) kết quả đã cache, hoặc gọi compute() rồi lưu.
+        Kết quả dạng dict được gắn thêm "_router_cache": "hit" | "miss".
+        should_cache(result) = False (VD: kết quả fallback do lỗi) thì không lưu.
+        """
+        key = self.make_key(kind, prompt, history_text, project_id)
+        while True:
+            with self._lock:
+                value = self._get_fresh(key)
+                if value is not None:
+                    self.hits += 1
+                    return self._mark(value, "hit")
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    self.misses += 1
+                    break
+            # Request giống hệt đang chạy: chờ rồi đọc lại cache. Nếu thread kia lỗi/không cache -> tự tính.
+            event.wait(ROUTER_CACHE_INFLIGHT_WAIT_SEC)
+            with self._lock:
+                value = self._get_fresh(key)
+                if value is not None:
+                    self.hits += 1
+                    return self._mark(value, "hit")
+                if self._inflight.get(key) is event:
+                    self._inflight.pop(key, None)
+        try:
+            result = compute()
+            if result is not None and (should_cache is None or should_cache(result)):
+                with self._lock:
+                    self._put(key, copy.deepcopy(result))
+            return self._mark(result, "miss")
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is event:
+                    self._inflight.pop(key, None)
+            event.set()
+
+    @staticmethod
+    def _mark(value: Any, status: str) -> Any:
+        out = copy.deepcopy(value)
+        if isinstance(out, dict):
+            out["_router_cache"] = status
+        return out
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return (self.hits / total) if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "size": size}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+router_cache = RouterCache()
+
+
+def get_router_cache_note(router_result: Optional[Dict]) -> str:
+    """Chuỗi ngắn cho debug_notes: trạng thái hit/miss của lần gọi + hit rate tích lũy."""
+    status = (router_result or {}).get("_router_cache") if isinstance(router_result, dict) else None
+    if not status:
+        return ""
+    rate = int(round(router_cache.hit_rate() * 100))
+    icon = "⚡" if status == "hit" else "🧭"
+    return f"{icon} Router cache {status} ({rate}% hit)"
@@ -1,4 +1,7 @@
 # ai/service.py - AIService và model mặc định cho công cụ
+import sys
+import time
+
 import streamlit as st
 from openai import OpenAI
 from typing import Any, Dict, List, Optional
@@ -38,9 +41,33 @@ class AIService:
         temperature: float = 0.7,
         max_tokens: int = 8000,
         stream: bool = False,
-        response_format: Optional[Dict] = None
+        response_format: Optional[Dict] = None,
+        call_site: Optional[str] = None,
+        cache: Optional[bool] = None,
     ) -> Any:
-        """Gọi OpenRouter API sử dụng OpenAI client"""
+        """Gọi OpenRouter API sử dụng OpenAI client. Usage thật (tokens, cost, latency) được ghi vào cost ledger.
+        stream=True: trả về UsageTrackingStream (chỉ yield chunk có choices; usage ghi khi stream kết thúc).
+        cache: None = theo LLM_CACHE_CALL_SITES (ai/llm_cache.py), True/False = bật/tắt cho lần gọi này.
+        Cache hit: response có from_cache=True, usage_record=None, không ghi cost ledger."""
+        from core.cost_ledger import UsageTrackingStream, record_response_usage
+        from ai.llm_cache import cache_key, cached_response, is_cacheable, llm_response_cache, ttl_for_call_site
+        if call_site is None:
+            try:
+                call_site = sys._getframe(1).f_code.co_name
+            except Exception:
+                call_site = ""
+        key = None
+        if getattr(Config, "LLM_CACHE_ENABLED", True) and is_cacheable(call_site, temperature, stream, cache):
+            try:
+                key = cache_key(model, messages, temperature, max_tokens, response_format)
+                hit = llm_response_cache.get(key, call_site)
+                if hit is not None:
+                    cached = cached_response(hit["content"], model, hit["finish_reason"])
+                    cached.llm_cache_key = key
+                    return cached
+            except Exception as e:
+                print(f"llm_cache lookup error: {e}")
+                key = None
         try:
             client = OpenAI(
                 base_url=Config.OPENROUTER_BASE_URL,
@@ -51,19 +78,50 @@ class AIService:
                 }
             )
 
+            extra = {"stream_options": {"include_usage": True}} if stream else {}
+            started_at = time.time()
             response = client.chat.completions.create(
                 model=model,
                 messages=messages,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 stream=stream,
-                response_format=response_format
+                response_format=response_format,
+                **extra
             )
-
-            return response
         except Exception as e:
             raise Exception(f"OpenRouter API error: {str(e)}")
 
+        if stream:
+            return UsageTrackingStream(response, model, started_at, call_site=call_site)
+        try:
+            response.usage_record = record_response_usage(
+                getattr(response, "usage", None), model, int((time.time() - started_at) * 1000), call_site=call_site,
+            )
+        except Exception as e:
+            print(f"cost_ledger record error: {e}")
+        if key:
+            try:
+                from ai.llm_cache import is_valid_json_content
+                from core.cost_ledger import get_cost_actor
+                choice = response.choices[0]
+                content = choice.message.content
+                wants_json = (response_format or {}).get("type") == "json_object"
+                if (
+                    content
+                    and getattr(choice, "finish_reason", None) in (None, "stop")
+                    and (not wants_json or is_valid_json_content(content))
+                ):
+                    llm_response_cache.put(
+                        key, call_site, model, content, "stop",
+                        getattr(response, "usage_record", None), ttl_for_call_site(call_site),
+                        user_id=get_cost_actor()[0],
+                    )
+                    response.llm_cache_key = key
+            except Exception as e:
+                print(f"llm_cache store error: {e}")
+        return response
+
     @staticmethod
     def get_embedding(text: str) -> Optional[List[float]]:
         """Lấy embedding từ OpenRouter"""
@@ -0,0 +1,170 @@
+# ai/split_strategy.py - Nhận diện quy luật phân cách bằng heuristic (không LLM) + cache theo project / fingerprint tài liệu
+"""
+analyze_split_strategy gọi detect_split_strategy trước:
+- Chấm điểm các mẫu tiêu đề ứng viên (Chương / Chapter / Hồi / Phần / Part / Quyển, dấu phân cách ***, ---, ===,
+  heading markdown, tiêu đề đánh số) theo số lần xuất hiện, độ đều khoảng cách và thứ tự số tăng dần.
+- Không có mẫu nào lặp lại (VD: chunk trong 1 chương) -> by_length, đủ tin cậy, không cần LLM.
+- Chỉ khi có mẫu lặp lại nhưng điểm thấp (mơ hồ) mới cần LLM.
+Kết quả (heuristic hoặc LLM) được cache theo (project, loại file, gợi ý, fingerprint mẫu file).
+"""
+import hashlib
+import re
+import statistics
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Dưới ngưỡng này analyze_split_strategy mới gọi LLM.
+SPLIT_HEURISTIC_MIN_CONFIDENCE = 0.6
+# Mẫu lặp lại có điểm từ ngưỡng này tới MIN_CONFIDENCE coi là mơ hồ (hỏi LLM); thấp hơn coi như không có cấu trúc.
+SPLIT_AMBIGUOUS_MIN_CONFIDENCE = 0.35
+# Khoảng cách trung bình giữa 2 tiêu đề nhỏ hơn -> giống danh sách hơn là chương.
+SPLIT_MIN_SECTION_CHARS = 300
+# Dòng tiêu đề dài hơn -> không tính (câu văn bắt đầu bằng "Chương 3 ...").
+SPLIT_MAX_HEADING_CHARS = 120
+SPLIT_STRATEGY_CACHE_MAX = 512
+
+_ROMAN = r"[IVXLCDM]+"
+# (tên, regex dùng cho execute_split_logic (IGNORECASE | MULTILINE), có số thứ tự?, trọng số)
+SPLIT_CANDIDATES: List[Tuple[str, str, bool, float]] = [
+    ("chuong", r"^[ \t]*(?:Chương|Chuong)[ \t]+(\d+|" + _ROMAN + r")\b", True, 1.0),
+    ("chapter", r"^[ \t]*Chapter[ \t]+(\d+|" + _ROMAN + r")\b", True, 1.0),
+    ("hoi", r"^[ \t]*(?:Hồi|Hoi)[ \t]+(\d+|" + _ROMAN + r")\b", True, 1.0),
+    ("phan", r"^[ \t]*(?:Phần|Phan)[ \t]+(\d+|" + _ROMAN + r")\b", True, 0.95),
+    ("part", r"^[ \t]*Part[ \t]+(\d+|" + _ROMAN + r")\b", True, 0.95),
+    ("quyen", r"^[ \t]*(?:Quyển|Quyen|Tập|Tap|Volume)[ \t]+(\d+|" + _ROMAN + r")\b", True, 0.9),
+    ("sheet", r"^\[Sheet:", False, 1.0),
+    ("stars", r"^[ \t]*(?:\*[ \t]*){3,}$", False, 0.85),
+    ("dashes", r"^[ \t]*-{3,}[ \t]*$", False, 0.8),
+    ("equals", r"^[ \t]*={3,}[ \t]*$", False, 0.8),
+    ("md_heading", r"^#{1,3}[ \t]+\S", False, 0.85),
+    ("numbered", r"^[ \t]*(\d{1,4})[.)][ \t]+\S", True, 0.75),
+]
+_COMPILED = [(name, pattern, re.compile(pattern, re.IGNORECASE | re.MULTILINE), numbered, weight) for name, pattern, numbered, weight in SPLIT_CANDIDATES]
+_ROMAN_VALUES = {"I": 1, "V": 5, "X": 10, "L": 50, "C": 100, "D": 500, "M": 1000}
+
+
+def _to_number(token: str) -> Optional[int]:
+    if not token:
+        return None
+    if token.isdigit():
+        return int(token)
+    total, prev = 0, 0
+    for ch in reversed(token.upper()):
+        v = _ROMAN_VALUES.get(ch)
+        if v is None:
+            return None
+        total = total - v if v < prev else total + v
+        prev = max(prev, v)
+    return total
+
+
+def _score_candidate(text: str, regex, numbered: bool, weight: float) -> Tuple[float, int]:
+    """(confidence 0..1, số tiêu đề hợp lệ)."""
+    positions, numbers = [], []
+    for m in regex.finditer(text):
+        line_end = text.find("\n", m.start())
+        line_len = (line_end if line_end >= 0 else len(text)) - m.start()
+        if line_len > SPLIT_MAX_HEADING_CHARS:
+            continue
+        positions.append(m.start())
+        if numbered and m.groups():
+            numbers.append(_to_number(m.group(1)))
+    n = len(positions)
+    if n < 2:
+        return 0.0, n
+    gaps = [b - a for a, b in zip(positions, positions[1:])]
+    mean_gap = statistics.mean(gaps)
+    cv = statistics.pstdev(gaps) / mean_gap if mean_gap else 10.0
+    count_score = min(1.0, (n - 1) / 4.0)
+    spacing_score = 1.0 / (1.0 + cv)
+    if numbered:
+        pairs = [(a, b) for a, b in zip(numbers, numbers[1:]) if a is not None and b is not None]
+        seq_score = (sum(1 for a, b in pairs if b > a) / len(pairs)) if pairs else 0.5
+    else:
+        seq_score = 0.6
+    confidence = weight * (0.4 * count_score + 0.3 * spacing_score + 0.3 * seq_score)
+    if mean_gap < SPLIT_MIN_SECTION_CHARS:
+        confidence *= 0.3
+    return round(confidence, 3), n
+
+
+def detect_split_strategy(file_content: str, file_type: str = "story") -> Dict[str, Any]:
+    """
+    Heuristic cục bộ. Trả về {"split_type", "split_value", "confidence", "source": "heuristic", "matches"}.
+    confidence < SPLIT_HEURISTIC_MIN_CONFIDENCE: mẫu mơ hồ, nên hỏi LLM.
+    """
+    text = str(file_content or "")
+    best_name, best_pattern, best_conf, best_n = None, None, 0.0, 0
+    for name, pattern, regex, numbered, weight in _COMPILED:
+        conf, n = _score_candidate(text, regex, numbered, weight)
+        if conf > best_conf:
+            best_name, best_pattern, best_conf, best_n = name, pattern, conf, n
+    if best_pattern and best_conf >= SPLIT_HEURISTIC_MIN_CONFIDENCE:
+        return {"split_type": "by_keyword", "split_value": best_pattern, "confidence": best_conf, "source": "heuristic", "matches": best_n, "pattern_name": best_name}
+    ambiguous = best_conf >= SPLIT_AMBIGUOUS_MIN_CONFIDENCE
+    if (file_type or "").strip().lower() == "excel_export":
+        return {"split_type": "by_sheet", "split_value": "100", "confidence": best_conf if ambiguous else 0.7, "source": "heuristic", "matches": 0}
+    # Không có tiêu đề lặp lại (VD: nội dung 1 chương) -> cắt theo độ dài; có lặp lại nhưng điểm lưng chừng -> mơ hồ.
+    return {
+        "split_type": "by_length",
+        "split_value": "2000",
+        "confidence": best_conf if ambiguous else 0.75,
+        "source": "heuristic",
+        "matches": best_n,
+    }
+
+
+def document_fingerprint(file_content: str) -> str:
+    """Fingerprint tài liệu: hash mẫu 80 đầu + 80 giữa + 80 cuối dòng (cùng mẫu LLM thấy) + độ dài."""
+    from ai.content import get_file_sample
+    text = str(file_content or "")
+    sample = get_file_sample(text, sample_size=80)
+    return hashlib.sha1(f"{len(text)}\n{sample}".encode("utf-8", errors="replace")).hexdigest()
+
+
+class SplitStrategyCache:
+    """LRU (project, file_type, context_hint, fingerprint) -> strategy; thread-safe."""
+
+    def __init__(self, max_entries: int = SPLIT_STRATEGY_CACHE_MAX):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str, str], Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.llm_calls = 0
+
+    def get(self, key: Tuple[str, str, str, str]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(value)
+
+    def put(self, key: Tuple[str, str, str, str], strategy: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = dict(strategy)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_project(self, project_id: Optional[str]) -> None:
+        pid = str(project_id or "")
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == pid]:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+        return {"hits": self.hits, "misses": self.misses, "llm_calls": self.llm_calls, "size": size}
+
+
+split_strategy_cache = SplitStrategyCache()
+
+
+def split_cache_key(project_id: Optional[str], file_type: str, context_hint: str, file_content: str) -> Tuple[str, str, str, str]:
+    return (str(project_id or ""), (file_type or "story").strip().lower(), (context_hint or "").strip(), document_fingerprint(file_content))
@@ -374,8 +374,19 @@ def get_timeline_events(
     chapter_range: Optional[Tuple[int, int]] = None,
     arc_id: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
+    """
+    Sự kiện timeline theo thứ tự (chương, event_order), lọc khoảng chương / arc.
+    Đọc từ chỉ mục trong bộ nhớ (core.timeline_index); không có chỉ mục thì query trực tiếp như cũ.
+    """
     if not project_id:
         return []
+    try:
+        from core.timeline_index import get_timeline_index
+        index = get_timeline_index(project_id)
+        if index is not None:
+            return index.query(limit=limit, chapter_range=chapter_range, arc_id=arc_id)
+    except Exception as e:
+        print(f"get_timeline_events index error: {e}")
     try:
         services = init_services()
         if not services:
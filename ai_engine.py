@@ -12,15 +12,18 @@ from config import Config, init_services
 from ai.service import AIService, _get_default_tool_model
 from ai.context_helpers import get_mandatory_rules as _get_mandatory_rules, resolve_chapter_range as _resolve_chapter_range, get_entity_relations as _get_entity_relations
 from ai.hybrid_search import HybridSearch, check_semantic_intent, search_chunks_vector
+from ai.answer_cache import track_rows
 from ai.query_sql import VALID_QUERY_TARGETS, build_query_sql_context, infer_query_target
 from ai.router import get_v7_reminder_message, is_multi_intent_request, is_multi_step_update_data_request, SmartAIRouter
 from ai.evaluate import evaluate_step_outcome, replan_after_step
 from ai.content import (
     suggest_relations,
+    suggest_relations_batch,
     suggest_import_category,
     generate_arc_summary_from_chapters,
     generate_chapter_metadata,
     extract_timeline_events_from_content,
+    extract_timeline_events_batch,
     get_file_sample,
     analyze_split_strategy,
     execute_split_logic,
@@ -70,7 +73,7 @@ class ContextManager:
         """
         if not ArcService or not current_arc_id:
             return "", 0
-        arc = ArcService.get_arc(current_arc_id)
+        arc = ArcService.get_arc(current_arc_id, story_id=project_id)
         if not arc:
             return "", 0
         parts = []
@@ -80,8 +83,13 @@ class ContextManager:
             for a in scope["arc_summaries"]:
                 parts.append("- ARC: %s\n  Summary: %s" % (a.get("name", ""), (a.get("summary") or "").strip() or "(none)"))
             parts.append("")
+        arc_summary = (arc.get("summary") or "").strip()
+        if not arc_summary:
+            # Arc chưa có tóm tắt viết tay: dùng tóm tắt arc tự sinh từ cây tóm tắt chương.
+            from core.summary_tree import get_arc_tree_summary
+            arc_summary = get_arc_tree_summary(project_id, current_arc_id)
         parts.append("[MACRO CONTEXT - ARC: %s]" % (arc.get("name") or "Current"))
-        parts.append("Summary: %s" % ((arc.get("summary") or "").strip() or "(none)"))
+        parts.append("Summary: %s" % (arc_summary or "(none)"))
         text = "\n".join(parts)
         return text, AIService.estimate_tokens(text)
 
@@ -136,6 +144,7 @@ class ContextManager:
         start: int,
         end: int,
         token_limit: int = 60000,
+        used_rows: Optional[Dict[str, set]] = None,
     ) -> Tuple[str, List[str]]:
         """Load chương theo khoảng chapter_number; có summary và art_style; nếu vượt token_limit thì ưu tiên summary cho chương cũ, full content cho chương đang bàn (cuối)."""
         try:
@@ -176,6 +185,7 @@ class ContextManager:
             full_text += block
             loaded_sources.append(f"📄 {title}")
             total_tokens += AIService.estimate_tokens(block)
+            track_rows(used_rows, "chapter", [item.get("id")])
 
         return full_text, loaded_sources
 
@@ -185,6 +195,7 @@ class ContextManager:
         project_id: str,
         token_limit: int = 60000,
         focus_chapter_name: Optional[str] = None,
+        used_rows: Optional[Dict[str, set]] = None,
     ) -> Tuple[str, List[str]]:
         """Load nội dung file/chương; thêm summary và art_style; nếu vượt token_limit thì ưu tiên summary, full content cho chương focus."""
         if not file_names:
@@ -217,10 +228,11 @@ class ContextManager:
             else:
                 try:
                     res_bible = supabase.table("story_bible").select(
-                        "entity_name, description"
+                        "id, entity_name, description"
                     ).eq("story_id", project_id).ilike("entity_name", f"%{name}%").execute()
                     if res_bible.data and len(res_bible.data) > 0:
                         item = res_bible.data[0]
+                        track_rows(used_rows, "bible", [item.get("id")])
                         full_text += f"\n\n=== ⚠️ BIBLE SUMMARY: {item.get('entity_name', name)} ===\n{item.get('description', '')}\n"
                         loaded_sources.append(f"🗂️ {item.get('entity_name', name)} (Summary)")
                 except Exception:
@@ -245,6 +257,7 @@ class ContextManager:
             full_text += block
             loaded_sources.append(f"📄 {title}")
             total_tokens += AIService.estimate_tokens(block)
+            track_rows(used_rows, "chapter", [item.get("id")])
 
         return full_text, loaded_sources
 
@@ -263,8 +276,10 @@ class ContextManager:
         session_state: Optional[Dict] = None,
         free_chat_mode: bool = False,
         max_context_tokens: Optional[int] = None,
+        used_rows: Optional[Dict[str, set]] = None,
     ) -> Tuple[str, List[str], int]:
-        """Xây dựng context từ router result. max_context_tokens: giới hạn độ dài (từ Settings Context Size); None = không giới hạn."""
+        """Xây dựng context từ router result. max_context_tokens: giới hạn độ dài (từ Settings Context Size); None = không giới hạn.
+        used_rows (tùy chọn): dict ghi lại id các dòng nguồn (bible/chapter/chunk/timeline/relation) đã đưa vào context, dùng cho answer cache."""
         context_parts = []
         sources = []
         total_tokens = 0
@@ -384,7 +399,21 @@ class ContextManager:
                 from core.chapter_logic_check import run_chapter_logic_check
                 ch_range = router_result.get("chapter_range")
                 ch_num = int(ch_range[0]) if (ch_range and len(ch_range) >= 1) else None
-                if ch_num is None:
+                ch_end = int(ch_range[1]) if (ch_range and len(ch_range) >= 2 and ch_range[1] is not None) else ch_num
+                if ch_num is not None and ch_end is not None and ch_end != ch_num:
+                    # Nhiều chương: chạy job nền song song thay vì soát tuần tự trong lượt chat.
+                    from core.chapter_logic_check import start_logic_check_job
+                    from core.cost_ledger import get_cost_actor
+                    job_id = start_logic_check_job(project_id, get_cost_actor()[0], ch_num, ch_end)
+                    if job_id:
+                        context_parts.append(
+                            "[SOÁT LOGIC CHƯƠNG] Đã tạo job nền soát chương %s–%s. Tiến độ ở tab Background Jobs; kết quả xem tại **Data Health**."
+                            % (min(ch_num, ch_end), max(ch_num, ch_end))
+                        )
+                    else:
+                        context_parts.append("[SOÁT LOGIC CHƯƠNG] Không tạo được job soát khoảng chương.")
+                    sources.append("🔍 Logic check (Background Jobs)")
+                elif ch_num is None:
                     context_parts.append("[SOÁT LOGIC CHƯƠNG] Chưa xác định được chương. Hãy nêu rõ số chương (vd: chương 3).")
                     sources.append("🔍 Logic check")
                 else:
@@ -444,14 +473,18 @@ class ContextManager:
                     full_text, source_names = "", []
                     if range_bounds_bible is not None:
                         cap = (min(ContextManager.DEFAULT_CHAPTER_TOKEN_LIMIT, (max_context_tokens - total_tokens) // max(1, len(context_priority))) if max_context_tokens else ContextManager.DEFAULT_CHAPTER_TOKEN_LIMIT)
-                        full_text, source_names = ContextManager.load_chapters_by_range(
-                            project_id, range_bounds_bible[0], range_bounds_bible[1],
-                            token_limit=cap,
+                        # Khoảng dài: map-reduce trên cây tóm tắt (core.summary_tree); khoảng ngắn: đọc chương như cũ.
+                        from core.summary_tree import build_range_context
+                        full_text, source_names = build_range_context(
+                            project_id, router_result.get("rewritten_query") or "",
+                            range_bounds_bible[0], range_bounds_bible[1],
+                            token_limit=cap, used_rows=used_rows,
                         )
                     if not full_text and target_files:
                         full_text, source_names = ContextManager.load_full_content(
                             target_files, project_id,
                             token_limit=ContextManager.DEFAULT_CHAPTER_TOKEN_LIMIT,
+                            used_rows=used_rows,
                         )
                     if full_text:
                         context_parts.append(f"\n--- TARGET CONTENT ---\n{full_text}")
@@ -467,6 +500,7 @@ class ContextManager:
                     if p and str(p).strip().upper().replace(" ", "_") in valid_keys
                 ] if valid_keys else raw_inferred
                 bible_context = ""
+                main_ids = []
                 for entity in target_bible_entities:
                     raw_list = HybridSearch.smart_search_hybrid_raw(
                         entity, project_id, top_k=7, inferred_prefixes=inferred_prefixes
@@ -482,14 +516,24 @@ class ContextManager:
                             except Exception:
                                 pass
                         main_id = raw_list[0].get("id") if raw_list else None
+                        track_rows(used_rows, "bible", [it.get("id") for it in raw_list])
+                        track_rows(used_rows, "relation", [main_id])
                         rel_block = ""
                         if main_id:
+                            main_ids.append(main_id)
                             rel_text = ContextManager.get_entity_relations(main_id, project_id)
                             if rel_text:
                                 rel_block = f"> [RELATION]:\n{rel_text}\n\n"
                         part = format_bible_context_by_sections(raw_list)
                         bible_context += f"\n--- {entity.upper()} ---\n{rel_block}{part}\n"
 
+                if len(main_ids) >= 2 and main_ids[0] != main_ids[1]:
+                    # Hai thực thể: chuỗi quan hệ ngắn nhất giữa chúng (đồ thị cache) để trả lời "A và B liên quan thế nào".
+                    from core.relation_graph import describe_relation_path
+                    path_text = describe_relation_path(project_id, main_ids[0], main_ids[1])
+                    if path_text:
+                        bible_context = f"\n--- CHUỖI QUAN HỆ ---\n{path_text}\n" + bible_context
+
                 if not bible_context and router_result.get("rewritten_query"):
                     raw_list = HybridSearch.smart_search_hybrid_raw(
                         router_result["rewritten_query"],
@@ -508,6 +552,8 @@ class ContextManager:
                             except Exception:
                                 pass
                         main_id = raw_list[0].get("id") if raw_list else None
+                        track_rows(used_rows, "bible", [it.get("id") for it in raw_list])
+                        track_rows(used_rows, "relation", [main_id])
                         rel_block = ""
                         if main_id:
                             rel_text = ContextManager.get_entity_relations(main_id, project_id)
@@ -525,8 +571,12 @@ class ContextManager:
                     services = init_services()
                     supabase = services['supabase']
                     related_chapter_nums = set()
+                    # Chỉ mục nhắc tên: top chương theo mật độ nhắc (một lần đọc); chưa có chỉ mục -> source_chapter như cũ.
+                    from core.mention_index import related_chapter_numbers
+                    indexed_nums = related_chapter_numbers(project_id, target_bible_entities) if target_bible_entities else []
+                    related_chapter_nums.update(indexed_nums)
 
-                    if target_bible_entities:
+                    if target_bible_entities and not indexed_nums:
                         for entity in target_bible_entities:
                             res = supabase.table("story_bible") \
                                 .select("source_chapter") \
@@ -541,16 +591,18 @@ class ContextManager:
 
                     if related_chapter_nums:
                         chap_res = supabase.table("chapters") \
-                            .select("title") \
+                            .select("title, chapter_number") \
                             .eq("story_id", project_id) \
                             .in_("chapter_number", list(related_chapter_nums)) \
                             .execute()
 
                         if chap_res.data:
-                            auto_files = [c['title'] for c in chap_res.data if c.get('title')]
+                            rank = {n: i for i, n in enumerate(indexed_nums)}
+                            ordered = sorted(chap_res.data, key=lambda c: rank.get(c.get("chapter_number"), len(rank)))
+                            auto_files = [c['title'] for c in ordered if c.get('title')]
 
                             if auto_files:
-                                extra_text, extra_sources = ContextManager.load_full_content(auto_files, project_id)
+                                extra_text, extra_sources = ContextManager.load_full_content(auto_files, project_id, used_rows=used_rows)
 
                                 if extra_text:
                                     context_parts.append(f"\n--- 🕵️ AUTO-DETECTED CONTEXT (REVERSE LOOKUP) ---\n{extra_text}")
@@ -569,6 +621,7 @@ class ContextManager:
                     arc_id=current_arc_id,
                 )
                 if events:
+                    track_rows(used_rows, "timeline", [e.get("id") for e in events])
                     lines = ["[TIMELINE EVENTS - Thứ tự sự kiện / mốc thời gian]"]
                     for e in events:
                         order = e.get("event_order", 0)
@@ -597,6 +650,8 @@ class ContextManager:
                             project_id, chunk_ids, current_arc_id, token_limit=5000
                         )
                         if chunk_ctx:
+                            track_rows(used_rows, "chunk", chunk_ids)
+                            track_rows(used_rows, "chapter", [c.get("chapter_id") for c in chunk_rows])
                             context_parts.append(chunk_ctx)
                             total_tokens += chunk_tokens
                             sources.extend(chunk_sources)
@@ -606,7 +661,7 @@ class ContextManager:
                 if chapter_range_from_query and "chapter" not in context_needs:
                     full_text, source_names = ContextManager.load_chapters_by_range(
                         project_id, chapter_range_from_query[0], chapter_range_from_query[1],
-                        token_limit=8000,
+                        token_limit=8000, used_rows=used_rows,
                     )
                     if full_text:
                         context_parts.append(f"\n--- 📄 NỘI DUNG CHƯƠNG (fallback) ---\n{full_text}")
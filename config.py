@@ -195,6 +195,8 @@ class Config:
 
     # Cache settings
     CACHE_TTL_HOURS = 24
+    # Cache response LLM tất định trên đĩa (ai/llm_cache.py); tắt = False
+    LLM_CACHE_ENABLED = True
     MAX_CONTEXT_TOKENS = {
         "low": 15000,
         "medium": 30000,
@@ -471,11 +473,19 @@ class CostManager:
 
     @staticmethod
     def update_budget(user_id: str, cost: float):
-        """Cập nhật budget sau khi sử dụng"""
+        """Cập nhật budget sau khi sử dụng: cộng nguyên tử qua RPC increment_user_credits (schema_v7.9); fallback đọc-ghi nếu chưa chạy migration.
+        Chi phí LLM thông thường đã được cost ledger (core/cost_ledger.py) cộng theo lô, không cần gọi hàm này."""
         try:
             services = init_services()
             supabase = services['supabase']
 
+            try:
+                r = supabase.rpc("increment_user_credits", {"p_user_id": str(user_id), "p_cost": cost}).execute()
+                if r.data is not None:
+                    return r.data if not isinstance(r.data, list) else (r.data[0] if r.data else None)
+            except Exception:
+                pass
+
             budget = CostManager.get_user_budget(user_id)
 
             new_used = budget.get("used_credits", 0.0) + cost
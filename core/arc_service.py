@@ -2,11 +2,21 @@
 """
 Manage arcs: SEQUENTIAL (timeline inheritance) vs STANDALONE (total isolation).
 Context scoping: [Global Bible] + [Past Arc Summaries if sequential] + [Current Arc].
+Arc graph: all arcs of a story loaded in one query and cached in memory (ARC_GRAPH_TTL_SEC);
+chain / scope resolution walks prev_arc_id in memory. Arc writes call ArcService.invalidate_arc_cache(story_id).
 """
+import threading
+import time
 from typing import Dict, List, Optional, Any
 
 from config import init_services
 
+# Cache arc graph per story (seconds). Writes from this process invalidate immediately; TTL covers other processes.
+ARC_GRAPH_TTL_SEC = 300
+
+_arc_graph_lock = threading.Lock()
+_arc_graphs: Dict[str, tuple] = {}
+
 
 class ArcService:
     """Arc CRUD and context scoping for V6."""
@@ -23,10 +33,56 @@ class ArcService:
     # CRUD
     # -------------------------------------------------------------------------
     @staticmethod
-    def get_arc(arc_id: str) -> Optional[Dict[str, Any]]:
-        """Get a single arc by id."""
+    def get_arc_graph(story_id: str) -> Dict[str, Any]:
+        """
+        All arcs of a story from one query (cached): {"by_id": {id: arc}, "order": [id, ...] by sort_order/created_at}.
+        Empty graph on error (not cached).
+        """
+        empty = {"by_id": {}, "order": []}
+        if not story_id:
+            return empty
+        key = str(story_id)
+        with _arc_graph_lock:
+            hit = _arc_graphs.get(key)
+            if hit and time.time() - hit[0] < ARC_GRAPH_TTL_SEC:
+                return hit[1]
+        supabase = ArcService._supabase()
+        if not supabase:
+            return empty
+        try:
+            r = supabase.table("arcs").select("*").eq("story_id", story_id).order("sort_order").order("created_at").execute()
+        except Exception:
+            return empty
+        rows = list(r.data) if r.data else []
+        graph = {"by_id": {str(a.get("id")): a for a in rows if a.get("id")}, "order": [str(a.get("id")) for a in rows if a.get("id")]}
+        with _arc_graph_lock:
+            _arc_graphs[key] = (time.time(), graph)
+        return graph
+
+    @staticmethod
+    def invalidate_arc_cache(story_id: Optional[str] = None) -> None:
+        """Drop cached arc graph of a story (None: all stories). Call after inserting / updating arcs."""
+        with _arc_graph_lock:
+            if story_id:
+                _arc_graphs.pop(str(story_id), None)
+            else:
+                _arc_graphs.clear()
+
+    @staticmethod
+    def get_arc(arc_id: str, story_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get a single arc by id. With story_id (or already-cached story): from the arc graph, no extra query; else one query."""
+        if not arc_id:
+            return None
+        if story_id:
+            arc = ArcService.get_arc_graph(story_id)["by_id"].get(str(arc_id))
+            if arc:
+                return arc
+        with _arc_graph_lock:
+            for _, graph in _arc_graphs.values():
+                if str(arc_id) in graph["by_id"]:
+                    return graph["by_id"][str(arc_id)]
         supabase = ArcService._supabase()
-        if not supabase or not arc_id:
+        if not supabase:
             return None
         try:
             r = supabase.table("arcs").select("*").eq("id", arc_id).limit(1).execute()
@@ -37,17 +93,11 @@ class ArcService:
     @staticmethod
     def list_arcs(story_id: str, status: Optional[str] = None) -> List[Dict[str, Any]]:
         """List arcs for a project, ordered by sort_order."""
-        supabase = ArcService._supabase()
-        if not supabase or not story_id:
-            return []
-        try:
-            q = supabase.table("arcs").select("*").eq("story_id", story_id)
-            if status:
-                q = q.eq("status", status)
-            r = q.order("sort_order").order("created_at").execute()
-            return list(r.data) if r.data else []
-        except Exception:
-            return []
+        graph = ArcService.get_arc_graph(story_id)
+        arcs = [graph["by_id"][i] for i in graph["order"]]
+        if status:
+            arcs = [a for a in arcs if a.get("status") == status]
+        return arcs
 
     @staticmethod
     def get_current_arc_id(story_id: str, from_session: Optional[Dict] = None) -> Optional[str]:
@@ -69,21 +119,33 @@ class ArcService:
         Order: follow prev_arc_id chain from current backwards, then by sort_order/created_at.
         Returns list of {id, name, summary} for injection as [Past Arc Summaries].
         """
-        current = ArcService.get_arc(current_arc_id)
-        if not current or current.get("type") != ArcService.ARC_TYPE_SEQUENTIAL:
+        chain = ArcService.get_arc_chain(story_id, current_arc_id)
+        if not chain or chain[-1].get("type") != ArcService.ARC_TYPE_SEQUENTIAL:
+            return []
+        return [{"id": a.get("id"), "name": a.get("name") or "", "summary": a.get("summary") or ""} for a in chain[:-1]]
+
+    @staticmethod
+    def get_arc_chain(story_id: str, arc_id: str) -> List[Dict[str, Any]]:
+        """
+        Timeline chain ending at arc_id: follow prev_arc_id backwards in the cached graph (stops on cycle / other story).
+        Returns arcs oldest first, arc_id last; [] if arc not found.
+        """
+        by_id = ArcService.get_arc_graph(story_id)["by_id"]
+        current = by_id.get(str(arc_id)) if arc_id else None
+        if not current:
             return []
-        past = []
-        seen = {current_arc_id}
+        chain = [current]
+        seen = {str(arc_id)}
         prev_id = current.get("prev_arc_id")
-        while prev_id and prev_id not in seen:
-            seen.add(prev_id)
-            a = ArcService.get_arc(prev_id)
-            if not a or a.get("story_id") != story_id:
+        while prev_id and str(prev_id) not in seen:
+            seen.add(str(prev_id))
+            a = by_id.get(str(prev_id))
+            if not a:
                 break
-            past.append({"id": a.get("id"), "name": a.get("name") or "", "summary": a.get("summary") or ""})
+            chain.append(a)
             prev_id = a.get("prev_arc_id")
-        past.reverse()
-        return past
+        chain.reverse()
+        return chain
 
     # -------------------------------------------------------------------------
     # Context scoping (Module 1)
@@ -96,7 +158,7 @@ class ArcService:
         """
         if not current_arc_id:
             return "[Global Bible] (no arc selected)"
-        arc = ArcService.get_arc(current_arc_id)
+        arc = ArcService.get_arc(current_arc_id, story_id=story_id)
         if not arc:
             return "[Global Bible] + [Current Arc]"
         if arc.get("type") == ArcService.ARC_TYPE_SEQUENTIAL:
@@ -127,7 +189,7 @@ class ArcService:
         }
         if not current_arc_id:
             return out
-        arc = ArcService.get_arc(current_arc_id)
+        arc = ArcService.get_arc(current_arc_id, story_id=story_id)
         if not arc:
             return out
         out["scope_type"] = arc.get("type") or ArcService.ARC_TYPE_STANDALONE
@@ -109,13 +109,15 @@ def _post_completion_to_chat(project_id: str, user_id: Optional[str], label: str
 def run_job_worker(job_id: str) -> None:
     """
     Chạy trong thread: lấy job, set status=running, gọi worker theo job_type, cập nhật completed/failed, nếu post_to_chat thì ghi chat.
-    job_type: data_analyze_bible | data_analyze_relation | data_analyze_timeline | data_analyze_chunk | data_operation_batch.
+    job_type: data_analyze_bible | data_analyze_relation | data_analyze_timeline | data_analyze_chunk | data_operation_batch | embedding_backfill | chapter_logic_check_range | mention_index_rebuild | summary_tree_rebuild.
     """
     from config import init_services
     services = init_services()
     if not services:
         return
     supabase = services["supabase"]
+    story_id = None
+    mentions_held = False
     try:
         r = supabase.table("background_jobs").select("*").eq("id", job_id).limit(1).execute()
         if not r.data or len(r.data) == 0:
@@ -127,6 +129,13 @@ def run_job_worker(job_id: str) -> None:
         label = (job.get("label") or "Tác vụ").strip()
         payload = job.get("payload") or {}
         post_to_chat = bool(job.get("post_to_chat", True))
+        # Thread mới: gán user/project cho cost ledger (chi phí LLM của job tính vào user tạo job).
+        from core.cost_ledger import set_cost_actor
+        set_cost_actor(user_id, story_id)
+        # Ghi Bible / chương trong job: gom yêu cầu quét chỉ mục nhắc tên, quét một lần khi job xong.
+        from core.mention_index import hold_mention_updates
+        hold_mention_updates(story_id)
+        mentions_held = True
 
         update_job(job_id, "running")
 
@@ -146,6 +155,14 @@ def run_job_worker(job_id: str) -> None:
             _worker_data_analyze_timeline(job_id, story_id, user_id, label, payload, post_to_chat, supabase)
         elif job_type == "data_analyze_chunk":
             _worker_data_analyze_chunk(job_id, story_id, user_id, label, payload, post_to_chat, supabase)
+        elif job_type == "embedding_backfill":
+            _worker_embedding_backfill(job_id, story_id, payload)
+        elif job_type == "chapter_logic_check_range":
+            _worker_logic_check_range(job_id, story_id, user_id, label, payload, post_to_chat)
+        elif job_type == "mention_index_rebuild":
+            _worker_mention_index_rebuild(job_id, story_id, payload)
+        elif job_type == "summary_tree_rebuild":
+            _worker_summary_tree_rebuild(job_id, story_id, payload)
         else:
             update_job(job_id, "failed", error_message=f"job_type không hỗ trợ: {job_type}")
             if post_to_chat:
@@ -161,6 +178,14 @@ def run_job_worker(job_id: str) -> None:
                 )
         except Exception:
             pass
+    finally:
+        # Job đã ghi Bible/chương: router cache của project hết hiệu lực.
+        if story_id:
+            from ai.router_cache import bump_data_version
+            bump_data_version(story_id)
+        if mentions_held:
+            from core.mention_index import release_mention_updates
+            release_mention_updates(story_id)
 
 
 def _worker_data_analyze_bible(
@@ -215,15 +240,16 @@ def _worker_data_analyze_bible(
         if post_to_chat:
             _post_completion_to_chat(project_id, user_id, label, True, "Không có mục nào hợp lệ.", None)
         return
-    count = 0
-    for row in rows_to_save:
-        supabase.table("story_bible").insert({
+    from core.embedding_backfill import insert_rows_with_embeddings
+    count = len(insert_rows_with_embeddings(supabase, "story_bible", [
+        {
             "story_id": project_id,
             "entity_name": row["final_name"],
             "description": row["description"],
             "source_chapter": chap_num,
-        }).execute()
-        count += 1
+        }
+        for row in rows_to_save
+    ]))
     summary = f"Đã lưu {count} mục Bible."
     update_job(job_id, "completed", result_summary=summary)
     if post_to_chat:
@@ -264,6 +290,8 @@ def _worker_data_analyze_relation(
             if ids_to_del:
                 supabase.table("entity_relations").delete().in_("id", ids_to_del).execute()
     rels = suggest_relations(content, project_id)
+    from core.data_operation_jobs import _invalidate_relation_answers
+    _invalidate_relation_answers(project_id, entity_ids, rels)
     saved = 0
     for item in (rels or []):
         if only_new and item.get("kind") == "relation":
@@ -317,11 +345,13 @@ def _worker_data_analyze_timeline(
         ids = [r["id"] for r in old.data if r.get("id")]
         if ids:
             supabase.table("timeline_events").delete().in_("id", ids).execute()
+    from core.timeline_index import timeline_events_deleted, timeline_events_written
+    timeline_events_deleted(project_id, chapter_ids=[chapter_id])
     events = extract_timeline_events_from_content(content, chapter_label)
     saved = 0
     for ev in (events or []):
         try:
-            supabase.table("timeline_events").insert({
+            ins = supabase.table("timeline_events").insert({
                 "story_id": project_id,
                 "chapter_id": chapter_id,
                 "event_order": ev.get("event_order", 0),
@@ -330,6 +360,7 @@ def _worker_data_analyze_timeline(
                 "raw_date": (ev.get("raw_date") or "").strip(),
                 "event_type": ev.get("event_type", "event"),
             }).execute()
+            timeline_events_written(project_id, ins.data)
             saved += 1
         except Exception:
             pass
@@ -343,6 +374,7 @@ def _worker_data_analyze_chunk(
     job_id: str, project_id: str, user_id: Optional[str], label: str, payload: Dict, post_to_chat: bool, supabase,
 ) -> None:
     from ai_engine import analyze_split_strategy, execute_split_logic
+    from ai.content import BY_TOKENS_DEFAULT_VALUE
 
     chap_num = int(payload.get("chapter_number", 0))
     ch_row = supabase.table("chapters").select("id, content, arc_id").eq("story_id", project_id).eq("chapter_number", chap_num).limit(1).execute()
@@ -359,97 +391,145 @@ def _worker_data_analyze_chunk(
         if post_to_chat:
             _post_completion_to_chat(project_id, user_id, label, False, None, "Chương không có nội dung")
         return
-    strategy = analyze_split_strategy(content, file_type="story", context_hint="Đoạn văn có ý nghĩa")
-    chunks_list = execute_split_logic(content, strategy.get("split_type", "by_length"), strategy.get("split_value", "2000"))
+    strategy = analyze_split_strategy(content, file_type="story", context_hint="Đoạn văn có ý nghĩa", project_id=project_id)
+    stype, sval = strategy.get("split_type", "by_length"), strategy.get("split_value", "2000")
+    if stype == "by_length":
+        # Chunk để embed: đo theo token, ranh giới câu.
+        stype, sval = "by_tokens", BY_TOKENS_DEFAULT_VALUE
+    chunks_list = execute_split_logic(content, stype, sval)
     if not chunks_list:
-        chunks_list = execute_split_logic(content, "by_length", "2000")
-    edited = [{"title": c.get("title", ""), "content": (c.get("content") or "").strip(), "order": c.get("order", i + 1)} for i, c in enumerate(chunks_list)]
-    old = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
-    if old.data:
-        ids = [r["id"] for r in old.data if r.get("id")]
-        if ids:
-            supabase.table("chunks").delete().in_("id", ids).execute()
-    saved = 0
-    for idx, chk in enumerate(edited):
-        txt = chk.get("content", "").strip()
-        if txt:
-            row = {
-                "story_id": project_id,
-                "chapter_id": chapter_id,
-                "arc_id": arc_id,
-                "content": txt,
-                "raw_content": txt,
-                "meta_json": {"source": "data_analyze", "chapter": chap_num, "title": chk.get("title", "")},
-                "sort_order": chk.get("order", idx + 1),
-            }
-            supabase.table("chunks").insert(row).execute()
-            saved += 1
-    summary = f"Đã lưu {saved} chunks."
+        chunks_list = execute_split_logic(content, "by_tokens", BY_TOKENS_DEFAULT_VALUE)
+    edited = [{"title": c.get("title", ""), "content": (c.get("content") or "").strip(), "order": c.get("order", i + 1), "meta": c.get("meta") or {}} for i, c in enumerate(chunks_list)]
+    from core.chunk_sync import format_chunk_sync_stats, sync_chapter_chunks
+    rows = [
+        {
+            "content": chk.get("content", "").strip(),
+            "sort_order": chk.get("order", idx + 1),
+            "meta_json": {"source": "data_analyze", "chapter": chap_num, "title": chk.get("title", ""), **chk.get("meta", {})},
+        }
+        for idx, chk in enumerate(edited)
+        if chk.get("content", "").strip()
+    ]
+    # Re-chunk theo diff: chunk không đổi giữ nguyên dòng + embedding.
+    stats = sync_chapter_chunks(supabase, project_id, chapter_id, arc_id, rows)
+    summary = f"Đã lưu {stats['total']} chunks ({format_chunk_sync_stats(stats)})."
     update_job(job_id, "completed", result_summary=summary)
     if post_to_chat:
         _post_completion_to_chat(project_id, user_id, label, True, summary, None)
 
 
-_embedding_backfill_running = False
+def _worker_embedding_backfill(job_id: str, project_id: str, payload: Dict) -> None:
+    """Backfill embedding theo trang; ghi checkpoint + tiến độ (rows/s, ETA) vào payload để tab Background Jobs hiển thị."""
+    from core.embedding_backfill import run_embedding_backfill as _run_backfill
+
+    state = dict(payload or {})
+
+    def _on_progress(patch: Dict[str, Any]) -> None:
+        state.update(patch)
+        update_job_payload(job_id, state)
+
+    res = _run_backfill(project_id, tables=state.get("tables"), checkpoint=state.get("checkpoint"), on_progress=_on_progress)
+    if res.get("busy"):
+        update_job(job_id, "failed", error_message="Project đang có backfill embedding khác chạy.")
+        return
+    if res.get("error"):
+        # failed + checkpoint trong payload: job backfill sau (_latest_unfinished_checkpoint) tiếp tục từ đây.
+        update_job(
+            job_id, "failed",
+            error_message=f"{res['error']} (đã embed Bible: {res['bible_updated']}, Chunks: {res['chunks_updated']}; chạy lại để tiếp tục từ checkpoint)",
+        )
+        return
+    summary = f"Bible: {res['bible_updated']}, Chunks: {res['chunks_updated']} embedding ({res['elapsed_sec']}s)."
+    if res.get("failed"):
+        summary += f" Lỗi: {res['failed']} (chạy lại để thử tiếp)."
+    update_job(job_id, "completed", result_summary=summary)
+
+
+def _worker_logic_check_range(job_id: str, project_id: str, user_id: Optional[str], label: str, payload: Dict, post_to_chat: bool) -> None:
+    """Soát logic cả khoảng chương (song song); tiến độ từng chương ghi vào payload["progress"]."""
+    from core.chapter_logic_check import run_logic_check_range
+
+    state = dict(payload or {})
+
+    def _on_progress(patch: Dict[str, Any]) -> None:
+        state.update(patch)
+        update_job_payload(job_id, state)
+
+    res = run_logic_check_range(
+        project_id, int(state.get("chapter_start") or 1), int(state.get("chapter_end") or state.get("chapter_start") or 1),
+        on_progress=_on_progress,
+        stale_only=bool(state.get("stale_only")),
+    )
+    summary = (
+        f"Đã soát {res['checked']} chương: {res['issues']} lỗi, đã khắc phục {res['resolved']} lỗi cũ ({res['elapsed_sec']}s)."
+    )
+    if res.get("skipped"):
+        summary += f" Bỏ qua {res['skipped']} chương không thay đổi."
+    if res.get("failed"):
+        summary += f" {res['failed']} chương lỗi gọi AI (chạy lại để thử tiếp)."
+    update_job(job_id, "completed", result_summary=summary)
+    if post_to_chat:
+        _post_completion_to_chat(project_id, user_id, label, True, summary, None)
 
 
-def is_embedding_backfill_running() -> bool:
-    """True nếu đang chạy backfill embedding (tránh chạy trùng)."""
-    return _embedding_backfill_running
+def _worker_mention_index_rebuild(job_id: str, project_id: str, payload: Dict) -> None:
+    """Dựng lại chỉ mục entity -> chương; tiến độ (chương/s, ETA) ghi vào payload["progress"]."""
+    from core.mention_index import rebuild_mention_index
 
+    state = dict(payload or {})
 
-def run_embedding_backfill(project_id: str, bible_limit: int = 50, chunks_limit: int = 50) -> Dict[str, int]:
-    """
-    Tìm story_bible và chunks có embedding null, gọi API embedding batch, cập nhật lại DB.
-    Trả về {"bible_updated": n, "chunks_updated": m}. Không chạy trùng nếu đang có backfill khác.
-    """
-    global _embedding_backfill_running
-    if _embedding_backfill_running:
-        return {"bible_updated": 0, "chunks_updated": 0}
-    out = {"bible_updated": 0, "chunks_updated": 0}
-    if not project_id:
-        return out
+    def _on_progress(patch: Dict[str, Any]) -> None:
+        state.update(patch)
+        update_job_payload(job_id, state)
+
+    res = rebuild_mention_index(project_id, on_progress=_on_progress)
+    update_job(
+        job_id, "completed",
+        result_summary=f"Đã quét {res['chapters']} chương × {res['entities']} thực thể: {res['rows']} dòng chỉ mục ({res['elapsed_sec']}s).",
+    )
+
+
+def _worker_summary_tree_rebuild(job_id: str, project_id: str, payload: Dict) -> None:
+    """Dựng cây tóm tắt (khối chương + arc) từ chapters.summary; tiến độ từng cấp ghi vào payload["progress"]."""
+    from core.summary_tree import rebuild_summary_tree
+
+    state = dict(payload or {})
+
+    def _on_progress(patch: Dict[str, Any]) -> None:
+        state.update(patch)
+        update_job_payload(job_id, state)
+
+    res = rebuild_summary_tree(project_id, on_progress=_on_progress)
+    update_job(
+        job_id, "completed",
+        result_summary=f"Cây tóm tắt {res['chapters']} chương: cập nhật {res['nodes']} khối, {res['arcs']} arc ({res['elapsed_sec']}s).",
+    )
+
+
+def update_job_payload(job_id: str, payload: Dict[str, Any]) -> None:
+    """Ghi đè payload job (checkpoint / progress của job dài)."""
     try:
         from config import init_services
-        from ai_engine import AIService
         services = init_services()
         if not services:
-            return out
-        supabase = services["supabase"]
+            return
+        services["supabase"].table("background_jobs").update({"payload": payload}).eq("id", job_id).execute()
     except Exception:
-        return out
-    _embedding_backfill_running = True
-    try:
-        try:
-            r = supabase.table("story_bible").select("id, description").eq("story_id", project_id).is_("embedding", "NULL").limit(bible_limit).execute()
-            rows_bible = list(r.data or [])
-            if rows_bible:
-                texts_bible = [(row.get("description") or "").strip() or "" for row in rows_bible]
-                vectors_bible = AIService.get_embeddings_batch(texts_bible) if hasattr(AIService, "get_embeddings_batch") else []
-                for i, row in enumerate(rows_bible):
-                    if i < len(vectors_bible) and vectors_bible[i]:
-                        try:
-                            supabase.table("story_bible").update({"embedding": vectors_bible[i]}).eq("id", row["id"]).execute()
-                            out["bible_updated"] += 1
-                        except Exception:
-                            pass
-        except Exception:
-            pass
-        try:
-            r = supabase.table("chunks").select("id, content").eq("story_id", project_id).is_("embedding", "NULL").limit(chunks_limit).execute()
-            rows_chunks = list(r.data or [])
-            if rows_chunks:
-                texts_chunks = [(row.get("content") or "").strip() or "" for row in rows_chunks]
-                vectors_chunks = AIService.get_embeddings_batch(texts_chunks) if hasattr(AIService, "get_embeddings_batch") else []
-                for i, row in enumerate(rows_chunks):
-                    if i < len(vectors_chunks) and vectors_chunks[i]:
-                        try:
-                            supabase.table("chunks").update({"embedding": vectors_chunks[i]}).eq("id", row["id"]).execute()
-                            out["chunks_updated"] += 1
-                        except Exception:
-                            pass
-        except Exception:
-            pass
-    finally:
-        _embedding_backfill_running = False
-    return out
+        pass
+
+
+def is_embedding_backfill_running(project_id: Optional[str] = None) -> bool:
+    """True nếu đang chạy backfill embedding (theo project; tránh chạy trùng)."""
+    from core.embedding_backfill import is_embedding_backfill_running as _running
+    return _running(project_id)
+
+
+def run_embedding_backfill(project_id: str, bible_limit: int = 50, chunks_limit: int = 50) -> Dict[str, int]:
+    """
+    Tương thích cũ: backfill đồng bộ toàn bộ bảng có limit > 0 (không còn giới hạn số dòng; xem core.embedding_backfill).
+    Trả về {"bible_updated": n, "chunks_updated": m}.
+    """
+    from core.embedding_backfill import run_embedding_backfill as _run_backfill
+    tables = [t for t, n in (("story_bible", bible_limit), ("chunks", chunks_limit)) if n]
+    res = _run_backfill(project_id, tables=tables)
+    return {"bible_updated": res.get("bible_updated", 0), "chunks_updated": res.get("chunks_updated", 0)}
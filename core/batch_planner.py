@@ -0,0 +1,210 @@
+# core/batch_planner.py - Lập kế hoạch lô LLM cho thao tác dữ liệu theo khoảng chương (bin-packing first-fit decreasing)
+"""
+Thay cách chia cũ (nhóm cố định 7 chương, cắt tham lam theo thứ tự, chương quá lớn bị bỏ qua, cắt cứng 120k ký tự):
+- Mỗi chương thành 1 hoặc nhiều PHẦN (section) không vượt giới hạn ký tự mà prompt của target dùng và ngân sách token một lần gọi;
+  cắt ở ranh giới đoạn văn / dòng nên không mất nội dung.
+- Các phần được xếp vào lần gọi theo first-fit decreasing trên toàn khoảng yêu cầu: ngân sách input = DATA_BATCH_MAX_TOKENS
+  trừ phần prompt cố định, số phần / lần gọi giới hạn bởi ngân sách output.
+- plan_data_batches trả về kế hoạch (số lần gọi, token, chi phí ước tính) để báo trước khi chạy;
+  plan_data_batches_from_lengths ước tính cùng kế hoạch chỉ từ độ dài chương (xem trước, không đọc nội dung).
+Key của phần: số chương (chương nguyên) hoặc "N-pK" (phần K của chương N); LLM trả kết quả theo đúng key.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# Target có lô LLM nhiều chương (chunking / delete không qua planner).
+PLANNED_TARGETS = ("bible", "relation", "timeline")
+# Ký tự tối đa của một phần (prompt batch của từng target đưa nguyên phần vào, không cắt thêm).
+PLAN_SECTION_MAX_CHARS = {"bible": 120000, "relation": 40000, "timeline": 40000}
+# Token prompt cố định mỗi lần gọi (hướng dẫn, danh sách Bible cho relation).
+PLAN_PROMPT_OVERHEAD_TOKENS = {"bible": 800, "relation": 1800, "timeline": 400}
+# Token output ước tính cho mỗi phần; giới hạn output một lần gọi = PLAN_MAX_OUTPUT_TOKENS.
+PLAN_OUTPUT_TOKENS_PER_SECTION = {"bible": 1500, "relation": 2000, "timeline": 2000}
+PLAN_MAX_OUTPUT_TOKENS = 16000
+PLAN_SECTION_HEADER_TOKENS = 10
+
+
+def section_key(chapter_number: int, part: int, parts: int):
+    """Key phần: int nếu chương không bị chia, ngược lại 'N-pK'."""
+    return int(chapter_number) if parts <= 1 else f"{int(chapter_number)}-p{part}"
+
+
+def split_into_sections(text: str, max_chars: int) -> List[str]:
+    """Cắt text thành các phần <= max_chars, ưu tiên ranh giới đoạn (\\n\\n), rồi dòng, rồi câu; không bỏ ký tự nào (trừ khoảng trắng ở mép)."""
+    text = (text or "").strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    sections = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            window = text[start:end]
+            cut = -1
+            for sep in ("\n\n", "\n", ". "):
+                pos = window.rfind(sep)
+                if pos >= max_chars // 2:
+                    cut = pos + len(sep)
+                    break
+            if cut > 0:
+                end = start + cut
+        part = text[start:end].strip()
+        if part:
+            sections.append(part)
+        start = end
+    return sections
+
+
+def _section_budget(target: str, max_input_tokens: int) -> int:
+    """Ký tự tối đa một phần: giới hạn prompt của target và ngân sách input của một lần gọi (~4 ký tự / token)."""
+    by_budget = max(1000, (max_input_tokens - PLAN_PROMPT_OVERHEAD_TOKENS.get(target, 0) - PLAN_SECTION_HEADER_TOKENS) * 4)
+    return min(PLAN_SECTION_MAX_CHARS.get(target, by_budget), by_budget)
+
+
+def build_sections(target: str, chapters: List[Tuple[int, str]], max_input_tokens: int) -> List[Dict[str, Any]]:
+    """[(chapter_number, content)] -> [{"key", "chapter", "part", "parts", "text", "tokens"}]; chương rỗng bị bỏ (caller báo lỗi)."""
+    from ai_engine import AIService
+    max_chars = _section_budget(target, max_input_tokens)
+    out = []
+    for ch_num, content in chapters:
+        parts = split_into_sections(content, max_chars)
+        for i, text in enumerate(parts, start=1):
+            out.append({
+                "key": section_key(ch_num, i, len(parts)),
+                "chapter": int(ch_num),
+                "part": i,
+                "parts": len(parts),
+                "text": text,
+                "tokens": AIService.estimate_tokens(text) + PLAN_SECTION_HEADER_TOKENS,
+            })
+    return out
+
+
+def pack_first_fit_decreasing(sections: List[Dict[str, Any]], capacity: int, max_items: int) -> List[List[Dict[str, Any]]]:
+    """Bin-packing FFD: phần lớn trước, đặt vào lần gọi đầu tiên còn đủ chỗ (token + số phần). Lần gọi sắp theo chương nhỏ nhất."""
+    bins: List[Dict[str, Any]] = []
+    for sec in sorted(sections, key=lambda s: (-s["tokens"], s["chapter"], s["part"])):
+        for b in bins:
+            if b["used"] + sec["tokens"] <= capacity and len(b["items"]) < max_items:
+                b["items"].append(sec)
+                b["used"] += sec["tokens"]
+                break
+        else:
+            bins.append({"items": [sec], "used": sec["tokens"]})
+    calls = [sorted(b["items"], key=lambda s: (s["chapter"], s["part"])) for b in bins]
+    calls.sort(key=lambda items: (items[0]["chapter"], items[0]["part"]))
+    return calls
+
+
+def estimate_sections_from_lengths(target: str, lengths: List[Tuple[int, int]], max_input_tokens: int) -> List[Dict[str, Any]]:
+    """
+    [(chapter_number, số ký tự)] -> phần ước tính (không có text) để xem trước mà không đọc nội dung chương.
+    Số phần = ceil(len / max_chars) (split_into_sections có thể cắt thêm một phần ở ranh giới đoạn); token ~ len // 4.
+    """
+    max_chars = _section_budget(target, max_input_tokens)
+    out = []
+    for ch_num, length in lengths:
+        length = int(length or 0)
+        if length <= 0:
+            continue
+        parts = -(-length // max_chars)
+        for i in range(1, parts + 1):
+            part_len = min(max_chars, length - (i - 1) * max_chars)
+            out.append({
+                "key": section_key(ch_num, i, parts),
+                "chapter": int(ch_num),
+                "part": i,
+                "parts": parts,
+                "text": "",
+                "tokens": part_len // 4 + PLAN_SECTION_HEADER_TOKENS,
+            })
+    return out
+
+
+def plan_data_batches(
+    target: str,
+    chapters: List[Tuple[int, str]],
+    max_input_tokens: Optional[int] = None,
+    model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Kế hoạch cho một target trên toàn khoảng chương.
+    Returns {"target", "calls": [[section, ...]], "n_calls", "n_chapters", "split_chapters": {ch: parts},
+             "input_tokens", "output_tokens", "est_cost", "model"}.
+    """
+    max_input_tokens = _max_input_tokens(max_input_tokens)
+    return _plan_from_sections(target, build_sections(target, chapters, max_input_tokens), max_input_tokens, model)
+
+
+def plan_data_batches_from_lengths(
+    target: str,
+    lengths: List[Tuple[int, int]],
+    max_input_tokens: Optional[int] = None,
+    model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Như plan_data_batches nhưng từ độ dài chương (xem trước); calls chứa phần không có text — không dùng để chạy."""
+    max_input_tokens = _max_input_tokens(max_input_tokens)
+    return _plan_from_sections(target, estimate_sections_from_lengths(target, lengths, max_input_tokens), max_input_tokens, model)
+
+
+def _max_input_tokens(max_input_tokens: Optional[int]) -> int:
+    if max_input_tokens is None:
+        from config import Config
+        max_input_tokens = getattr(Config, "DATA_BATCH_MAX_TOKENS", 50000)
+    return max_input_tokens
+
+
+def _plan_from_sections(target: str, sections: List[Dict[str, Any]], max_input_tokens: int, model: Optional[str]) -> Dict[str, Any]:
+    """Xếp phần vào lần gọi (FFD) và ước tính token / chi phí."""
+    overhead = PLAN_PROMPT_OVERHEAD_TOKENS.get(target, 0)
+    out_per_section = PLAN_OUTPUT_TOKENS_PER_SECTION.get(target, 2000)
+    max_items = max(1, PLAN_MAX_OUTPUT_TOKENS // out_per_section)
+    calls = pack_first_fit_decreasing(sections, max(1, max_input_tokens - overhead), max_items)
+    input_tokens = sum(s["tokens"] for s in sections) + overhead * len(calls)
+    output_tokens = out_per_section * len(sections)
+    if model is None:
+        try:
+            from ai_engine import _get_default_tool_model
+            model = _get_default_tool_model()
+        except Exception:
+            model = ""
+    try:
+        from ai_engine import AIService
+        est_cost = AIService.calculate_cost(input_tokens, output_tokens, model)
+    except Exception:
+        est_cost = 0.0
+    return {
+        "target": target,
+        "calls": calls,
+        "n_calls": len(calls),
+        "n_chapters": len({s["chapter"] for s in sections}),
+        "split_chapters": {s["chapter"]: s["parts"] for s in sections if s["parts"] > 1},
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "est_cost": est_cost,
+        "model": model,
+    }
+
+
+def format_plan_preview(plans: List[Dict[str, Any]]) -> str:
+    """VD: 'bible: 50 chương → 4 lần gọi (~180k token vào, ~75k ra, ~$0.05); chia phần: ch.12 (2)'."""
+    lines = []
+    total_calls, total_cost = 0, 0.0
+    for p in plans:
+        if not p or not p.get("n_calls"):
+            continue
+        total_calls += p["n_calls"]
+        total_cost += float(p.get("est_cost") or 0)
+        line = (
+            f"{p['target']}: {p['n_chapters']} chương → {p['n_calls']} lần gọi "
+            f"(~{p['input_tokens'] // 1000}k token vào, ~{p['output_tokens'] // 1000}k ra, ~${p.get('est_cost') or 0:.3f})"
+        )
+        if p.get("split_chapters"):
+            split = ", ".join(f"ch.{ch} ({n})" for ch, n in sorted(p["split_chapters"].items())[:8])
+            more = len(p["split_chapters"]) - 8
+            line += f"; chia phần: {split}" + (f" +{more}" if more > 0 else "")
+        lines.append(line)
+    if not lines:
+        return ""
+    if len(lines) > 1:
+        lines.append(f"Tổng: {total_calls} lần gọi, ~${total_cost:.3f}")
+    return "\n".join(lines)
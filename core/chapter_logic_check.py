@@ -1,9 +1,11 @@
 # core/chapter_logic_check.py - V7.7 Soát lỗi logic theo chương (5 dimensions)
 """Build context (timeline, bible, relation, chat_crystallize, rule), gọi LLM, lưu chapter_logic_issues. Khi chạy lại: issue không còn thì đánh dấu resolved."""
+import hashlib
 import json
 import re
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from config import init_services
 
@@ -14,6 +16,45 @@ from ai.utils import get_timeline_events
 LOGIC_DIMENSIONS = ("timeline", "bible", "relation", "chat_crystallize", "rule")
 
 
+# Cột story_bible cần cho soát logic (không lấy embedding).
+LOGIC_BIBLE_COLUMNS = "id, entity_name, description, parent_id"
+# Giới hạn khối context: thực thể láng giềng 1 bước, rule chung (không nhắc thực thể nào), sự kiện timeline dự phòng.
+LOGIC_MAX_NEIGHBOURS = 60
+LOGIC_MAX_GENERAL_RULES = 30
+LOGIC_MAX_FALLBACK_EVENTS = 40
+LOGIC_DESC_MAX_CHARS = 800
+LOGIC_NEIGHBOUR_DESC_MAX_CHARS = 300
+LOGIC_SNAPSHOT_MAX_EVENTS = 5000
+LOGIC_MAX_CONTENT_CHARS = 80000
+
+# Job soát logic cả khoảng chương (chạy nền, song song, giới hạn tốc độ).
+LOGIC_CHECK_JOB_TYPE = "chapter_logic_check_range"
+LOGIC_CHECK_MAX_CONCURRENCY = 4
+LOGIC_CHECK_REQUESTS_PER_MIN = 30
+LOGIC_CHECK_FLUSH_EVERY = 10
+LOGIC_CHECK_PROGRESS_EVERY_SEC = 3.0
+# Tăng khi đổi prompt / cách chọn tham chiếu: mọi chương thành "cần soát lại".
+LOGIC_CHECK_DEPS_VERSION = 1
+LOGIC_LATEST_CHECK_BATCH = 20
+# Cỡ trang khi đọc snapshot / lần soát (PostgREST mặc định cắt 1000 dòng mỗi select).
+LOGIC_FETCH_PAGE = 1000
+
+
+def _fetch_paged(make_query, max_rows: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Đọc hết các dòng của một select theo trang .range(); make_query() trả về query mới (đã order). max_rows: dừng sớm."""
+    out: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        size = LOGIC_FETCH_PAGE if max_rows is None else min(LOGIC_FETCH_PAGE, max_rows - len(out))
+        if size <= 0:
+            return out
+        rows = make_query().range(offset, offset + size - 1).execute().data or []
+        out.extend(rows)
+        if len(rows) < size:
+            return out
+        offset += size
+
+
 def _get_bible_for_logic(project_id: str, include_archived: bool = False) -> List[Dict[str, Any]]:
     """Lấy story_bible cho project; mặc định loại archived (để context không gồm [CHAT] đã archive)."""
     try:
@@ -21,43 +62,221 @@ def _get_bible_for_logic(project_id: str, include_archived: bool = False) -> Lis
         if not services:
             return []
         supabase = services["supabase"]
-        q = supabase.table("story_bible").select("*").eq("story_id", project_id)
-        if not include_archived:
-            q = q.or_("archived.is.null,archived.eq.false")
-        r = q.order("created_at", desc=True).execute()
-        return list(r.data) if r.data else []
+        def _query():
+            q = supabase.table("story_bible").select(LOGIC_BIBLE_COLUMNS).eq("story_id", project_id)
+            if not include_archived:
+                q = q.or_("archived.is.null,archived.eq.false")
+            return q.order("created_at", desc=True).order("id")
+        return _fetch_paged(_query)
     except Exception as e:
         print(f"_get_bible_for_logic error: {e}")
         return []
 
 
+def _get_relations_for_logic(project_id: str) -> List[Dict[str, Any]]:
+    """Toàn bộ entity_relations của project; lấy từ đồ thị quan hệ cache nếu có (core.relation_graph)."""
+    try:
+        from core.relation_graph import get_relation_graph
+        graph = get_relation_graph(project_id)
+        if graph is not None:
+            return list(graph.relations)
+    except Exception as e:
+        print(f"_get_relations_for_logic graph error: {e}")
+    try:
+        services = init_services()
+        if not services:
+            return []
+        supabase = services["supabase"]
+        return _fetch_paged(lambda: supabase.table("entity_relations").select("*").eq("story_id", project_id).order("id"))
+    except Exception as e:
+        print(f"_get_relations_for_logic error: {e}")
+        return []
+
+
+def _get_timeline_for_logic(project_id: str) -> List[Dict[str, Any]]:
+    """Snapshot timeline (tối đa LOGIC_SNAPSHOT_MAX_EVENTS) cho job nhiều chương: chỉ mục trong bộ nhớ, không có thì query theo trang."""
+    try:
+        from core.timeline_index import get_timeline_index
+        index = get_timeline_index(project_id)
+        if index is not None:
+            return index.query(limit=LOGIC_SNAPSHOT_MAX_EVENTS)
+    except Exception as e:
+        print(f"_get_timeline_for_logic index error: {e}")
+    try:
+        services = init_services()
+        if not services:
+            return []
+        supabase = services["supabase"]
+        return _fetch_paged(
+            lambda: supabase.table("timeline_events").select(
+                "id, event_order, title, description, raw_date, event_type, chapter_id, arc_id"
+            ).eq("story_id", project_id).order("event_order").order("id"),
+            max_rows=LOGIC_SNAPSHOT_MAX_EVENTS,
+        )
+    except Exception as e:
+        print(f"_get_timeline_for_logic error: {e}")
+        return []
+
+
+def load_logic_references(project_id: str, include_archived: bool = False, with_timeline: bool = False) -> Dict[str, Any]:
+    """
+    Dữ liệu tham chiếu dùng chung cho nhiều chương: Bible (tách thực thể / [RULE] / [CHAT]), quan hệ, MentionIndex.
+    with_timeline=True: kèm toàn bộ timeline_events (snapshot cho job soát nhiều chương, không query timeline mỗi chương).
+    Returns {"entities", "rules", "chats", "relations", "index", "id_to_name", "timeline"}; timeline=None nếu không lấy.
+    """
+    from core.entity_mentions import MentionIndex
+    bible = _get_bible_for_logic(project_id, include_archived=include_archived)
+    entities, rules, chats = [], [], []
+    for e in bible:
+        name = (e.get("entity_name") or "").strip()
+        if not name:
+            continue
+        if name.startswith("[RULE]"):
+            rules.append(e)
+        elif name.startswith("[CHAT]"):
+            chats.append(e)
+        else:
+            entities.append(e)
+    return {
+        "entities": entities,
+        "rules": rules,
+        "chats": chats,
+        "relations": _get_relations_for_logic(project_id),
+        "index": MentionIndex(entities),
+        "id_to_name": {str(e.get("id")): (e.get("entity_name") or "").strip() for e in bible if e.get("id")},
+        "timeline": _get_timeline_for_logic(project_id) if with_timeline else None,
+    }
+
+
+def select_logic_references(refs: Dict[str, Any], chapter_content: str) -> Dict[str, Any]:
+    """
+    Chọn phần tham chiếu liên quan tới nội dung chương: thực thể được nhắc + láng giềng 1 bước (quan hệ / cha-con),
+    quan hệ chạm thực thể được nhắc, [RULE] / [CHAT] nhắc tới các thực thể đó, cộng rule chung (không nhắc thực thể nào).
+    Returns {"mentioned": [entry], "neighbours": [entry], "relations": [row], "rules": [entry], "chats": [entry], "mentioned_ids": set}.
+    """
+    from core.entity_mentions import expand_one_hop
+    index = refs["index"]
+    counts = index.detect(chapter_content or "")
+    mentioned_ids = set(counts)
+    neighbour_ids = expand_one_hop(mentioned_ids, refs["relations"], index.entries_by_id)
+    neighbour_ids = {i for i in neighbour_ids if i in index.entries_by_id}
+    neighbours = sorted((index.entries_by_id[i] for i in neighbour_ids), key=lambda e: (e.get("entity_name") or ""))
+    mentioned = sorted((index.entries_by_id[i] for i in mentioned_ids), key=lambda e: -counts[str(e.get("id"))])
+
+    relations = []
+    for r in refs["relations"]:
+        src = r.get("source_entity_id") or r.get("entity_id")
+        tgt = r.get("target_entity_id")
+        if (src and str(src) in mentioned_ids) or (tgt and str(tgt) in mentioned_ids):
+            relations.append(r)
+
+    relevant_ids = mentioned_ids | neighbour_ids
+    rules, general_rules = [], []
+    for e in refs["rules"]:
+        hits = set(index.detect(f"{e.get('entity_name') or ''} {e.get('description') or ''}"))
+        if hits & relevant_ids:
+            rules.append(e)
+        elif not hits:
+            general_rules.append(e)
+    chats = [
+        e for e in refs["chats"]
+        if set(index.detect(f"{e.get('entity_name') or ''} {e.get('description') or ''}")) & mentioned_ids
+    ]
+    return {
+        "mentioned": mentioned,
+        "neighbours": neighbours[:LOGIC_MAX_NEIGHBOURS],
+        "relations": relations,
+        "rules": rules + general_rules[:LOGIC_MAX_GENERAL_RULES],
+        "chats": chats,
+        "mentioned_ids": mentioned_ids,
+    }
+
+
+def _entry_line(e: Dict[str, Any], max_chars: int) -> str:
+    name = (e.get("entity_name") or "").strip()
+    desc = (e.get("description") or "").strip()
+    if len(desc) > max_chars:
+        desc = desc[:max_chars - 3] + "..."
+    return f"  • {name}: {desc}"
+
+
+def _mentions_any(text: str, index: Any, ids: set) -> bool:
+    return bool(ids) and bool(set(index.detect(text)) & ids)
+
+
 def build_logic_context_for_chapter(
     project_id: str,
     chapter_id: int,
     chapter_number: int,
     arc_id: Optional[str] = None,
     include_archived: bool = False,
+    chapter_content: Optional[str] = None,
+    refs: Optional[Dict[str, Any]] = None,
 ) -> str:
     """
     Tạo context soát logic: timeline, bible, relation, chat_crystallize [CHAT], rule [RULE].
+    Chỉ gồm thực thể chương nhắc tới (+ láng giềng 1 bước), không đổ toàn bộ dự án.
+    chapter_content=None: đọc nội dung từ bảng chapters. refs: kết quả load_logic_references (dùng lại giữa nhiều chương).
     Dùng chung cho Data Health soát chương và Review (Review có thể gọi hàm này).
     """
+    return _build_logic_context(
+        project_id, chapter_id, chapter_number, arc_id, include_archived, chapter_content, refs
+    )[0]
+
+
+def _ref_line(deps: Dict[str, Dict[str, str]], dimension: str, row: Dict[str, Any], line: str) -> str:
+    """Ghi hash dòng tham chiếu (đúng nội dung đưa vào prompt) vào deps[dimension][row_id]; trả lại line."""
+    if row.get("id") is not None:
+        deps.setdefault(dimension, {})[str(row["id"])] = hashlib.sha1(line.encode("utf-8")).hexdigest()[:16]
+    return line
+
+
+def _build_logic_context(
+    project_id: str,
+    chapter_id: int,
+    chapter_number: int,
+    arc_id: Optional[str] = None,
+    include_archived: bool = False,
+    chapter_content: Optional[str] = None,
+    refs: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Như build_logic_context_for_chapter, kèm ref_hashes {dimension: {row_id: hash}, "_v": version}; lỗi -> (thông báo, None)."""
     parts = []
+    deps: Dict[str, Any] = {"_v": LOGIC_CHECK_DEPS_VERSION}
     try:
         services = init_services()
         if not services:
-            return "(Không kết nối được dịch vụ.)"
+            return "(Không kết nối được dịch vụ.)", None
         supabase = services["supabase"]
 
-        # 1) Timeline: sự kiện liên quan chương này hoặc toàn dự án (rút gọn)
-        events = get_timeline_events(
-            project_id,
-            limit=100,
-            chapter_range=(chapter_number, chapter_number),
-            arc_id=arc_id,
-        )
+        if chapter_content is None and chapter_id:
+            ch = supabase.table("chapters").select("content").eq("id", chapter_id).limit(1).execute()
+            chapter_content = (ch.data[0].get("content") if ch.data else "") or ""
+        if refs is None:
+            refs = load_logic_references(project_id, include_archived=include_archived)
+        selected = select_logic_references(refs, chapter_content or "")
+        index = refs["index"]
+        mentioned_ids = selected["mentioned_ids"]
+
+        # 1) Timeline: sự kiện của chương này; không có thì sự kiện toàn dự án có nhắc tới thực thể trong chương
+        if refs.get("timeline") is not None:
+            pool = [e for e in refs["timeline"] if not arc_id or e.get("arc_id") == arc_id]
+            events = [e for e in pool if chapter_id and str(e.get("chapter_id")) == str(chapter_id)][:100]
+        else:
+            pool = None
+            events = get_timeline_events(
+                project_id,
+                limit=100,
+                chapter_range=(chapter_number, chapter_number),
+                arc_id=arc_id,
+            )
         if not events:
-            events = get_timeline_events(project_id, limit=80, arc_id=arc_id)
+            if pool is None:
+                pool = get_timeline_events(project_id, limit=300, arc_id=arc_id)
+            events = [
+                e for e in pool
+                if _mentions_any(f"{e.get('title') or ''} {e.get('description') or ''}", index, mentioned_ids)
+            ][:LOGIC_MAX_FALLBACK_EVENTS]
         if events:
             lines = ["[TIMELINE - Sự kiện đã thiết lập]"]
             for e in events[:80]:
@@ -67,58 +286,48 @@ def build_logic_context_for_chapter(
                 if len(desc) > 400:
                     desc = desc[:397] + "..."
                 if title or desc:
-                    lines.append(f"  • #{order}: {title} — {desc}")
+                    lines.append(_ref_line(deps, "timeline", e, f"  • #{order}: {title} — {desc}"))
             parts.append("\n".join(lines))
         else:
-            parts.append("[TIMELINE] Chưa có dữ liệu sự kiện.")
-
-        # 2) Bible (không archive) + 3) Rule + 4) Chat crystallize: từ story_bible
-        bible_entries = _get_bible_for_logic(project_id, include_archived=include_archived)
-        bible_lines = []
-        rule_lines = []
-        chat_lines = []
-        for e in bible_entries[:400]:
-            name = (e.get("entity_name") or "").strip()
-            desc = (e.get("description") or "").strip()
-            if len(desc) > 800:
-                desc = desc[:797] + "..."
-            if not name:
-                continue
-            if name.startswith("[RULE]"):
-                rule_lines.append(f"  • {name}: {desc}")
-            elif name.startswith("[CHAT]"):
-                chat_lines.append(f"  • {name}: {desc}")
-            else:
-                bible_lines.append(f"  • {name}: {desc}")
-
-        if bible_lines:
-            parts.append("[BIBLE - Nhân vật / khái niệm]\n" + "\n".join(bible_lines))
-        if rule_lines:
-            parts.append("[RULE - Quy tắc đã lưu]\n" + "\n".join(rule_lines))
-        if chat_lines:
-            parts.append("[CHAT CRYSTALLIZE - Điểm nhớ từ hội thoại]\n" + "\n".join(chat_lines))
+            parts.append("[TIMELINE] Chưa có sự kiện liên quan.")
 
-        # 5) Relations
-        id_to_name = {str(e.get("id")): (e.get("entity_name") or "").strip() for e in bible_entries if e.get("id")}
-        try:
-            rel_res = supabase.table("entity_relations").select("*").eq("story_id", project_id).execute()
-            if rel_res.data:
-                rel_lines = ["[QUAN HỆ THỰC THỂ]"]
-                for r in rel_res.data[:400]:
-                    src_id = r.get("source_entity_id") or r.get("entity_id")
-                    tgt_id = r.get("target_entity_id")
-                    src_name = id_to_name.get(str(src_id), str(src_id) if src_id else "?")
-                    tgt_name = id_to_name.get(str(tgt_id), str(tgt_id) if tgt_id else "?")
-                    rtype = r.get("relation_type") or r.get("relation") or "liên quan"
-                    rel_lines.append(f"  • {src_name} — {rtype} — {tgt_name}")
-                parts.append("\n".join(rel_lines))
-        except Exception:
-            parts.append("[QUAN HỆ] Chưa có dữ liệu.")
+        # 2) Bible: thực thể được nhắc + láng giềng 1 bước; 3) Rule; 4) Chat crystallize
+        if selected["mentioned"]:
+            parts.append("[BIBLE - Nhân vật / khái niệm được nhắc trong chương]\n" + "\n".join(
+                _ref_line(deps, "bible", e, _entry_line(e, LOGIC_DESC_MAX_CHARS)) for e in selected["mentioned"]
+            ))
+        else:
+            parts.append("[BIBLE] Chương không nhắc tới thực thể nào đã có trong Bible.")
+        if selected["neighbours"]:
+            parts.append("[BIBLE - Thực thể liên quan (1 bước)]\n" + "\n".join(
+                _ref_line(deps, "bible", e, _entry_line(e, LOGIC_NEIGHBOUR_DESC_MAX_CHARS)) for e in selected["neighbours"]
+            ))
+        if selected["rules"]:
+            parts.append("[RULE - Quy tắc đã lưu]\n" + "\n".join(
+                _ref_line(deps, "rule", e, _entry_line(e, LOGIC_DESC_MAX_CHARS)) for e in selected["rules"]
+            ))
+        if selected["chats"]:
+            parts.append("[CHAT CRYSTALLIZE - Điểm nhớ từ hội thoại]\n" + "\n".join(
+                _ref_line(deps, "chat_crystallize", e, _entry_line(e, LOGIC_DESC_MAX_CHARS)) for e in selected["chats"]
+            ))
+
+        # 5) Relations chạm thực thể được nhắc
+        if selected["relations"]:
+            id_to_name = refs["id_to_name"]
+            rel_lines = ["[QUAN HỆ THỰC THỂ]"]
+            for r in selected["relations"][:400]:
+                src_id = r.get("source_entity_id") or r.get("entity_id")
+                tgt_id = r.get("target_entity_id")
+                src_name = id_to_name.get(str(src_id), str(src_id) if src_id else "?")
+                tgt_name = id_to_name.get(str(tgt_id), str(tgt_id) if tgt_id else "?")
+                rtype = r.get("relation_type") or r.get("relation") or "liên quan"
+                rel_lines.append(_ref_line(deps, "relation", r, f"  • {src_name} — {rtype} — {tgt_name}"))
+            parts.append("\n".join(rel_lines))
 
     except Exception as e:
         print(f"build_logic_context_for_chapter error: {e}")
-        return f"(Lỗi build context: {e})"
-    return "\n\n---\n\n".join(parts) if parts else "(Không có dữ liệu tham chiếu.)"
+        return f"(Lỗi build context: {e})", None
+    return ("\n\n---\n\n".join(parts) if parts else "(Không có dữ liệu tham chiếu.)"), deps
 
 
 def _parse_issues_from_llm(content: str) -> List[Dict[str, Any]]:
@@ -167,6 +376,134 @@ def _parse_issues_from_llm(content: str) -> List[Dict[str, Any]]:
     return out
 
 
+def _build_logic_prompt(
+    context_ref: str,
+    chapter_number: int,
+    chapter_title: str,
+    chapter_content: str,
+    max_content_chars: int = LOGIC_MAX_CONTENT_CHARS,
+) -> str:
+    content_slice = (chapter_content or "")[:max_content_chars]
+    if len(chapter_content or "") > max_content_chars:
+        content_slice += "\n\n[... (nội dung cắt bớt do giới hạn)]"
+
+    return f"""Bạn là trợ lý kiểm tra tính logic của truyện. Soát nội dung chương dưới đây với 5 nguồn tham chiếu: TIMELINE, BIBLE, RELATION, CHAT_CRYSTALLIZE, RULE.
+
+DỮ LIỆU THAM CHIẾU (đã thiết lập trong dự án):
+---
+{context_ref}
+---
+
+NỘI DUNG CHƯƠNG CẦN SOÁT (Chương #{chapter_number}: {chapter_title}):
+---
+{content_slice}
+---
+
+YÊU CẦU: Tìm mâu thuẫn logic, điểm vô lý, plot hole: (1) Timeline: sự kiện trong chương có trái với thứ tự/ mô tả timeline đã có không? (2) Bible: nhân vật/địa điểm/khái niệm có sai lệch với định nghĩa Bible không? (3) Relation: quan hệ giữa nhân vật có đúng với entity_relations không? (4) Chat crystallize: có trái với điểm nhớ [CHAT] không? (5) Rule: có vi phạm quy tắc [RULE] không?
+
+Trả về ĐÚNG MỘT mảng JSON, mỗi phần tử là object có key: "dimension" (một trong: timeline, bible, relation, chat_crystallize, rule), "message" (mô tả ngắn lỗi), "details" (object tùy chọn). Nếu không có lỗi, trả về mảng rỗng [].
+Ví dụ: [{{"dimension": "bible", "message": "Nhân vật A trong chương được mô tả khác với Bible.", "details": {{}}}}]
+Chỉ trả về JSON, không giải thích thêm."""
+
+
+def _call_logic_llm(prompt: str) -> str:
+    """Gọi LLM soát logic; lỗi API được raise cho caller."""
+    response = AIService.call_openrouter(
+        messages=[{"role": "user", "content": prompt}],
+        model=_get_default_tool_model(),
+        temperature=0.2,
+        max_tokens=4000,
+        call_site="run_chapter_logic_check",
+    )
+    return (response.choices[0].message.content or "").strip() if response and response.choices else ""
+
+
+def _issue_key(issue: Dict[str, Any]) -> Tuple[Any, str]:
+    return (issue.get("dimension"), (issue.get("message") or "")[:200])
+
+
+def _get_active_issues_by_chapter(supabase, project_id: str, chapter_ids: List[Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """{chapter_id (str): [issue active]} cho nhiều chương (query theo lô 100 chapter_id)."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for i in range(0, len(chapter_ids), 100):
+        part = chapter_ids[i:i + 100]
+        rows = _fetch_paged(
+            lambda part=part: supabase.table("chapter_logic_issues").select("id, chapter_id, dimension, message").eq(
+                "story_id", project_id
+            ).eq("status", "active").in_("chapter_id", part).order("id")
+        )
+        for row in rows:
+            out.setdefault(str(row.get("chapter_id")), []).append(row)
+    return out
+
+
+def _write_check_results(supabase, project_id: str, results: List[Dict[str, Any]]) -> int:
+    """
+    Ghi kết quả của nhiều lần soát: một insert cho toàn bộ issue mới, một update resolved cho mọi issue cũ không còn,
+    một upsert trạng thái chapter_logic_checks. results: [{"check_id", "chapter_id", "arc_id", "issues", "raw_text",
+    "error", "existing"}]. Gán result["resolved"]; trả về tổng số issue đã resolve.
+    """
+    now_iso = datetime.now(timezone.utc).isoformat()
+    new_rows, resolve_ids, check_rows = [], [], []
+    for res in results:
+        check_row = {
+            "id": res["check_id"],
+            "story_id": project_id,
+            "chapter_id": res["chapter_id"],
+            "arc_id": res.get("arc_id"),
+            "result_summary": None,
+            "raw_llm_response": None,
+            "error_message": None,
+            "content_hash": None,
+            "ref_hashes": None,
+        }
+        if res.get("error"):
+            check_rows.append({**check_row, "status": "failed", "error_message": str(res["error"])[:1000]})
+            res["resolved"] = 0
+            continue
+        issues = res.get("issues") or []
+        new_keys = set(_issue_key(i) for i in issues)
+        stale = [ex["id"] for ex in (res.get("existing") or []) if _issue_key(ex) not in new_keys]
+        resolve_ids.extend(stale)
+        res["resolved"] = len(stale)
+        for i in issues:
+            new_rows.append({
+                "story_id": project_id,
+                "chapter_id": res["chapter_id"],
+                "check_id": res["check_id"],
+                "dimension": i["dimension"],
+                "message": i["message"],
+                "details": i.get("details") or {},
+                "status": "active",
+            })
+        raw_text = res.get("raw_text") or ""
+        check_rows.append({
+            **check_row,
+            "status": "completed",
+            "result_summary": f"Phát hiện {len(issues)} lỗi; đã khắc phục {len(stale)} lỗi cũ.",
+            "raw_llm_response": raw_text[:50000] if raw_text else None,
+            "content_hash": res.get("content_hash"),
+            "ref_hashes": res.get("ref_hashes"),
+        })
+    for i in range(0, len(resolve_ids), 200):
+        supabase.table("chapter_logic_issues").update({
+            "status": "resolved",
+            "resolved_at": now_iso,
+        }).in_("id", resolve_ids[i:i + 200]).execute()
+    if new_rows:
+        supabase.table("chapter_logic_issues").insert(new_rows).execute()
+    if check_rows:
+        try:
+            supabase.table("chapter_logic_checks").upsert(check_rows).execute()
+        except Exception as e:
+            # Chưa chạy schema_v8.1_migration.sql (chưa có content_hash / ref_hashes): ghi trạng thái không kèm hash.
+            print(f"chapter_logic_checks upsert (hash) error: {e}")
+            supabase.table("chapter_logic_checks").upsert([
+                {k: v for k, v in row.items() if k not in ("content_hash", "ref_hashes")} for row in check_rows
+            ]).execute()
+    return len(resolve_ids)
+
+
 def run_chapter_logic_check(
     project_id: str,
     chapter_id: int,
@@ -174,7 +511,7 @@ def run_chapter_logic_check(
     chapter_title: str,
     chapter_content: str,
     arc_id: Optional[str] = None,
-    max_content_chars: int = 80000,
+    max_content_chars: int = LOGIC_MAX_CONTENT_CHARS,
 ) -> Tuple[List[Dict[str, Any]], int, Optional[int], str]:
     """
     Chạy soát logic 1 chương. Tạo chapter_logic_checks, gọi LLM, ghi chapter_logic_issues.
@@ -199,85 +536,29 @@ def run_chapter_logic_check(
         if not check_id:
             return [], 0, None, "Không tạo được bản ghi check."
 
-        context_ref = build_logic_context_for_chapter(
-            project_id, chapter_id, chapter_number, arc_id, include_archived=False
+        context_ref, ref_hashes = _build_logic_context(
+            project_id, chapter_id, chapter_number, arc_id, include_archived=False, chapter_content=chapter_content or "",
         )
-        content_slice = (chapter_content or "")[:max_content_chars]
-        if len(chapter_content or "") > max_content_chars:
-            content_slice += "\n\n[... (nội dung cắt bớt do giới hạn)]"
-
-        prompt = f"""Bạn là trợ lý kiểm tra tính logic của truyện. Soát nội dung chương dưới đây với 5 nguồn tham chiếu: TIMELINE, BIBLE, RELATION, CHAT_CRYSTALLIZE, RULE.
-
-DỮ LIỆU THAM CHIẾU (đã thiết lập trong dự án):
----
-{context_ref}
----
-
-NỘI DUNG CHƯƠNG CẦN SOÁT (Chương #{chapter_number}: {chapter_title}):
----
-{content_slice}
----
-
-YÊU CẦU: Tìm mâu thuẫn logic, điểm vô lý, plot hole: (1) Timeline: sự kiện trong chương có trái với thứ tự/ mô tả timeline đã có không? (2) Bible: nhân vật/địa điểm/khái niệm có sai lệch với định nghĩa Bible không? (3) Relation: quan hệ giữa nhân vật có đúng với entity_relations không? (4) Chat crystallize: có trái với điểm nhớ [CHAT] không? (5) Rule: có vi phạm quy tắc [RULE] không?
-
-Trả về ĐÚNG MỘT mảng JSON, mỗi phần tử là object có key: "dimension" (một trong: timeline, bible, relation, chat_crystallize, rule), "message" (mô tả ngắn lỗi), "details" (object tùy chọn). Nếu không có lỗi, trả về mảng rỗng [].
-Ví dụ: [{{"dimension": "bible", "message": "Nhân vật A trong chương được mô tả khác với Bible.", "details": {{}}}}]
-Chỉ trả về JSON, không giải thích thêm."""
-
+        prompt = _build_logic_prompt(context_ref, chapter_number, chapter_title, chapter_content, max_content_chars)
+        result = {
+            "check_id": check_id,
+            "chapter_id": chapter_id,
+            "arc_id": arc_id,
+            "content_hash": chapter_content_hash(chapter_content),
+            "ref_hashes": ref_hashes,
+        }
         try:
-            response = AIService.call_openrouter(
-                messages=[{"role": "user", "content": prompt}],
-                model=_get_default_tool_model(),
-                temperature=0.2,
-                max_tokens=4000,
-            )
-            raw_text = (response.choices[0].message.content or "").strip() if response and response.choices else ""
+            raw_text = _call_logic_llm(prompt)
         except Exception as e:
-            supabase.table("chapter_logic_checks").update({
-                "status": "failed",
-                "error_message": str(e)[:1000],
-            }).eq("id", check_id).execute()
+            _write_check_results(supabase, project_id, [{**result, "error": str(e)}])
             return [], 0, check_id, str(e)
 
-        issues = _parse_issues_from_llm(raw_text)
-        now_iso = datetime.now(timezone.utc).isoformat()
-
-        # Lấy danh sách active hiện tại của chương này (để so sánh và resolve)
-        existing = supabase.table("chapter_logic_issues").select("id, dimension, message").eq(
-            "story_id", project_id
-        ).eq("chapter_id", chapter_id).eq("status", "active").execute()
-        existing_list = list(existing.data or [])
-        new_keys = set((i["dimension"], (i["message"] or "")[:200]) for i in issues)
-        resolved_count = 0
-        for ex in existing_list:
-            key = (ex.get("dimension"), (ex.get("message") or "")[:200])
-            if key not in new_keys:
-                supabase.table("chapter_logic_issues").update({
-                    "status": "resolved",
-                    "resolved_at": now_iso,
-                }).eq("id", ex["id"]).execute()
-                resolved_count += 1
-
-        # Insert issues mới (active)
-        for i in issues:
-            supabase.table("chapter_logic_issues").insert({
-                "story_id": project_id,
-                "chapter_id": chapter_id,
-                "check_id": check_id,
-                "dimension": i["dimension"],
-                "message": i["message"],
-                "details": i.get("details") or {},
-                "status": "active",
-            }).execute()
-
-        summary = f"Phát hiện {len(issues)} lỗi; đã khắc phục {resolved_count} lỗi cũ."
-        supabase.table("chapter_logic_checks").update({
-            "status": "completed",
-            "result_summary": summary,
-            "raw_llm_response": raw_text[:50000] if raw_text else None,
-        }).eq("id", check_id).execute()
-
-        return issues, resolved_count, check_id, ""
+        result["issues"] = _parse_issues_from_llm(raw_text)
+        result["raw_text"] = raw_text
+        # Issue active hiện tại của chương này (để so sánh và resolve)
+        result["existing"] = _get_active_issues_by_chapter(supabase, project_id, [chapter_id]).get(str(chapter_id), [])
+        resolved_count = _write_check_results(supabase, project_id, [result])
+        return result["issues"], resolved_count, check_id, ""
     except Exception as e:
         print(f"run_chapter_logic_check error: {e}")
         try:
@@ -291,6 +572,255 @@ Chỉ trả về JSON, không giải thích thêm."""
         return [], 0, None, str(e)
 
 
+def format_logic_check_progress(progress: Optional[Dict[str, Any]]) -> str:
+    """VD: 'Soát logic: 12/50 chương · 7 lỗi · còn ~3m05s'."""
+    if not progress:
+        return ""
+    text = f"Soát logic: {int(progress.get('done') or 0)}/{int(progress.get('total') or 0)} chương · {int(progress.get('issues') or 0)} lỗi"
+    if progress.get("failed"):
+        text += f" · {int(progress['failed'])} chương lỗi gọi AI"
+    eta = progress.get("eta_sec")
+    if eta is not None:
+        m, s = divmod(int(eta), 60)
+        text += f" · còn ~{m}m{s:02d}s" if m else f" · còn ~{s}s"
+    return text
+
+
+def chapter_content_hash(content: Optional[str]) -> str:
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
+def _get_chapters_for_logic(supabase, project_id: str, chapter_start: int, chapter_end: int) -> List[Dict[str, Any]]:
+    """Chương có nội dung trong [chapter_start, chapter_end], theo chapter_number."""
+    lo, hi = min(int(chapter_start), int(chapter_end)), max(int(chapter_start), int(chapter_end))
+    rows = _fetch_paged(
+        lambda: supabase.table("chapters").select("id, chapter_number, title, content, arc_id").eq(
+            "story_id", project_id
+        ).gte("chapter_number", lo).lte("chapter_number", hi).order("chapter_number").order("id")
+    )
+    return [c for c in rows if c.get("id") and (c.get("content") or "").strip()]
+
+
+def _latest_checks_by_chapter(supabase, project_id: str, chapter_ids: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    {chapter_id (str): lần soát completed gần nhất {content_hash, ref_hashes, created_at}}.
+    Đọc theo trang: chương soát nhiều lần có thể vượt 1000 dòng / lô, chương bị cắt sẽ thành "chưa soát".
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(chapter_ids), LOGIC_LATEST_CHECK_BATCH):
+        part = chapter_ids[i:i + LOGIC_LATEST_CHECK_BATCH]
+        try:
+            rows = _fetch_paged(
+                lambda part=part: supabase.table("chapter_logic_checks").select("chapter_id, content_hash, ref_hashes, created_at").eq(
+                    "story_id", project_id
+                ).eq("status", "completed").in_("chapter_id", part).order("created_at", desc=True).order("id")
+            )
+        except Exception as e:
+            # Chưa có cột content_hash / ref_hashes: coi như chưa soát (mọi chương cần soát).
+            print(f"_latest_checks_by_chapter error: {e}")
+            return {}
+        for row in rows:
+            out.setdefault(str(row.get("chapter_id")), row)
+    return out
+
+
+def logic_check_stale_reasons(
+    last_check: Optional[Dict[str, Any]],
+    content_hash: str,
+    ref_hashes: Optional[Dict[str, Any]],
+) -> List[str]:
+    """Lý do chương cần soát lại so với lần soát gần nhất; [] = không đổi (bỏ qua được)."""
+    if not last_check or not last_check.get("content_hash") or not isinstance(last_check.get("ref_hashes"), dict):
+        return ["chưa soát"]
+    if ref_hashes is None:
+        return ["lỗi build context"]
+    reasons = []
+    if last_check["content_hash"] != content_hash:
+        reasons.append("nội dung")
+    old = last_check["ref_hashes"]
+    if old.get("_v") != ref_hashes.get("_v"):
+        reasons.append("phiên bản soát")
+    for dim in LOGIC_DIMENSIONS:
+        if (old.get(dim) or {}) != (ref_hashes.get(dim) or {}):
+            reasons.append(dim)
+    return reasons
+
+
+def _prepare_chapter_checks(
+    supabase,
+    project_id: str,
+    chapters: List[Dict[str, Any]],
+    refs: Dict[str, Any],
+    stale_only: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    Dựng context + hash cho từng chương (không gọi LLM). stale_only: chỉ giữ chương có lý do soát lại.
+    Returns [{"chapter", "context", "content_hash", "ref_hashes", "reasons"}].
+    """
+    latest = _latest_checks_by_chapter(supabase, project_id, [c["id"] for c in chapters]) if stale_only else {}
+    plans = []
+    for ch in chapters:
+        content = ch.get("content") or ""
+        context, ref_hashes = _build_logic_context(
+            project_id, ch["id"], ch.get("chapter_number") or 0, ch.get("arc_id"), chapter_content=content, refs=refs,
+        )
+        content_hash = chapter_content_hash(content)
+        reasons = logic_check_stale_reasons(latest.get(str(ch["id"])), content_hash, ref_hashes) if stale_only else []
+        if stale_only and not reasons:
+            continue
+        plans.append({"chapter": ch, "context": context, "content_hash": content_hash, "ref_hashes": ref_hashes, "reasons": reasons})
+    return plans
+
+
+def find_stale_chapters(project_id: str, chapter_start: int, chapter_end: int) -> List[Dict[str, Any]]:
+    """Xem trước (không gọi LLM): [{"chapter_number", "title", "reasons"}] các chương cần soát lại trong khoảng."""
+    try:
+        services = init_services()
+        if not services:
+            return []
+        supabase = services["supabase"]
+        chapters = _get_chapters_for_logic(supabase, project_id, chapter_start, chapter_end)
+        if not chapters:
+            return []
+        refs = load_logic_references(project_id, with_timeline=True)
+        return [
+            {"chapter_number": p["chapter"].get("chapter_number"), "title": p["chapter"].get("title") or "", "reasons": p["reasons"]}
+            for p in _prepare_chapter_checks(supabase, project_id, chapters, refs, stale_only=True)
+        ]
+    except Exception as e:
+        print(f"find_stale_chapters error: {e}")
+        return []
+
+
+def run_logic_check_range(
+    project_id: str,
+    chapter_start: int,
+    chapter_end: int,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    include_archived: bool = False,
+    stale_only: bool = False,
+) -> Dict[str, Any]:
+    """
+    Soát logic mọi chương trong [chapter_start, chapter_end] song song (LOGIC_CHECK_MAX_CONCURRENCY luồng, giới hạn
+    LOGIC_CHECK_REQUESTS_PER_MIN). Bible / quan hệ / timeline lấy một lần cho cả job; kết quả ghi theo lô LOGIC_CHECK_FLUSH_EVERY chương.
+    stale_only=True: bỏ qua chương có nội dung và dòng tham chiếu y như lần soát gần nhất (không gọi LLM).
+    on_progress({"progress": {...}}) gọi tối đa mỗi LOGIC_CHECK_PROGRESS_EVERY_SEC giây.
+    Returns {"checked", "failed", "skipped", "issues", "resolved", "elapsed_sec"}.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from core.cost_ledger import get_cost_actor, set_cost_actor
+    from core.embedding_backfill import RateLimiter
+
+    started = time.time()
+    out: Dict[str, Any] = {"checked": 0, "failed": 0, "skipped": 0, "issues": 0, "resolved": 0, "elapsed_sec": 0.0}
+    services = init_services()
+    if not services:
+        raise RuntimeError("Không kết nối được dịch vụ.")
+    supabase = services["supabase"]
+    chapters = _get_chapters_for_logic(supabase, project_id, chapter_start, chapter_end)
+    if not chapters:
+        return out
+
+    refs = load_logic_references(project_id, include_archived=include_archived, with_timeline=True)
+    plans = _prepare_chapter_checks(supabase, project_id, chapters, refs, stale_only=stale_only)
+    out["skipped"] = len(chapters) - len(plans)
+    chapters = [p["chapter"] for p in plans]
+    plan_by_chapter = {str(p["chapter"]["id"]): p for p in plans}
+    if not chapters:
+        out["elapsed_sec"] = round(time.time() - started, 1)
+        return out
+    ins = supabase.table("chapter_logic_checks").insert([
+        {"story_id": project_id, "chapter_id": c["id"], "arc_id": c.get("arc_id"), "status": "running"} for c in chapters
+    ]).execute()
+    check_by_chapter = {str(row.get("chapter_id")): row.get("id") for row in (ins.data or [])}
+    existing = _get_active_issues_by_chapter(supabase, project_id, [c["id"] for c in chapters])
+    limiter = RateLimiter(LOGIC_CHECK_REQUESTS_PER_MIN)
+    actor = get_cost_actor()
+
+    def _check_one(ch: Dict[str, Any]) -> Dict[str, Any]:
+        set_cost_actor(*actor)
+        plan = plan_by_chapter[str(ch["id"])]
+        res = {
+            "check_id": check_by_chapter.get(str(ch["id"])),
+            "chapter_id": ch["id"],
+            "arc_id": ch.get("arc_id"),
+            "existing": existing.get(str(ch["id"]), []),
+            "content_hash": plan["content_hash"],
+            "ref_hashes": plan["ref_hashes"],
+        }
+        try:
+            num = ch.get("chapter_number") or 0
+            prompt = _build_logic_prompt(plan["context"], num, ch.get("title") or f"Chương {num}", ch.get("content") or "")
+            limiter.acquire()
+            raw_text = _call_logic_llm(prompt)
+            res["issues"] = _parse_issues_from_llm(raw_text)
+            res["raw_text"] = raw_text
+        except Exception as e:
+            res["error"] = str(e)
+        return res
+
+    pending: List[Dict[str, Any]] = []
+    last_report = 0.0
+
+    def _flush() -> None:
+        batch = [p for p in pending if p.get("check_id")]
+        pending.clear()
+        if batch:
+            out["resolved"] += _write_check_results(supabase, project_id, batch)
+
+    with ThreadPoolExecutor(max_workers=LOGIC_CHECK_MAX_CONCURRENCY) as pool:
+        futures = [pool.submit(_check_one, ch) for ch in chapters]
+        for fut in as_completed(futures):
+            res = fut.result()
+            pending.append(res)
+            if res.get("error"):
+                out["failed"] += 1
+            else:
+                out["checked"] += 1
+                out["issues"] += len(res.get("issues") or [])
+            if len(pending) >= LOGIC_CHECK_FLUSH_EVERY:
+                _flush()
+            done = out["checked"] + out["failed"]
+            now = time.time()
+            if on_progress and (now - last_report >= LOGIC_CHECK_PROGRESS_EVERY_SEC or done == len(chapters)):
+                last_report = now
+                elapsed = max(0.001, now - started)
+                on_progress({"progress": {
+                    "done": done,
+                    "total": len(chapters),
+                    "issues": out["issues"],
+                    "failed": out["failed"],
+                    "eta_sec": int((len(chapters) - done) * elapsed / done) if done else None,
+                }})
+    _flush()
+    out["elapsed_sec"] = round(time.time() - started, 1)
+    return out
+
+
+def start_logic_check_job(
+    project_id: str,
+    user_id: Optional[str],
+    chapter_start: int,
+    chapter_end: int,
+    stale_only: bool = False,
+) -> Optional[str]:
+    """Tạo job soát logic khoảng chương và chạy trong thread. stale_only: chỉ soát lại chương đã thay đổi. Trả về job_id hoặc None."""
+    import threading
+    from core.background_jobs import create_job, run_job_worker
+    lo, hi = min(int(chapter_start), int(chapter_end)), max(int(chapter_start), int(chapter_end))
+    label = f"Soát logic chương {lo}" if lo == hi else f"Soát logic chương {lo}–{hi}"
+    if stale_only:
+        label += " (chỉ chương đã thay đổi)"
+    job_id = create_job(
+        project_id, user_id, LOGIC_CHECK_JOB_TYPE, label,
+        payload={"chapter_start": lo, "chapter_end": hi, "stale_only": bool(stale_only)},
+        post_to_chat=True,
+    )
+    if job_id:
+        threading.Thread(target=run_job_worker, args=(job_id,), daemon=True).start()
+    return job_id
+
+
 def get_chapter_logic_issues(
     project_id: str,
     chapter_id: Optional[int] = None,
@@ -0,0 +1,117 @@
+# core/chunk_sync.py - Re-chunk theo diff: giữ chunk không đổi (kèm embedding), chỉ thêm / xóa phần khác
+"""
+Trước đây chunk lại một chương = xóa hết chunk cũ rồi insert mới (embedding NULL) -> backfill embed lại cả chương.
+sync_chapter_chunks so danh sách chunk mới với chunk hiện có theo hash nội dung (sha1 của content đã strip):
+- Trùng hash: giữ dòng cũ (id, embedding, không embed lại); ghi sort_order / meta_json / arc_id nếu đổi, gộp một upsert
+  cho mỗi nhóm cột. Offset trong meta_json (char_start...) luôn được ghi khi dịch (sửa đầu chương dịch offset mọi chunk sau):
+  offset cũ sẽ trỏ sai vị trí trong chương.
+- Chunk mới không khớp: insert một lần (bulk). Dòng cũ không khớp: xóa một lần (in_).
+Trả về thống kê để báo cáo số chunk / embedding được dùng lại.
+"""
+import hashlib
+from typing import Any, Dict, List, Optional
+
+def chunk_content_hash(content: str) -> str:
+    return hashlib.sha1((content or "").strip().encode("utf-8")).hexdigest()
+
+
+def sync_chapter_chunks(
+    supabase,
+    project_id: str,
+    chapter_id,
+    arc_id,
+    new_chunks: List[Dict[str, Any]],
+    embed: bool = True,
+) -> Dict[str, int]:
+    """
+    new_chunks: [{"content", "sort_order", "meta_json"}] theo thứ tự mới. embed=True: chunk mới được insert kèm vector.
+    Returns {"total", "kept", "updated", "inserted", "deleted", "reused_embeddings", "embedded"}.
+    """
+    stats = {"total": 0, "kept": 0, "updated": 0, "inserted": 0, "deleted": 0, "reused_embeddings": 0, "embedded": 0}
+    r = supabase.table("chunks").select("id, content, sort_order, meta_json, arc_id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
+    existing = list(r.data or [])
+    no_vec_ids = set()
+    if existing:
+        try:
+            nv = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).is_("embedding", "null").execute()
+            no_vec_ids = {row.get("id") for row in (nv.data or [])}
+        except Exception:
+            pass
+    by_hash: Dict[str, List[Dict[str, Any]]] = {}
+    for row in sorted(existing, key=lambda x: x.get("sort_order") or 0):
+        by_hash.setdefault(chunk_content_hash(row.get("content") or ""), []).append(row)
+
+    to_insert = []
+    kept_ids = set()
+    # Patch dòng giữ lại, nhóm theo tập cột (upsert nhiều dòng cần cùng cột): mỗi nhóm một upsert.
+    patches_by_cols: Dict[tuple, List[Dict[str, Any]]] = {}
+    for chk in new_chunks:
+        txt = (chk.get("content") or "").strip()
+        if not txt:
+            continue
+        stats["total"] += 1
+        candidates = by_hash.get(chunk_content_hash(txt))
+        if candidates:
+            row = candidates.pop(0)
+            kept_ids.add(row.get("id"))
+            stats["kept"] += 1
+            if row.get("id") not in no_vec_ids:
+                stats["reused_embeddings"] += 1
+            patch = {"id": row.get("id"), "story_id": project_id, "sort_order": chk.get("sort_order")}
+            if (row.get("meta_json") or {}) != (chk.get("meta_json") or {}):
+                patch["meta_json"] = chk.get("meta_json") or {}
+            if str(row.get("arc_id") or "") != str(arc_id or ""):
+                patch["arc_id"] = arc_id
+            if len(patch) > 3 or row.get("sort_order") != chk.get("sort_order"):
+                patches_by_cols.setdefault(tuple(sorted(patch)), []).append(patch)
+            continue
+        to_insert.append({
+            "story_id": project_id,
+            "chapter_id": chapter_id,
+            "arc_id": arc_id,
+            "content": txt,
+            "raw_content": txt,
+            "meta_json": chk.get("meta_json") or {},
+            "sort_order": chk.get("sort_order"),
+        })
+
+    for patches in patches_by_cols.values():
+        supabase.table("chunks").upsert(patches, on_conflict="id").execute()
+    stats["updated"] = sum(len(p) for p in patches_by_cols.values())
+
+    stale_ids = [row.get("id") for row in existing if row.get("id") and row.get("id") not in kept_ids]
+    if stale_ids:
+        supabase.table("chunks").delete().in_("id", stale_ids).execute()
+        stats["deleted"] = len(stale_ids)
+        try:
+            from ai.answer_cache import invalidate_answer_rows
+            invalidate_answer_rows(project_id, "chunk", stale_ids)
+        except Exception:
+            pass
+    if to_insert:
+        if embed:
+            # Embed-on-write: chunk mới có vector ngay, không chờ backfill (embed + insert theo sub-batch).
+            from core.embedding_backfill import insert_rows_with_embeddings
+            inserted = insert_rows_with_embeddings(supabase, "chunks", to_insert)
+            stats["inserted"] = len(inserted)
+            stats["embedded"] = sum(1 for row in to_insert if row.get("embedding"))
+        else:
+            supabase.table("chunks").insert(to_insert).execute()
+            stats["inserted"] = len(to_insert)
+    return stats
+
+
+def format_chunk_sync_stats(stats: Optional[Dict[str, int]]) -> str:
+    """VD: '15 chunk: giữ 12 (12 embedding dùng lại), thêm 3 (3 đã embed), xóa 2'."""
+    if not stats:
+        return ""
+    return "%s chunk: giữ %s (%s embedding dùng lại), thêm %s (%s đã embed), xóa %s" % (
+        stats.get("total", 0), stats.get("kept", 0), stats.get("reused_embeddings", 0),
+        stats.get("inserted", 0), stats.get("embedded", 0), stats.get("deleted", 0),
+    )
+
+
+def merge_chunk_sync_stats(total: Dict[str, int], stats: Optional[Dict[str, int]]) -> Dict[str, int]:
+    for k, v in (stats or {}).items():
+        total[k] = total.get(k, 0) + int(v or 0)
+    return total
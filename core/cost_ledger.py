@@ -0,0 +1,215 @@
+# core/cost_ledger.py - Cost ledger: ghi usage thật của từng lần gọi LLM vào hàng đợi, flush theo lô qua RPC record_cost_batch
+"""
+Mỗi lần AIService.call_openrouter xong: record_response_usage đọc response.usage (prompt/completion/cached tokens,
+cost nếu provider trả về), gắn model, latency, user/project hiện tại (cost actor) rồi đẩy vào buffer trong process.
+Thread nền flush buffer theo lô (đủ COST_LEDGER_FLUSH_SIZE hoặc mỗi COST_LEDGER_FLUSH_INTERVAL_SEC giây).
+Server cộng rollup + user_budgets nguyên tử (schema_v7.9_migration.sql) -> không còn read-modify-write trên đường chat.
+"""
+import atexit
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+COST_LEDGER_FLUSH_SIZE = 20
+COST_LEDGER_FLUSH_INTERVAL_SEC = 10
+# Giới hạn buffer khi DB lỗi lâu (bỏ bản ghi cũ nhất).
+COST_LEDGER_MAX_BUFFER = 5000
+
+_actor: ContextVar = ContextVar("cost_actor", default=(None, None))
+_buffer: deque = deque(maxlen=COST_LEDGER_MAX_BUFFER)
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wake = threading.Event()
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+
+def set_cost_actor(user_id: Optional[str], story_id: Optional[str]) -> None:
+    """Gán user/project cho các lần gọi LLM tiếp theo trong thread hiện tại (main.py gọi mỗi lần chạy script)."""
+    _actor.set((str(user_id) if user_id else None, str(story_id) if story_id else None))
+
+
+def get_cost_actor() -> Tuple[Optional[str], Optional[str]]:
+    return _actor.get()
+
+
+@contextmanager
+def cost_actor(user_id: Optional[str], story_id: Optional[str]):
+    """Dùng trong thread nền (job worker): with cost_actor(user_id, story_id): ..."""
+    token = _actor.set((str(user_id) if user_id else None, str(story_id) if story_id else None))
+    try:
+        yield
+    finally:
+        _actor.reset(token)
+
+
+def _usage_value(obj: Any, name: str, default: Any = 0) -> Any:
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def usage_from_response(usage: Any, model: str) -> Optional[Dict[str, Any]]:
+    """Chuẩn hóa response.usage -> {prompt_tokens, completion_tokens, cached_tokens, cost}. None nếu không có usage."""
+    if usage is None:
+        return None
+    prompt_tokens = int(_usage_value(usage, "prompt_tokens", 0) or 0)
+    completion_tokens = int(_usage_value(usage, "completion_tokens", 0) or 0)
+    details = _usage_value(usage, "prompt_tokens_details", None)
+    cached_tokens = int(_usage_value(details, "cached_tokens", 0) or 0)
+    cost = _usage_value(usage, "cost", None)
+    if cost is None:
+        from ai.service import AIService
+        cost = AIService.calculate_cost(prompt_tokens, completion_tokens, model)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "cost": round(float(cost or 0.0), 6),
+    }
+
+
+def record_usage(
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cost: float,
+    cached_tokens: int = 0,
+    latency_ms: int = 0,
+    call_site: str = "",
+    estimated: bool = False,
+    user_id: Optional[str] = None,
+    story_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Đẩy một bản ghi vào buffer (không chặn). user_id/story_id mặc định lấy từ cost actor hiện tại."""
+    actor_user, actor_story = get_cost_actor()
+    entry = {
+        "user_id": str(user_id) if user_id else actor_user,
+        "story_id": str(story_id) if story_id else actor_story,
+        "model": model or "",
+        "call_site": (call_site or "")[:100],
+        "prompt_tokens": int(prompt_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0),
+        "cost": round(float(cost or 0.0), 6),
+        "latency_ms": int(latency_ms or 0),
+        "estimated": bool(estimated),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with _buffer_lock:
+        _buffer.append(entry)
+        size = len(_buffer)
+    _ensure_flusher()
+    if size >= COST_LEDGER_FLUSH_SIZE:
+        _wake.set()
+    return entry
+
+
+def record_response_usage(usage: Any, model: str, latency_ms: int, call_site: str = "") -> Optional[Dict[str, Any]]:
+    """Ghi usage từ response API. Trả về bản ghi (có cost) hoặc None nếu response không có usage."""
+    u = usage_from_response(usage, model)
+    if u is None:
+        return None
+    return record_usage(
+        model,
+        u["prompt_tokens"],
+        u["completion_tokens"],
+        u["cost"],
+        cached_tokens=u["cached_tokens"],
+        latency_ms=latency_ms,
+        call_site=call_site,
+    )
+
+
+def flush_cost_ledger() -> int:
+    """Ghi toàn bộ buffer xuống DB trong một RPC. Lỗi: trả lại buffer để lần sau thử lại. Trả về số bản ghi đã ghi."""
+    with _flush_lock:
+        with _buffer_lock:
+            batch: List[Dict[str, Any]] = list(_buffer)
+            _buffer.clear()
+        if not batch:
+            return 0
+        try:
+            from config import init_services
+            services = init_services()
+            if not services:
+                raise RuntimeError("no services")
+            services["supabase"].rpc("record_cost_batch", {"entries": batch}).execute()
+            return len(batch)
+        except Exception as e:
+            print(f"cost_ledger flush error: {e}")
+            with _buffer_lock:
+                _buffer.extendleft(reversed(batch))
+            return 0
+
+
+def request_flush() -> None:
+    """Đánh thức thread flush (VD: sau một lượt chat để budget cập nhật sớm)."""
+    _ensure_flusher()
+    _wake.set()
+
+
+def _flusher_loop() -> None:
+    while True:
+        _wake.wait(COST_LEDGER_FLUSH_INTERVAL_SEC)
+        _wake.clear()
+        try:
+            flush_cost_ledger()
+        except Exception:
+            pass
+
+
+def _ensure_flusher() -> None:
+    global _flusher_started
+    if _flusher_started:
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        threading.Thread(target=_flusher_loop, daemon=True, name="cost-ledger-flusher").start()
+        _flusher_started = True
+
+
+def pending_count() -> int:
+    with _buffer_lock:
+        return len(_buffer)
+
+
+atexit.register(flush_cost_ledger)
+
+
+class UsageTrackingStream:
+    """
+    Bọc stream chat.completions: chỉ yield chunk có choices (chunk usage cuối bị bỏ qua),
+    khi stream kết thúc thì ghi usage vào ledger. Sau khi lặp xong: .usage_record = bản ghi (có cost) hoặc None.
+    """
+
+    def __init__(self, stream: Any, model: str, started_at: float, call_site: str = ""):
+        self._stream = stream
+        self._model = model
+        self._started_at = started_at
+        self._call_site = call_site
+        self._actor = get_cost_actor()
+        self.usage_record: Optional[Dict[str, Any]] = None
+
+    def __iter__(self):
+        usage = None
+        for chunk in self._stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if getattr(chunk, "choices", None):
+                yield chunk
+        latency_ms = int((time.time() - self._started_at) * 1000)
+        u = usage_from_response(usage, self._model)
+        if u is not None:
+            self.usage_record = record_usage(
+                self._model, u["prompt_tokens"], u["completion_tokens"], u["cost"],
+                cached_tokens=u["cached_tokens"], latency_ms=latency_ms, call_site=self._call_site,
+                user_id=self._actor[0], story_id=self._actor[1],
+            )
@@ -2,12 +2,14 @@
 """Chạy trong thread sau khi user xác nhận. Ghi audit vào data_operation_log và tin nhắn hoàn thành vào chat_history."""
 import time
 from datetime import datetime, timezone
-from typing import Optional, List, Tuple
+from typing import Dict, Optional, List, Tuple
 
-# Tối đa 7 chương / lô (fallback khi không ước lượng được token).
+# Tối đa 7 chương / lô cho chunking / delete (Bible / Relation / Timeline lập lô bằng core.batch_planner).
 MAX_CHAPTERS_PER_BATCH = 7
 # Thứ tự chạy target: Bible trước, Relation cuối để relation dựa trên Bible đã có.
 ORDERED_TARGETS = ["bible", "timeline", "chunking", "relation"]
+# Cỡ trang khi đọc dữ liệu cũ / Bible cho kế hoạch lô (PostgREST mặc định cắt 1000 dòng).
+PLANNED_FETCH_PAGE = 1000
 
 # Lazy imports inside run_data_operation để tránh circular / streamlit khi import top-level.
 
@@ -26,6 +28,8 @@ def run_data_operation(
     Chạy ngầm; khi xong ghi tin nhắn vào chat_history (trừ khi post_completion_message=False, dùng khi gọi từ batch).
     """
     from config import init_services, Config
+    from core.cost_ledger import set_cost_actor
+    set_cost_actor(user_id, project_id)
     services = init_services()
     if not services:
         if post_completion_message:
@@ -63,6 +67,7 @@ def run_data_operation(
         chapter_id = chapter.get("id")
         content = (chapter.get("content") or "").strip()
         chapter_label = (chapter.get("title") or "").strip() or f"Chương {chapter_number}"
+        chunk_detail = None
 
         if operation_type == "delete":
             _do_delete(supabase, project_id, target, chapter_number, chapter_id)
@@ -79,7 +84,10 @@ def run_data_operation(
             elif target == "timeline":
                 _do_extract_timeline(supabase, project_id, chapter_id, chapter_number, chapter_label, content)
             elif target == "chunking":
-                _do_extract_chunking(supabase, project_id, chapter_id, chapter.get("arc_id"), chapter_number, content)
+                from core.chunk_sync import format_chunk_sync_stats
+                chunk_detail = format_chunk_sync_stats(
+                    _do_extract_chunking(supabase, project_id, chapter_id, chapter.get("arc_id"), chapter_number, content)
+                )
             else:
                 if post_completion_message:
                     _post_completion_message(project_id, user_id, user_request, False, f"Đối tượng không hỗ trợ: {target}")
@@ -93,13 +101,16 @@ def run_data_operation(
 
         _update_log_status(supabase, log_id, "completed")
         if post_completion_message:
-            _post_completion_message(project_id, user_id, user_request, True, None)
+            _post_completion_message(project_id, user_id, user_request, True, None, detail=chunk_detail)
     except Exception as e:
         err_msg = str(e)[:500]
         _update_log_status(supabase, log_id, "failed", err_msg)
         if post_completion_message:
             _post_completion_message(project_id, user_id, user_request, False, err_msg)
         raise
+    finally:
+        from ai.router_cache import bump_data_version
+        bump_data_version(project_id)
 
 
 def run_data_operation_chunk(
@@ -110,10 +121,15 @@ def run_data_operation_chunk(
     chapter_numbers: List[int],
     user_request: str,
     post_completion_message: bool = False,
+    chunk_stats: Optional[Dict[str, int]] = None,
+    plan: Optional[Dict] = None,
 ) -> List[str]:
     """
     Thực thi cùng một thao tác (op_type, target) cho nhiều chương trong một lô.
-    Fetch tất cả chapter trong chapter_numbers bằng MỘT query, rồi xử lý từng chương (tránh tràn token: gọi với tối đa MAX_CHAPTERS_PER_BATCH chương).
+    Fetch tất cả chapter trong chapter_numbers bằng MỘT query.
+    Extract/update Bible / Relation / Timeline: chạy theo kế hoạch core.batch_planner (plan truyền vào hoặc tự lập cho chapter_numbers).
+    Chunking / delete: theo nhóm MAX_CHAPTERS_PER_BATCH chương.
+    chunk_stats: dict cộng dồn thống kê re-chunk (kept / inserted / deleted / reused_embeddings) nếu truyền vào.
     Returns: danh sách mô tả lỗi (rỗng nếu không lỗi).
     """
     if not chapter_numbers:
@@ -144,47 +160,23 @@ def run_data_operation_chunk(
         except Exception:
             pass
 
-        ch_rows = supabase.table("chapters").select("id, content, title, arc_id, chapter_number").eq(
-            "story_id", project_id
-        ).in_("chapter_number", chapter_numbers).order("chapter_number").execute()
-        chapters = (ch_rows.data or []) if ch_rows.data else []
+        from core.batch_planner import PLANNED_TARGETS, plan_data_batches
+        planned = target in PLANNED_TARGETS and operation_type in ("extract", "update")
+        # Có plan sẵn (run_data_operations_batch đã đọc nội dung để lập kế hoạch) -> không đọc lại content.
+        columns = "id, title, arc_id, chapter_number" if (planned and plan) else "id, content, title, arc_id, chapter_number"
+        chapters = []
+        for i in range(0, len(chapter_numbers), 200):
+            ch_rows = supabase.table("chapters").select(columns).eq(
+                "story_id", project_id
+            ).in_("chapter_number", chapter_numbers[i:i + 200]).order("chapter_number").execute()
+            chapters.extend(ch_rows.data or [])
         by_num = {int(c["chapter_number"]): c for c in chapters if c.get("chapter_number") is not None}
 
-        # Chia lô theo token để tránh lỗi gói tối đa / lag (chương vượt giới hạn bỏ qua, xử lý lần sau)
-        try:
-            from config import Config
-            from ai_engine import AIService
-            max_tokens = getattr(Config, "DATA_BATCH_MAX_TOKENS", 50000)
-            token_per_ch = {}
-            for ch_num in chapter_numbers:
-                ch = by_num.get(ch_num)
-                if not ch:
-                    continue
-                content = (ch.get("content") or "").strip()
-                token_per_ch[ch_num] = AIService.estimate_tokens(content) if content else 0
-            sub_batches = []
-            current_batch = []
-            current_tokens = 0
-            for ch_num in chapter_numbers:
-                tok = token_per_ch.get(ch_num, 0)
-                if tok > max_tokens:
-                    failed.append(f"{target} ch.{ch_num}: vượt giới hạn token ({tok}), bỏ qua lần sau.")
-                    continue
-                if current_tokens + tok > max_tokens and current_batch:
-                    sub_batches.append(current_batch)
-                    current_batch = []
-                    current_tokens = 0
-                current_batch.append(ch_num)
-                current_tokens += tok
-            if current_batch:
-                sub_batches.append(current_batch)
-        except Exception:
-            sub_batches = [[ch] for ch in chapter_numbers]
-
-        for sub in sub_batches:
-            if target == "bible" and operation_type in ("extract", "update"):
-                contents_list = []
-                for ch_num in sub:
+        if planned:
+            # Bible / Relation / Timeline: bin-packing toàn khoảng (chương lớn chia phần, không bỏ qua).
+            if plan is None:
+                contents = []
+                for ch_num in chapter_numbers:
                     chapter = by_num.get(ch_num)
                     if not chapter:
                         failed.append(f"{target} ch.{ch_num}: không tìm thấy chương")
@@ -193,15 +185,22 @@ def run_data_operation_chunk(
                     if not content:
                         failed.append(f"{target} ch.{ch_num}: chương không có nội dung")
                         continue
-                    contents_list.append((ch_num, content))
-                if contents_list:
-                    try:
-                        _do_extract_bible_batch(supabase, project_id, contents_list)
-                    except Exception as e:
-                        failed.append(f"bible batch: {str(e)[:150]}")
-            elif target == "chunking" and operation_type in ("extract", "update"):
+                    contents.append((ch_num, content))
+                plan = plan_data_batches(target, contents)
+            else:
+                failed.extend(plan.get("failed") or [])
+            _run_planned_operation(supabase, project_id, target, plan, by_num, failed)
+            sub_batches = []
+        else:
+            sub_batches = [chapter_numbers[i:i + MAX_CHAPTERS_PER_BATCH] for i in range(0, len(chapter_numbers), MAX_CHAPTERS_PER_BATCH)]
+
+        for sub in sub_batches:
+            if target == "chunking" and operation_type in ("extract", "update"):
                 try:
-                    _do_extract_chunking_batch(supabase, project_id, sub, by_num, failed, target)
+                    from core.chunk_sync import merge_chunk_sync_stats
+                    sub_stats = _do_extract_chunking_batch(supabase, project_id, sub, by_num, failed, target)
+                    if chunk_stats is not None:
+                        merge_chunk_sync_stats(chunk_stats, sub_stats)
                 except Exception as e:
                     failed.append(f"chunking batch: {str(e)[:150]}")
             else:
@@ -211,35 +210,18 @@ def run_data_operation_chunk(
                         failed.append(f"{target} ch.{ch_num}: không tìm thấy chương")
                         continue
                     chapter_id = chapter.get("id")
-                    content = (chapter.get("content") or "").strip()
-                    chapter_label = (chapter.get("title") or "").strip() or f"Chương {ch_num}"
-                    arc_id = chapter.get("arc_id")
                     try:
                         if operation_type == "delete":
                             _do_delete(supabase, project_id, target, ch_num, chapter_id)
                         elif operation_type in ("extract", "update"):
-                            if not content and target in ("bible", "relation", "timeline", "chunking"):
-                                failed.append(f"{target} ch.{ch_num}: chương không có nội dung")
-                                continue
-                            if target == "relation":
-                                _do_extract_relation(supabase, project_id, ch_num, content)
-                            elif target == "timeline":
-                                _do_extract_timeline(supabase, project_id, chapter_id, ch_num, chapter_label, content)
-                            else:
-                                failed.append(f"{target} ch.{ch_num}: đối tượng không hỗ trợ")
+                            failed.append(f"{target} ch.{ch_num}: đối tượng không hỗ trợ")
                         else:
                             failed.append(f"ch.{ch_num}: loại thao tác không hỗ trợ {operation_type}")
                     except Exception as e:
                         failed.append(f"{target} ch.{ch_num}: {str(e)[:150]}")
             # Độ trễ theo batch (sau mỗi sub_batch), tránh quá tải API
             if operation_type in ("extract", "update"):
-                try:
-                    from config import Config
-                    delay = getattr(Config, "DATA_OPERATION_DELAY_SEC", 7)
-                    if delay and delay > 0:
-                        time.sleep(delay)
-                except Exception:
-                    pass
+                _sleep_between_calls()
 
         _update_log_status(supabase, log_id, "failed" if failed else "completed", "; ".join(failed[:3]) if failed else None)
         if post_completion_message and not failed:
@@ -267,7 +249,7 @@ def _update_log_status(supabase, log_id, status: str, error_message: Optional[st
         pass
 
 
-def _post_completion_message(project_id: str, user_id: Optional[str], user_request: str, success: bool, error_detail: Optional[str]):
+def _post_completion_message(project_id: str, user_id: Optional[str], user_request: str, success: bool, error_detail: Optional[str], detail: Optional[str] = None):
     from config import init_services
     services = init_services()
     if not services:
@@ -277,6 +259,8 @@ def _post_completion_message(project_id: str, user_id: Optional[str], user_reque
     now_display = datetime.now().strftime("%d/%m/%Y %H:%M")
     if success:
         content = f"✅ Đã thực hiện xong yêu cầu của bạn: **{user_request}**. Thời gian: {now_display}."
+        if detail:
+            content += f"\n\n{detail}."
     else:
         content = f"⚠️ Không thể hoàn thành yêu cầu: **{user_request}**. {error_detail or 'Lỗi không xác định.'} Thời gian: {now_display}."
     try:
@@ -332,10 +316,17 @@ def _run_one_target_sequential(
     target: str,
     list_of_chapter_lists: List[List[int]],
     user_request: str,
+    chunk_stats: Optional[Dict[str, int]] = None,
+    plan: Optional[Dict] = None,
 ) -> Tuple[int, List[str]]:
-    """Chạy tuần tự các lô cho một (op_type, target). Returns (total_chapters_done, failed_messages)."""
+    """
+    Chạy tuần tự các lô cho một (op_type, target). Returns (total_chapters_done, failed_messages).
+    plan (core.batch_planner): chạy một lần cho toàn khoảng plan["chapter_numbers"] thay vì từng lô.
+    """
     total = 0
     all_failed: List[str] = []
+    if plan is not None:
+        list_of_chapter_lists = [plan.get("chapter_numbers") or [n for nums in list_of_chapter_lists for n in nums]]
     for chapter_numbers in list_of_chapter_lists:
         total += len(chapter_numbers)
         failed = run_data_operation_chunk(
@@ -346,6 +337,8 @@ def _run_one_target_sequential(
             chapter_numbers=chapter_numbers,
             user_request=user_request,
             post_completion_message=False,
+            chunk_stats=chunk_stats,
+            plan=plan,
         )
         all_failed.extend(failed)
     return total, all_failed
@@ -397,8 +390,25 @@ def run_data_operations_batch(
             grouped[key] = []
         grouped[key].append(item["chapter_numbers"])
 
+    # Bible / Relation / Timeline: lập kế hoạch bin-packing trên toàn khoảng, báo trước số lần gọi / token / chi phí.
+    plans: Dict[Tuple[str, str], Dict] = {}
+    try:
+        from config import init_services
+        from core.batch_planner import format_plan_preview
+        services = init_services()
+        if services:
+            plans = build_data_operation_plans(services["supabase"], project_id, steps)
+        preview = format_plan_preview(list(plans.values()))
+        if job_id and preview:
+            from core.background_jobs import update_job_payload
+            update_job_payload(job_id, {"steps": steps, "user_request": user_request, "plan_preview": preview})
+    except Exception as e:
+        print(f"build_data_operation_plans error: {e}")
+        plans = {}
+
     all_failed: List[str] = []
     total_ops = 0
+    chunk_stats: Dict[str, int] = {}
     # Chạy theo thứ tự cố định: bible → timeline → chunking → relation (relation cuối để dựa trên Bible đã có)
     for target in ORDERED_TARGETS:
         for (op_type, t), list_of_chapter_lists in list(grouped.items()):
@@ -406,7 +416,8 @@ def run_data_operations_batch(
                 continue
             try:
                 count, failed = _run_one_target_sequential(
-                    project_id, user_id, op_type, t, list_of_chapter_lists, user_request
+                    project_id, user_id, op_type, t, list_of_chapter_lists, user_request,
+                    chunk_stats=chunk_stats, plan=plans.get((op_type, t)),
                 )
                 total_ops += count
                 all_failed.extend(failed)
@@ -427,6 +438,9 @@ def run_data_operations_batch(
         try:
             from core.background_jobs import update_job
             summary = f"{total_ops} thao tác" + (f", {len(all_failed)} lỗi" if all_failed else "")
+            if chunk_stats:
+                from core.chunk_sync import format_chunk_sync_stats
+                summary += f". Chunking: {format_chunk_sync_stats(chunk_stats)}"
             update_job(
                 job_id,
                 "failed" if all_failed and total_ops == 0 else "completed",
@@ -445,6 +459,7 @@ def _do_delete(supabase, project_id: str, target: str, chapter_number: int, chap
             supabase.table("story_bible").delete().in_("id", ids).execute()
     elif target == "relation":
         entity_ids = _get_entity_ids_for_chapter(supabase, project_id, chapter_number)
+        _invalidate_relation_answers(project_id, entity_ids, None)
         if entity_ids:
             rels = supabase.table("entity_relations").select("id, source_entity_id, target_entity_id").eq("story_id", project_id).execute()
             ids_to_del = [r["id"] for r in (rels.data or []) if r.get("id") and (r.get("source_entity_id") in entity_ids or r.get("target_entity_id") in entity_ids)]
@@ -455,6 +470,8 @@ def _do_delete(supabase, project_id: str, target: str, chapter_number: int, chap
         ids = [x["id"] for x in (r.data or []) if x.get("id")]
         if ids:
             supabase.table("timeline_events").delete().in_("id", ids).execute()
+            from core.timeline_index import timeline_events_deleted
+            timeline_events_deleted(project_id, ids=ids)
     elif target == "chunking" and chapter_id:
         r = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
         ids = [x["id"] for x in (r.data or []) if x.get("id")]
@@ -462,6 +479,15 @@ def _do_delete(supabase, project_id: str, target: str, chapter_number: int, chap
             supabase.table("chunks").delete().in_("id", ids).execute()
 
 
+def _invalidate_relation_answers(project_id: str, entity_ids, rels) -> None:
+    """Quan hệ của các entity này sắp đổi: bỏ answer cache phụ thuộc (theo entity id)."""
+    from ai.answer_cache import invalidate_answer_rows
+    touched = set(entity_ids or [])
+    for item in (rels or []):
+        touched.update(x for x in (item.get("source_entity_id"), item.get("target_entity_id")) if x)
+    invalidate_answer_rows(project_id, "relation", touched)
+
+
 def _get_entity_ids_for_chapter(supabase, project_id: str, chap_num: int):
     try:
         r = supabase.table("story_bible").select("id").eq("story_id", project_id).eq("source_chapter", chap_num).execute()
@@ -504,51 +530,16 @@ def _do_extract_bible(supabase, project_id: str, chap_num: int, content: str):
             rows_to_save.append({"final_name": final_name, "description": desc})
     if not rows_to_save:
         return
-    for row in rows_to_save:
-        payload = {
+    from core.embedding_backfill import insert_rows_with_embeddings
+    insert_rows_with_embeddings(supabase, "story_bible", [
+        {
             "story_id": project_id,
             "entity_name": row["final_name"],
             "description": row["description"],
             "source_chapter": chap_num,
         }
-        supabase.table("story_bible").insert(payload).execute()
-
-
-def _do_extract_bible_batch(supabase, project_id: str, contents_list: List[Tuple[int, str]]) -> None:
-    """Một lần gọi API cho nhiều chương; contents_list = [(ch_num, content), ...]."""
-    if not contents_list:
-        return
-    from views.data_analyze import _run_extract_bible_batch
-    from config import Config
-
-    ext_persona = _get_extract_persona()
-    for ch_num, _ in contents_list:
-        r = supabase.table("story_bible").select("id").eq("story_id", project_id).eq("source_chapter", ch_num).execute()
-        ids = [x["id"] for x in (r.data or []) if x.get("id")]
-        if ids:
-            supabase.table("story_bible").delete().in_("id", ids).execute()
-
-    result = _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase)
-    for ch_num, items in result.items():
-        if not items:
-            continue
-        for item in items:
-            desc = (item.get("description") or "").strip()
-            raw_name = (item.get("entity_name") or "Unknown").strip()
-            raw_type_str = (item.get("type") or "OTHER").strip()
-            prefix_key = Config.resolve_prefix_for_bible(raw_type_str)
-            final_name = f"[{prefix_key}] {raw_name}" if not raw_name.startswith("[") else raw_name
-            if desc:
-                payload = {
-                    "story_id": project_id,
-                    "entity_name": final_name,
-                    "description": desc,
-                    "source_chapter": ch_num,
-                }
-                try:
-                    supabase.table("story_bible").insert(payload).execute()
-                except Exception:
-                    pass
+        for row in rows_to_save
+    ])
 
 
 def _do_extract_relation(supabase, project_id: str, chap_num: int, content: str):
@@ -564,6 +555,11 @@ def _do_extract_relation(supabase, project_id: str, chap_num: int, content: str)
         if ids_to_del:
             supabase.table("entity_relations").delete().in_("id", ids_to_del).execute()
     rels = suggest_relations(content, project_id)
+    _invalidate_relation_answers(project_id, entity_ids, rels)
+    _save_relation_items(supabase, project_id, rels)
+
+
+def _save_relation_items(supabase, project_id: str, rels) -> None:
     for item in (rels or []):
         if item.get("kind") == "relation":
             try:
@@ -583,13 +579,319 @@ def _do_extract_relation(supabase, project_id: str, chap_num: int, content: str)
                 pass
 
 
+def _sleep_between_calls() -> None:
+    """Độ trễ giữa hai lần gọi API khi xử lý khoảng chương (Config.DATA_OPERATION_DELAY_SEC)."""
+    try:
+        from config import Config
+        delay = getattr(Config, "DATA_OPERATION_DELAY_SEC", 7)
+        if delay and delay > 0:
+            time.sleep(delay)
+    except Exception:
+        pass
+
+
+def _fetch_planned_rows(make_query) -> List[Dict]:
+    """Đọc hết các dòng của một select theo trang (PostgREST mặc định cắt 1000 dòng). make_query() trả về query mới."""
+    out: List[Dict] = []
+    offset = 0
+    while True:
+        rows = make_query().range(offset, offset + PLANNED_FETCH_PAGE - 1).execute().data or []
+        out.extend(rows)
+        if len(rows) < PLANNED_FETCH_PAGE:
+            return out
+        offset += PLANNED_FETCH_PAGE
+
+
+def _snapshot_planned_target(supabase, project_id: str, target: str, chapters: Dict[int, Dict], entries: List[Dict]) -> Tuple[Dict[int, List], Dict[int, List]]:
+    """
+    Ghi nhận id dữ liệu cũ của từng chương trong kế hoạch trước lần gọi đầu (chưa xóa gì).
+    Chỉ xóa id trong ảnh chụp này nên dòng vừa ghi cho chương trước không bị chương sau xóa nhầm (quan hệ nối hai chương).
+    Returns (id cũ theo chương, entity_ids theo chương — relation: để bỏ answer cache).
+    """
+    nums = sorted(chapters)
+    old_ids_by_ch: Dict[int, List] = {ch: [] for ch in nums}
+    entity_ids_by_ch: Dict[int, List] = {ch: [] for ch in nums}
+    if not nums:
+        return old_ids_by_ch, entity_ids_by_ch
+    if target == "bible":
+        for i in range(0, len(nums), 200):
+            part = nums[i:i + 200]
+            rows = _fetch_planned_rows(
+                lambda part=part: supabase.table("story_bible").select("id, source_chapter").eq("story_id", project_id).in_("source_chapter", part).order("id")
+            )
+            for row in rows:
+                src = row.get("source_chapter")
+                if row.get("id") and src is not None and int(src) in old_ids_by_ch:
+                    old_ids_by_ch[int(src)].append(row["id"])
+    elif target == "relation":
+        ch_by_entity = {}
+        for e in entries:
+            src = e.get("source_chapter")
+            if e.get("id") and src is not None and int(src) in entity_ids_by_ch:
+                entity_ids_by_ch[int(src)].append(e["id"])
+                ch_by_entity[e["id"]] = int(src)
+        if ch_by_entity:
+            rels_exist = _fetch_planned_rows(
+                lambda: supabase.table("entity_relations").select("id, source_entity_id, target_entity_id").eq("story_id", project_id).order("id")
+            )
+            for row in rels_exist:
+                if not row.get("id"):
+                    continue
+                for ch in {ch_by_entity.get(row.get("source_entity_id")), ch_by_entity.get(row.get("target_entity_id"))}:
+                    if ch is not None:
+                        old_ids_by_ch[ch].append(row["id"])
+    elif target == "timeline":
+        ch_by_chapter_id = {c.get("id"): ch for ch, c in chapters.items() if c.get("id") is not None}
+        chapter_ids = list(ch_by_chapter_id)
+        for i in range(0, len(chapter_ids), 200):
+            part = chapter_ids[i:i + 200]
+            rows = _fetch_planned_rows(
+                lambda part=part: supabase.table("timeline_events").select("id, chapter_id").eq("story_id", project_id).in_("chapter_id", part).order("id")
+            )
+            for row in rows:
+                ch = ch_by_chapter_id.get(row.get("chapter_id"))
+                if row.get("id") and ch is not None:
+                    old_ids_by_ch[ch].append(row["id"])
+    return old_ids_by_ch, entity_ids_by_ch
+
+
+def _clear_planned_chapter(supabase, project_id: str, target: str, old_ids: List, cleared: set) -> None:
+    """Xóa dữ liệu cũ (theo ảnh chụp) của một chương ngay trước khi ghi kết quả mới; cleared: id đã xóa (quan hệ dùng chung hai chương)."""
+    ids = [x for x in dict.fromkeys(old_ids or []) if x not in cleared]
+    if not ids:
+        return
+    table = {"bible": "story_bible", "relation": "entity_relations", "timeline": "timeline_events"}.get(target)
+    if not table:
+        return
+    for i in range(0, len(ids), 200):
+        supabase.table(table).delete().in_("id", ids[i:i + 200]).execute()
+    cleared.update(ids)
+    if target == "timeline":
+        from core.timeline_index import timeline_events_deleted
+        timeline_events_deleted(project_id, ids=ids)
+
+
+def _extract_planned_call(project_id: str, target: str, call: List[Dict], by_num: Dict[int, Dict], entries: List[Dict], ext_persona) -> Dict:
+    """
+    Một lần gọi LLM cho các phần trong call. Returns {key: items | None}; None = phần không có kết quả
+    (model bỏ sót hoặc lần gọi từng phần lỗi) — caller giữ dữ liệu cũ của chương. Lô Bible lỗi -> raise.
+    Lô relation / timeline lỗi -> gọi lại từng phần với đúng giới hạn ký tự phần của planner (không cắt thêm).
+    """
+    from core.batch_planner import PLAN_SECTION_MAX_CHARS
+    max_chars = PLAN_SECTION_MAX_CHARS.get(target, 40000)
+    if target == "bible":
+        from views.data_analyze import _run_extract_bible_batch
+        return _run_extract_bible_batch([(sec["key"], sec["text"]) for sec in call], ext_persona, project_id, raise_errors=True)
+    if target == "relation":
+        from ai_engine import suggest_relations, suggest_relations_batch
+        result = suggest_relations_batch([(sec["key"], sec["text"]) for sec in call], project_id, entries=entries)
+        if result is None:
+            result = {}
+            for sec in call:
+                try:
+                    result[sec["key"]] = suggest_relations(sec["text"], project_id, entries=entries, max_chars=max_chars, raise_errors=True)
+                except Exception:
+                    result[sec["key"]] = None
+        return result
+    from ai_engine import extract_timeline_events_batch, extract_timeline_events_from_content
+    items = []
+    for sec in call:
+        label = (by_num.get(sec["chapter"], {}).get("title") or "").strip() or f"Chương {sec['chapter']}"
+        if sec["parts"] > 1:
+            label += f" (phần {sec['part']}/{sec['parts']})"
+        items.append((sec["key"], label, sec["text"]))
+    result = extract_timeline_events_batch(items)
+    if result is None:
+        result = {}
+        for key, label, text in items:
+            try:
+                result[key] = extract_timeline_events_from_content(text, label, max_chars=max_chars, raise_errors=True)
+            except Exception:
+                result[key] = None
+    return result
+
+
+def _save_planned_chapter(supabase, project_id: str, target: str, ch_num: int, chapter: Dict, parts_items: List[List], entity_ids: List) -> None:
+    """Ghi kết quả một chương khi đủ mọi phần (gộp theo thứ tự phần)."""
+    if target == "bible":
+        from config import Config
+        from core.embedding_backfill import insert_rows_with_embeddings
+        from core.entity_name_index import entity_name_key
+        by_name: Dict[str, Dict] = {}
+        for items in parts_items:
+            for item in (items or []):
+                desc = (item.get("description") or "").strip()
+                raw_name = (item.get("entity_name") or "Unknown").strip()
+                prefix_key = Config.resolve_prefix_for_bible((item.get("type") or "OTHER").strip())
+                final_name = f"[{prefix_key}] {raw_name}" if not raw_name.startswith("[") else raw_name
+                # Cùng thực thể ở nhiều phần (so theo tên chuẩn hóa): giữ mô tả dài hơn.
+                key = entity_name_key(final_name)
+                if desc and key and (key not in by_name or len(desc) > len(by_name[key]["description"])):
+                    by_name[key] = {
+                        "story_id": project_id,
+                        "entity_name": final_name,
+                        "description": desc,
+                        "source_chapter": ch_num,
+                    }
+        if by_name:
+            insert_rows_with_embeddings(supabase, "story_bible", list(by_name.values()))
+    elif target == "relation":
+        rels = [item for items in parts_items for item in (items or [])]
+        _invalidate_relation_answers(project_id, entity_ids, rels)
+        _save_relation_items(supabase, project_id, rels)
+    elif target == "timeline":
+        payloads = []
+        for items in parts_items:
+            for ev in sorted(items or [], key=lambda e: e.get("event_order", 0)):
+                payloads.append({
+                    "story_id": project_id,
+                    "chapter_id": chapter.get("id"),
+                    "event_order": len(payloads) + 1,
+                    "title": (ev.get("title") or "").strip() or "Sự kiện",
+                    "description": (ev.get("description") or "").strip(),
+                    "raw_date": (ev.get("raw_date") or "").strip(),
+                    "event_type": ev.get("event_type", "event"),
+                })
+        if payloads:
+            from core.timeline_index import timeline_events_written
+            ins = supabase.table("timeline_events").insert(payloads).execute()
+            timeline_events_written(project_id, ins.data)
+
+
+def _run_planned_operation(supabase, project_id: str, target: str, plan: Dict, by_num: Dict[int, Dict], failed: List[str]) -> None:
+    """
+    Chạy các lần gọi của kế hoạch; một chương được ghi ngay khi đủ mọi phần.
+    Dữ liệu cũ của chương chỉ bị xóa ngay trước khi ghi, sau khi MỌI phần của chương có kết quả;
+    chương có lần gọi lỗi / phần bị bỏ sót giữ nguyên dữ liệu cũ và được ghi vào failed.
+    Bible (id, tên, source_chapter) fetch một lần cho cả kế hoạch (relation).
+    """
+    calls = plan.get("calls") or []
+    if not calls:
+        return
+    chapters = {sec["chapter"]: by_num.get(sec["chapter"]) or {} for call in calls for sec in call}
+    entries: List[Dict] = []
+    if target == "relation":
+        entries = _fetch_planned_rows(
+            lambda: supabase.table("story_bible").select("id, entity_name, source_chapter").eq("story_id", project_id).order("id")
+        )
+    ext_persona = _get_extract_persona() if target == "bible" else None
+    old_ids_by_ch, entity_ids_by_ch = _snapshot_planned_target(supabase, project_id, target, chapters, entries)
+    collected: Dict[int, Dict[int, List]] = {}
+    failed_chapters = set()
+    cleared = set()
+    for i, call in enumerate(calls):
+        try:
+            result = _extract_planned_call(project_id, target, call, by_num, entries, ext_persona) or {}
+        except Exception as e:
+            for ch in dict.fromkeys(sec["chapter"] for sec in call):
+                if ch not in failed_chapters:
+                    failed_chapters.add(ch)
+                    failed.append(f"{target} ch.{ch}: lần gọi {i + 1}/{len(calls)} lỗi, giữ dữ liệu cũ ({str(e)[:150]})")
+            result = {}
+        for sec in call:
+            items = result.get(sec["key"])
+            if items is None and sec["chapter"] not in failed_chapters:
+                failed_chapters.add(sec["chapter"])
+                failed.append(f"{target} ch.{sec['chapter']}: phần {sec['key']} không có kết quả từ LLM, giữ dữ liệu cũ")
+            parts = collected.setdefault(sec["chapter"], {})
+            parts[sec["part"]] = items or []
+            if len(parts) == sec["parts"]:
+                collected.pop(sec["chapter"], None)
+                if sec["chapter"] in failed_chapters:
+                    continue
+                try:
+                    _clear_planned_chapter(supabase, project_id, target, old_ids_by_ch.get(sec["chapter"]), cleared)
+                    _save_planned_chapter(
+                        supabase, project_id, target, sec["chapter"], chapters.get(sec["chapter"]) or {},
+                        [parts[k] for k in sorted(parts)], entity_ids_by_ch.get(sec["chapter"]) or [],
+                    )
+                except Exception as e:
+                    failed.append(f"{target} ch.{sec['chapter']}: {str(e)[:150]}")
+        if i < len(calls) - 1:
+            _sleep_between_calls()
+
+
+def _planned_step_chapters(steps: list) -> Dict[Tuple[str, str], List[int]]:
+    """{(op_type, target): [chương]} cho các bước extract/update Bible / Relation / Timeline (lập lô bằng batch_planner)."""
+    from core.batch_planner import PLANNED_TARGETS
+    wanted: Dict[Tuple[str, str], List[int]] = {}
+    for item in _group_into_chunked_batches(steps):
+        key = (item["operation_type"], item["target"])
+        if key[0] in ("extract", "update") and key[1] in PLANNED_TARGETS:
+            wanted.setdefault(key, [])
+            wanted[key].extend(n for n in item["chapter_numbers"] if n not in wanted[key])
+    return wanted
+
+
+def build_data_operation_plans(supabase, project_id: str, steps: list) -> Dict[Tuple[str, str], Dict]:
+    """
+    Kế hoạch lô cho các bước extract/update Bible / Relation / Timeline trên toàn khoảng chương (đọc nội dung một lần).
+    Returns {(op_type, target): plan}; plan["chapter_numbers"] = các chương của bước, plan["failed"] = chương thiếu / rỗng.
+    """
+    from core.batch_planner import plan_data_batches
+    wanted = _planned_step_chapters(steps)
+    if not wanted:
+        return {}
+    all_nums = sorted({n for nums in wanted.values() for n in nums})
+    contents: Dict[int, str] = {}
+    for i in range(0, len(all_nums), 200):
+        r = supabase.table("chapters").select("chapter_number, content").eq("story_id", project_id).in_("chapter_number", all_nums[i:i + 200]).execute()
+        for row in (r.data or []):
+            if row.get("chapter_number") is not None:
+                contents[int(row["chapter_number"])] = (row.get("content") or "").strip()
+    plans = {}
+    for (op_type, target), nums in wanted.items():
+        nums = sorted(nums)
+        missing = [f"{target} ch.{n}: " + ("không tìm thấy chương" if n not in contents else "chương không có nội dung") for n in nums if not contents.get(n)]
+        plan = plan_data_batches(target, [(n, contents[n]) for n in nums if contents.get(n)])
+        plan["chapter_numbers"] = nums
+        plan["failed"] = missing
+        plans[(op_type, target)] = plan
+    return plans
+
+
+def preview_data_operation_plan(project_id: str, steps: list) -> str:
+    """
+    Xem trước kế hoạch (số lần gọi, token, chi phí ước tính) trước khi chạy; rỗng nếu không có bước cần LLM theo lô.
+    Chỉ đọc độ dài chương (content_length, schema v8.4) — không tải nội dung lên thread Streamlit; job tự đọc nội dung khi chạy.
+    """
+    try:
+        from config import init_services
+        from core.batch_planner import format_plan_preview, plan_data_batches_from_lengths
+        wanted = _planned_step_chapters(steps)
+        if not wanted:
+            return ""
+        services = init_services()
+        if not services:
+            return ""
+        supabase = services["supabase"]
+        all_nums = sorted({n for nums in wanted.values() for n in nums})
+        lengths: Dict[int, int] = {}
+        for i in range(0, len(all_nums), 200):
+            r = supabase.table("chapters").select("chapter_number, content_length").eq("story_id", project_id).in_("chapter_number", all_nums[i:i + 200]).execute()
+            for row in (r.data or []):
+                if row.get("chapter_number") is not None:
+                    lengths[int(row["chapter_number"])] = int(row.get("content_length") or 0)
+        plans = [
+            plan_data_batches_from_lengths(target, [(n, lengths[n]) for n in sorted(nums) if lengths.get(n)])
+            for (_op_type, target), nums in wanted.items()
+        ]
+        return format_plan_preview(plans)
+    except Exception as e:
+        print(f"preview_data_operation_plan error: {e}")
+        return ""
+
+
 def _do_extract_timeline(supabase, project_id: str, chapter_id, chapter_number: int, chapter_label: str, content: str):
     from ai_engine import extract_timeline_events_from_content
 
+    from core.timeline_index import timeline_events_deleted, timeline_events_written
+
     r = supabase.table("timeline_events").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
     ids = [x["id"] for x in (r.data or []) if x.get("id")]
     if ids:
         supabase.table("timeline_events").delete().in_("id", ids).execute()
+        timeline_events_deleted(project_id, ids=ids)
     events = extract_timeline_events_from_content(content, chapter_label)
     for ev in (events or []):
         payload = {
@@ -601,55 +903,69 @@ def _do_extract_timeline(supabase, project_id: str, chapter_id, chapter_number:
             "raw_date": (ev.get("raw_date") or "").strip(),
             "event_type": ev.get("event_type", "event"),
         }
-        supabase.table("timeline_events").insert(payload).execute()
-
+        ins = supabase.table("timeline_events").insert(payload).execute()
+        timeline_events_written(project_id, ins.data)
 
-def _do_extract_chunking(supabase, project_id: str, chapter_id, arc_id, chap_num: int, content: str):
-    from ai_engine import analyze_split_strategy, execute_split_logic
 
-    r = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
-    ids = [x["id"] for x in (r.data or []) if x.get("id")]
-    if ids:
-        supabase.table("chunks").delete().in_("id", ids).execute()
-    strategy = analyze_split_strategy(content, file_type="story", context_hint="Đoạn văn có ý nghĩa")
-    chunks_list = execute_split_logic(content, strategy.get("split_type", "by_length"), strategy.get("split_value", "2000"))
-    if not chunks_list:
-        chunks_list = execute_split_logic(content, "by_length", "2000")
-    edited = [{"title": c.get("title", ""), "content": (c.get("content") or "").strip(), "order": c.get("order", i + 1)} for i, c in enumerate(chunks_list or [])]
-    for idx, chk in enumerate(edited):
-        txt = chk.get("content", "").strip()
+def _chunk_rows_for_sync(chunks_list: List[Dict], chap_num: int) -> List[Dict]:
+    """execute_split_logic -> [{"content", "sort_order", "meta_json"}] cho sync_chapter_chunks."""
+    rows = []
+    for idx, chk in enumerate(chunks_list or []):
+        txt = (chk.get("content") or "").strip()
         if not txt:
             continue
-        payload = {
-            "story_id": project_id,
-            "chapter_id": chapter_id,
-            "arc_id": arc_id,
+        rows.append({
             "content": txt,
-            "raw_content": txt,
-            "meta_json": {"source": "data_operation_jobs", "chapter": chap_num, "title": chk.get("title", "")},
             "sort_order": chk.get("order", idx + 1),
-        }
-        supabase.table("chunks").insert(payload).execute()
+            "meta_json": {"source": "data_operation_jobs", "chapter": chap_num, "title": chk.get("title", ""), **(chk.get("meta") or {})},
+        })
+    return rows
+
+
+def _do_extract_chunking(supabase, project_id: str, chapter_id, arc_id, chap_num: int, content: str) -> Dict[str, int]:
+    """Chunk lại chương theo diff (giữ chunk không đổi + embedding). Trả về thống kê sync_chapter_chunks."""
+    from ai_engine import analyze_split_strategy, execute_split_logic
+    from ai.content import BY_TOKENS_DEFAULT_VALUE
+    from core.chunk_sync import sync_chapter_chunks
+
+    strategy = analyze_split_strategy(content, file_type="story", context_hint="Đoạn văn có ý nghĩa", project_id=project_id)
+    stype, sval = strategy.get("split_type", "by_length"), strategy.get("split_value", "2000")
+    if stype == "by_length":
+        # Chunk để embed: đo theo token, ranh giới câu.
+        stype, sval = "by_tokens", BY_TOKENS_DEFAULT_VALUE
+    chunks_list = execute_split_logic(content, stype, sval)
+    if not chunks_list:
+        chunks_list = execute_split_logic(content, "by_tokens", BY_TOKENS_DEFAULT_VALUE)
+    return sync_chapter_chunks(supabase, project_id, chapter_id, arc_id, _chunk_rows_for_sync(chunks_list, chap_num))
 
 
-def _do_extract_chunking_batch(supabase, project_id: str, sub: List[int], by_num: dict, failed: List[str], target: str) -> None:
-    """Một lần gọi LLM (analyze_split_strategy) cho cả sub_batch, rồi execute_split_logic (không LLM) từng chương."""
+def _do_extract_chunking_batch(supabase, project_id: str, sub: List[int], by_num: dict, failed: List[str], target: str) -> Dict[str, int]:
+    """
+    Một lần analyze_split_strategy (heuristic, LLM khi không chắc) cho cả sub_batch, rồi execute_split_logic (không LLM) từng chương.
+    Mỗi chương sync theo diff; trả về thống kê cộng dồn (kept / inserted / deleted / reused_embeddings).
+    """
     from ai_engine import analyze_split_strategy, execute_split_logic
+    from ai.content import BY_TOKENS_DEFAULT_VALUE
+    from core.chunk_sync import merge_chunk_sync_stats, sync_chapter_chunks
 
+    totals: Dict[str, int] = {}
     if not sub:
-        return
+        return totals
     first_ch_num = sub[0]
     first_chapter = by_num.get(first_ch_num)
     if not first_chapter:
         failed.append(f"{target} ch.{first_ch_num}: không tìm thấy chương")
-        return
+        return totals
     first_content = (first_chapter.get("content") or "").strip()
     if not first_content:
         failed.append(f"{target} ch.{first_ch_num}: chương không có nội dung")
-        return
-    strategy = analyze_split_strategy(first_content, file_type="story", context_hint="Đoạn văn có ý nghĩa")
+        return totals
+    strategy = analyze_split_strategy(first_content, file_type="story", context_hint="Đoạn văn có ý nghĩa", project_id=project_id)
     stype = strategy.get("split_type", "by_length")
     sval = strategy.get("split_value", "2000")
+    if stype == "by_length":
+        # Chunk để embed: đo theo token, ranh giới câu.
+        stype, sval = "by_tokens", BY_TOKENS_DEFAULT_VALUE
 
     for ch_num in sub:
         chapter = by_num.get(ch_num)
@@ -662,27 +978,12 @@ def _do_extract_chunking_batch(supabase, project_id: str, sub: List[int], by_num
         if not content:
             failed.append(f"{target} ch.{ch_num}: chương không có nội dung")
             continue
-        r = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
-        ids = [x["id"] for x in (r.data or []) if x.get("id")]
-        if ids:
-            supabase.table("chunks").delete().in_("id", ids).execute()
         chunks_list = execute_split_logic(content, stype, sval)
         if not chunks_list:
-            chunks_list = execute_split_logic(content, "by_length", "2000")
-        for idx, chk in enumerate(chunks_list or []):
-            txt = (chk.get("content") or "").strip()
-            if not txt:
-                continue
-            payload = {
-                "story_id": project_id,
-                "chapter_id": chapter_id,
-                "arc_id": arc_id,
-                "content": txt,
-                "raw_content": txt,
-                "meta_json": {"source": "data_operation_jobs", "chapter": ch_num, "title": chk.get("title", "")},
-                "sort_order": chk.get("order", idx + 1),
-            }
-            try:
-                supabase.table("chunks").insert(payload).execute()
-            except Exception as e:
-                failed.append(f"{target} ch.{ch_num}: {str(e)[:100]}")
+            chunks_list = execute_split_logic(content, "by_tokens", BY_TOKENS_DEFAULT_VALUE)
+        try:
+            stats = sync_chapter_chunks(supabase, project_id, chapter_id, arc_id, _chunk_rows_for_sync(chunks_list, ch_num))
+            merge_chunk_sync_stats(totals, stats)
+        except Exception as e:
+            failed.append(f"{target} ch.{ch_num}: {str(e)[:100]}")
+    return totals
@@ -0,0 +1,361 @@
+# core/embedding_backfill.py - Backfill embedding: keyset pagination, batch song song có giới hạn + rate limit, ghi bulk, checkpoint để resume
+"""
+Thay vòng lặp cũ (50 dòng / lần, update từng dòng, cờ global):
+- Duyệt mọi dòng embedding NULL theo keyset (order id, gt last_id) -> không sót / không lặp khi dòng đổi trạng thái.
+- Mỗi trang chia batch get_embeddings_batch; tối đa EMBED_BACKFILL_MAX_CONCURRENCY batch chạy song song, qua RateLimiter.
+- Ghi vector bằng RPC set_embeddings_bulk (schema_v8.0); chưa chạy migration -> fallback update từng dòng.
+- Sau mỗi trang ghi checkpoint (id cuối) vào payload job; job sau resume từ đó rồi quay vòng lại phần đầu.
+- Lock theo project (không chặn project khác); tiến độ rows/s + ETA ghi vào payload["progress"] cho tab Background Jobs.
+Embed-on-write (attach_embeddings / insert_rows_with_embeddings): dòng mới từ extract / chunk được insert kèm vector,
+dùng chung RateLimiter với backfill.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+EMBED_BACKFILL_BATCH_SIZE = 100
+EMBED_BACKFILL_MAX_CONCURRENCY = 3
+EMBED_BACKFILL_PAGE_SIZE = EMBED_BACKFILL_BATCH_SIZE * EMBED_BACKFILL_MAX_CONCURRENCY
+# Số request embedding tối đa mỗi phút (mọi project dùng chung một API key).
+EMBED_BACKFILL_REQUESTS_PER_MIN = 60
+EMBED_BACKFILL_PROGRESS_EVERY_SEC = 3.0
+# Bảng -> cột text để embed. Thứ tự = thứ tự chạy.
+EMBED_BACKFILL_TABLES: Dict[str, str] = {"story_bible": "description", "chunks": "content"}
+EMBEDDING_BACKFILL_JOB_TYPE = "embedding_backfill"
+
+
+class RateLimiter:
+    """Token bucket thread-safe: acquire() chờ tới khi còn lượt."""
+
+    def __init__(self, per_minute: int):
+        self.rate = max(1, per_minute) / 60.0
+        self.capacity = float(max(1, per_minute // 6))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_rate_limiter = RateLimiter(EMBED_BACKFILL_REQUESTS_PER_MIN)
+_project_locks: Dict[str, threading.Lock] = {}
+_project_locks_guard = threading.Lock()
+
+
+def _project_lock(project_id: str) -> threading.Lock:
+    with _project_locks_guard:
+        lock = _project_locks.get(str(project_id))
+        if lock is None:
+            lock = threading.Lock()
+            _project_locks[str(project_id)] = lock
+        return lock
+
+
+def is_embedding_backfill_running(project_id: Optional[str] = None) -> bool:
+    """True nếu project (hoặc bất kỳ project nào khi project_id=None) đang backfill."""
+    with _project_locks_guard:
+        if project_id is None:
+            return any(lock.locked() for lock in _project_locks.values())
+        lock = _project_locks.get(str(project_id))
+    return bool(lock and lock.locked())
+
+
+def count_missing_embeddings(supabase, project_id: str, table: str) -> int:
+    try:
+        r = supabase.table(table).select("count", count="exact").eq("story_id", project_id).is_("embedding", "null").execute()
+        return int(r.count or 0)
+    except Exception:
+        return 0
+
+
+def _fetch_page(supabase, project_id: str, table: str, after_id, until_id, limit: int) -> List[Dict[str, Any]]:
+    col = EMBED_BACKFILL_TABLES[table]
+    q = supabase.table(table).select(f"id, {col}").eq("story_id", project_id).is_("embedding", "null")
+    if after_id is not None:
+        q = q.gt("id", after_id)
+    if until_id is not None:
+        q = q.lte("id", until_id)
+    r = q.order("id").limit(limit).execute()
+    return list(r.data or [])
+
+
+def write_embeddings_bulk(supabase, project_id: str, table: str, pairs: List[Tuple[Any, List[float]]]) -> int:
+    """Ghi [(id, vector)] trong một RPC; lỗi RPC (chưa chạy schema_v8.0) -> update từng dòng. Trả về số dòng đã ghi."""
+    if not pairs:
+        return 0
+    try:
+        r = supabase.rpc("set_embeddings_bulk", {
+            "p_table": table,
+            "p_story_id": str(project_id),
+            "p_rows": [{"id": str(row_id), "embedding": vec} for row_id, vec in pairs],
+        }).execute()
+        return int(r.data or 0) if not isinstance(r.data, list) else len(pairs)
+    except Exception as e:
+        print(f"set_embeddings_bulk error (fallback update từng dòng): {e}")
+    written = 0
+    for row_id, vec in pairs:
+        try:
+            supabase.table(table).update({"embedding": vec}).eq("id", row_id).execute()
+            written += 1
+        except Exception:
+            pass
+    return written
+
+
+def embed_rows(
+    supabase,
+    project_id: str,
+    table: str,
+    rows: List[Dict[str, Any]],
+    max_workers: int = EMBED_BACKFILL_MAX_CONCURRENCY,
+) -> Dict[str, int]:
+    """Embed + ghi một nhóm dòng (id, cột text). Returns {"updated", "failed", "skipped"}."""
+    from ai_engine import AIService
+    col = EMBED_BACKFILL_TABLES[table]
+    out = {"updated": 0, "failed": 0, "skipped": 0}
+    todo = []
+    for row in rows:
+        text = (row.get(col) or "").strip()
+        if text and row.get("id") is not None:
+            todo.append((row["id"], text))
+        else:
+            out["skipped"] += 1
+    batches = [todo[i:i + EMBED_BACKFILL_BATCH_SIZE] for i in range(0, len(todo), EMBED_BACKFILL_BATCH_SIZE)]
+
+    def _one(batch):
+        _rate_limiter.acquire()
+        vectors = AIService.get_embeddings_batch([t for _, t in batch], batch_size=len(batch))
+        pairs = [(row_id, vectors[i]) for i, (row_id, _) in enumerate(batch) if i < len(vectors) and vectors[i]]
+        return write_embeddings_bulk(supabase, project_id, table, pairs), len(batch)
+
+    if not batches:
+        return out
+    if len(batches) == 1 or max_workers <= 1:
+        results = [_one(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            results = list(pool.map(_one, batches))
+    for written, n in results:
+        out["updated"] += written
+        out["failed"] += n - written
+    return out
+
+
+def attach_embeddings(rows: List[Dict[str, Any]], text_key: str, batch_size: int = EMBED_BACKFILL_BATCH_SIZE) -> int:
+    """
+    Embed-on-write: gán rows[i]["embedding"] cho dòng chưa có, một get_embeddings_batch mỗi sub-batch.
+    Lỗi API -> dòng giữ không có embedding (backfill sẽ bổ sung). Trả về số dòng đã gán.
+    """
+    from ai_engine import AIService
+    todo = [row for row in rows if not row.get("embedding") and (row.get(text_key) or "").strip()]
+    n = 0
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        _rate_limiter.acquire()
+        try:
+            vectors = AIService.get_embeddings_batch([row[text_key].strip() for row in batch], batch_size=len(batch))
+        except Exception as e:
+            print(f"attach_embeddings error: {e}")
+            continue
+        for i, row in enumerate(batch):
+            if i < len(vectors) and vectors[i]:
+                row["embedding"] = vectors[i]
+                n += 1
+    return n
+
+
+def insert_rows_with_embeddings(
+    supabase,
+    table: str,
+    rows: List[Dict[str, Any]],
+    text_key: Optional[str] = None,
+    batch_size: int = EMBED_BACKFILL_BATCH_SIZE,
+) -> List[Dict[str, Any]]:
+    """
+    Insert theo sub-batch, mỗi sub-batch embed một lần rồi insert một lần (kèm vector).
+    Insert lô lỗi -> thử từng dòng (dòng lỗi bị bỏ qua như trước). Trả về các dòng DB đã insert.
+    """
+    text_key = text_key or EMBED_BACKFILL_TABLES.get(table, "content")
+    inserted: List[Dict[str, Any]] = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        attach_embeddings(batch, text_key, batch_size=batch_size)
+        for row in batch:
+            # Insert lô của PostgREST cần mọi object cùng bộ key.
+            row.setdefault("embedding", None)
+        try:
+            r = supabase.table(table).insert(batch).execute()
+            inserted.extend(r.data or [])
+            continue
+        except Exception as e:
+            print(f"insert_rows_with_embeddings {table} error (thử từng dòng): {e}")
+        for row in batch:
+            try:
+                r = supabase.table(table).insert(row).execute()
+                inserted.extend(r.data or [])
+            except Exception:
+                pass
+    if table == "story_bible" and inserted:
+        from core.mention_index import schedule_entity_mentions
+        schedule_entity_mentions(inserted[0].get("story_id"), [r.get("id") for r in inserted])
+    return inserted
+
+
+def format_backfill_progress(progress: Optional[Dict[str, Any]]) -> str:
+    """VD: 'chunks: 1.200/5.000 dòng · 35.2 dòng/s · còn ~1m48s'."""
+    if not progress:
+        return ""
+    done, total = int(progress.get("done") or 0), int(progress.get("total") or 0)
+    rate = float(progress.get("rows_per_sec") or 0)
+    text = f"{progress.get('table') or ''}: {done:,}/{total:,} dòng · {rate:.1f} dòng/s".replace(",", ".")
+    eta = progress.get("eta_sec")
+    if eta is not None:
+        m, s = divmod(int(eta), 60)
+        text += f" · còn ~{m}m{s:02d}s" if m else f" · còn ~{s}s"
+    return text
+
+
+def run_embedding_backfill(
+    project_id: str,
+    tables: Optional[List[str]] = None,
+    checkpoint: Optional[Dict[str, Any]] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Backfill toàn bộ dòng embedding NULL của project. checkpoint: {table: last_id} (resume).
+    on_progress(payload_patch) được gọi sau mỗi trang với {"checkpoint", "progress"}.
+    Returns {"bible_updated", "chunks_updated", "failed", "skipped", "elapsed_sec", "busy", "error", "checkpoint"};
+    busy=True nếu project đang backfill; error != None nếu dừng giữa chừng (checkpoint = vị trí để chạy lại tiếp).
+    """
+    out: Dict[str, Any] = {
+        "bible_updated": 0, "chunks_updated": 0, "failed": 0, "skipped": 0, "elapsed_sec": 0.0, "busy": False,
+        "error": None, "checkpoint": {},
+    }
+    if not project_id:
+        return out
+    checkpoint = dict(checkpoint or {})
+    lock = _project_lock(project_id)
+    if not lock.acquire(blocking=False):
+        out["busy"] = True
+        return out
+    try:
+        from config import init_services
+        services = init_services()
+        if not services:
+            out["error"] = "Không kết nối được Supabase."
+            out["checkpoint"] = checkpoint
+            return out
+        supabase = services["supabase"]
+        tables = [t for t in (tables or list(EMBED_BACKFILL_TABLES)) if t in EMBED_BACKFILL_TABLES]
+        totals = {t: count_missing_embeddings(supabase, project_id, t) for t in tables}
+        t0 = time.monotonic()
+        last_report = 0.0
+        done_all = 0
+        total_all = sum(totals.values())
+        for table in tables:
+            resume_from = checkpoint.get(table)
+            # Pass 1: từ checkpoint tới hết; pass 2 (khi resume): quay lại đầu tới checkpoint (dòng lỗi / dòng mới id nhỏ hơn).
+            passes = [(resume_from, None)] + ([(None, resume_from)] if resume_from is not None else [])
+            for after_id, until_id in passes:
+                while True:
+                    rows = _fetch_page(supabase, project_id, table, after_id, until_id, EMBED_BACKFILL_PAGE_SIZE)
+                    if not rows:
+                        break
+                    res = embed_rows(supabase, project_id, table, rows)
+                    out["bible_updated" if table == "story_bible" else "chunks_updated"] += res["updated"]
+                    out["failed"] += res["failed"]
+                    out["skipped"] += res["skipped"]
+                    done_all += len(rows)
+                    after_id = rows[-1]["id"]
+                    if until_id is None:
+                        checkpoint[table] = after_id
+                    elapsed = time.monotonic() - t0
+                    rate = done_all / elapsed if elapsed > 0 else 0.0
+                    remaining = max(0, total_all - done_all)
+                    progress = {
+                        "table": table,
+                        "done": done_all,
+                        "total": max(total_all, done_all),
+                        "rows_per_sec": round(rate, 2),
+                        "eta_sec": int(remaining / rate) if rate > 0 else None,
+                    }
+                    now = time.monotonic()
+                    if on_progress and (now - last_report >= EMBED_BACKFILL_PROGRESS_EVERY_SEC):
+                        last_report = now
+                        on_progress({"checkpoint": dict(checkpoint), "progress": progress})
+                    if len(rows) < EMBED_BACKFILL_PAGE_SIZE:
+                        break
+            checkpoint[table] = None
+        out["elapsed_sec"] = round(time.monotonic() - t0, 1)
+        if on_progress:
+            rate = done_all / out["elapsed_sec"] if out["elapsed_sec"] else 0.0
+            on_progress({"checkpoint": {}, "progress": {"table": "xong", "done": done_all, "total": done_all, "rows_per_sec": round(rate, 2), "eta_sec": 0}})
+    except Exception as e:
+        print(f"run_embedding_backfill error: {e}")
+        # Giữ checkpoint mới nhất (báo tiến độ bị giãn nhịp) để job sau tiếp tục từ đây.
+        out["error"] = str(e)[:500]
+        out["checkpoint"] = {t: v for t, v in checkpoint.items() if v is not None}
+        if on_progress:
+            try:
+                on_progress({"checkpoint": dict(out["checkpoint"])})
+            except Exception:
+                pass
+    finally:
+        lock.release()
+    return out
+
+
+def start_embedding_backfill_job(project_id: str, user_id: Optional[str], tables: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Tạo job embedding_backfill (resume checkpoint của job backfill dang dở gần nhất) và chạy trong thread.
+    Trả về job_id, None nếu project đang backfill hoặc không tạo được job.
+    """
+    if is_embedding_backfill_running(project_id):
+        return None
+    from core.background_jobs import create_job, run_job_worker
+    tables = [t for t in (tables or list(EMBED_BACKFILL_TABLES)) if t in EMBED_BACKFILL_TABLES]
+    checkpoint = _latest_unfinished_checkpoint(project_id, tables)
+    label = "Đồng bộ vector (" + ", ".join("Bible" if t == "story_bible" else "Chunks" for t in tables) + ")"
+    job_id = create_job(
+        project_id, user_id, EMBEDDING_BACKFILL_JOB_TYPE, label,
+        payload={"tables": tables, "checkpoint": checkpoint},
+        post_to_chat=False,
+    )
+    if job_id:
+        threading.Thread(target=run_job_worker, args=(job_id,), daemon=True).start()
+    return job_id
+
+
+def _latest_unfinished_checkpoint(project_id: str, tables: List[str]) -> Dict[str, Any]:
+    """Checkpoint của job backfill gần nhất chưa completed (process bị tắt giữa chừng / lỗi); đánh dấu job đó failed."""
+    try:
+        from config import init_services
+        from core.background_jobs import update_job
+        services = init_services()
+        if not services:
+            return {}
+        r = (
+            services["supabase"].table("background_jobs").select("id, status, payload")
+            .eq("story_id", project_id).eq("job_type", EMBEDDING_BACKFILL_JOB_TYPE)
+            .order("created_at", desc=True).limit(1).execute()
+        )
+        if not r.data or r.data[0].get("status") == "completed":
+            return {}
+        job = r.data[0]
+        cp = (job.get("payload") or {}).get("checkpoint") or {}
+        if job.get("status") in ("pending", "running"):
+            update_job(job["id"], "failed", error_message="Bị gián đoạn; job mới tiếp tục từ checkpoint.")
+        return {t: cp.get(t) for t in tables if cp.get(t) is not None}
+    except Exception:
+        return {}
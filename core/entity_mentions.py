@@ -0,0 +1,216 @@
+# core/entity_mentions.py - Phát hiện thực thể Bible được nhắc trong văn bản (Aho-Corasick, không phân biệt dấu)
+"""
+Dùng cho soát logic theo chương: thay vì đưa toàn bộ Bible / quan hệ vào prompt, chỉ lấy thực thể mà chương thực sự nhắc tới.
+- Tên được chuẩn hóa: bỏ dấu tiếng Việt (đ -> d), chữ thường, ký tự không phải chữ/số -> khoảng trắng.
+  Dấu dạng tổ hợp (văn bản NFD, hay gặp khi dán từ macOS) bị bỏ hẳn, không thành khoảng trắng.
+- Mỗi thực thể có nhiều mẫu: tên hiển thị (bỏ prefix [X]), phần trong ngoặc, các phương án tách bởi "/" hoặc " | ";
+  bản ghi con (parent_id) là biến thể của bản ghi cha nên cũng trỏ về cha.
+- Khớp theo ranh giới từ (mẫu và văn bản đều đệm khoảng trắng) trong một lần quét O(len(text)).
+"""
+import re
+import unicodedata
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Mẫu ngắn hơn giá trị này (sau chuẩn hóa) bị bỏ để tránh khớp nhầm ("a", "an"...).
+MENTION_MIN_PATTERN_CHARS = 2
+
+_ALT_SPLIT_RE = re.compile(r"\s*(?:/|\|)\s*")
+_PAREN_RE = re.compile(r"\(([^)]*)\)")
+
+
+def _fold_char(c: str) -> str:
+    """Một ký tự gốc -> ký tự đã chuẩn hóa; dấu tổ hợp (combining) -> "" (thuộc ký tự đứng trước)."""
+    if c in "đĐ":
+        return "d"
+    if unicodedata.combining(c):
+        return ""
+    base = unicodedata.normalize("NFD", c)[0].lower()
+    return base if base.isalnum() else " "
+
+
+def normalize_mention_text(text: str) -> str:
+    """'Lý Tiểu-Long!' -> 'ly tieu long' (cả dạng NFC lẫn NFD). Dùng chung cho tên thực thể và nội dung chương."""
+    if not text:
+        return ""
+    return " ".join("".join(_fold_char(c) for c in unicodedata.normalize("NFD", text)).split())
+
+
+def _normalize_with_positions(text: str) -> Tuple[str, List[int]]:
+    """Như normalize_mention_text nhưng kèm vị trí ký tự gốc cho mỗi ký tự kết quả (đệm khoảng trắng hai đầu)."""
+    chars: List[str] = [" "]
+    positions: List[int] = [0]
+    for i, c in enumerate(text or ""):
+        f = _fold_char(c)
+        if not f or (f == " " and chars[-1] == " "):
+            continue
+        chars.append(f)
+        positions.append(i)
+    if chars[-1] != " ":
+        chars.append(" ")
+        positions.append(len(text or ""))
+    return "".join(chars), positions
+
+
+def entity_name_variants(entity_name: str) -> List[str]:
+    """Các cách gọi của một entity_name (đã chuẩn hóa, không trùng): tên bỏ prefix, phần ngoặc, phương án '/'."""
+    from ai.utils import extract_prefix
+    _, display = extract_prefix((entity_name or "").strip())
+    raw = [display]
+    raw.extend(_PAREN_RE.findall(display))
+    raw.append(_PAREN_RE.sub(" ", display))
+    out: List[str] = []
+    for r in raw:
+        for alt in _ALT_SPLIT_RE.split(r or ""):
+            norm = normalize_mention_text(alt)
+            if len(norm) >= MENTION_MIN_PATTERN_CHARS and norm not in out:
+                out.append(norm)
+    return out
+
+
+class AhoCorasick:
+    """Automaton Aho-Corasick trên ký tự; mỗi mẫu gắn một tập value."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[Any]] = [set()]
+        self._built = False
+
+    def add(self, pattern: str, value: Any) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            node = nxt
+        self._out[node].add(value)
+        self._built = False
+
+    def build(self) -> None:
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, Any]]:
+        """Yield (vị trí kết thúc, value) cho mọi lần khớp (kể cả chồng lấn)."""
+        if not self._built:
+            self.build()
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for value in out[node]:
+                    yield i, value
+
+
+class MentionIndex:
+    """Chỉ mục tên -> id thực thể cho một tập bản ghi story_bible."""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.entries_by_id: Dict[str, Dict[str, Any]] = {}
+        self.patterns: Dict[str, Set[str]] = {}
+        self._ac = AhoCorasick()
+        for e in entries or []:
+            eid = e.get("id")
+            if not eid:
+                continue
+            eid = str(eid)
+            self.entries_by_id[eid] = e
+            targets = {eid}
+            if e.get("parent_id"):
+                targets.add(str(e["parent_id"]))
+            for variant in entity_name_variants(e.get("entity_name") or ""):
+                self.patterns.setdefault(variant, set()).update(targets)
+        for variant, ids in self.patterns.items():
+            self._ac.add(f" {variant} ", (len(variant) + 2, frozenset(ids)))
+        self._ac.build()
+
+    def _spans(self, norm: str) -> List[Tuple[int, int, Any]]:
+        """Span khớp (start, end, ids) trên text đã chuẩn hóa + đệm; khớp dài nhất thắng."""
+        spans = [(end - length + 1, end, ids) for end, (length, ids) in self._ac.iter_matches(norm)]
+        # Sắp theo start tăng, độ dài giảm: span nằm trọn trong span trước đó (dài hơn) bị bỏ.
+        spans.sort(key=lambda sp: (sp[0], -(sp[1] - sp[0])))
+        out = []
+        cover_end = -1
+        for start, end, ids in spans:
+            if end <= cover_end:
+                continue
+            cover_end = max(cover_end, end)
+            out.append((start, end, ids))
+        return out
+
+    def detect(self, text: str) -> Dict[str, int]:
+        """{entity_id: số lần nhắc}. Khớp dài nhất thắng: "Mai Hoa" không tính thêm "Mai". Chỉ trả id có trong entries."""
+        counts: Dict[str, int] = {}
+        if not text or not self.patterns:
+            return counts
+        for _, _, ids in self._spans(f" {normalize_mention_text(text)} "):
+            for eid in ids:
+                if eid in self.entries_by_id:
+                    counts[eid] = counts.get(eid, 0) + 1
+        return counts
+
+    def scan(self, text: str) -> Dict[str, Dict[str, int]]:
+        """{entity_id: {"count", "first_offset"}}; first_offset = vị trí ký tự trong text gốc của lần nhắc đầu tiên."""
+        out: Dict[str, Dict[str, int]] = {}
+        if not text or not self.patterns:
+            return out
+        norm, positions = _normalize_with_positions(text)
+        for start, _, ids in self._spans(norm):
+            offset = positions[min(start + 1, len(positions) - 1)]
+            for eid in ids:
+                if eid not in self.entries_by_id:
+                    continue
+                hit = out.setdefault(eid, {"count": 0, "first_offset": offset})
+                hit["count"] += 1
+        return out
+
+
+def detect_entity_mentions(text: str, entries: List[Dict[str, Any]], index: Optional[MentionIndex] = None) -> Dict[str, int]:
+    """Tiện ích: dựng MentionIndex (nếu chưa có) rồi detect."""
+    return (index or MentionIndex(entries)).detect(text)
+
+
+def expand_one_hop(
+    entity_ids: Iterable[str],
+    relations: List[Dict[str, Any]],
+    entries_by_id: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Set[str]:
+    """Láng giềng 1 bước: thực thể nối với entity_ids qua entity_relations hoặc quan hệ cha/con (parent_id). Không gồm chính entity_ids."""
+    seeds = {str(i) for i in entity_ids}
+    neighbours: Set[str] = set()
+    for r in relations or []:
+        src = r.get("source_entity_id") or r.get("entity_id")
+        tgt = r.get("target_entity_id")
+        src, tgt = (str(src) if src else None), (str(tgt) if tgt else None)
+        if src in seeds and tgt:
+            neighbours.add(tgt)
+        if tgt in seeds and src:
+            neighbours.add(src)
+    for eid, e in (entries_by_id or {}).items():
+        pid = str(e.get("parent_id")) if e.get("parent_id") else None
+        if pid in seeds:
+            neighbours.add(eid)
+        if eid in seeds and pid:
+            neighbours.add(pid)
+    return neighbours - seeds
@@ -0,0 +1,161 @@
+# core/entity_name_index.py - Chỉ mục tên thực thể Bible: tra chính xác, theo tiền tố (trie), gần đúng (edit distance có giới hạn)
+"""
+Dùng chung cho:
+- suggest_relations: tên LLM trả về -> id Bible (thay quét substring O(N) mỗi đầu quan hệ).
+- Khử trùng kết quả extract Bible: entity_name_key (bỏ prefix [X], dấu, hoa/thường) thay các _norm rời rạc.
+Tên chuẩn hóa bằng core.entity_mentions (normalize_mention_text / entity_name_variants), nên "[CHARACTER] Lý Tiểu-Long"
+và "ly tieu long" cùng một khóa; phần trong ngoặc và phương án "/" là bí danh; bản ghi con (parent_id) nhớ id cha.
+Tra chính xác / tiền tố: O(độ dài tên). Gần đúng: duyệt trie với hàng DP Levenshtein, cắt nhánh khi vượt ngưỡng.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+# Tiền tố ngắn hơn giá trị này không dùng để tra (quá nhiều ứng viên).
+NAME_PREFIX_MIN_CHARS = 3
+NAME_PREFIX_MAX_RESULTS = 20
+# Ngưỡng edit distance theo độ dài tên chuẩn hóa: <= 4 ký tự không tra gần đúng, <= 8 -> 1, dài hơn -> 2.
+NAME_FUZZY_MAX_DISTANCE = 2
+
+
+def entity_name_key(name: str) -> str:
+    """Khóa so trùng tên thực thể: bỏ prefix [X], bỏ dấu, chữ thường, gộp khoảng trắng. '[CHARACTER] Lý  Long' -> 'ly long'."""
+    from ai.utils import extract_prefix
+    from core.entity_mentions import normalize_mention_text
+    _, display = extract_prefix((name or "").strip())
+    return normalize_mention_text(display)
+
+
+def _fuzzy_budget(length: int) -> int:
+    if length <= 4:
+        return 0
+    if length <= 8:
+        return min(1, NAME_FUZZY_MAX_DISTANCE)
+    return NAME_FUZZY_MAX_DISTANCE
+
+
+class EntityNameIndex:
+    """
+    Khóa (tên chuẩn hóa) -> [(rank, thứ tự, id)]; rank 0 = tên chính, 1 = bí danh (ngoặc, '/'), nên tên chính thắng khi trùng khóa.
+    Trie trên các khóa cho tra tiền tố và gần đúng.
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        from core.entity_mentions import entity_name_variants
+        self.entries_by_id: Dict[Any, Dict[str, Any]] = {}
+        self.parent_of: Dict[Any, Any] = {}
+        self._keys: Dict[str, List[Tuple[int, int, Any]]] = {}
+        self._children: List[Dict[str, int]] = [{}]
+        self._terminal: List[Optional[str]] = [None]
+        for order, e in enumerate(entries or []):
+            eid = e.get("id")
+            name = (e.get("entity_name") or "").strip()
+            if eid is None or not name:
+                continue
+            self.entries_by_id[eid] = e
+            if e.get("parent_id"):
+                self.parent_of[eid] = e["parent_id"]
+            primary = entity_name_key(name)
+            for variant in entity_name_variants(name):
+                self._add(variant, 0 if variant == primary else 1, order, eid)
+
+    def _add(self, key: str, rank: int, order: int, eid: Any) -> None:
+        if key not in self._keys:
+            self._keys[key] = []
+            node = 0
+            for ch in key:
+                nxt = self._children[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._children)
+                    self._children[node][ch] = nxt
+                    self._children.append({})
+                    self._terminal.append(None)
+                node = nxt
+            self._terminal[node] = key
+        self._keys[key].append((rank, order, eid))
+
+    def __len__(self) -> int:
+        return len(self.entries_by_id)
+
+    def _best(self, key: str) -> Optional[Any]:
+        hits = self._keys.get(key)
+        return min(hits)[2] if hits else None
+
+    def exact(self, name: str) -> Optional[Any]:
+        """Id có khóa trùng khớp (tên chính ưu tiên hơn bí danh, rồi thứ tự trong entries)."""
+        return self._best(entity_name_key(name))
+
+    def prefix(self, name: str, limit: int = NAME_PREFIX_MAX_RESULTS) -> List[Any]:
+        """Id có khóa bắt đầu bằng tên (chuẩn hóa), theo thứ tự khóa ngắn trước; [] nếu tên quá ngắn."""
+        key = entity_name_key(name)
+        if len(key) < NAME_PREFIX_MIN_CHARS:
+            return []
+        node = 0
+        for ch in key:
+            node = self._children[node].get(ch)
+            if node is None:
+                return []
+        found: List[str] = []
+        stack = [node]
+        while stack and len(found) < limit * 4:
+            n = stack.pop()
+            if self._terminal[n]:
+                found.append(self._terminal[n])
+            stack.extend(self._children[n].values())
+        out: List[Any] = []
+        for k in sorted(found, key=len):
+            eid = self._best(k)
+            if eid not in out:
+                out.append(eid)
+            if len(out) >= limit:
+                break
+        return out
+
+    def fuzzy(self, name: str, max_distance: Optional[int] = None) -> List[Tuple[Any, int]]:
+        """[(id, khoảng cách)] các khóa trong ngưỡng edit distance, gần nhất trước."""
+        key = entity_name_key(name)
+        budget = _fuzzy_budget(len(key)) if max_distance is None else max_distance
+        if not key or budget <= 0:
+            return []
+        hits: Dict[str, int] = {}
+        first_row = list(range(len(key) + 1))
+        stack = [(child, ch, first_row) for ch, child in self._children[0].items()]
+        while stack:
+            node, ch, prev_row = stack.pop()
+            row = [prev_row[0] + 1]
+            for i in range(1, len(key) + 1):
+                row.append(min(row[i - 1] + 1, prev_row[i] + 1, prev_row[i - 1] + (key[i - 1] != ch)))
+            if self._terminal[node] and row[-1] <= budget:
+                hits[self._terminal[node]] = row[-1]
+            if min(row) <= budget:
+                stack.extend((child, c, row) for c, child in self._children[node].items())
+        out: List[Tuple[Any, int]] = []
+        seen = set()
+        for k, dist in sorted(hits.items(), key=lambda kv: (kv[1], len(kv[0]))):
+            eid = self._best(k)
+            if eid not in seen:
+                seen.add(eid)
+                out.append((eid, dist))
+        return out
+
+    def resolve(self, name: str, prefer_parent: bool = False) -> Optional[Any]:
+        """
+        Tên (LLM / người dùng) -> id: chính xác (cả bí danh trong ngoặc / '/') -> tiền tố duy nhất -> gần đúng duy nhất gần nhất.
+        Mơ hồ (nhiều ứng viên ngang nhau) -> None. prefer_parent=True: bản ghi con trả về id cha.
+        """
+        from core.entity_mentions import entity_name_variants
+        eid = self.exact(name)
+        if eid is None:
+            for variant in entity_name_variants(name):
+                eid = self._best(variant)
+                if eid is not None:
+                    break
+        if eid is None:
+            cands = self.prefix(name, limit=2)
+            if len(cands) == 1:
+                eid = cands[0]
+        if eid is None:
+            cands = self.fuzzy(name)
+            if cands and (len(cands) == 1 or cands[0][1] < cands[1][1]):
+                eid = cands[0][0]
+        if eid is not None and prefer_parent:
+            return self.parent_of.get(eid, eid)
+        return eid
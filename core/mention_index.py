@@ -0,0 +1,384 @@
+# core/mention_index.py - Chỉ mục entity -> chương có nhắc tên (bảng entity_chapter_mentions), cập nhật tăng dần
+"""
+Quét nội dung chương bằng MentionIndex (core/entity_mentions.py) cho mọi tên thực thể Bible; lưu (entity_id, chapter_id,
+mention_count, first_offset, density). Reverse lookup lấy top chương theo mật độ nhắc trong một lần đọc.
+Cập nhật:
+- Lưu chương -> schedule_chapter_mentions(project_id, chapter_numbers): quét lại các chương đó.
+- Thêm / đổi tên thực thể -> schedule_entity_mentions(project_id, entity_ids): quét mọi chương cho các thực thể đó.
+- Xóa chương / thực thể: ON DELETE CASCADE.
+Các yêu cầu được gộp tới khi yên MENTION_INDEX_DEBOUNCE_SEC rồi xử lý ở một thread nền. Job nền giữ project
+(hold_mention_updates / release_mention_updates) nên mọi batch insert Bible của một job chỉ gây một lần quét khi job xong.
+- rebuild_mention_index: dựng lại toàn bộ (job mention_index_rebuild).
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+MENTION_INDEX_TABLE = "entity_chapter_mentions"
+MENTION_INDEX_JOB_TYPE = "mention_index_rebuild"
+MENTION_INDEX_DEBOUNCE_SEC = 5.0
+MENTION_INDEX_CHAPTER_PAGE = 50
+# Cỡ trang đọc story_bible (PostgREST mặc định cắt 1000 dòng mỗi select).
+MENTION_INDEX_ENTITY_PAGE = 1000
+MENTION_INDEX_WRITE_BATCH = 500
+MENTION_LOOKUP_TOP_N = 5
+
+_pending_lock = threading.Lock()
+_pending: Dict[str, Dict[str, Set[Any]]] = {}
+_pending_since: Dict[str, float] = {}
+_held: Dict[str, int] = {}
+_wake = threading.Event()
+_worker: Optional[threading.Thread] = None
+_index_cache_lock = threading.Lock()
+_index_cache: Dict[str, Any] = {}
+
+
+def _supabase():
+    from config import init_services
+    services = init_services()
+    return services["supabase"] if services else None
+
+
+def _load_entities(supabase, project_id: str) -> List[Dict[str, Any]]:
+    """Thực thể Bible (không [RULE] / [CHAT], không archived) để dựng MentionIndex; đọc theo trang (rebuild xóa cả index trước)."""
+    rows: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        r = supabase.table("story_bible").select("id, entity_name, parent_id").eq("story_id", project_id).or_(
+            "archived.is.null,archived.eq.false"
+        ).order("id").range(offset, offset + MENTION_INDEX_ENTITY_PAGE - 1).execute()
+        page = r.data or []
+        rows.extend(page)
+        if len(page) < MENTION_INDEX_ENTITY_PAGE:
+            break
+        offset += MENTION_INDEX_ENTITY_PAGE
+    return [
+        e for e in rows
+        if e.get("id") and not (e.get("entity_name") or "").startswith(("[RULE]", "[CHAT]"))
+    ]
+
+
+def _build_index(supabase, project_id: str):
+    from core.entity_mentions import MentionIndex
+    return MentionIndex(_load_entities(supabase, project_id))
+
+
+def _cached_index(supabase, project_id: str):
+    """MentionIndex dùng cho đọc (chat): giữ theo data version của project (ai.router_cache), ghi Bible -> dựng lại."""
+    from ai.router_cache import get_data_version
+    version = get_data_version(project_id)
+    with _index_cache_lock:
+        hit = _index_cache.get(str(project_id))
+        if hit and hit[0] == version:
+            return hit[1]
+    index = _build_index(supabase, project_id)
+    with _index_cache_lock:
+        _index_cache[str(project_id)] = (version, index)
+    return index
+
+
+def _mention_rows(project_id: str, chapter: Dict[str, Any], hits: Dict[str, Dict[str, int]]) -> List[Dict[str, Any]]:
+    length = max(1, len(chapter.get("content") or ""))
+    return [
+        {
+            "entity_id": eid,
+            "chapter_id": chapter["id"],
+            "story_id": project_id,
+            "chapter_number": chapter.get("chapter_number"),
+            "mention_count": h["count"],
+            "first_offset": h["first_offset"],
+            "density": round(h["count"] * 1000.0 / length, 4),
+        }
+        for eid, h in hits.items()
+    ]
+
+
+def _write_rows(supabase, rows: List[Dict[str, Any]]) -> None:
+    for i in range(0, len(rows), MENTION_INDEX_WRITE_BATCH):
+        supabase.table(MENTION_INDEX_TABLE).upsert(rows[i:i + MENTION_INDEX_WRITE_BATCH], on_conflict="entity_id,chapter_id").execute()
+
+
+def _iter_chapters(supabase, project_id: str, chapter_numbers: Optional[List[int]] = None) -> Iterable[Dict[str, Any]]:
+    """Chương (id, chapter_number, content) theo trang; chapter_numbers=None: mọi chương."""
+    if chapter_numbers is not None:
+        for i in range(0, len(chapter_numbers), MENTION_INDEX_CHAPTER_PAGE):
+            r = supabase.table("chapters").select("id, chapter_number, content").eq("story_id", project_id).in_(
+                "chapter_number", chapter_numbers[i:i + MENTION_INDEX_CHAPTER_PAGE]
+            ).execute()
+            yield from (r.data or [])
+        return
+    offset = 0
+    while True:
+        r = supabase.table("chapters").select("id, chapter_number, content").eq("story_id", project_id).order(
+            "chapter_number"
+        ).range(offset, offset + MENTION_INDEX_CHAPTER_PAGE - 1).execute()
+        rows = r.data or []
+        yield from rows
+        if len(rows) < MENTION_INDEX_CHAPTER_PAGE:
+            return
+        offset += MENTION_INDEX_CHAPTER_PAGE
+
+
+def reindex_chapters(project_id: str, chapter_numbers: List[int], index=None) -> int:
+    """Quét lại các chương (theo số chương): xóa dòng cũ của chương rồi ghi dòng mới. Trả về số dòng đã ghi."""
+    supabase = _supabase()
+    if not supabase or not chapter_numbers:
+        return 0
+    index = index or _build_index(supabase, project_id)
+    written = 0
+    for ch in _iter_chapters(supabase, project_id, sorted({int(n) for n in chapter_numbers})):
+        rows = _mention_rows(project_id, ch, index.scan(ch.get("content") or ""))
+        supabase.table(MENTION_INDEX_TABLE).delete().eq("chapter_id", ch["id"]).execute()
+        _write_rows(supabase, rows)
+        written += len(rows)
+    return written
+
+
+def _contained_entities(index, entity_ids: Iterable[str]) -> Set[str]:
+    """
+    Thực thể có tên nằm trọn (theo từ) trong tên của entity_ids: "Long" khi thêm "Lý Long".
+    Khớp dài nhất thắng nên số lần nhắc của chúng đổi khi tên dài hơn xuất hiện -> phải quét lại cùng.
+    """
+    from core.entity_mentions import entity_name_variants
+    out: Set[str] = set()
+    for eid in entity_ids:
+        entry = index.entries_by_id.get(str(eid))
+        if not entry:
+            continue
+        for variant in entity_name_variants(entry.get("entity_name") or ""):
+            words = variant.split()
+            for i in range(len(words)):
+                for j in range(i + 1, len(words) + 1):
+                    if j - i == len(words):
+                        continue
+                    for other in index.patterns.get(" ".join(words[i:j]), ()):
+                        if other in index.entries_by_id:
+                            out.add(other)
+    return out
+
+
+def reindex_entities(project_id: str, entity_ids: List[Any], index=None) -> int:
+    """
+    Quét mọi chương cho các thực thể mới / đổi tên (index đầy đủ để khớp dài nhất vẫn đúng), kèm thực thể có tên
+    ngắn hơn nằm trong tên của chúng (số lần nhắc bị tên dài "lấy" mất). Trả về số dòng đã ghi.
+    """
+    supabase = _supabase()
+    if not supabase or not entity_ids:
+        return 0
+    index = index or _build_index(supabase, project_id)
+    targets = {str(i) for i in entity_ids}
+    targets |= _contained_entities(index, targets)
+    ids = list(targets)
+    for i in range(0, len(ids), 200):
+        supabase.table(MENTION_INDEX_TABLE).delete().in_("entity_id", ids[i:i + 200]).execute()
+    rows: List[Dict[str, Any]] = []
+    written = 0
+    for ch in _iter_chapters(supabase, project_id):
+        hits = {eid: h for eid, h in index.scan(ch.get("content") or "").items() if eid in targets}
+        rows.extend(_mention_rows(project_id, ch, hits))
+        if len(rows) >= MENTION_INDEX_WRITE_BATCH:
+            _write_rows(supabase, rows)
+            written += len(rows)
+            rows = []
+    _write_rows(supabase, rows)
+    return written + len(rows)
+
+
+def rebuild_mention_index(project_id: str, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Dựng lại toàn bộ chỉ mục của project. Returns {"chapters", "rows", "entities", "elapsed_sec"}."""
+    started = time.time()
+    supabase = _supabase()
+    if not supabase:
+        raise RuntimeError("Không kết nối được dịch vụ.")
+    index = _build_index(supabase, project_id)
+    total_r = supabase.table("chapters").select("id", count="exact").eq("story_id", project_id).limit(1).execute()
+    total = int(getattr(total_r, "count", None) or 0)
+    supabase.table(MENTION_INDEX_TABLE).delete().eq("story_id", project_id).execute()
+    rows: List[Dict[str, Any]] = []
+    out = {"chapters": 0, "rows": 0, "entities": len(index.entries_by_id), "elapsed_sec": 0.0}
+    last_report = 0.0
+    for ch in _iter_chapters(supabase, project_id):
+        rows.extend(_mention_rows(project_id, ch, index.scan(ch.get("content") or "")))
+        out["chapters"] += 1
+        if len(rows) >= MENTION_INDEX_WRITE_BATCH:
+            _write_rows(supabase, rows)
+            out["rows"] += len(rows)
+            rows = []
+        now = time.time()
+        if on_progress and now - last_report >= 3.0:
+            last_report = now
+            rate = out["chapters"] / max(0.001, now - started)
+            on_progress({"progress": {
+                "table": "chương",
+                "done": out["chapters"],
+                "total": max(total, out["chapters"]),
+                "rows_per_sec": round(rate, 1),
+                "eta_sec": int((total - out["chapters"]) / rate) if rate and total > out["chapters"] else None,
+            }})
+    _write_rows(supabase, rows)
+    out["rows"] += len(rows)
+    out["elapsed_sec"] = round(time.time() - started, 1)
+    return out
+
+
+def start_mention_index_job(project_id: str, user_id: Optional[str]) -> Optional[str]:
+    """Tạo job dựng lại chỉ mục nhắc tên và chạy trong thread. Trả về job_id hoặc None."""
+    from core.background_jobs import create_job, run_job_worker
+    job_id = create_job(project_id, user_id, MENTION_INDEX_JOB_TYPE, "Dựng chỉ mục nhắc tên (entity → chương)", payload={}, post_to_chat=False)
+    if job_id:
+        threading.Thread(target=run_job_worker, args=(job_id,), daemon=True).start()
+    return job_id
+
+
+# ---------------------------------------------------------------------------
+# Cập nhật tăng dần (gộp yêu cầu, chạy nền)
+# ---------------------------------------------------------------------------
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_worker_loop, daemon=True)
+        _worker.start()
+
+
+def _schedule(project_id: str, kind: str, keys: Iterable[Any]) -> None:
+    keys = [k for k in keys if k is not None and k != ""]
+    if not project_id or not keys:
+        return
+    with _pending_lock:
+        entry = _pending.setdefault(str(project_id), {"chapters": set(), "entities": set()})
+        entry[kind].update(keys)
+        _pending_since[str(project_id)] = time.time()
+        _ensure_worker()
+    _wake.set()
+
+
+def hold_mention_updates(project_id: Optional[str]) -> None:
+    """Job nền bắt đầu ghi: yêu cầu quét của project chỉ gom lại, chưa chạy (lồng nhau được)."""
+    if not project_id:
+        return
+    with _pending_lock:
+        _held[str(project_id)] = _held.get(str(project_id), 0) + 1
+
+
+def release_mention_updates(project_id: Optional[str]) -> None:
+    """Job xong: bỏ giữ; phần đã gom chạy một lần sau debounce."""
+    if not project_id:
+        return
+    key = str(project_id)
+    with _pending_lock:
+        left = _held.get(key, 0) - 1
+        if left > 0:
+            _held[key] = left
+        else:
+            _held.pop(key, None)
+        if key in _pending:
+            _pending_since[key] = time.time()
+            _ensure_worker()
+    _wake.set()
+
+
+def schedule_chapter_mentions(project_id: str, chapter_numbers: Iterable[int]) -> None:
+    """Sau khi lưu chương: quét lại các chương này (nền, gộp trong MENTION_INDEX_DEBOUNCE_SEC)."""
+    _schedule(project_id, "chapters", (int(n) for n in chapter_numbers if n is not None))
+
+
+def schedule_entity_mentions(project_id: str, entity_ids: Iterable[Any]) -> None:
+    """Sau khi thêm / đổi tên thực thể Bible: quét mọi chương cho các thực thể này (nền)."""
+    _schedule(project_id, "entities", (str(i) for i in entity_ids if i))
+
+
+def _take_ready() -> Dict[str, Dict[str, Set[Any]]]:
+    """Project không bị giữ và đã yên MENTION_INDEX_DEBOUNCE_SEC kể từ yêu cầu cuối."""
+    now = time.time()
+    with _pending_lock:
+        ready = [
+            pid for pid in _pending
+            if not _held.get(pid) and now - _pending_since.get(pid, 0) >= MENTION_INDEX_DEBOUNCE_SEC
+        ]
+        batch = {pid: _pending.pop(pid) for pid in ready}
+        for pid in ready:
+            _pending_since.pop(pid, None)
+    return batch
+
+
+def _worker_loop() -> None:
+    while True:
+        _wake.wait(timeout=60)
+        _wake.clear()
+        time.sleep(MENTION_INDEX_DEBOUNCE_SEC)
+        batch = _take_ready()
+        with _pending_lock:
+            if any(not _held.get(pid) for pid in _pending):
+                # Còn project chưa đủ yên: vòng sau kiểm tra lại.
+                _wake.set()
+        if not batch:
+            continue
+        for project_id, entry in batch.items():
+            try:
+                supabase = _supabase()
+                if not supabase:
+                    continue
+                index = _build_index(supabase, project_id)
+                if entry["entities"]:
+                    reindex_entities(project_id, list(entry["entities"]), index=index)
+                if entry["chapters"]:
+                    reindex_chapters(project_id, list(entry["chapters"]), index=index)
+            except Exception as e:
+                print(f"mention_index update error: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Đọc
+# ---------------------------------------------------------------------------
+
+def resolve_entity_ids(project_id: str, names: List[str]) -> List[str]:
+    """Tên (router target_bible_entities) -> id thực thể: khớp chính xác tên / biến thể, không có thì thực thể có tên nằm trong chuỗi."""
+    from core.entity_mentions import normalize_mention_text
+    supabase = _supabase()
+    if not supabase or not names:
+        return []
+    index = _cached_index(supabase, project_id)
+    ids: List[str] = []
+    for name in names:
+        norm = normalize_mention_text(str(name or ""))
+        if not norm:
+            continue
+        found = index.patterns.get(norm) or set(index.detect(norm))
+        for eid in found:
+            if eid not in ids:
+                ids.append(eid)
+    return ids
+
+
+def get_top_mention_chapters(project_id: str, entity_ids: List[str], top_n: int = MENTION_LOOKUP_TOP_N) -> List[int]:
+    """
+    Top chapter_number theo tổng mật độ nhắc các thực thể (một lần đọc bảng chỉ mục).
+    [] nếu chưa có chỉ mục / không có dòng (caller fallback cách cũ).
+    """
+    supabase = _supabase()
+    if not supabase or not entity_ids:
+        return []
+    try:
+        r = supabase.table(MENTION_INDEX_TABLE).select("entity_id, chapter_number, density").eq(
+            "story_id", project_id
+        ).in_("entity_id", [str(i) for i in entity_ids]).order("density", desc=True).limit(max(50, top_n * len(entity_ids) * 4)).execute()
+    except Exception as e:
+        print(f"get_top_mention_chapters error: {e}")
+        return []
+    score: Dict[int, float] = {}
+    for row in (r.data or []):
+        if row.get("chapter_number") is None:
+            continue
+        num = int(row["chapter_number"])
+        score[num] = score.get(num, 0.0) + float(row.get("density") or 0)
+    return [n for n, _ in sorted(score.items(), key=lambda kv: (-kv[1], kv[0]))[:top_n]]
+
+
+def related_chapter_numbers(project_id: str, entity_names: List[str], top_n: int = MENTION_LOOKUP_TOP_N) -> List[int]:
+    """Tên thực thể -> top chương nhắc tới (theo mật độ). [] nếu không xác định được (caller fallback source_chapter)."""
+    try:
+        return get_top_mention_chapters(project_id, resolve_entity_ids(project_id, entity_names), top_n=top_n)
+    except Exception as e:
+        print(f"related_chapter_numbers error: {e}")
+        return []
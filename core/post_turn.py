@@ -0,0 +1,103 @@
+# core/post_turn.py - Pipeline sau mỗi lượt chat: chạy ngầm (lưu history, crystallize counter, rule mining, semantic-add)
+"""
+Sau khi stream xong câu trả lời, các việc còn lại được đẩy vào pipeline thay vì chạy đồng bộ trong lượt Streamlit:
+- Executor giới hạn số thread (POST_TURN_MAX_WORKERS); mỗi project một hàng đợi chạy tuần tự đúng thứ tự gửi.
+- coalesce_key: task cùng key còn đang chờ trong hàng đợi thì gộp (VD: crystallize counter +n, chỉ 1 lần kiểm tra / burst).
+- Kết quả cần hiện cho user (pending rules, semantic-add) được post_result; lần rerun sau view gọi pop_results để đưa vào session_state.
+"""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+POST_TURN_MAX_WORKERS = 4
+# Hàng đợi mỗi project đầy -> chạy task ngay trong thread gọi (backpressure, không bỏ task).
+POST_TURN_MAX_QUEUE = 50
+
+
+class PostTurnPipeline:
+    """Executor giới hạn + hàng đợi tuần tự theo project + gộp task theo coalesce_key."""
+
+    def __init__(self, max_workers: int = POST_TURN_MAX_WORKERS, max_queue: int = POST_TURN_MAX_QUEUE):
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="post-turn")
+        self._lock = threading.Lock()
+        self._queues: Dict[str, deque] = {}
+        self._running: set = set()
+        self._results: Dict[str, List[Dict[str, Any]]] = {}
+
+    def submit(
+        self,
+        project_id: str,
+        name: str,
+        fn: Callable,
+        *args,
+        coalesce_key: Optional[str] = None,
+        merge: Optional[Callable[[tuple, dict, tuple, dict], tuple]] = None,
+        **kwargs,
+    ) -> None:
+        """
+        Đưa task vào hàng đợi của project. coalesce_key + merge: nếu task cùng key còn chờ thì
+        merge(old_args, old_kwargs, new_args, new_kwargs) -> (args, kwargs) thay vì thêm task mới.
+        """
+        pid = str(project_id or "")
+        run_inline = False
+        with self._lock:
+            q = self._queues.setdefault(pid, deque())
+            if coalesce_key:
+                for task in q:
+                    if task["coalesce_key"] == coalesce_key:
+                        if merge:
+                            task["args"], task["kwargs"] = merge(task["args"], task["kwargs"], args, kwargs)
+                        return
+            if len(q) >= self.max_queue:
+                run_inline = True
+            else:
+                q.append({"name": name, "fn": fn, "args": args, "kwargs": kwargs, "coalesce_key": coalesce_key})
+                if pid not in self._running:
+                    self._running.add(pid)
+                    self._executor.submit(self._drain, pid)
+        if run_inline:
+            self._run_task(name, fn, args, kwargs)
+
+    @staticmethod
+    def _run_task(name: str, fn: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            print(f"post_turn task {name} error: {e}")
+
+    def _drain(self, pid: str) -> None:
+        while True:
+            with self._lock:
+                q = self._queues.get(pid)
+                if not q:
+                    self._running.discard(pid)
+                    self._queues.pop(pid, None)
+                    return
+                task = q.popleft()
+            self._run_task(task["name"], task["fn"], task["args"], task["kwargs"])
+
+    def post_result(self, result_key: str, kind: str, value: Any) -> None:
+        """Lưu kết quả để lần rerun sau hiển thị (result_key thường là 'user_id:project_id')."""
+        with self._lock:
+            self._results.setdefault(result_key, []).append({"kind": kind, "value": value})
+
+    def pop_results(self, result_key: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._results.pop(result_key, [])
+
+    def pending(self, project_id: str) -> int:
+        """Số task còn chờ (không tính task đang chạy) của project."""
+        with self._lock:
+            return len(self._queues.get(str(project_id or "")) or [])
+
+
+post_turn_pipeline = PostTurnPipeline()
+
+
+def merge_add_count(old_args: tuple, old_kwargs: dict, new_args: tuple, new_kwargs: dict):
+    """merge cho task đếm: cộng kwargs['count'] (mặc định 1), giữ args cũ."""
+    kw = dict(old_kwargs)
+    kw["count"] = int(old_kwargs.get("count", 1)) + int(new_kwargs.get("count", 1))
+    return old_args, kw
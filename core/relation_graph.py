@@ -0,0 +1,224 @@
+# core/relation_graph.py - Đồ thị quan hệ thực thể trong bộ nhớ (theo project): láng giềng, đường đi ngắn nhất, đồ thị con k bước
+"""
+Dựng một lần từ entity_relations + story_bible (parent_id = cạnh biến thể), giữ trong bộ nhớ theo project.
+Hết hiệu lực khi:
+- data version của project đổi (ai.router_cache.bump_data_version: ghi Bible / job xong), hoặc
+- ghi quan hệ gọi invalidate_relation_graph(project_id), hoặc quá RELATION_GRAPH_TTL_SEC (ghi từ process khác).
+Dùng cho:
+- get_entity_relations: quan hệ của một thực thể không cần query or_ + tra tên + biến thể mỗi lần.
+- "A và B liên quan thế nào?": chỉ đưa đường đi ngắn nhất vào prompt thay vì toàn bộ cạnh.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+RELATION_GRAPH_TTL_SEC = 600
+# Giới hạn khi tìm đường / mở rộng k bước (tránh nổ đồ thị ở node "hub").
+RELATION_PATH_MAX_HOPS = 4
+RELATION_SUBGRAPH_MAX_NODES = 40
+VARIANT_RELATION_TYPE = "biến thể"
+# Cỡ trang khi dựng đồ thị (PostgREST mặc định cắt 1000 dòng mỗi select).
+RELATION_GRAPH_PAGE = 1000
+
+_graph_lock = threading.Lock()
+_graph_cache: Dict[str, Tuple[str, int, float, "RelationGraph"]] = {}
+_graph_versions: Dict[str, int] = {}
+
+
+def _edge_ends(r: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    src = r.get("source_entity_id") or r.get("entity_id") or r.get("from_entity_id")
+    tgt = r.get("target_entity_id") or r.get("to_entity_id")
+    return (str(src) if src else None), (str(tgt) if tgt else None)
+
+
+class RelationGraph:
+    """
+    Danh sách kề theo id thực thể. Mỗi cạnh lưu một lần ở cả hai đầu:
+    adj[id] = [(id_kia, edge_index)], edges[edge_index] = {"source", "target", "type", "description", "relation_id", "variant"}.
+    """
+
+    def __init__(self, entities: List[Dict[str, Any]], relations: List[Dict[str, Any]]):
+        self.names: Dict[str, str] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.adj: Dict[str, List[Tuple[str, int]]] = {}
+        self.edges: List[Dict[str, Any]] = []
+        self.relations: List[Dict[str, Any]] = list(relations or [])
+        for e in entities or []:
+            if e.get("id"):
+                self.names[str(e["id"])] = (e.get("entity_name") or "").strip()
+                self.descriptions[str(e["id"])] = e.get("description") or ""
+        for r in self.relations:
+            src, tgt = _edge_ends(r)
+            if src and tgt:
+                self._add_edge(src, tgt, r.get("relation_type") or r.get("relation") or "liên quan",
+                               r.get("description") or "", r.get("id"), False)
+        for e in entities or []:
+            if e.get("id") and e.get("parent_id"):
+                self._add_edge(str(e["id"]), str(e["parent_id"]), VARIANT_RELATION_TYPE, "", None, True)
+
+    def _add_edge(self, src: str, tgt: str, rel_type: str, desc: str, relation_id: Any, variant: bool) -> None:
+        idx = len(self.edges)
+        self.edges.append({
+            "source": src, "target": tgt, "type": rel_type, "description": desc,
+            "relation_id": relation_id, "variant": variant,
+        })
+        self.adj.setdefault(src, []).append((tgt, idx))
+        self.adj.setdefault(tgt, []).append((src, idx))
+
+    def name(self, entity_id: Any) -> str:
+        return self.names.get(str(entity_id)) or "Entity"
+
+    def neighbours(self, entity_id: Any) -> List[Dict[str, Any]]:
+        """Cạnh nối trực tiếp với entity_id (cả quan hệ lẫn biến thể), theo thứ tự dựng."""
+        return [self.edges[i] for _, i in self.adj.get(str(entity_id), [])]
+
+    def shortest_path(self, a: Any, b: Any, max_hops: int = RELATION_PATH_MAX_HOPS) -> Optional[List[Dict[str, Any]]]:
+        """BFS không trọng số (cạnh xét cả hai chiều). Trả về list cạnh từ a tới b ([] nếu a == b), None nếu không nối trong max_hops."""
+        a, b = str(a), str(b)
+        if a == b:
+            return []
+        if a not in self.adj or b not in self.adj:
+            return None
+        prev: Dict[str, Tuple[Optional[str], Optional[int]]] = {a: (None, None)}
+        queue = deque([(a, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if depth >= max_hops:
+                continue
+            for nxt, idx in self.adj.get(node, []):
+                if nxt in prev:
+                    continue
+                prev[nxt] = (node, idx)
+                if nxt == b:
+                    path = []
+                    cur = b
+                    while prev[cur][0] is not None:
+                        path.append(self.edges[prev[cur][1]])
+                        cur = prev[cur][0]
+                    return path[::-1]
+                queue.append((nxt, depth + 1))
+        return None
+
+    def k_hop(self, seeds: Iterable[Any], k: int = 1, max_nodes: int = RELATION_SUBGRAPH_MAX_NODES) -> Tuple[Set[str], List[Dict[str, Any]]]:
+        """Đồ thị con trong k bước từ seeds: (tập node, cạnh giữa các node đó). Dừng mở rộng khi đủ max_nodes."""
+        nodes: Set[str] = {str(s) for s in seeds if s}
+        frontier = list(nodes)
+        for _ in range(max(0, k)):
+            nxt_frontier = []
+            for node in frontier:
+                for nxt, _ in self.adj.get(node, []):
+                    if nxt not in nodes and len(nodes) < max_nodes:
+                        nodes.add(nxt)
+                        nxt_frontier.append(nxt)
+            frontier = nxt_frontier
+            if not frontier:
+                break
+        seen: Set[int] = set()
+        edges = []
+        for node in nodes:
+            for nxt, idx in self.adj.get(node, []):
+                if nxt in nodes and idx not in seen:
+                    seen.add(idx)
+                    edges.append(self.edges[idx])
+        return nodes, edges
+
+    def format_edge(self, edge: Dict[str, Any]) -> str:
+        if edge.get("variant"):
+            return f"> [RELATION]: {self.name(edge['source'])} là biến thể của {self.name(edge['target'])}."
+        return f"> [RELATION]: {self.name(edge['source'])} là {edge['type']} của {self.name(edge['target'])}."
+
+    def format_path(self, path: List[Dict[str, Any]], a: Any) -> str:
+        """'A —[sư phụ]→ B ←[kẻ thù]— C' theo chiều đi từ a."""
+        cur = str(a)
+        parts = [self.name(cur)]
+        for edge in path:
+            label = VARIANT_RELATION_TYPE if edge.get("variant") else edge["type"]
+            if edge["source"] == cur:
+                parts.append(f"—[{label}]→ {self.name(edge['target'])}")
+                cur = edge["target"]
+            else:
+                parts.append(f"←[{label}]— {self.name(edge['source'])}")
+                cur = edge["source"]
+        return " ".join(parts)
+
+
+def _fetch_all(supabase, table: str, columns: str, project_id: str) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        r = supabase.table(table).select(columns).eq("story_id", project_id).order("id").range(
+            offset, offset + RELATION_GRAPH_PAGE - 1
+        ).execute()
+        rows = r.data or []
+        out.extend(rows)
+        if len(rows) < RELATION_GRAPH_PAGE:
+            return out
+        offset += RELATION_GRAPH_PAGE
+
+
+def _load_graph(project_id: str) -> Optional[RelationGraph]:
+    from config import init_services
+    services = init_services()
+    if not services:
+        return None
+    supabase = services["supabase"]
+    entities = _fetch_all(supabase, "story_bible", "id, entity_name, description, parent_id", project_id)
+    relations = _fetch_all(supabase, "entity_relations", "*", project_id)
+    return RelationGraph(entities, relations)
+
+
+def invalidate_relation_graph(project_id: Optional[str]) -> None:
+    """Gọi sau khi thêm / sửa / xóa entity_relations (lần đọc sau dựng lại đồ thị)."""
+    if not project_id:
+        return
+    with _graph_lock:
+        _graph_versions[str(project_id)] = _graph_versions.get(str(project_id), 0) + 1
+        _graph_cache.pop(str(project_id), None)
+
+
+def get_relation_graph(project_id: str) -> Optional[RelationGraph]:
+    """Đồ thị quan hệ của project (cache). None nếu không kết nối được / lỗi (caller fallback query trực tiếp)."""
+    if not project_id:
+        return None
+    from ai.router_cache import get_data_version
+    key = str(project_id)
+    data_version = get_data_version(project_id)
+    with _graph_lock:
+        local_version = _graph_versions.get(key, 0)
+        hit = _graph_cache.get(key)
+        if hit and hit[0] == data_version and hit[1] == local_version and time.time() - hit[2] < RELATION_GRAPH_TTL_SEC:
+            return hit[3]
+    try:
+        graph = _load_graph(project_id)
+    except Exception as e:
+        print(f"get_relation_graph error: {e}")
+        return None
+    if graph is not None:
+        with _graph_lock:
+            if _graph_versions.get(key, 0) == local_version:
+                _graph_cache[key] = (data_version, local_version, time.time(), graph)
+    return graph
+
+
+def describe_relation_path(project_id: str, entity_a: Any, entity_b: Any, max_hops: int = RELATION_PATH_MAX_HOPS) -> str:
+    """
+    Đoạn ngắn giải thích A và B liên quan thế nào: đường đi ngắn nhất + quan hệ trực tiếp của từng cạnh.
+    "" nếu không có đồ thị; câu báo không nối được nếu không có đường trong max_hops.
+    """
+    graph = get_relation_graph(project_id)
+    if graph is None:
+        return ""
+    path = graph.shortest_path(entity_a, entity_b, max_hops=max_hops)
+    name_a, name_b = graph.name(entity_a), graph.name(entity_b)
+    if path is None:
+        return f"Không tìm thấy chuỗi quan hệ nào nối {name_a} và {name_b} (trong {max_hops} bước)."
+    if not path:
+        return f"{name_a} và {name_b} là cùng một thực thể."
+    lines = [f"Chuỗi quan hệ ({len(path)} bước): {graph.format_path(path, entity_a)}"]
+    for edge in path:
+        line = graph.format_edge(edge)
+        if edge.get("description"):
+            line += f" ({edge['description'][:200]})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -41,9 +41,9 @@ class ReverseLookupAssembler:
                     if not arc_id and chapter.get("arc_id"):
                         arc_id = chapter["arc_id"]
             if arc_id:
-                ar = supabase.table("arcs").select("*").eq("id", arc_id).limit(1).execute()
-                if ar.data:
-                    arc = ar.data[0]
+                from core.arc_service import ArcService
+                story_id = chunk.get("story_id") or (chapter or {}).get("story_id")
+                arc = ArcService.get_arc(arc_id, story_id=story_id)
             return {"chunk": chunk, "chapter": chapter, "arc": arc}
         except Exception:
             return None
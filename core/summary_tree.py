@@ -0,0 +1,502 @@
+# core/summary_tree.py - Cây tóm tắt phân cấp theo chương (khối N chương, khối lớn hơn, arc) + trả lời map-reduce theo khoảng chương
+"""
+Lá là chapters.summary. Node cấp 1 tóm tắt SUMMARY_BLOCK_CHAPTERS chương liên tiếp (1-10, 11-20...);
+node cấp L tóm tắt SUMMARY_FANOUT node cấp L-1. Node arc (ARC:<id>) tóm tắt chương của arc qua
+generate_arc_summary_from_chapters (arc dài: đưa vào tóm tắt khối thay vì từng chương).
+Lưu ở bảng chapter_summary_nodes (schema_v8.3); source_hash = hash nội dung con -> con không đổi thì không gọi LLM.
+Cập nhật:
+- Lưu chương xong metadata (summary) -> schedule_summary_refresh(project_id, [số chương]): dựng lại đường từ lá lên gốc.
+- Job summary_tree_rebuild (tab Arc): dựng toàn bộ.
+Trả lời khoảng chương dài (build_range_context): chọn cấp sao cho số đoạn <= MAP_REDUCE_MAX_CALLS, mỗi đoạn một lần gọi
+LLM song song trích ý liên quan câu hỏi (map), ghép ghi chú theo thứ tự (reduce) -> không cắt văn bản tùy ý.
+"""
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+SUMMARY_TREE_TABLE = "chapter_summary_nodes"
+SUMMARY_TREE_JOB_TYPE = "summary_tree_rebuild"
+SUMMARY_BLOCK_CHAPTERS = 10
+SUMMARY_FANOUT = 10
+SUMMARY_MAX_LEVEL = 4
+# Arc có nhiều chương hơn giá trị này: tóm tắt arc từ node cấp 1 thay vì từng chương.
+SUMMARY_ARC_DIRECT_CHAPTERS = 20
+SUMMARY_CONCURRENCY = 4
+SUMMARY_PAGE = 1000
+
+# Khoảng dài hơn giá trị này (số chương) -> map-reduce trên cây; ngắn hơn -> load_chapters_by_range như cũ.
+MAP_REDUCE_MIN_CHAPTERS = 15
+MAP_REDUCE_MAX_CALLS = 24
+MAP_INPUT_MAX_TOKENS = 6000
+MAP_NOTE_MAX_TOKENS = 400
+MAP_NO_INFO = "KHÔNG LIÊN QUAN"
+
+_refresh_locks: Dict[str, threading.Lock] = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def _supabase():
+    from config import init_services
+    services = init_services()
+    return services["supabase"] if services else None
+
+
+def _span(level: int) -> int:
+    return SUMMARY_BLOCK_CHAPTERS * SUMMARY_FANOUT ** (level - 1)
+
+
+def _node_start(chapter_number: int, level: int) -> int:
+    span = _span(level)
+    return ((int(chapter_number) - 1) // span) * span + 1
+
+
+def _node_key(level: int, start: int) -> str:
+    return f"L{level}:{start}"
+
+
+def _hash(parts: Iterable[str]) -> str:
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _range_label(start: int, end: int) -> str:
+    return f"Chương {start}" if start == end else f"Chương {start}–{end}"
+
+
+def _load_chapter_summaries(supabase, project_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """(chapter_number, title, summary, arc_id) trong [start, end], theo trang."""
+    out: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        r = supabase.table("chapters").select("id, chapter_number, title, summary, arc_id").eq(
+            "story_id", project_id
+        ).gte("chapter_number", start).lte("chapter_number", end).order("chapter_number").range(
+            offset, offset + SUMMARY_PAGE - 1
+        ).execute()
+        rows = r.data or []
+        out.extend(rows)
+        if len(rows) < SUMMARY_PAGE:
+            return out
+        offset += SUMMARY_PAGE
+
+
+def _load_nodes(supabase, project_id: str, level: int, start: int, end: int) -> Dict[int, Dict[str, Any]]:
+    """Node cấp level có start_chapter trong [start, end] -> {start_chapter: row}."""
+    r = supabase.table(SUMMARY_TREE_TABLE).select("node_key, level, start_chapter, end_chapter, summary, source_hash").eq(
+        "story_id", project_id
+    ).eq("level", level).gte("start_chapter", start).lte("start_chapter", end).execute()
+    return {int(row["start_chapter"]): row for row in (r.data or []) if row.get("start_chapter") is not None}
+
+
+def _summarize_block_llm(items: List[Tuple[int, int, str]], label: str) -> str:
+    """items: [(chương đầu, chương cuối, tóm tắt)] theo thứ tự -> một đoạn tóm tắt cho cả khối."""
+    from ai.service import AIService, _get_default_tool_model
+    body = "\n".join(f"{_range_label(a, b)}: {text}" for a, b, text in items)
+    prompt = f"""Các tóm tắt theo thứ tự thời gian của {label}:
+
+{body}
+
+Nhiệm vụ: Viết MỘT đoạn tóm tắt (4-8 câu) cho toàn bộ {label}: giữ tên nhân vật, sự kiện chính, bước ngoặt và kết quả theo đúng thứ tự.
+Chỉ trả về đoạn tóm tắt, không lời dẫn."""
+    resp = AIService.call_openrouter(
+        messages=[{"role": "user", "content": prompt}],
+        model=_get_default_tool_model(),
+        temperature=0.2,
+        max_tokens=700,
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _block_items(supabase, project_id: str, level: int, start: int, end: int,
+                 chapters: Optional[List[Dict[str, Any]]] = None) -> List[Tuple[int, int, str]]:
+    """Con của node (level, start..end) dạng (chương đầu, chương cuối, tóm tắt): cấp 1 = chương, cấp > 1 = node cấp dưới."""
+    if level == 1:
+        rows = chapters if chapters is not None else _load_chapter_summaries(supabase, project_id, start, end)
+        return [
+            (int(c["chapter_number"]), int(c["chapter_number"]), (c.get("summary") or "").strip())
+            for c in rows
+            if start <= int(c["chapter_number"]) <= end and (c.get("summary") or "").strip()
+        ]
+    children = _load_nodes(supabase, project_id, level - 1, start, end)
+    return [
+        (s, int(children[s].get("end_chapter") or s), (children[s].get("summary") or "").strip())
+        for s in sorted(children)
+        if (children[s].get("summary") or "").strip()
+    ]
+
+
+def _refresh_node(supabase, project_id: str, level: int, start: int,
+                  chapters: Optional[List[Dict[str, Any]]] = None) -> bool:
+    """Tính lại một node nếu con đổi. True nếu node được ghi (cấp trên cần tính lại)."""
+    items = _block_items(supabase, project_id, level, start, start + _span(level) - 1, chapters)
+    if not items or (level > 1 and len(items) < 2):
+        # Cấp > 1 chỉ một con: không thêm node trùng nội dung.
+        return False
+    # Khối cuối truyện chưa đủ chương: end_chapter = chương cuối thực có.
+    end = max(b for _, b, _ in items)
+    source_hash = _hash(f"{a}-{b}\x1e{text}" for a, b, text in items)
+    key = _node_key(level, start)
+    try:
+        cur = supabase.table(SUMMARY_TREE_TABLE).select("source_hash").eq("story_id", project_id).eq("node_key", key).limit(1).execute()
+        if cur.data and cur.data[0].get("source_hash") == source_hash:
+            return False
+    except Exception:
+        pass
+    summary = _summarize_block_llm(items, _range_label(start, end))
+    if not summary:
+        return False
+    supabase.table(SUMMARY_TREE_TABLE).upsert({
+        "story_id": project_id,
+        "node_key": key,
+        "level": level,
+        "start_chapter": start,
+        "end_chapter": end,
+        "arc_id": None,
+        "summary": summary,
+        "source_hash": source_hash,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }, on_conflict="story_id,node_key").execute()
+    return True
+
+
+def arc_summary_inputs(project_id: str, arc_id: str, supabase=None) -> List[Dict[str, Any]]:
+    """
+    Đầu vào cho generate_arc_summary_from_chapters: [{"num", "summary"}].
+    Arc <= SUMMARY_ARC_DIRECT_CHAPTERS chương: tóm tắt từng chương; dài hơn: tóm tắt node cấp 1 (khối chương chưa có node thì dùng chương).
+    """
+    supabase = supabase or _supabase()
+    if not supabase or not arc_id:
+        return []
+    r = supabase.table("chapters").select("chapter_number, summary").eq("story_id", project_id).eq(
+        "arc_id", arc_id
+    ).order("chapter_number").execute()
+    chaps = [c for c in (r.data or []) if (c.get("summary") or "").strip()]
+    if len(chaps) <= SUMMARY_ARC_DIRECT_CHAPTERS:
+        return [{"num": c["chapter_number"], "summary": c["summary"]} for c in chaps]
+    nums = [int(c["chapter_number"]) for c in chaps]
+    nodes = _load_nodes(supabase, project_id, 1, _node_start(min(nums), 1), max(nums))
+    out: List[Dict[str, Any]] = []
+    by_block: Dict[int, List[Dict[str, Any]]] = {}
+    for c in chaps:
+        by_block.setdefault(_node_start(int(c["chapter_number"]), 1), []).append(c)
+    for start in sorted(by_block):
+        node = nodes.get(start)
+        if node and (node.get("summary") or "").strip():
+            out.append({"num": f"{start}–{node.get('end_chapter') or start}", "summary": node["summary"]})
+        else:
+            out.extend({"num": c["chapter_number"], "summary": c["summary"]} for c in by_block[start])
+    return out
+
+
+def _refresh_arc_node(supabase, project_id: str, arc_id: str) -> bool:
+    from ai.content import generate_arc_summary_from_chapters
+    items = arc_summary_inputs(project_id, arc_id, supabase)
+    if not items:
+        return False
+    source_hash = _hash(f"{it['num']}\x1e{it['summary']}" for it in items)
+    key = f"ARC:{arc_id}"
+    cur = supabase.table(SUMMARY_TREE_TABLE).select("source_hash").eq("story_id", project_id).eq("node_key", key).limit(1).execute()
+    if cur.data and cur.data[0].get("source_hash") == source_hash:
+        return False
+    arc = None
+    try:
+        from core.arc_service import ArcService
+        arc = ArcService.get_arc(arc_id, story_id=project_id)
+    except Exception:
+        pass
+    summary = generate_arc_summary_from_chapters(items, (arc or {}).get("name") or "")
+    if not summary:
+        return False
+    supabase.table(SUMMARY_TREE_TABLE).upsert({
+        "story_id": project_id,
+        "node_key": key,
+        "level": 0,
+        "start_chapter": None,
+        "end_chapter": None,
+        "arc_id": arc_id,
+        "summary": summary,
+        "source_hash": source_hash,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }, on_conflict="story_id,node_key").execute()
+    return True
+
+
+def get_arc_tree_summary(project_id: str, arc_id: str) -> str:
+    """Tóm tắt arc tự sinh từ cây ("" nếu chưa có). Dùng khi arcs.summary trống."""
+    supabase = _supabase()
+    if not supabase or not arc_id:
+        return ""
+    try:
+        r = supabase.table(SUMMARY_TREE_TABLE).select("summary").eq("story_id", project_id).eq("node_key", f"ARC:{arc_id}").limit(1).execute()
+        return (r.data[0].get("summary") or "").strip() if r.data else ""
+    except Exception:
+        return ""
+
+
+def refresh_summary_tree(
+    project_id: str,
+    chapter_numbers: Iterable[int],
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, int]:
+    """
+    Tính lại các node chứa chapter_numbers, từ cấp 1 lên; cấp trên chỉ tính khi cấp dưới thật sự đổi.
+    Node trong một cấp gọi LLM song song (SUMMARY_CONCURRENCY). Returns {"nodes", "arcs"} số node đã ghi.
+    """
+    supabase = _supabase()
+    nums = sorted({int(n) for n in chapter_numbers if n is not None})
+    out = {"nodes": 0, "arcs": 0}
+    if not supabase or not nums:
+        return out
+    from core.cost_ledger import get_cost_actor, set_cost_actor
+    actor = get_cost_actor()
+    chapters = _load_chapter_summaries(supabase, project_id, _node_start(nums[0], 1), _node_start(nums[-1], 1) + _span(1) - 1)
+    changed = sorted({_node_start(n, 1) for n in nums})
+
+    def _run(level: int, start: int) -> bool:
+        set_cost_actor(*actor)
+        try:
+            return _refresh_node(supabase, project_id, level, start, chapters if level == 1 else None)
+        except Exception as e:
+            print(f"summary_tree node L{level}:{start} error: {e}")
+            return False
+
+    for level in range(1, SUMMARY_MAX_LEVEL + 1):
+        if not changed:
+            break
+        written: List[int] = []
+        started, last_report = time.time(), 0.0
+        with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+            futures = {pool.submit(_run, level, s): s for s in changed}
+            for done, fut in enumerate(as_completed(futures), 1):
+                if fut.result():
+                    written.append(futures[fut])
+                now = time.time()
+                if on_progress and (now - last_report >= 3.0 or done == len(changed)):
+                    last_report = now
+                    rate = done / max(0.001, now - started)
+                    on_progress({"progress": {
+                        "table": f"khối tóm tắt cấp {level}",
+                        "done": done,
+                        "total": len(changed),
+                        "rows_per_sec": round(rate, 2),
+                        "eta_sec": int((len(changed) - done) / rate) if rate else None,
+                    }})
+        out["nodes"] += len(written)
+        changed = sorted({_node_start(s, level + 1) for s in written})
+
+    num_set = set(nums)
+    for arc_id in sorted({str(c["arc_id"]) for c in chapters if c.get("arc_id") and int(c["chapter_number"]) in num_set}):
+        try:
+            if _refresh_arc_node(supabase, project_id, arc_id):
+                out["arcs"] += 1
+        except Exception as e:
+            print(f"summary_tree arc {arc_id} error: {e}")
+    return out
+
+
+def rebuild_summary_tree(project_id: str, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Dựng (bổ sung) toàn bộ cây cho project; node có con không đổi được bỏ qua nhờ source_hash."""
+    started = time.time()
+    supabase = _supabase()
+    if not supabase:
+        raise RuntimeError("Không kết nối được dịch vụ.")
+    r = supabase.table("chapters").select("chapter_number").eq("story_id", project_id).order("chapter_number", desc=True).limit(1).execute()
+    last = int(r.data[0]["chapter_number"]) if r.data else 0
+    if not last:
+        return {"chapters": 0, "nodes": 0, "arcs": 0, "elapsed_sec": 0.0}
+    res = refresh_summary_tree(project_id, range(1, last + 1), on_progress=on_progress)
+    return {"chapters": last, **res, "elapsed_sec": round(time.time() - started, 1)}
+
+
+def start_summary_tree_job(project_id: str, user_id: Optional[str]) -> Optional[str]:
+    """Tạo job dựng cây tóm tắt và chạy trong thread. Trả về job_id hoặc None."""
+    from core.background_jobs import create_job, run_job_worker
+    job_id = create_job(project_id, user_id, SUMMARY_TREE_JOB_TYPE, "Dựng cây tóm tắt chương", payload={}, post_to_chat=False)
+    if job_id:
+        threading.Thread(target=run_job_worker, args=(job_id,), daemon=True).start()
+    return job_id
+
+
+def schedule_summary_refresh(project_id: str, chapter_numbers: Iterable[int]) -> None:
+    """Cập nhật cây cho các chương vừa đổi tóm tắt (thread nền; mỗi project một lượt tại một thời điểm)."""
+    nums = [n for n in chapter_numbers if n is not None]
+    if not project_id or not nums:
+        return
+    from core.cost_ledger import get_cost_actor, set_cost_actor
+    actor = get_cost_actor()
+    with _refresh_locks_guard:
+        lock = _refresh_locks.setdefault(str(project_id), threading.Lock())
+
+    def _run():
+        set_cost_actor(*actor)
+        with lock:
+            try:
+                refresh_summary_tree(project_id, nums)
+            except Exception as e:
+                print(f"schedule_summary_refresh error: {e}")
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+# ---------------------------------------------------------------------------
+# Map-reduce theo khoảng chương
+# ---------------------------------------------------------------------------
+
+def _map_segments(start: int, end: int) -> Tuple[int, List[Tuple[int, int]]]:
+    """Chọn cấp nhỏ nhất để số đoạn <= MAP_REDUCE_MAX_CALLS. Returns (level, [(a, b)]) đã cắt theo [start, end]."""
+    level = 1
+    while level < SUMMARY_MAX_LEVEL and (end - _node_start(start, level)) // _span(level) + 1 > MAP_REDUCE_MAX_CALLS:
+        level += 1
+    span = _span(level)
+    segs = [(max(s, start), min(s + span - 1, end)) for s in range(_node_start(start, level), end + 1, span)]
+    return level, segs
+
+
+def _segment_text(supabase, project_id: str, level: int, a: int, b: int, chapters: List[Dict[str, Any]]) -> str:
+    """Đầu vào map của một đoạn: cấp 1 = tóm tắt chương (chương chưa có tóm tắt: trích nội dung); cấp > 1 = node cấp dưới."""
+    from ai.utils import cap_context_to_tokens
+    lines: List[str] = []
+    if level > 1:
+        children = _load_nodes(supabase, project_id, level - 1, _node_start(a, level - 1), b)
+        covered = set()
+        for s in sorted(children):
+            node = children[s]
+            if (node.get("summary") or "").strip():
+                lines.append(f"[{_range_label(s, int(node.get('end_chapter') or s))}] {node['summary'].strip()}")
+                covered.update(range(s, int(node.get("end_chapter") or s) + 1))
+        # Khối chưa có node: dùng tóm tắt chương.
+        chapters = [c for c in chapters if a <= int(c["chapter_number"]) <= b and int(c["chapter_number"]) not in covered]
+    else:
+        chapters = [c for c in chapters if a <= int(c["chapter_number"]) <= b]
+    missing = [int(c["chapter_number"]) for c in chapters if not (c.get("summary") or "").strip()]
+    excerpts: Dict[int, str] = {}
+    if missing:
+        per = max(200, (MAP_INPUT_MAX_TOKENS * 4) // max(1, len(chapters)))
+        r = supabase.table("chapters").select("chapter_number, content").eq("story_id", project_id).in_("chapter_number", missing).execute()
+        excerpts = {int(x["chapter_number"]): (x.get("content") or "")[:per] for x in (r.data or [])}
+    for c in chapters:
+        num = int(c["chapter_number"])
+        title = (c.get("title") or "").strip()
+        text = (c.get("summary") or "").strip() or excerpts.get(num, "")
+        if text:
+            lines.append(f"[Chương {num}{' - ' + title if title else ''}] {text}")
+    text, _ = cap_context_to_tokens("\n".join(lines), MAP_INPUT_MAX_TOKENS)
+    return text
+
+
+def _map_range_llm(question: str, label: str, segment_text: str) -> str:
+    from ai.service import AIService, _get_default_tool_model
+    prompt = f"""CÂU HỎI: {question}
+
+TÓM TẮT {label.upper()}:
+{segment_text}
+
+Nhiệm vụ: Trích từ phần tóm tắt trên MỌI thông tin giúp trả lời câu hỏi (sự kiện, nhân vật, chi tiết, số chương), viết gọn dạng gạch đầu dòng.
+Không suy diễn ngoài tóm tắt. Nếu không có gì liên quan, chỉ trả về đúng: {MAP_NO_INFO}"""
+    resp = AIService.call_openrouter(
+        messages=[{"role": "user", "content": prompt}],
+        model=_get_default_tool_model(),
+        temperature=0.0,
+        max_tokens=MAP_NOTE_MAX_TOKENS,
+    )
+    note = (resp.choices[0].message.content or "").strip()
+    return "" if not note or note.upper().startswith(MAP_NO_INFO) else note
+
+
+def map_reduce_range(
+    project_id: str,
+    question: str,
+    start: int,
+    end: int,
+    token_limit: int = 8000,
+    used_rows: Optional[Dict[str, set]] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Map: mỗi đoạn của cây (song song) -> ghi chú liên quan câu hỏi. Reduce: ghép theo thứ tự chương;
+    vượt token_limit -> gộp lại bằng một lần gọi. Returns (text, sources); ("", []) nếu không có dữ liệu.
+    """
+    supabase = _supabase()
+    if not supabase or start > end:
+        return "", []
+    from ai.service import AIService
+    from core.cost_ledger import get_cost_actor, set_cost_actor
+    level, segs = _map_segments(start, end)
+    chapters = _load_chapter_summaries(supabase, project_id, start, end)
+    if not chapters:
+        return "", []
+    from ai.answer_cache import track_rows
+    track_rows(used_rows, "chapter", [c.get("id") for c in chapters])
+    actor = get_cost_actor()
+
+    def _run(seg: Tuple[int, int]) -> str:
+        set_cost_actor(*actor)
+        a, b = seg
+        try:
+            text = _segment_text(supabase, project_id, level, a, b, chapters)
+            return _map_range_llm(question, _range_label(a, b), text) if text else ""
+        except Exception as e:
+            print(f"map_reduce_range segment {a}-{b} error: {e}")
+            return ""
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        notes = list(pool.map(_run, segs))
+    parts = [f"[{_range_label(a, b)}]\n{note}" for (a, b), note in zip(segs, notes) if note]
+    if not parts:
+        return "", []
+    text = "\n\n".join(parts)
+    if AIService.estimate_tokens(text) > token_limit:
+        text = _reduce_notes_llm(question, text, token_limit) or text
+        from ai.utils import cap_context_to_tokens
+        text, _ = cap_context_to_tokens(text, token_limit)
+    return text, [f"🌲 {_range_label(start, end)} (map-reduce {len(segs)} đoạn)"]
+
+
+def _reduce_notes_llm(question: str, notes: str, token_limit: int) -> str:
+    from ai.service import AIService, _get_default_tool_model
+    prompt = f"""CÂU HỎI: {question}
+
+GHI CHÚ THEO KHOẢNG CHƯƠNG:
+{notes}
+
+Nhiệm vụ: Gộp các ghi chú thành một bản ngắn gọn hơn, giữ thứ tự chương và mọi chi tiết trả lời câu hỏi, bỏ lặp. Giữ nhãn [Chương a–b]."""
+    try:
+        resp = AIService.call_openrouter(
+            messages=[{"role": "user", "content": prompt}],
+            model=_get_default_tool_model(),
+            temperature=0.0,
+            max_tokens=min(4000, max(500, token_limit)),
+        )
+        return (resp.choices[0].message.content or "").strip()
+    except Exception as e:
+        print(f"_reduce_notes_llm error: {e}")
+        return ""
+
+
+def build_range_context(
+    project_id: str,
+    question: str,
+    start: int,
+    end: int,
+    token_limit: int = 8000,
+    used_rows: Optional[Dict[str, set]] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Context cho câu hỏi về khoảng chương: khoảng ngắn -> load_chapters_by_range (cắt theo token);
+    khoảng > MAP_REDUCE_MIN_CHAPTERS -> map-reduce trên cây tóm tắt (lỗi / không có dữ liệu thì quay về cách cũ).
+    """
+    from ai_engine import ContextManager
+    from ai.utils import cap_context_to_tokens
+    start, end = min(int(start), int(end)), max(int(start), int(end))
+    if end - start + 1 > MAP_REDUCE_MIN_CHAPTERS and (question or "").strip():
+        try:
+            text, sources = map_reduce_range(project_id, question, start, end, token_limit=token_limit, used_rows=used_rows)
+            if text:
+                return text, sources
+        except Exception as e:
+            print(f"build_range_context map-reduce error: {e}")
+    text, sources = ContextManager.load_chapters_by_range(project_id, start, end, token_limit=token_limit, used_rows=used_rows)
+    if token_limit > 0 and text:
+        text, _ = cap_context_to_tokens(text, token_limit)
+    return text, sources
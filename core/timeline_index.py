@@ -0,0 +1,232 @@
+# core/timeline_index.py - Chỉ mục timeline trong bộ nhớ (theo project): theo chương, theo arc, "giữa sự kiện A và B"
+"""
+Nạp một lần toàn bộ timeline_events + (id, chapter_number, arc_id) của chapters, giữ trong bộ nhớ theo project.
+- Thứ tự: (chapter_number, event_order); sự kiện không gắn chương (thêm tay) xếp sau theo event_order.
+- Khoảng chương: mảng chapter_number đã sắp + bisect (mỗi sự kiện thuộc đúng một chương nên cây khoảng suy biến thành điểm).
+- Arc: phân vùng theo arc_id của sự kiện, không có thì arc_id của chương.
+Cập nhật tăng dần: ghi timeline (tab Timeline, job extract) gọi timeline_events_written / timeline_events_deleted;
+gặp chương chưa biết -> bỏ cache, lần đọc sau nạp lại. Ghi khác (xóa chương...) đi qua invalidate_timeline_index / TTL.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TIMELINE_INDEX_TTL_SEC = 600
+TIMELINE_PAGE = 1000
+TIMELINE_EVENT_COLUMNS = "id, event_order, title, description, raw_date, event_type, chapter_id, arc_id"
+
+_index_lock = threading.Lock()
+_indexes: Dict[str, Tuple[float, "TimelineIndex"]] = {}
+
+
+def _order_key(ev: Dict[str, Any]) -> Tuple[int, float, int, str]:
+    num = ev.get("_chapter_number")
+    return (0 if num is not None else 1, num if num is not None else 0, int(ev.get("event_order") or 0), str(ev.get("id")))
+
+
+class TimelineIndex:
+    """Sự kiện timeline của một project; truy vấn khoảng chương / arc / giữa hai sự kiện không cần query DB."""
+
+    def __init__(self, events: List[Dict[str, Any]], chapters: List[Dict[str, Any]]):
+        self._lock = threading.Lock()
+        self.chapter_number: Dict[str, int] = {}
+        self.chapter_arc: Dict[str, str] = {}
+        for c in chapters or []:
+            if c.get("id") is None or c.get("chapter_number") is None:
+                continue
+            self.chapter_number[str(c["id"])] = int(c["chapter_number"])
+            if c.get("arc_id"):
+                self.chapter_arc[str(c["id"])] = str(c["arc_id"])
+        self._events: Dict[str, Dict[str, Any]] = {}
+        self._dirty = True
+        self.apply_upsert(events)
+
+    # --- dựng cấu trúc ---
+    def _decorate(self, ev: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Bản sao sự kiện kèm _chapter_number / _arc_id. None nếu chapter_id không có trong chỉ mục."""
+        row = dict(ev)
+        cid = str(ev["chapter_id"]) if ev.get("chapter_id") is not None else None
+        if cid is not None and cid not in self.chapter_number:
+            return None
+        row["_chapter_number"] = self.chapter_number.get(cid) if cid else None
+        row["_arc_id"] = str(ev["arc_id"]) if ev.get("arc_id") else self.chapter_arc.get(cid or "")
+        return row
+
+    def _rebuild(self) -> None:
+        ordered = sorted(self._events.values(), key=_order_key)
+        self._ordered = ordered
+        self._pos = {str(e["id"]): i for i, e in enumerate(ordered)}
+        self._chaptered = [e for e in ordered if e["_chapter_number"] is not None]
+        self._chapter_keys = [e["_chapter_number"] for e in self._chaptered]
+        self._by_arc: Dict[str, List[Dict[str, Any]]] = {}
+        for e in ordered:
+            if e.get("_arc_id"):
+                self._by_arc.setdefault(e["_arc_id"], []).append(e)
+        self._dirty = False
+
+    def _ensure(self) -> None:
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    self._rebuild()
+
+    # --- cập nhật tăng dần ---
+    def apply_upsert(self, rows: Iterable[Dict[str, Any]]) -> bool:
+        """Thêm / sửa sự kiện (dòng trả về từ insert / update). False nếu có chương chưa biết (caller bỏ cache)."""
+        ok = True
+        with self._lock:
+            for ev in rows or []:
+                if ev.get("id") is None:
+                    ok = False
+                    continue
+                old = self._events.get(str(ev["id"]), {})
+                merged = {**{k: v for k, v in old.items() if not k.startswith("_")}, **ev}
+                row = self._decorate(merged)
+                if row is None:
+                    ok = False
+                    continue
+                self._events[str(ev["id"])] = row
+            self._dirty = True
+        return ok
+
+    def apply_delete(self, ids: Iterable[Any] = (), chapter_ids: Iterable[Any] = ()) -> None:
+        ids = {str(i) for i in ids or []}
+        chapter_ids = {str(c) for c in chapter_ids or []}
+        with self._lock:
+            for eid in list(self._events):
+                ev = self._events[eid]
+                if eid in ids or (ev.get("chapter_id") is not None and str(ev["chapter_id"]) in chapter_ids):
+                    del self._events[eid]
+            self._dirty = True
+
+    # --- truy vấn ---
+    def ordered(self) -> List[Dict[str, Any]]:
+        self._ensure()
+        return self._ordered
+
+    def in_chapter_range(self, start: int, end: int) -> List[Dict[str, Any]]:
+        self._ensure()
+        start, end = min(int(start), int(end)), max(int(start), int(end))
+        return self._chaptered[bisect_left(self._chapter_keys, start):bisect_right(self._chapter_keys, end)]
+
+    def in_arc(self, arc_id: Any) -> List[Dict[str, Any]]:
+        self._ensure()
+        return self._by_arc.get(str(arc_id), [])
+
+    def find(self, query: str) -> Optional[Dict[str, Any]]:
+        """Sự kiện theo id, hoặc tiêu đề (không phân biệt dấu; trùng khớp trước, chứa sau; sớm nhất thắng)."""
+        self._ensure()
+        q = str(query or "").strip()
+        if not q:
+            return None
+        if q in self._pos:
+            return self._ordered[self._pos[q]]
+        from core.entity_mentions import normalize_mention_text
+        nq = normalize_mention_text(q)
+        if not nq:
+            return None
+        contains = None
+        for e in self._ordered:
+            title = normalize_mention_text(e.get("title") or "")
+            if title == nq:
+                return e
+            if contains is None and nq in title:
+                contains = e
+        return contains
+
+    def between(self, a: Any, b: Any, inclusive: bool = False) -> List[Dict[str, Any]]:
+        """Sự kiện nằm giữa A và B theo thứ tự timeline (A, B: id hoặc tiêu đề). [] nếu không tìm thấy A hoặc B."""
+        ev_a, ev_b = self.find(a), self.find(b)
+        if not ev_a or not ev_b:
+            return []
+        i, j = sorted((self._pos[str(ev_a["id"])], self._pos[str(ev_b["id"])]))
+        return self._ordered[i:j + 1] if inclusive else self._ordered[i + 1:j]
+
+    def query(
+        self,
+        limit: int = 50,
+        chapter_range: Optional[Tuple[int, int]] = None,
+        arc_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Tương đương get_timeline_events: lọc khoảng chương và / hoặc arc, theo thứ tự timeline, tối đa limit."""
+        if chapter_range and len(chapter_range) >= 2:
+            events = self.in_chapter_range(chapter_range[0], chapter_range[1])
+            if arc_id:
+                events = [e for e in events if e.get("_arc_id") == str(arc_id)]
+        elif arc_id:
+            events = self.in_arc(arc_id)
+        else:
+            events = self.ordered()
+        return [{k: v for k, v in e.items() if not k.startswith("_")} for e in events[:max(0, limit)]]
+
+
+def _fetch_all(supabase, table: str, columns: str, project_id: str, order: str) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        r = supabase.table(table).select(columns).eq("story_id", project_id).order(order).range(
+            offset, offset + TIMELINE_PAGE - 1
+        ).execute()
+        rows = r.data or []
+        out.extend(rows)
+        if len(rows) < TIMELINE_PAGE:
+            return out
+        offset += TIMELINE_PAGE
+
+
+def get_timeline_index(project_id: str) -> Optional[TimelineIndex]:
+    """Chỉ mục timeline của project (cache). None nếu không kết nối được / lỗi (caller query trực tiếp)."""
+    if not project_id:
+        return None
+    key = str(project_id)
+    with _index_lock:
+        hit = _indexes.get(key)
+        if hit and time.time() - hit[0] < TIMELINE_INDEX_TTL_SEC:
+            return hit[1]
+    try:
+        from config import init_services
+        services = init_services()
+        if not services:
+            return None
+        supabase = services["supabase"]
+        events = _fetch_all(supabase, "timeline_events", TIMELINE_EVENT_COLUMNS, project_id, "id")
+        chapters = _fetch_all(supabase, "chapters", "id, chapter_number, arc_id", project_id, "chapter_number")
+    except Exception as e:
+        print(f"get_timeline_index error: {e}")
+        return None
+    index = TimelineIndex(events, chapters)
+    with _index_lock:
+        _indexes[key] = (time.time(), index)
+    return index
+
+
+def invalidate_timeline_index(project_id: Optional[str] = None) -> None:
+    """Bỏ chỉ mục của project (None: mọi project); lần đọc sau nạp lại."""
+    with _index_lock:
+        if project_id:
+            _indexes.pop(str(project_id), None)
+        else:
+            _indexes.clear()
+
+
+def _cached(project_id: str) -> Optional[TimelineIndex]:
+    with _index_lock:
+        hit = _indexes.get(str(project_id or ""))
+        return hit[1] if hit else None
+
+
+def timeline_events_written(project_id: str, rows: Optional[List[Dict[str, Any]]]) -> None:
+    """Sau insert / update timeline_events (rows = data trả về, có id). Không có id / chương lạ -> bỏ cache."""
+    index = _cached(project_id)
+    if index is None:
+        return
+    if not rows or not index.apply_upsert(rows):
+        invalidate_timeline_index(project_id)
+
+
+def timeline_events_deleted(project_id: str, ids: Iterable[Any] = (), chapter_ids: Iterable[Any] = ()) -> None:
+    """Sau delete timeline_events theo id và / hoặc theo chương."""
+    index = _cached(project_id)
+    if index is not None:
+        index.apply_delete(ids, chapter_ids)
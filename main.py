@@ -7,6 +7,7 @@ import streamlit as st
 import time
 
 from config import Config, init_services, SessionManager
+from core.cost_ledger import set_cost_actor
 from utils.cache_helpers import get_user_budget_cached
 from views.sidebar import render_sidebar
 
@@ -150,6 +151,8 @@ def main():
         st.stop()
 
     project_id, persona = render_sidebar(session_manager)
+    if st.session_state.get("user"):
+        set_cost_actor(st.session_state.user.id, project_id)
 
     # Header (tiêu đề căn giữa)
     col1, col2 = st.columns([3, 1])
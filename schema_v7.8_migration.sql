@@ -0,0 +1,62 @@
+-- ==============================================================================
+-- V7.8 Migration: updated_at tự cập nhật khi nội dung đổi (answer cache kiểm tra dòng nguồn)
+-- - story_bible, chapters, chunks, timeline_events: trigger BEFORE UPDATE OF <cột nội dung>
+-- - Chỉ các cột nội dung: cập nhật embedding / lookup_count không làm đổi updated_at
+-- Chạy sau schema_v7.7_migration.sql.
+-- ==============================================================================
+
+-- ------------------------------------------------------------------------------
+-- 1) Đảm bảo cột updated_at tồn tại
+-- ------------------------------------------------------------------------------
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'story_bible' AND column_name = 'updated_at') THEN
+    ALTER TABLE story_bible ADD COLUMN updated_at TIMESTAMPTZ DEFAULT NOW();
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'chapters' AND column_name = 'updated_at') THEN
+    ALTER TABLE chapters ADD COLUMN updated_at TIMESTAMPTZ DEFAULT NOW();
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'chunks' AND column_name = 'updated_at') THEN
+    ALTER TABLE chunks ADD COLUMN updated_at TIMESTAMPTZ DEFAULT NOW();
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'timeline_events' AND column_name = 'updated_at') THEN
+    ALTER TABLE timeline_events ADD COLUMN updated_at TIMESTAMPTZ DEFAULT NOW();
+  END IF;
+END $$;
+
+-- ------------------------------------------------------------------------------
+-- 2) Hàm trigger dùng chung
+-- ------------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION set_row_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  RETURN NEW;
+END;
+$$;
+COMMENT ON FUNCTION set_row_updated_at() IS 'V7.8: Gán updated_at = NOW() khi cột nội dung đổi. Answer cache so updated_at để biết dòng nguồn đã đổi.';
+
+-- ------------------------------------------------------------------------------
+-- 3) Trigger theo bảng (chỉ cột nội dung)
+-- ------------------------------------------------------------------------------
+DROP TRIGGER IF EXISTS trg_story_bible_updated_at ON story_bible;
+CREATE TRIGGER trg_story_bible_updated_at
+  BEFORE UPDATE OF entity_name, description, source_chapter, parent_id, archived ON story_bible
+  FOR EACH ROW EXECUTE FUNCTION set_row_updated_at();
+
+DROP TRIGGER IF EXISTS trg_chapters_updated_at ON chapters;
+CREATE TRIGGER trg_chapters_updated_at
+  BEFORE UPDATE OF title, content, summary, art_style, chapter_number, arc_id ON chapters
+  FOR EACH ROW EXECUTE FUNCTION set_row_updated_at();
+
+DROP TRIGGER IF EXISTS trg_chunks_updated_at ON chunks;
+CREATE TRIGGER trg_chunks_updated_at
+  BEFORE UPDATE OF content, raw_content, meta_json, chapter_id, arc_id ON chunks
+  FOR EACH ROW EXECUTE FUNCTION set_row_updated_at();
+
+DROP TRIGGER IF EXISTS trg_timeline_events_updated_at ON timeline_events;
+CREATE TRIGGER trg_timeline_events_updated_at
+  BEFORE UPDATE OF title, description, event_order, raw_date, event_type, chapter_id, arc_id ON timeline_events
+  FOR EACH ROW EXECUTE FUNCTION set_row_updated_at();
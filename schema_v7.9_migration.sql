@@ -0,0 +1,134 @@
+-- ==============================================================================
+-- V7.9 Migration: Cost ledger (usage thật từ API) + rollup theo ngày + tăng budget nguyên tử
+-- - cost_ledger: mỗi lần gọi LLM một dòng (prompt/completion/cached tokens, model, latency)
+-- - cost_usage_daily: tổng theo (user, project, ngày, model) cho tab Cost
+-- - RPC record_cost_batch(entries): ghi lô ledger + cộng rollup + cộng user_budgets trong 1 transaction
+-- - RPC increment_user_credits(p_user_id, p_cost): cộng used_credits nguyên tử (thay read-modify-write)
+-- Chạy sau schema_v7.8_migration.sql.
+-- ==============================================================================
+
+-- ------------------------------------------------------------------------------
+-- 1) cost_ledger
+-- ------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS cost_ledger (
+  id BIGSERIAL PRIMARY KEY,
+  user_id TEXT,
+  story_id UUID,
+  model TEXT NOT NULL DEFAULT '',
+  call_site TEXT NOT NULL DEFAULT '',
+  prompt_tokens INT NOT NULL DEFAULT 0,
+  completion_tokens INT NOT NULL DEFAULT 0,
+  cached_tokens INT NOT NULL DEFAULT 0,
+  cost NUMERIC(14, 6) NOT NULL DEFAULT 0,
+  latency_ms INT NOT NULL DEFAULT 0,
+  estimated BOOLEAN NOT NULL DEFAULT FALSE,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_cost_ledger_user_created ON cost_ledger(user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_cost_ledger_story_created ON cost_ledger(story_id, created_at DESC);
+COMMENT ON TABLE cost_ledger IS 'V7.9: Mỗi lần gọi LLM (usage thật từ API; estimated=true khi API không trả usage). Ghi theo lô qua record_cost_batch.';
+
+-- ------------------------------------------------------------------------------
+-- 2) cost_usage_daily (rollup)
+-- ------------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS cost_usage_daily (
+  user_key TEXT NOT NULL DEFAULT '',
+  story_key TEXT NOT NULL DEFAULT '',
+  day DATE NOT NULL,
+  model TEXT NOT NULL DEFAULT '',
+  calls INT NOT NULL DEFAULT 0,
+  prompt_tokens BIGINT NOT NULL DEFAULT 0,
+  completion_tokens BIGINT NOT NULL DEFAULT 0,
+  cached_tokens BIGINT NOT NULL DEFAULT 0,
+  cost NUMERIC(14, 6) NOT NULL DEFAULT 0,
+  latency_ms_total BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_key, story_key, day, model)
+);
+CREATE INDEX IF NOT EXISTS idx_cost_usage_daily_user_day ON cost_usage_daily(user_key, day DESC);
+COMMENT ON TABLE cost_usage_daily IS 'V7.9: Tổng chi phí theo user/project/ngày/model. user_key/story_key = '''' khi không gắn user/project.';
+
+-- ------------------------------------------------------------------------------
+-- 3) RPC record_cost_batch
+-- entries: [{"user_id","story_id","model","call_site","prompt_tokens","completion_tokens","cached_tokens","cost","latency_ms","estimated","created_at"}]
+-- ------------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION record_cost_batch(entries JSONB)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  n INT := 0;
+BEGIN
+  IF entries IS NULL OR jsonb_typeof(entries) <> 'array' OR jsonb_array_length(entries) = 0 THEN
+    RETURN 0;
+  END IF;
+
+  INSERT INTO cost_ledger (user_id, story_id, model, call_site, prompt_tokens, completion_tokens, cached_tokens, cost, latency_ms, estimated, created_at)
+  SELECT
+    NULLIF(e->>'user_id', ''),
+    NULLIF(e->>'story_id', '')::uuid,
+    COALESCE(e->>'model', ''),
+    COALESCE(e->>'call_site', ''),
+    COALESCE((e->>'prompt_tokens')::int, 0),
+    COALESCE((e->>'completion_tokens')::int, 0),
+    COALESCE((e->>'cached_tokens')::int, 0),
+    COALESCE((e->>'cost')::numeric, 0),
+    COALESCE((e->>'latency_ms')::int, 0),
+    COALESCE((e->>'estimated')::boolean, FALSE),
+    COALESCE((e->>'created_at')::timestamptz, NOW())
+  FROM jsonb_array_elements(entries) AS e;
+  GET DIAGNOSTICS n = ROW_COUNT;
+
+  INSERT INTO cost_usage_daily AS d (user_key, story_key, day, model, calls, prompt_tokens, completion_tokens, cached_tokens, cost, latency_ms_total)
+  SELECT
+    COALESCE(e->>'user_id', ''),
+    COALESCE(e->>'story_id', ''),
+    (COALESCE((e->>'created_at')::timestamptz, NOW()) AT TIME ZONE 'UTC')::date,
+    COALESCE(e->>'model', ''),
+    COUNT(*),
+    SUM(COALESCE((e->>'prompt_tokens')::bigint, 0)),
+    SUM(COALESCE((e->>'completion_tokens')::bigint, 0)),
+    SUM(COALESCE((e->>'cached_tokens')::bigint, 0)),
+    SUM(COALESCE((e->>'cost')::numeric, 0)),
+    SUM(COALESCE((e->>'latency_ms')::bigint, 0))
+  FROM jsonb_array_elements(entries) AS e
+  GROUP BY 1, 2, 3, 4
+  ON CONFLICT (user_key, story_key, day, model) DO UPDATE SET
+    calls = d.calls + EXCLUDED.calls,
+    prompt_tokens = d.prompt_tokens + EXCLUDED.prompt_tokens,
+    completion_tokens = d.completion_tokens + EXCLUDED.completion_tokens,
+    cached_tokens = d.cached_tokens + EXCLUDED.cached_tokens,
+    cost = d.cost + EXCLUDED.cost,
+    latency_ms_total = d.latency_ms_total + EXCLUDED.latency_ms_total;
+
+  UPDATE user_budgets AS b SET
+    used_credits = COALESCE(b.used_credits, 0) + t.cost,
+    remaining_credits = COALESCE(b.remaining_credits, 0) - t.cost,
+    updated_at = NOW()
+  FROM (
+    SELECT e->>'user_id' AS uid, SUM(COALESCE((e->>'cost')::numeric, 0)) AS cost
+    FROM jsonb_array_elements(entries) AS e
+    WHERE COALESCE(e->>'user_id', '') <> ''
+    GROUP BY 1
+  ) AS t
+  WHERE b.user_id::text = t.uid;
+
+  RETURN n;
+END;
+$$;
+COMMENT ON FUNCTION record_cost_batch(JSONB) IS 'V7.9: Ghi lô cost_ledger, cộng cost_usage_daily và user_budgets trong một lần gọi (không mất cập nhật khi nhiều phiên song song).';
+
+-- ------------------------------------------------------------------------------
+-- 4) RPC increment_user_credits
+-- ------------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION increment_user_credits(p_user_id TEXT, p_cost NUMERIC)
+RETURNS NUMERIC
+LANGUAGE sql
+AS $$
+  UPDATE user_budgets SET
+    used_credits = COALESCE(used_credits, 0) + p_cost,
+    remaining_credits = COALESCE(remaining_credits, 0) - p_cost,
+    updated_at = NOW()
+  WHERE user_id::text = p_user_id
+  RETURNING remaining_credits;
+$$;
+COMMENT ON FUNCTION increment_user_credits(TEXT, NUMERIC) IS 'V7.9: Cộng used_credits nguyên tử, trả về remaining_credits mới.';
@@ -0,0 +1,46 @@
+-- ==============================================================================
+-- V8.0 Migration: Backfill embedding theo lô
+-- - RPC set_embeddings_bulk(p_table, p_story_id, p_rows): ghi nhiều vector trong một lần gọi (thay update từng dòng)
+-- - Partial index (story_id, id) WHERE embedding IS NULL cho keyset pagination của backfill
+-- Chạy sau schema_v7.9_migration.sql.
+-- ==============================================================================
+
+-- ------------------------------------------------------------------------------
+-- 1) Index cho keyset pagination (order id, chỉ dòng chưa có embedding)
+-- ------------------------------------------------------------------------------
+CREATE INDEX IF NOT EXISTS idx_chunks_story_id_no_embedding ON chunks(story_id, id) WHERE embedding IS NULL;
+CREATE INDEX IF NOT EXISTS idx_story_bible_story_id_no_embedding ON story_bible(story_id, id) WHERE embedding IS NULL;
+
+-- ------------------------------------------------------------------------------
+-- 2) RPC set_embeddings_bulk
+-- p_rows: [{"id": "...", "embedding": [0.1, ...]}]. Chỉ ghi dòng thuộc p_story_id và còn embedding NULL.
+-- ------------------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION set_embeddings_bulk(p_table TEXT, p_story_id UUID, p_rows JSONB)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  n INT := 0;
+BEGIN
+  IF p_rows IS NULL OR jsonb_typeof(p_rows) <> 'array' OR jsonb_array_length(p_rows) = 0 THEN
+    RETURN 0;
+  END IF;
+
+  IF p_table = 'chunks' THEN
+    UPDATE chunks c SET embedding = (r->'embedding')::text::vector
+    FROM jsonb_array_elements(p_rows) r
+    WHERE c.story_id = p_story_id AND c.id::text = r->>'id' AND c.embedding IS NULL;
+    GET DIAGNOSTICS n = ROW_COUNT;
+  ELSIF p_table = 'story_bible' THEN
+    UPDATE story_bible b SET embedding = (r->'embedding')::text::vector
+    FROM jsonb_array_elements(p_rows) r
+    WHERE b.story_id = p_story_id AND b.id::text = r->>'id' AND b.embedding IS NULL;
+    GET DIAGNOSTICS n = ROW_COUNT;
+  ELSE
+    RAISE EXCEPTION 'set_embeddings_bulk: bảng không hỗ trợ %', p_table;
+  END IF;
+
+  RETURN n;
+END;
+$$;
+COMMENT ON FUNCTION set_embeddings_bulk(TEXT, UUID, JSONB) IS 'V8.0: Ghi lô embedding cho chunks / story_bible (backfill). Trả về số dòng đã cập nhật.';
@@ -0,0 +1,23 @@
+-- ==============================================================================
+-- V8.1 Migration: Soát logic tăng dần (chỉ soát lại chương có thay đổi)
+-- - chapter_logic_checks.content_hash: sha1 nội dung chương lúc soát
+-- - chapter_logic_checks.ref_hashes: {dimension: {row_id: hash}} các dòng tham chiếu (bible, relation, timeline, rule, chat) đã đưa vào prompt
+-- - Index (story_id, chapter_id, created_at) để lấy lần soát gần nhất của mỗi chương
+-- Chạy sau schema_v8.0_migration.sql.
+-- ==============================================================================
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'chapter_logic_checks' AND column_name = 'content_hash') THEN
+    ALTER TABLE chapter_logic_checks ADD COLUMN content_hash TEXT;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'chapter_logic_checks' AND column_name = 'ref_hashes') THEN
+    ALTER TABLE chapter_logic_checks ADD COLUMN ref_hashes JSONB;
+  END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_chapter_logic_checks_story_chapter_created
+  ON chapter_logic_checks(story_id, chapter_id, created_at DESC);
+
+COMMENT ON COLUMN chapter_logic_checks.content_hash IS 'V8.1: sha1 nội dung chương tại lần soát (so sánh để biết chương đã đổi).';
+COMMENT ON COLUMN chapter_logic_checks.ref_hashes IS 'V8.1: {dimension: {row_id: hash}} dòng tham chiếu dùng trong prompt; khác hiện tại -> chương cần soát lại.';
@@ -0,0 +1,21 @@
+-- ==============================================================================
+-- V8.2 Migration: Chỉ mục nhắc tên thực thể theo chương (entity -> chapter)
+-- - entity_chapter_mentions: mỗi (thực thể Bible, chương) có nhắc tên: số lần, vị trí đầu tiên, mật độ / 1000 ký tự
+-- - Reverse lookup lấy top chương theo mật độ trong một lần đọc (thay ilike entity_name + source_chapter)
+-- Chạy sau schema_v8.1_migration.sql.
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS entity_chapter_mentions (
+  entity_id UUID NOT NULL REFERENCES story_bible(id) ON DELETE CASCADE,
+  chapter_id BIGINT NOT NULL REFERENCES chapters(id) ON DELETE CASCADE,
+  story_id UUID NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+  chapter_number INT,
+  mention_count INT NOT NULL DEFAULT 0,
+  first_offset INT,
+  density REAL NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (entity_id, chapter_id)
+);
+CREATE INDEX IF NOT EXISTS idx_entity_chapter_mentions_lookup ON entity_chapter_mentions(story_id, entity_id, density DESC);
+CREATE INDEX IF NOT EXISTS idx_entity_chapter_mentions_chapter ON entity_chapter_mentions(chapter_id);
+COMMENT ON TABLE entity_chapter_mentions IS 'V8.2: Thực thể Bible được nhắc ở chương nào (quét nội dung chương, không phân biệt dấu). density = mention_count / 1000 ký tự.';
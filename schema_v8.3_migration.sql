@@ -0,0 +1,21 @@
+-- ==============================================================================
+-- V8.3 Migration: Cây tóm tắt chương phân cấp (map-reduce cho câu hỏi về khoảng chương dài)
+-- - chapter_summary_nodes: node_key 'L<cấp>:<chương đầu>' (khối 10 chương, 100 chương...) hoặc 'ARC:<arc_id>'
+-- - source_hash: hash tóm tắt các node con; con không đổi -> không tóm tắt lại
+-- Chạy sau schema_v8.2_migration.sql.
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS chapter_summary_nodes (
+  story_id UUID NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+  node_key TEXT NOT NULL,
+  level INT NOT NULL,
+  start_chapter INT,
+  end_chapter INT,
+  arc_id UUID REFERENCES arcs(id) ON DELETE CASCADE,
+  summary TEXT NOT NULL DEFAULT '',
+  source_hash TEXT,
+  updated_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (story_id, node_key)
+);
+CREATE INDEX IF NOT EXISTS idx_chapter_summary_nodes_level ON chapter_summary_nodes(story_id, level, start_chapter);
+COMMENT ON TABLE chapter_summary_nodes IS 'V8.3: Cây tóm tắt: level 1 = 10 chương, level L = 10 node cấp L-1, level 0 = arc. Dựng từ chapters.summary.';
@@ -0,0 +1,15 @@
+-- ==============================================================================
+-- V8.4 Migration: Độ dài nội dung chương (xem trước kế hoạch lô không cần đọc nội dung)
+-- - content_length(chapters): computed column PostgREST, select("chapter_number, content_length")
+-- - core.data_operation_jobs.preview_data_operation_plan ước tính số lần gọi / token từ độ dài này
+-- Chạy sau schema_v8.3_migration.sql.
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION content_length(chapters)
+RETURNS INT
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT char_length(btrim(COALESCE($1.content, '')));
+$$;
+COMMENT ON FUNCTION content_length(chapters) IS 'V8.4: Số ký tự nội dung chương (đã bỏ khoảng trắng hai đầu) cho xem trước kế hoạch lô.';
@@ -0,0 +1,163 @@
+# scripts/bench_ingestion.py - Đo peak memory + throughput của import file (load() ghép chuỗi vs load_segments streaming, Excel theo dòng)
+"""
+Chạy từ thư mục gốc repo:
+    python scripts/bench_ingestion.py --txt-mb 50 --csv-rows 200000 --xlsx-rows 100000
+    python scripts/bench_ingestion.py --pdf path/to/big.pdf
+    python scripts/bench_ingestion.py --txt-mb 0 --csv-rows 0 --xlsx-rows 0 --excel-chunk-rows 100000
+Fixture TXT / CSV / XLSX được sinh vào thư mục tạm; PDF lớn cần truyền file có sẵn.
+Peak memory đo bằng tracemalloc (bộ nhớ Python + numpy/pandas); PDF song song chạy ở process con nên chỉ đo được phía process chính.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chunk_tools import load_file_chunks, split_text_by_length_with_overlap  # noqa: E402
+from utils.file_importer import UniversalLoader, _excel_frame_to_chunks, _excel_frame_to_chunks_iterrows  # noqa: E402
+
+
+class _Upload(io.BytesIO):
+    """Giống st.file_uploader: BytesIO có .name."""
+
+    def __init__(self, raw: bytes, name: str):
+        super().__init__(raw)
+        self.name = name
+
+
+def _measure(label: str, size_bytes: int, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    mb = size_bytes / (1024 * 1024)
+    print(f"  {label:<22} {elapsed:8.2f}s  {mb / elapsed if elapsed else 0:8.1f} MB/s  peak {peak / (1024 * 1024):8.1f} MB  chunks={result}")
+
+
+def _bench_file(path: str, chunk_size: int, overlap: int) -> None:
+    with open(path, "rb") as f:
+        raw = f.read()
+    name = os.path.basename(path)
+    print(f"{name} ({len(raw) / (1024 * 1024):.1f} MB)")
+
+    def _joined():
+        text, err = UniversalLoader.load(_Upload(raw, name))
+        if err:
+            raise RuntimeError(err)
+        return len(split_text_by_length_with_overlap(text, chunk_size, overlap))
+
+    def _streaming():
+        chunks, err = load_file_chunks(_Upload(raw, name), chunk_size, overlap)
+        if err:
+            raise RuntimeError(err)
+        return len(chunks)
+
+    _measure("load() + split", len(raw), _joined)
+    _measure("load_segments stream", len(raw), _streaming)
+
+
+def _make_txt(folder: str, mb: int) -> str:
+    path = os.path.join(folder, "fixture.txt")
+    line = "Chương 1: Nhân vật chính bước vào thành phố, trời mưa rất to.   \n\n"
+    with open(path, "w", encoding="utf-8") as f:
+        written = 0
+        while written < mb * 1024 * 1024:
+            f.write(line)
+            written += len(line.encode("utf-8"))
+    return path
+
+
+def _make_csv(folder: str, rows: int) -> str:
+    path = os.path.join(folder, "fixture.csv")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("ma_hang,ten_hang,so_luong,don_gia,ghi_chu\n")
+        for i in range(rows):
+            f.write(f"SP{i:06d},Sản phẩm {i},{i % 97},{(i * 13) % 100000}.5,{'' if i % 3 else 'giao gấp'}\n")
+    return path
+
+
+def make_xlsx_fixture(folder: str, rows: int) -> str:
+    """XLSX 2 sheet (write_only để sinh nhanh); có ô trống để kiểm tra bỏ NaN."""
+    from openpyxl import Workbook
+    path = os.path.join(folder, "fixture.xlsx")
+    wb = Workbook(write_only=True)
+    for sheet in ("BaoGia", "DonHang"):
+        ws = wb.create_sheet(sheet)
+        ws.append(["ma_hang", "ten_hang", "so_luong", "don_gia", "ghi_chu"])
+        for i in range(rows // 2):
+            ws.append([f"SP{i:06d}", f"Sản phẩm {i}", i % 97, (i * 13) % 100000 + 0.5, None if i % 3 else "giao gấp"])
+    wb.save(path)
+    return path
+
+
+def _bench_excel_chunks(path: str) -> None:
+    """load_excel_as_chunks: iterrows cũ vs to_numpy + mặt nạ NaN; kiểm tra kết quả giống hệt (gồm source_metadata)."""
+    import pandas as pd
+    with open(path, "rb") as f:
+        raw = f.read()
+    name = os.path.basename(path)
+    frames = pd.read_excel(io.BytesIO(raw), sheet_name=None, header=None)
+    n_rows = sum(len(fr) for fr in frames.values())
+    print(f"{name} load_excel_as_chunks ({n_rows} dòng; chỉ tính phần dựng chunk, không tính đọc file)")
+    results = {}
+    for label, fn in (("iterrows", _excel_frame_to_chunks_iterrows), ("vectorized", _excel_frame_to_chunks)):
+        t0 = time.perf_counter()
+        out = []
+        for sheet_name, frame in frames.items():
+            out.extend(fn(frame, sheet_name, name))
+        elapsed = time.perf_counter() - t0
+        results[label] = out
+        print(f"  {label:<22} {elapsed:8.2f}s  {n_rows / elapsed if elapsed else 0:10.0f} dòng/s  chunks={len(out)}")
+    same = results["iterrows"] == results["vectorized"]
+    print(f"  kết quả giống hệt: {same}")
+    t0 = time.perf_counter()
+    chunks, err = UniversalLoader.load_excel_as_chunks(_Upload(raw, name))
+    print(f"  load_excel_as_chunks (đọc + dựng) {time.perf_counter() - t0:8.2f}s  chunks={len(chunks)} {err or ''}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--txt-mb", type=int, default=50)
+    parser.add_argument("--csv-rows", type=int, default=200000)
+    parser.add_argument("--xlsx-rows", type=int, default=100000)
+    parser.add_argument("--excel-chunk-rows", type=int, default=0, help="Sinh XLSX N dòng và so sánh load_excel_as_chunks")
+    parser.add_argument("--pdf", help="Đường dẫn PDF lớn (VD: web novel 1.500 trang)")
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--overlap", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        if args.txt_mb:
+            paths.append(_make_txt(folder, args.txt_mb))
+        if args.csv_rows:
+            paths.append(_make_csv(folder, args.csv_rows))
+        if args.xlsx_rows:
+            try:
+                paths.append(make_xlsx_fixture(folder, args.xlsx_rows))
+            except ImportError:
+                print("Bỏ qua XLSX: cần openpyxl")
+        if args.pdf:
+            paths.append(args.pdf)
+        for path in paths:
+            try:
+                _bench_file(path, args.chunk_size, args.overlap)
+            except Exception as e:
+                print(f"  lỗi: {e}")
+        if args.excel_chunk_rows:
+            try:
+                sub = os.path.join(folder, "excel_chunks")
+                os.makedirs(sub)
+                _bench_excel_chunks(make_xlsx_fixture(sub, args.excel_chunk_rows))
+            except ImportError:
+                print("Bỏ qua Excel chunks: cần pandas + openpyxl")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# scripts/bench_validation.py - Đo ValidationWorker trên file import lớn: gọi check_bible_integrity từng chunk (cũ) vs ValidationSession
+"""
+Chạy từ thư mục gốc repo:
+    python scripts/bench_validation.py --rows 10000 --bible 5000
+    python scripts/bench_validation.py --rows 10000 --bible 5000 --workers 4 --latency-ms 20
+Sinh sheet XLSX N dòng (cột thông số dạng "Material: X, Status: Y") + Bible giả M mục, đọc bằng load_excel_as_chunks.
+Supabase được thay bằng client trong bộ nhớ: đếm request (select story_bible / insert validation_logs),
+select cắt tối đa 1000 dòng như PostgREST (Bible lớn phải đọc theo trang .range()),
+--latency-ms cộng độ trễ mạng giả cho mỗi request. Đường cũ chỉ chạy trên --legacy-rows dòng đầu rồi ngoại suy
+(mỗi chunk tải lại Bible; log ghi một request mỗi chunk nên còn ít hơn bản cũ ghi từng dòng).
+Process pool (--workers) chỉ bật khi số chunk >= VALIDATION_POOL_MIN_CHUNKS.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import active_sentry  # noqa: E402
+from utils.active_sentry import ValidationSession, ValidationWorker  # noqa: E402
+from utils.file_importer import UniversalLoader  # noqa: E402
+
+MATERIALS = ["thép", "gỗ sồi", "nhôm", "vải bạt", "kính cường lực", "đồng", "nhựa pvc"]
+STATUSES = ["active", "draft", "archived", "đang giao", "tạm dừng"]
+# Giới hạn dòng mỗi select của PostgREST (mặc định max-rows = 1000).
+FAKE_MAX_ROWS = 1000
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, raw: bytes, name: str):
+        super().__init__(raw)
+        self.name = name
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table: str):
+        self.client, self.table, self.rows = client, table, None
+        self.offset, self.limit = 0, FAKE_MAX_ROWS
+
+    def select(self, *_args, **_kw):
+        return self
+
+    def eq(self, *_args, **_kw):
+        return self
+
+    def order(self, *_args, **_kw):
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset, self.limit = start, min(FAKE_MAX_ROWS, end - start + 1)
+        return self
+
+    def insert(self, rows):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def execute(self):
+        self.client.requests[self.table] = self.client.requests.get(self.table, 0) + 1
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        if self.rows is None:
+            data = self.client.bible if self.table == "story_bible" else []
+            return _Result(data[self.offset:self.offset + self.limit])
+        out = []
+        for r in self.rows:
+            self.client.next_id += 1
+            out.append({**r, "id": self.client.next_id})
+        self.client.inserted += len(out)
+        return _Result(out)
+
+
+class _FakeSupabase:
+    def __init__(self, bible, latency: float):
+        self.bible, self.latency = bible, latency
+        self.requests = {}
+        self.inserted = 0
+        self.next_id = 0
+
+    def table(self, name: str):
+        return _Query(self, name)
+
+
+def _make_bible(n: int):
+    bible = [{"entity_name": m, "description": "Vật liệu tiêu chuẩn dùng trong báo giá"} for m in MATERIALS[:5]]
+    bible += [{"entity_name": s, "description": "Trạng thái đơn"} for s in STATUSES[:3]]
+    for i in range(n - len(bible)):
+        bible.append({"entity_name": f"Sản phẩm {i}", "description": f"Mô tả sản phẩm số {i} gồm thông số kỹ thuật và ghi chú kho"})
+    return bible
+
+
+def _make_xlsx(folder: str, rows: int) -> str:
+    from openpyxl import Workbook
+    path = os.path.join(folder, "validation_fixture.xlsx")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Quotation")
+    ws.append(["ma_hang", "thong_so", "gia"])
+    for i in range(rows):
+        spec = "Name: Sản phẩm %d, Material: %s; Status: %s, Category: nhóm %d" % (
+            i * 7 % (rows + 500), MATERIALS[i % len(MATERIALS)], STATUSES[i % len(STATUSES)], i % 11)
+        ws.append([f"SP{i:06d}", spec, f"Price: {(i * 13) % 1000}.5"])
+    wb.save(path)
+    return path
+
+
+def _run(label: str, client: _FakeSupabase, rows: int, fn) -> float:
+    active_sentry._supabase = lambda: client
+    t0 = time.perf_counter()
+    conflicts = fn()
+    elapsed = time.perf_counter() - t0
+    reqs = ", ".join(f"{k}={v}" for k, v in sorted(client.requests.items()))
+    print(f"  {label:<28} {elapsed:8.2f}s  {rows / elapsed if elapsed else 0:10.0f} dòng/s  conflicts={len(conflicts)}  requests: {reqs}")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--bible", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="> 1: quét chunk bằng process pool")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Độ trễ giả cho mỗi request Supabase")
+    parser.add_argument("--legacy-rows", type=int, default=1000, help="Số dòng chạy đường cũ (0 = bỏ qua)")
+    args = parser.parse_args()
+
+    bible = _make_bible(args.bible)
+    latency = args.latency_ms / 1000.0
+    with tempfile.TemporaryDirectory() as folder:
+        path = _make_xlsx(folder, args.rows)
+        with open(path, "rb") as f:
+            raw = f.read()
+    chunks, err = UniversalLoader.load_excel_as_chunks(_Upload(raw, "validation_fixture.xlsx"))
+    if err:
+        print(f"lỗi đọc XLSX: {err}")
+        return
+    print(f"{len(chunks)} chunk, Bible {len(bible)} mục, latency {args.latency_ms:.0f} ms/request")
+
+    if args.legacy_rows:
+        part = chunks[:args.legacy_rows]
+
+        def _legacy():
+            out = []
+            for c in part:
+                out.extend(ValidationWorker.check_bible_integrity("bench", c.get("content", ""), c.get("meta_json")))
+            out.extend(ValidationWorker.check_cross_sheet("bench", part))
+            return out
+
+        elapsed = _run(f"từng chunk ({len(part)} dòng)", _FakeSupabase(bible, latency), len(part), _legacy)
+        print(f"  -> ngoại suy {len(chunks)} dòng: ~{elapsed * len(chunks) / max(1, len(part)):.1f}s")
+
+    _run("ValidationSession", _FakeSupabase(bible, latency), len(chunks),
+         lambda: ValidationSession("bench").run(chunks))
+    if args.workers > 1:
+        _run(f"ValidationSession x{args.workers}", _FakeSupabase(bible, latency), len(chunks),
+             lambda: ValidationSession("bench").run(chunks, workers=args.workers))
+
+
+if __name__ == "__main__":
+    main()
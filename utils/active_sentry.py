@@ -4,10 +4,23 @@ Proactive conflict detection: Bible integrity, cross-sheet logic.
 On upload/import: validate and log to validation_logs. User can Force Sync with Bible or Keep Exception.
 """
 import json
-from typing import Any, Dict, List, Optional, Tuple
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 from config import init_services
 
+# "Key: Value" in chunk content; only these keys are checked against the Bible.
+_INTEGRITY_PATTERN = re.compile(r"(?i)(\w+)\s*:\s*([^\n,;]+)")
+_INTEGRITY_KEYS = frozenset(("material", "status", "type", "category", "name"))
+# Rows per validation_logs insert request.
+VALIDATION_LOG_BATCH = 500
+# Page size for story_bible reads (PostgREST caps a select at 1000 rows by default).
+BIBLE_PAGE = 1000
+# Below this many chunks a process pool costs more (spawn + pickling the term set) than it saves:
+# scanning 10k rows in-process takes ~0.3s (scripts/bench_validation.py).
+VALIDATION_POOL_MIN_CHUNKS = 50000
+VALIDATION_POOL_BATCH = 500
+
 
 def _supabase():
     s = init_services()
@@ -15,44 +28,110 @@ def _supabase():
 
 
 def _get_bible_entities(story_id: str) -> List[Dict[str, Any]]:
-    """Fetch bible entities (entity_name, description) for project."""
+    """Fetch bible entities (entity_name, description) for project, paging past the row cap."""
     supabase = _supabase()
     if not supabase or not story_id:
         return []
+    out: List[Dict[str, Any]] = []
+    offset = 0
     try:
-        r = supabase.table("story_bible").select("entity_name, description").eq("story_id", story_id).execute()
-        return list(r.data) if r.data else []
-    except Exception:
-        return []
+        while True:
+            r = supabase.table("story_bible").select("entity_name, description").eq("story_id", story_id).order(
+                "id"
+            ).range(offset, offset + BIBLE_PAGE - 1).execute()
+            rows = r.data or []
+            out.extend(rows)
+            if len(rows) < BIBLE_PAGE:
+                return out
+            offset += BIBLE_PAGE
+    except Exception as e:
+        print(f"_get_bible_entities error: {e}")
+        return out
+
+
+def _bible_known_terms(bible: Iterable[Dict[str, Any]]) -> FrozenSet[str]:
+    """Known terms from Bible: entity_name and the first 20 words (> 2 chars) of each description, lowercased."""
+    known = set()
+    for b in bible or []:
+        name = (b.get("entity_name") or "").strip()
+        if name:
+            known.add(name.lower())
+        desc = (b.get("description") or "").strip()
+        for w in desc.split()[:20]:
+            if len(w) > 2:
+                known.add(w.lower())
+    return frozenset(known)
+
+
+def _scan_integrity(content: str, known: FrozenSet[str]) -> List[Tuple[str, str]]:
+    """(key, value) pairs in content whose key is checked and whose value is not a known Bible term."""
+    out = []
+    for m in _INTEGRITY_PATTERN.finditer(content or ""):
+        key = m.group(1).strip()
+        if key.lower() not in _INTEGRITY_KEYS:
+            continue
+        val = m.group(2).strip()
+        if not val or len(val) < 2:
+            continue
+        if val.lower() not in known:
+            out.append((key, val))
+    return out
+
+
+_pool_known: FrozenSet[str] = frozenset()
 
 
-def _log_conflict(
+def _pool_init(known: FrozenSet[str]) -> None:
+    global _pool_known
+    _pool_known = known
+
+
+def _pool_scan(contents: List[str]) -> List[List[Tuple[str, str]]]:
+    return [_scan_integrity(c, _pool_known) for c in contents]
+
+
+def _log_conflicts_bulk(
     story_id: str,
     arc_id: Optional[str],
-    log_type: str,
-    message: str,
-    details: Optional[Dict[str, Any]] = None,
-) -> Optional[int]:
-    """Insert into validation_logs. Returns id or None."""
+    rows: List[Tuple[str, str, Dict[str, Any]]],
+) -> List[Optional[int]]:
+    """
+    Insert (log_type, message, details) rows into validation_logs in batches. Returns ids aligned with rows (None if failed).
+    A failed batch insert is retried row by row so one bad row does not drop the rest of its batch.
+    """
+    ids: List[Optional[int]] = [None] * len(rows)
     supabase = _supabase()
-    if not supabase:
-        return None
-    try:
-        payload = {
-            "story_id": story_id,
-            "log_type": log_type,
-            "message": message,
-            "details": details or {},
-            "status": "pending",
-        }
-        if arc_id:
-            payload["arc_id"] = arc_id
-        r = supabase.table("validation_logs").insert(payload).execute()
-        if r.data and len(r.data) > 0:
-            return r.data[0].get("id")
-    except Exception:
-        pass
-    return None
+    if not supabase or not rows:
+        return ids
+    for start in range(0, len(rows), VALIDATION_LOG_BATCH):
+        batch = rows[start:start + VALIDATION_LOG_BATCH]
+        payloads = []
+        for log_type, message, details in batch:
+            payload = {
+                "story_id": story_id,
+                "log_type": log_type,
+                "message": message,
+                "details": details or {},
+                "status": "pending",
+            }
+            if arc_id:
+                payload["arc_id"] = arc_id
+            payloads.append(payload)
+        try:
+            r = supabase.table("validation_logs").insert(payloads).execute()
+            for i, row in enumerate((r.data or [])[:len(batch)]):
+                ids[start + i] = row.get("id")
+            continue
+        except Exception as e:
+            print(f"_log_conflicts_bulk batch error, retrying per row: {e}")
+        for i, payload in enumerate(payloads):
+            try:
+                r = supabase.table("validation_logs").insert(payload).execute()
+                if r.data:
+                    ids[start + i] = r.data[0].get("id")
+            except Exception as e:
+                print(f"_log_conflicts_bulk row error: {e}")
+    return ids
 
 
 class ValidationWorker:
@@ -74,38 +153,9 @@ class ValidationWorker:
         Compare X, Y to bible entity names/descriptions. If no match, log conflict.
         Returns list of {log_id, message, details} for conflicts found.
         """
-        import re
-        bible = _get_bible_entities(story_id)
-        if not bible:
-            return []
-        conflicts = []
-        # Build set of known terms from Bible (entity_name and first words of description)
-        known = set()
-        for b in bible:
-            name = (b.get("entity_name") or "").strip()
-            if name:
-                known.add(name.lower())
-            desc = (b.get("description") or "").strip()
-            for w in desc.split()[:20]:
-                if len(w) > 2:
-                    known.add(w.lower())
-        # Simple pattern: "Key: Value" in content
-        for m in re.finditer(r"(?i)(\w+)\s*:\s*([^\n,;]+)", chunk_content):
-            key, val = m.group(1).strip(), m.group(2).strip()
-            if not val or len(val) < 2:
-                continue
-            val_lower = val.lower()
-            if val_lower not in known and key.lower() in ("material", "status", "type", "category", "name"):
-                log_id = _log_conflict(
-                    story_id,
-                    arc_id,
-                    "bible_integrity",
-                    "Value '%s' (from %s) not found in Bible definitions." % (val, key),
-                    {"key": key, "value": val, "chunk_meta": chunk_meta},
-                )
-                if log_id:
-                    conflicts.append({"log_id": log_id, "message": "Bible integrity: %s = %s" % (key, val), "details": {"key": key, "value": val}})
-        return conflicts
+        session = ValidationSession(story_id, arc_id)
+        session.check_chunk(chunk_content, chunk_meta)
+        return session.flush()
 
     @staticmethod
     def check_cross_sheet(
@@ -118,65 +168,147 @@ class ValidationWorker:
         compare Price (or similar) columns. If mismatch, log.
         Returns list of conflicts.
         """
-        orders = []
-        quotations = []
-        for c in chunks:
-            meta = c.get("meta_json") or {}
-            sm = meta.get("source_metadata", meta) if isinstance(meta, dict) else {}
-            sheet = (sm.get("sheet_name") or "").lower()
-            content = (c.get("content") or c.get("raw_content") or "").lower()
-            if "order" in sheet or "order" in content[:200]:
-                orders.append(c)
-            if "quotation" in sheet or "quote" in sheet or "quotation" in content[:200]:
-                quotations.append(c)
-        conflicts = []
-        if not orders or not quotations:
-            return conflicts
-        import re
-        def extract_prices(text):
-            out = []
-            for m in re.finditer(r"(?i)price\s*:\s*([0-9.,]+)", text):
-                out.append(m.group(1).replace(",", ""))
-            for m in re.finditer(r"(?i)([0-9.,]+)\s*(?:vnd|usd|usd)", text):
-                out.append(m.group(1).replace(",", ""))
-            return out
-        order_prices = set()
-        for o in orders:
-            order_prices.update(extract_prices(o.get("content", "") + " " + o.get("raw_content", "")))
-        for q in quotations:
-            qp = extract_prices(q.get("content", "") + " " + q.get("raw_content", ""))
-            for p in qp:
-                if p and order_prices and p not in order_prices:
-                    log_id = _log_conflict(
-                        story_id,
-                        arc_id,
-                        "cross_sheet",
-                        "Price %s in Quotation not found in Order list." % p,
-                        {"price": p, "order_prices": list(order_prices)[:10]},
-                    )
-                    if log_id:
-                        conflicts.append({"log_id": log_id, "message": "Cross-sheet price mismatch: %s" % p, "details": {"price": p}})
-        return conflicts
+        session = ValidationSession(story_id, arc_id, bible=[])
+        session.check_cross_sheet(chunks)
+        return session.flush()
 
     @staticmethod
     def run_on_chunks(
         story_id: str,
         chunks: List[Dict[str, Any]],
         arc_id: Optional[str] = None,
+        workers: int = 0,
     ) -> List[Dict[str, Any]]:
-        """Run Bible integrity on each chunk and cross-sheet on full set. Return all conflicts."""
-        all_conflicts = []
-        for c in chunks:
-            all_conflicts.extend(
-                ValidationWorker.check_bible_integrity(
-                    story_id,
-                    c.get("content", "") or c.get("raw_content", ""),
-                    c.get("meta_json"),
-                    arc_id,
-                )
-            )
-        all_conflicts.extend(ValidationWorker.check_cross_sheet(story_id, chunks, arc_id))
-        return all_conflicts
+        """Run Bible integrity on each chunk and cross-sheet on full set (one Bible fetch, bulk log writes). Return all conflicts."""
+        return ValidationSession(story_id, arc_id).run(chunks, workers=workers)
+
+
+def _cross_sheet_findings(chunks: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+    """(Quotation prices missing from Order chunks, one per occurrence; up to 10 order prices for details)."""
+    orders = []
+    quotations = []
+    for c in chunks:
+        meta = c.get("meta_json") or {}
+        sm = meta.get("source_metadata", meta) if isinstance(meta, dict) else {}
+        sheet = (sm.get("sheet_name") or "").lower()
+        content = (c.get("content") or c.get("raw_content") or "").lower()
+        if "order" in sheet or "order" in content[:200]:
+            orders.append(c)
+        if "quotation" in sheet or "quote" in sheet or "quotation" in content[:200]:
+            quotations.append(c)
+    if not orders or not quotations:
+        return [], []
+
+    def extract_prices(text):
+        out = []
+        for m in re.finditer(r"(?i)price\s*:\s*([0-9.,]+)", text):
+            out.append(m.group(1).replace(",", ""))
+        for m in re.finditer(r"(?i)([0-9.,]+)\s*(?:vnd|usd|usd)", text):
+            out.append(m.group(1).replace(",", ""))
+        return out
+
+    order_prices = set()
+    for o in orders:
+        order_prices.update(extract_prices(o.get("content", "") + " " + o.get("raw_content", "")))
+    missing = []
+    for q in quotations:
+        for p in extract_prices(q.get("content", "") + " " + q.get("raw_content", "")):
+            if p and order_prices and p not in order_prices:
+                missing.append(p)
+    return missing, list(order_prices)[:10]
+
+
+class ValidationSession:
+    """
+    One validation run (e.g. one file import) against a Bible snapshot.
+    The Bible is fetched and its term set built once; chunks are scanned with precompiled patterns
+    (optionally in a process pool); conflicts are collected and written to validation_logs in bulk by flush().
+
+        session = ValidationSession(story_id, arc_id)
+        conflicts = session.run(chunks)          # scan + cross-sheet + flush
+    """
+
+    def __init__(self, story_id: str, arc_id: Optional[str] = None, bible: Optional[List[Dict[str, Any]]] = None):
+        self.story_id = story_id
+        self.arc_id = arc_id
+        self.known = _bible_known_terms(_get_bible_entities(story_id) if bible is None else bible)
+        # (log_type, message, details, summary message, summary details)
+        self._pending: List[Tuple[str, str, Dict[str, Any], str, Dict[str, Any]]] = []
+
+    def _add_integrity(self, findings: List[Tuple[str, str]], chunk_meta: Optional[Dict]) -> None:
+        for key, val in findings:
+            self._pending.append((
+                "bible_integrity",
+                "Value '%s' (from %s) not found in Bible definitions." % (val, key),
+                {"key": key, "value": val, "chunk_meta": chunk_meta},
+                "Bible integrity: %s = %s" % (key, val),
+                {"key": key, "value": val},
+            ))
+
+    def check_chunk(self, chunk_content: str, chunk_meta: Optional[Dict] = None) -> int:
+        """Scan one chunk; queue its conflicts. Returns number queued. No-op when the Bible is empty."""
+        if not self.known:
+            return 0
+        findings = _scan_integrity(chunk_content, self.known)
+        self._add_integrity(findings, chunk_meta)
+        return len(findings)
+
+    def check_chunks(self, chunks: List[Dict[str, Any]], workers: int = 0) -> int:
+        """
+        Scan many chunks. workers > 1 and at least VALIDATION_POOL_MIN_CHUNKS chunks -> ProcessPoolExecutor
+        (term set sent once per worker). Results keep chunk order. Returns number queued.
+        """
+        if not self.known or not chunks:
+            return 0
+        contents = [c.get("content", "") or c.get("raw_content", "") for c in chunks]
+        results: Optional[List[List[Tuple[str, str]]]] = None
+        if workers and workers > 1 and len(chunks) >= VALIDATION_POOL_MIN_CHUNKS:
+            try:
+                from concurrent.futures import ProcessPoolExecutor
+                batches = [contents[i:i + VALIDATION_POOL_BATCH] for i in range(0, len(contents), VALIDATION_POOL_BATCH)]
+                with ProcessPoolExecutor(max_workers=workers, initializer=_pool_init, initargs=(self.known,)) as pool:
+                    results = [r for part in pool.map(_pool_scan, batches) for r in part]
+            except Exception as e:
+                print(f"ValidationSession process pool error, scanning in-process: {e}")
+                results = None
+        if results is None:
+            results = [_scan_integrity(c, self.known) for c in contents]
+        before = len(self._pending)
+        for chunk, findings in zip(chunks, results):
+            if findings:
+                self._add_integrity(findings, chunk.get("meta_json"))
+        return len(self._pending) - before
+
+    def check_cross_sheet(self, chunks: List[Dict[str, Any]]) -> int:
+        """Queue Quotation prices missing from the Order list. Returns number queued."""
+        missing, order_prices = _cross_sheet_findings(chunks)
+        for p in missing:
+            self._pending.append((
+                "cross_sheet",
+                "Price %s in Quotation not found in Order list." % p,
+                {"price": p, "order_prices": order_prices},
+                "Cross-sheet price mismatch: %s" % p,
+                {"price": p},
+            ))
+        return len(missing)
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """Bulk-insert queued conflicts. Returns {log_id, message, details} for rows that were stored."""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return []
+        ids = _log_conflicts_bulk(self.story_id, self.arc_id, [(t, m, d) for t, m, d, _, _ in pending])
+        return [
+            {"log_id": log_id, "message": summary, "details": summary_details}
+            for log_id, (_, _, _, summary, summary_details) in zip(ids, pending)
+            if log_id
+        ]
+
+    def run(self, chunks: List[Dict[str, Any]], workers: int = 0) -> List[Dict[str, Any]]:
+        """Bible integrity on each chunk + cross-sheet on the full set, then one bulk write."""
+        self.check_chunks(chunks, workers=workers)
+        self.check_cross_sheet(chunks)
+        return self.flush()
 
 
 def get_pending_conflicts(story_id: str, arc_id: Optional[str] = None) -> List[Dict[str, Any]]:
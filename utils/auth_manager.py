@@ -197,6 +197,12 @@ def approve_pending_change(pending_id: str) -> bool:
             supabase.table("chapters").upsert(
                 payload, on_conflict="story_id,chapter_number"
             ).execute()
+            if payload.get("chapter_number") is not None:
+                from core.mention_index import schedule_chapter_mentions
+                schedule_chapter_mentions(story_id, [payload["chapter_number"]])
+                if payload.get("summary"):
+                    from core.summary_tree import schedule_summary_refresh
+                    schedule_summary_refresh(story_id, [payload["chapter_number"]])
         elif table_name == "story_bible":
             if target_key.get("id"):
                 # update existing
@@ -204,10 +210,15 @@ def approve_pending_change(pending_id: str) -> bool:
                 supabase.table("story_bible").update(upd).eq(
                     "id", target_key["id"]
                 ).execute()
+                if "entity_name" in upd:
+                    from core.mention_index import schedule_entity_mentions
+                    schedule_entity_mentions(story_id, [target_key["id"]])
             else:
                 # insert new
                 insert_data = {**new_data, "story_id": story_id}
-                supabase.table("story_bible").insert(insert_data).execute()
+                ins = supabase.table("story_bible").insert(insert_data).execute()
+                from core.mention_index import schedule_entity_mentions
+                schedule_entity_mentions(story_id, [r.get("id") for r in (ins.data or [])])
         else:
             pass
 
@@ -75,9 +75,23 @@ def get_chapter_content_cached(project_id: str, chapter_number: int, update_trig
         return None
 
 
-def invalidate_cache():
-    """Sau khi xóa/ghi DB: chỉ tăng update_trigger (lần chạy sau sẽ cache miss). Không clear cache, không rerun. User bấm Refresh nếu muốn xem ngay."""
+def invalidate_cache(data_changed: bool = True):
+    """Sau khi xóa/ghi DB: chỉ tăng update_trigger (lần chạy sau sẽ cache miss). Không clear cache, không rerun. User bấm Refresh nếu muốn xem ngay.
+    data_changed=False (VD: chỉ cập nhật budget): không tăng data version của router cache."""
     st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
+    if not data_changed:
+        return
+    try:
+        from ai.router_cache import bump_data_version
+        bump_data_version(st.session_state.get("project_id"))
+    except Exception:
+        pass
+    try:
+        # Ghi chung (xóa / đổi chương...) có thể đổi chapter_number / arc của sự kiện: nạp lại chỉ mục timeline.
+        from core.timeline_index import invalidate_timeline_index
+        invalidate_timeline_index(st.session_state.get("project_id"))
+    except Exception:
+        pass
 
 
 def invalidate_cache_and_rerun():
@@ -89,6 +103,13 @@ def full_refresh():
     """Xóa toàn bộ cache và rerun app. Chỉ gọi từ nút Refresh (sidebar)."""
     st.cache_data.clear()
     st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
+    try:
+        from ai.router_cache import router_cache
+        from ai.answer_cache import answer_cache
+        router_cache.clear()
+        answer_cache.invalidate_project(st.session_state.get("project_id"))
+    except Exception:
+        pass
     st.rerun()
 
 
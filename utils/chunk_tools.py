@@ -1,6 +1,6 @@
 # utils/chunk_tools.py - Công cụ chunk (tách văn bản / Excel theo dòng) dùng chung cho Workstation và Chunking
 """Logic chunk: tách theo ngữ nghĩa (như Workstation) và Excel theo dòng. Dùng lại từ Workstation."""
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 
 # Re-export và wrapper cho workflow chunk thống nhất
 
@@ -9,16 +9,17 @@ def split_text_to_chunks(
     text: str,
     file_type: str = "story",
     context_hint: str = "",
+    project_id: Optional[str] = None,
 ) -> List[Dict[str, Any]]:
     """
     Tách văn bản thành các chunk (cùng logic Workstation).
-    Dùng analyze_split_strategy + execute_split_logic từ ai_engine.
+    Dùng analyze_split_strategy (heuristic, LLM khi không chắc; cache theo project) + execute_split_logic từ ai_engine.
     Returns: list of {"title": str, "content": str, "order": int}.
     """
     if not text or not str(text).strip():
         return []
     from ai_engine import analyze_split_strategy, execute_split_logic
-    strategy = analyze_split_strategy(text, file_type=file_type, context_hint=context_hint)
+    strategy = analyze_split_strategy(text, file_type=file_type, context_hint=context_hint, project_id=project_id)
     chunks = execute_split_logic(
         text,
         strategy.get("split_type", "by_length"),
@@ -56,6 +57,98 @@ def split_text_by_length_with_overlap(
     return parts
 
 
+def iter_chunks_from_segments(
+    segments: Iterable[str],
+    chunk_size: int = 2000,
+    overlap: int = 200,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming split_text_by_length_with_overlap: nhận các đoạn từ UniversalLoader.load_segments,
+    chỉ giữ buffer ~chunk_size + overlap ký tự. Kết quả giống hệt split_text_by_length_with_overlap("\n".join(segments)).
+    Yields {"title": str, "content": str, "order": int}.
+    """
+    buf = ""
+    base = 0  # vị trí tuyệt đối của buf[0] trong text ghép
+    start = 0
+    idx = 1
+    first = True
+    exhausted = False
+    seg_iter = iter(segments)
+    while True:
+        # Cần biết text[start:start+chunk_size] và còn dữ liệu sau đó hay không.
+        while not exhausted and base + len(buf) <= start + chunk_size:
+            seg = next(seg_iter, None)
+            if seg is None:
+                exhausted = True
+            else:
+                buf += seg if first else "\n" + seg
+                first = False
+        total_known = base + len(buf)
+        if start >= total_known:
+            return
+        end = min(start + chunk_size, total_known)
+        part = buf[start - base:end - base]
+        ctx_start = max(0, start - overlap)
+        context_prefix = buf[ctx_start - base:start - base] if ctx_start < start else ""
+        full_content = (context_prefix + "\n\n[---]\n\n" + part).strip() if context_prefix else part.strip()
+        if full_content:
+            yield {"title": f"Đoạn {idx}", "content": full_content, "order": idx}
+            idx += 1
+        start = end - overlap if end < total_known else total_known
+        # Bỏ phần buffer không còn cần (trước start - overlap); chỉ cắt khi phần thừa đủ lớn để tránh copy mỗi chunk.
+        keep_from = max(base, start - overlap)
+        if keep_from - base > len(buf) // 2:
+            buf = buf[keep_from - base:]
+            base = keep_from
+
+
+def load_file_chunks(
+    file,
+    chunk_size: int = 2000,
+    overlap: int = 200,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Đọc file theo luồng (trang / sheet / khối dòng) và cắt theo độ dài có overlap, không dựng chuỗi toàn file.
+    Returns (list of {"title", "content", "order"}, error_message).
+    """
+    from utils.file_importer import UniversalLoader
+    segments, err = UniversalLoader.load_segments(file)
+    if err:
+        return [], err
+    try:
+        return list(iter_chunks_from_segments(segments, chunk_size, overlap)), None
+    except Exception as e:
+        return [], f"File lỗi hoặc không đọc được: {str(e)}"
+
+
+def load_file_text(file, max_chars: Optional[int] = None) -> Tuple[str, bool, Optional[str]]:
+    """
+    Đọc file theo luồng và ghép tối đa max_chars ký tự (None = toàn bộ, giống UniversalLoader.load).
+    Dừng đọc ngay khi đủ max_chars nên file lớn không bị dựng thành một chuỗi toàn file.
+    Returns (text, truncated, error_message); truncated=True nếu file còn nội dung sau max_chars.
+    """
+    from utils.file_importer import UniversalLoader
+    segments, err = UniversalLoader.load_segments(file)
+    if err:
+        return "", False, err
+    parts: List[str] = []
+    size = 0
+    truncated = False
+    try:
+        for seg in segments:
+            if max_chars is not None and size >= max_chars:
+                truncated = True
+                break
+            parts.append(seg)
+            size += len(seg) + (1 if len(parts) > 1 else 0)
+        text = "\n".join(parts)
+    except Exception as e:
+        return "", False, f"File lỗi hoặc không đọc được: {str(e)}"
+    if max_chars is not None and len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    return text, truncated, None
+
+
 def load_excel_as_chunks(file) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     """
     Excel theo dòng: mỗi dòng = 1 chunk (metadata sheet_name, row_index, source_file).
@@ -65,7 +158,7 @@ def load_excel_as_chunks(file) -> Tuple[List[Dict[str, Any]], Optional[str]]:
     return UniversalLoader.load_excel_as_chunks(file)
 
 
-def load_docx_text(file) -> Tuple[str, Optional[str]]:
-    """Đọc file Word thành text (để sau đó dùng split_text_to_chunks)."""
-    from utils.file_importer import UniversalLoader
-    return UniversalLoader.load(file)
+def load_docx_text(file, max_chars: Optional[int] = None) -> Tuple[str, Optional[str]]:
+    """Đọc file Word thành text (để sau đó dùng split_text_to_chunks); max_chars: chỉ đọc tới số ký tự này."""
+    text, _, err = load_file_text(file, max_chars)
+    return text, err
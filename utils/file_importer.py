@@ -1,8 +1,15 @@
-# utils/file_importer.py - Universal file loader + V6 Excel row-by-row (Messy Data Parser)
-from typing import Tuple, Optional, List, Dict, Any
+# utils/file_importer.py - Universal file loader (streaming theo trang / sheet / khối dòng) + V6 Excel row-by-row (Messy Data Parser)
+from typing import Tuple, Optional, List, Dict, Any, Iterator
 
 # Optional deps: import inside methods to avoid hard fail if not installed
 
+# Streaming: số dòng mỗi khối (CSV/Excel/DOCX), số byte mỗi lần đọc TXT, số trang PDF mỗi task, ngưỡng trang để dùng process pool.
+LOADER_ROW_BLOCK = 2000
+TEXT_READ_BYTES = 1 << 20
+PDF_PAGES_PER_TASK = 16
+PDF_PARALLEL_MIN_PAGES = 64
+PDF_MAX_WORKERS = 4
+
 
 def _clean_text(text: str) -> str:
     """Làm sạch whitespace thừa (giữ xuống dòng hợp lý)."""
@@ -12,6 +19,63 @@ def _clean_text(text: str) -> str:
     return "\n".join(line for line in lines if line).strip()
 
 
+def _clean_segments(segments) -> Iterator[str]:
+    """_clean_text từng đoạn, bỏ đoạn rỗng: "\n".join(kết quả) == _clean_text("\n".join(segments))."""
+    for seg in segments:
+        cleaned = _clean_text(seg)
+        if cleaned:
+            yield cleaned
+
+
+# --- PDF song song: mỗi process mở PDF 1 lần (initializer), trích text theo dải trang ---
+_PDF_WORKER_READER = None
+
+
+def _pdf_worker_init(raw: bytes) -> None:
+    global _PDF_WORKER_READER
+    from io import BytesIO
+    from pypdf import PdfReader
+    _PDF_WORKER_READER = PdfReader(BytesIO(raw))
+
+
+def _pdf_extract_range(start: int, end: int) -> str:
+    parts = []
+    for i in range(start, end):
+        t = _PDF_WORKER_READER.pages[i].extract_text()
+        if t:
+            parts.append(t)
+    return "\n".join(parts)
+
+
+def _iter_pdf_parallel(file, n_pages: int) -> Iterator[str]:
+    """Trích text PDF bằng process pool, yield theo đúng thứ tự trang; chỉ giữ tối đa 2 × workers dải trang đang chờ."""
+    import multiprocessing
+    import os
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    file.seek(0)
+    raw = file.read()
+    workers = max(1, min(PDF_MAX_WORKERS, os.cpu_count() or 1))
+    ranges = [(s, min(s + PDF_PAGES_PER_TASK, n_pages)) for s in range(0, n_pages, PDF_PAGES_PER_TASK)]
+    # spawn: không fork process Streamlit đang chạy nhiều thread.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_pdf_worker_init, initargs=(raw,)) as pool:
+        del raw
+        window: deque = deque()
+        it = iter(ranges)
+        for rng in it:
+            window.append(pool.submit(_pdf_extract_range, *rng))
+            if len(window) >= workers * 2:
+                break
+        while window:
+            text = window.popleft().result()
+            nxt = next(it, None)
+            if nxt is not None:
+                window.append(pool.submit(_pdf_extract_range, *nxt))
+            if text:
+                yield text
+
 class UniversalLoader:
     """Đọc file dữ liệu (PDF, TXT, DOCX, CSV, XLS, XLSX, MD) và chuyển thành text content."""
 
@@ -22,123 +86,159 @@ class UniversalLoader:
         """
         Input: file object (từ st.file_uploader).
         Output: (text đã làm sạch, None) hoặc ("", "thông báo lỗi thân thiện").
+        Ghép các đoạn từ load_segments (không còn bản to_string / bản copy toàn file trung gian).
+        """
+        segments, err = cls.load_segments(file)
+        if err:
+            return "", err
+        try:
+            return "\n".join(segments), None
+        except Exception as e:
+            return "", f"File lỗi hoặc không đọc được: {str(e)}"
+
+    @classmethod
+    def load_segments(cls, file) -> Tuple[Iterator[str], Optional[str]]:
+        """
+        Streaming: (iterator các đoạn text đã làm sạch, None) hoặc (iter([]), "thông báo lỗi").
+        Đoạn = 1 khối trang PDF / 1 khối dòng của sheet hoặc CSV / 1 khối đoạn văn DOCX / 1 khối dòng TXT.
+        Đọc thẳng từ file object (không file.read() toàn bộ). "\n".join(segments) == nội dung load().
+        Lỗi định dạng / thiếu thư viện được báo ngay; lỗi giữa chừng raise khi lặp.
         """
         if file is None:
-            return "", "Không có file được chọn."
+            return iter([]), "Không có file được chọn."
 
         name = getattr(file, "name", "") or ""
         ext = "." + name.rsplit(".", 1)[-1].lower() if "." in name else ""
 
         if ext not in cls.SUPPORTED_EXTENSIONS:
-            return "", f"Định dạng chưa hỗ trợ. Dùng: {', '.join(cls.SUPPORTED_EXTENSIONS)}"
+            return iter([]), f"Định dạng chưa hỗ trợ. Dùng: {', '.join(cls.SUPPORTED_EXTENSIONS)}"
 
         try:
             file.seek(0)
-            raw = file.read()
         except Exception as e:
-            return "", f"Không đọc được file: {str(e)}"
+            return iter([]), f"Không đọc được file: {str(e)}"
 
         if ext in (".txt", ".md"):
-            return cls._load_text(raw), None
+            return _clean_segments(cls._iter_text(file)), None
         if ext == ".docx":
-            return cls._load_docx(raw, name)
+            return cls._open_docx(file)
         if ext == ".pdf":
-            return cls._load_pdf(raw, name)
+            return cls._open_pdf(file)
         if ext in (".xlsx", ".xls"):
-            return cls._load_xlsx(raw, name)
+            return cls._open_xlsx(file)
         if ext == ".csv":
-            return cls._load_csv(raw, name)
+            return cls._open_csv(file)
 
-        return "", "Định dạng file chưa được xử lý."
+        return iter([]), "Định dạng file chưa được xử lý."
 
     @classmethod
-    def _load_text(cls, raw: bytes) -> str:
-        try:
-            text = raw.decode("utf-8")
-        except UnicodeDecodeError:
-            try:
-                text = raw.decode("utf-8", errors="replace")
-            except Exception:
-                return ""
-        return _clean_text(text)
+    def _iter_text(cls, file) -> Iterator[str]:
+        # Đọc theo khối byte, cắt ở b"\n" cuối khối: an toàn với UTF-8 (0x0A không nằm trong ký tự nhiều byte).
+        tail = b""
+        while True:
+            block = file.read(TEXT_READ_BYTES)
+            if not block:
+                break
+            block = tail + block
+            cut = block.rfind(b"\n")
+            if cut < 0:
+                tail = block
+                continue
+            tail = block[cut + 1:]
+            yield block[:cut + 1].decode("utf-8", errors="replace")
+        if tail:
+            yield tail.decode("utf-8", errors="replace")
 
     @classmethod
-    def _load_docx(cls, raw: bytes, name: str) -> Tuple[str, Optional[str]]:
+    def _open_docx(cls, file) -> Tuple[Iterator[str], Optional[str]]:
         try:
             import docx
-            from io import BytesIO
-            doc = docx.Document(BytesIO(raw))
-            parts = []
+            doc = docx.Document(file)
+        except ImportError:
+            return iter([]), "Cần cài đặt python-docx: pip install python-docx"
+        except Exception as e:
+            return iter([]), f"File Word lỗi hoặc không đọc được: {str(e)}"
+
+        def _gen():
+            block: List[str] = []
             for p in doc.paragraphs:
                 if p.text:
-                    parts.append(p.text)
+                    block.append(p.text)
+                if len(block) >= LOADER_ROW_BLOCK:
+                    yield "\n".join(block)
+                    block = []
             for table in doc.tables:
                 for row in table.rows:
-                    parts.append(" | ".join(cell.text for cell in row.cells))
-            text = "\n".join(parts)
-            return _clean_text(text), None
-        except ImportError:
-            return "", "Cần cài đặt python-docx: pip install python-docx"
-        except Exception as e:
-            return "", f"File Word lỗi hoặc không đọc được: {str(e)}"
+                    block.append(" | ".join(cell.text for cell in row.cells))
+                    if len(block) >= LOADER_ROW_BLOCK:
+                        yield "\n".join(block)
+                        block = []
+            if block:
+                yield "\n".join(block)
+
+        return _clean_segments(_gen()), None
 
     @classmethod
-    def _load_pdf(cls, raw: bytes, name: str) -> Tuple[str, Optional[str]]:
+    def _open_pdf(cls, file) -> Tuple[Iterator[str], Optional[str]]:
         try:
             from pypdf import PdfReader
-            from io import BytesIO
-            reader = PdfReader(BytesIO(raw))
-            parts = []
+            reader = PdfReader(file)
+            n_pages = len(reader.pages)
+        except ImportError:
+            return iter([]), "Cần cài đặt pypdf: pip install pypdf"
+        except Exception as e:
+            return iter([]), f"File PDF lỗi hoặc không đọc được: {str(e)}"
+        if n_pages >= PDF_PARALLEL_MIN_PAGES:
+            return _clean_segments(_iter_pdf_parallel(file, n_pages)), None
+
+        def _gen():
             for page in reader.pages:
                 t = page.extract_text()
                 if t:
-                    parts.append(t)
-            text = "\n".join(parts)
-            return _clean_text(text), None
-        except ImportError:
-            return "", "Cần cài đặt pypdf: pip install pypdf"
-        except Exception as e:
-            return "", f"File PDF lỗi hoặc không đọc được: {str(e)}"
+                    yield t
+
+        return _clean_segments(_gen()), None
 
     @classmethod
-    def _load_xlsx(cls, raw: bytes, name: str) -> Tuple[str, Optional[str]]:
+    def _open_xlsx(cls, file) -> Tuple[Iterator[str], Optional[str]]:
         try:
             import pandas as pd
-            from io import BytesIO
-            df = pd.read_excel(BytesIO(raw), sheet_name=None, header=None)
-            parts = []
-            for sheet_name, frame in df.items():
-                parts.append(f"[Sheet: {sheet_name}]")
-                parts.append(frame.to_string(index=False, header=False))
-            text = "\n\n".join(parts)
-            return _clean_text(text), None
+            book = pd.ExcelFile(file)
         except ImportError:
-            return "", "Cần cài đặt pandas và openpyxl: pip install pandas openpyxl"
+            return iter([]), "Cần cài đặt pandas và openpyxl: pip install pandas openpyxl"
         except Exception as e:
-            return "", f"File Excel lỗi hoặc không đọc được: {str(e)}"
+            return iter([]), f"File Excel lỗi hoặc không đọc được: {str(e)}"
+
+        def _gen():
+            # Mỗi lần chỉ giữ 1 sheet; text render theo khối dòng (căn cột trong từng khối).
+            for sheet_name in book.sheet_names:
+                frame = book.parse(sheet_name, header=None)
+                yield f"[Sheet: {sheet_name}]"
+                for start in range(0, len(frame), LOADER_ROW_BLOCK):
+                    yield frame.iloc[start:start + LOADER_ROW_BLOCK].to_string(index=False, header=False)
+                del frame
+
+        return _clean_segments(_gen()), None
 
     @classmethod
-    def _load_csv(cls, raw: bytes, name: str) -> Tuple[str, Optional[str]]:
+    def _open_csv(cls, file) -> Tuple[Iterator[str], Optional[str]]:
         try:
             import pandas as pd
-            from io import BytesIO
             try:
-                df = pd.read_csv(BytesIO(raw), encoding="utf-8", on_bad_lines="skip")
+                blocks = pd.read_csv(file, encoding="utf-8", encoding_errors="replace", on_bad_lines="skip", chunksize=LOADER_ROW_BLOCK)
             except TypeError:
-                df = pd.read_csv(BytesIO(raw), encoding="utf-8", error_bad_lines=False)
-            text = df.to_string(index=False)
-            return _clean_text(text), None
-        except UnicodeDecodeError:
-            try:
-                df = pd.read_csv(BytesIO(raw), encoding="utf-8", errors="replace")
-                text = df.to_string(index=False)
-                return _clean_text(text), None
-            except Exception as e:
-                return "", f"File CSV lỗi hoặc encoding không đúng: {str(e)}"
+                blocks = pd.read_csv(file, encoding="utf-8", error_bad_lines=False, chunksize=LOADER_ROW_BLOCK)
         except ImportError:
-            return "", "Cần cài đặt pandas: pip install pandas"
+            return iter([]), "Cần cài đặt pandas: pip install pandas"
         except Exception as e:
-            return "", f"File CSV lỗi hoặc không đọc được: {str(e)}"
+            return iter([]), f"File CSV lỗi hoặc không đọc được: {str(e)}"
+
+        def _gen():
+            for i, df in enumerate(blocks):
+                # Header chỉ ở khối đầu (giống to_string cả file).
+                yield df.to_string(index=False, header=(i == 0))
+
+        return _clean_segments(_gen()), None
 
     # -------------------------------------------------------------------------
     # V6 MODULE 2: Excel row-by-row -> Markdown Chunks with Metadata (Reverse Traceability)
@@ -164,41 +264,80 @@ class UniversalLoader:
             return [], "Chỉ hỗ trợ Excel (.xlsx, .xls) cho load_excel_as_chunks."
         try:
             file.seek(0)
-            raw = file.read()
         except Exception as e:
             return [], str(e)
         try:
             import pandas as pd
-            from io import BytesIO
         except ImportError:
             return [], "Cần cài đặt pandas và openpyxl: pip install pandas openpyxl"
         try:
-            df_dict = pd.read_excel(BytesIO(raw), sheet_name=None, header=None)
+            book = pd.ExcelFile(file)
         except Exception as e:
             return [], "File Excel lỗi hoặc không đọc được: %s" % e
         chunks = []
-        for sheet_name, frame in df_dict.items():
-            for row_idx, row in frame.iterrows():
-                row_idx_int = int(row_idx) + 2  # 1-based + header
-                parts = []
-                for c, v in row.items():
-                    if pd.isna(v):
-                        continue
-                    parts.append("%s: %s" % (c, str(v).strip()))
-                raw_content = "\n".join(parts) if parts else ""
-                content = raw_content
-                if not content.strip():
-                    continue
-                meta_json = {
-                    "source_metadata": {
-                        "sheet_name": str(sheet_name),
-                        "row_index": row_idx_int,
-                        "source_file": name or "uploaded",
-                    }
-                }
-                chunks.append({
-                    "raw_content": raw_content,
-                    "content": content,
-                    "meta_json": meta_json,
-                })
+        try:
+            # Mỗi lần chỉ giữ 1 sheet (không đọc sheet_name=None toàn workbook).
+            for sheet_name in book.sheet_names:
+                frame = book.parse(sheet_name, header=None)
+                chunks.extend(_excel_frame_to_chunks(frame, sheet_name, name or "uploaded"))
+                del frame
+        except Exception as e:
+            return [], "File Excel lỗi hoặc không đọc được: %s" % e
         return chunks, None
+
+
+def _excel_row_chunk(parts: List[str], sheet_name: Any, row_idx: Any, source_file: str) -> Optional[Dict[str, Any]]:
+    raw_content = "\n".join(parts) if parts else ""
+    content = raw_content
+    if not content.strip():
+        return None
+    meta_json = {
+        "source_metadata": {
+            "sheet_name": str(sheet_name),
+            "row_index": int(row_idx) + 2,  # 1-based + header
+            "source_file": source_file,
+        }
+    }
+    return {
+        "raw_content": raw_content,
+        "content": content,
+        "meta_json": meta_json,
+    }
+
+
+def _excel_frame_to_chunks(frame, sheet_name: Any, source_file: str) -> List[Dict[str, Any]]:
+    """
+    Mỗi dòng -> 1 chunk "cột: giá trị". Không tạo Series cho từng dòng (iterrows) và không pd.isna từng ô:
+    lấy frame.to_numpy() (cùng kiểu dữ liệu chung mà iterrows dùng) + mặt nạ NaN tính một lần cho cả sheet.
+    Kết quả giống hệt _excel_frame_to_chunks_iterrows.
+    """
+    import pandas as pd
+    values = frame.to_numpy()
+    if values.dtype.kind in "mM":
+        # Sheet toàn ngày giờ: iterrows đổi lại thành Timestamp -> giữ đường cũ để chuỗi giống hệt.
+        return _excel_frame_to_chunks_iterrows(frame, sheet_name, source_file)
+    missing = pd.isna(values).tolist()
+    prefixes = ["%s: " % c for c in frame.columns]
+    chunks = []
+    for row_idx, row, row_missing in zip(frame.index, values.tolist(), missing):
+        parts = [p + str(v).strip() for p, v, na in zip(prefixes, row, row_missing) if not na]
+        chunk = _excel_row_chunk(parts, sheet_name, row_idx, source_file)
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+def _excel_frame_to_chunks_iterrows(frame, sheet_name: Any, source_file: str) -> List[Dict[str, Any]]:
+    """Đường cũ (iterrows + pd.isna từng ô): fallback và làm mốc so sánh trong scripts/bench_ingestion.py."""
+    import pandas as pd
+    chunks = []
+    for row_idx, row in frame.iterrows():
+        parts = []
+        for c, v in row.items():
+            if pd.isna(v):
+                continue
+            parts.append("%s: %s" % (c, str(v).strip()))
+        chunk = _excel_row_chunk(parts, sheet_name, row_idx, source_file)
+        if chunk:
+            chunks.append(chunk)
+    return chunks
@@ -70,10 +70,12 @@ def render_arc_tab(project_id):
                 with col2:
                     if a.get("status") == "active" and st.button("📦 Archive", key=f"arc_archive_{arc_id}"):
                         supabase.table("arcs").update({"status": "archived", "updated_at": datetime.utcnow().isoformat()}).eq("id", arc_id).execute()
+                        ArcService.invalidate_arc_cache(project_id)
                         st.toast("Đã archive.")
                 with col3:
                     if can_delete and st.button("🗑️ Xóa Arc", key=f"arc_del_{arc_id}"):
                         supabase.table("arcs").update({"status": "archived"}).eq("id", arc_id).execute()
+                        ArcService.invalidate_arc_cache(project_id)
                         st.toast("Đã archive (xóa mềm).")
 
         for a in arcs_archived:
@@ -85,6 +87,7 @@ def render_arc_tab(project_id):
                 st.caption("Arc đã archive: không xóa chương thuộc arc này. Dùng Un-archive để chỉnh sửa.")
                 if can_write and st.button("↩️ Un-archive", key=f"arc_unarchive_{arc_id}"):
                     supabase.table("arcs").update({"status": "active", "updated_at": datetime.utcnow().isoformat()}).eq("id", arc_id).execute()
+                    ArcService.invalidate_arc_cache(project_id)
                     st.toast("Đã bỏ archive.")
 
     if st.session_state.get("arc_updating") and can_write:
@@ -93,9 +96,9 @@ def render_arc_tab(project_id):
         if arc:
             st.markdown("---")
             with st.spinner("Đang lấy tóm tắt chương và tạo tóm tắt Arc..."):
-                chaps_r = supabase.table("chapters").select("id, chapter_number, title, summary").eq("story_id", project_id).eq("arc_id", update_id).order("chapter_number").execute()
-                chaps_data = chaps_r.data or []
-                chapter_summaries = [{"chapter_number": c.get("chapter_number"), "summary": c.get("summary") or ""} for c in chaps_data if c.get("summary")]
+                # Arc dài: đầu vào là tóm tắt khối 10 chương từ cây tóm tắt thay vì mọi chương.
+                from core.summary_tree import arc_summary_inputs
+                chapter_summaries = arc_summary_inputs(project_id, update_id, supabase)
                 if not chapter_summaries:
                     st.warning("Không có chương nào có tóm tắt. Thêm tóm tắt chương trước khi cập nhật Arc.")
                     if st.button("Đóng", key="arc_update_close"):
@@ -104,6 +107,7 @@ def render_arc_tab(project_id):
                     new_summary = generate_arc_summary_from_chapters(chapter_summaries, arc.get("name", ""))
                     if new_summary:
                         supabase.table("arcs").update({"summary": new_summary, "updated_at": datetime.utcnow().isoformat()}).eq("id", update_id).execute()
+                        ArcService.invalidate_arc_cache(project_id)
                         del st.session_state["arc_updating"]
                         st.success("Đã cập nhật tóm tắt Arc từ tóm tắt chương!")
                     else:
@@ -120,11 +124,20 @@ def render_arc_tab(project_id):
                 new_summary = st.text_area("Tóm tắt", value=arc.get("summary") or "", key="arc_new_summary")
                 if st.form_submit_button("💾 Lưu"):
                     supabase.table("arcs").update({"summary": new_summary, "updated_at": datetime.utcnow().isoformat()}).eq("id", edit_id).execute()
+                    ArcService.invalidate_arc_cache(project_id)
                     del st.session_state["arc_editing"]
                     st.success("Đã cập nhật.")
                 if st.form_submit_button("Hủy"):
                     del st.session_state["arc_editing"]
 
+    if can_write and st.button("🌲 Dựng cây tóm tắt chương", key="arc_summary_tree_btn",
+                               help="Gộp tóm tắt chương thành khối 10 / 100 chương và tóm tắt arc; câu hỏi về khoảng chương dài trả lời map-reduce trên cây. Lưu chương tự cập nhật."):
+        from core.summary_tree import start_summary_tree_job
+        if start_summary_tree_job(project_id, str(user_id) if user_id else None):
+            st.toast("Đã bắt đầu dựng cây tóm tắt. Xem tiến độ ở tab Background Jobs.")
+        else:
+            st.error("Không tạo được job.")
+
     st.markdown("---")
     st.subheader("Tạo Arc mới")
     if can_write:
@@ -142,6 +155,7 @@ def render_arc_tab(project_id):
                         "summary": arc_summary or "",
                         "sort_order": len(arcs) + 1,
                     }).execute()
+                    ArcService.invalidate_arc_cache(project_id)
                     st.success("Đã tạo Arc.")
 
     st.markdown("---")
@@ -152,5 +166,6 @@ def render_arc_tab(project_id):
             if confirm and st.button("📦 Archive tất cả Arc"):
                 for a in arcs_active:
                     supabase.table("arcs").update({"status": "archived"}).eq("id", a["id"]).execute()
+                ArcService.invalidate_arc_cache(project_id)
                 st.success("Đã archive tất cả.")
         st.markdown("</div>", unsafe_allow_html=True)
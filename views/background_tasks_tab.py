@@ -3,6 +3,8 @@ import streamlit as st
 
 from config import init_services
 from core.background_jobs import list_jobs
+from core.chapter_logic_check import LOGIC_CHECK_JOB_TYPE, format_logic_check_progress
+from core.embedding_backfill import format_backfill_progress
 
 
 def render_background_tasks_tab(project_id):
@@ -68,6 +70,14 @@ def render_background_tasks_tab(project_id):
                 st.caption(f"Started: {started}")
             if completed:
                 st.caption(f"Completed: {completed}")
+            payload = j.get("payload") if isinstance(j.get("payload"), dict) else {}
+            if payload.get("plan_preview"):
+                st.caption("📋 Kế hoạch: " + payload["plan_preview"].replace("\n", " · "))
+            progress = payload.get("progress")
+            if status == "running" and progress:
+                total = int(progress.get("total") or 0)
+                fmt = format_logic_check_progress if job_type == LOGIC_CHECK_JOB_TYPE else format_backfill_progress
+                st.progress(min(1.0, int(progress.get("done") or 0) / total) if total else 0.0, text=fmt(progress))
             if result_summary:
                 st.success(result_summary)
             if error_message:
@@ -6,9 +6,16 @@ import streamlit as st
 
 from config import Config, init_services
 from ai_engine import AIService, HybridSearch, suggest_import_category, _get_default_tool_model
-from utils.file_importer import UniversalLoader
+from utils.chunk_tools import load_file_text
 from utils.auth_manager import check_permission, submit_pending_change
 from utils.cache_helpers import get_bible_list_cached, invalidate_cache
+from ai.answer_cache import invalidate_answer_rows
+from core.mention_index import schedule_entity_mentions
+from core.relation_graph import invalidate_relation_graph
+
+# Import Knowledge: mô tả entry bị cắt ở 50.000 ký tự khi lưu -> chỉ đọc chừng ấy từ file.
+BIBLE_IMPORT_MAX_CHARS = 50000
+
 
 # Tiền tố khóa (chỉ sửa nội dung, không sửa tiền tố): lấy từ Config.PREFIX_SPECIAL_SYSTEM, bỏ OTHER.
 def _get_locked_prefixes():
@@ -81,12 +88,20 @@ def render_bible_tab(project_id, persona):
             st.toast("Đã làm mới. Số mục chưa có embedding hiển thị phía trên.")
     with c2:
         if st.button("🔄 Đồng bộ vector (Bible)", key="bible_sync_vec_btn", disabled=(bible_no_vec_count == 0)):
-            import threading
-            from core.background_jobs import run_embedding_backfill
-            def _run():
-                run_embedding_backfill(project_id, bible_limit=200, chunks_limit=0)
-            threading.Thread(target=_run, daemon=True).start()
-            st.toast("Đã bắt đầu đồng bộ vector. Bấm Refresh sau vài giây để xem kết quả.")
+            from core.embedding_backfill import start_embedding_backfill_job
+            uid = getattr(st.session_state.get("user"), "id", None)
+            if start_embedding_backfill_job(project_id, str(uid) if uid else None, tables=["story_bible"]):
+                st.toast("Đã bắt đầu đồng bộ vector. Xem tiến độ (dòng/s, ETA) ở tab Background Jobs.")
+            else:
+                st.toast("Project đang đồng bộ vector. Xem tiến độ ở tab Background Jobs.")
+    if st.button("🧭 Dựng lại chỉ mục nhắc tên (thực thể → chương)", key="bible_mention_index_btn",
+                 help="Quét nội dung mọi chương tìm tên thực thể; reverse lookup dùng chỉ mục này. Thêm / sửa entry và lưu chương tự cập nhật."):
+        from core.mention_index import start_mention_index_job
+        uid = getattr(st.session_state.get("user"), "id", None)
+        if start_mention_index_job(project_id, str(uid) if uid else None):
+            st.toast("Đã bắt đầu dựng chỉ mục. Xem tiến độ ở tab Background Jobs.")
+        else:
+            st.error("Không tạo được job.")
 
     # --- Import Knowledge: upload file -> parse -> gợi ý category -> thêm entry ---
     if st.session_state.get('import_knowledge_mode'):
@@ -98,10 +113,12 @@ def render_bible_tab(project_id, persona):
             key="import_file_upload"
         )
         if uploaded:
-            text, err = UniversalLoader.load(uploaded)
+            text, truncated, err = load_file_text(uploaded, BIBLE_IMPORT_MAX_CHARS)
             if err:
                 st.error(err)
             elif text:
+                if truncated:
+                    st.caption(f"⚠️ File dài: chỉ đọc {BIBLE_IMPORT_MAX_CHARS:,} ký tự đầu (giới hạn mô tả một entry).")
                 if 'import_parsed_text' not in st.session_state or st.session_state.get('import_file_id') != id(uploaded):
                     with st.spinner("Đang gợi ý phân loại..."):
                         suggested = suggest_import_category(text)
@@ -144,7 +161,8 @@ def render_bible_tab(project_id, persona):
                             ok = False
                             if can_write:
                                 payload["story_id"] = project_id
-                                supabase.table("story_bible").insert(payload).execute()
+                                ins = supabase.table("story_bible").insert(payload).execute()
+                                schedule_entity_mentions(project_id, [r.get("id") for r in (ins.data or [])])
                                 st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
                                 st.success("Đã thêm entry từ file!")
                                 ok = True
@@ -356,7 +374,8 @@ def render_bible_tab(project_id, persona):
                                     try:
                                         if can_write:
                                             payload["story_id"] = project_id
-                                            supabase.table("story_bible").insert(payload).execute()
+                                            ins = supabase.table("story_bible").insert(payload).execute()
+                                            schedule_entity_mentions(project_id, [r.get("id") for r in (ins.data or [])])
                                             st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
                                             st.success("Entry added!")
                                             st.session_state['adding_bible_entry'] = False
@@ -581,6 +600,8 @@ def render_bible_tab(project_id, persona):
                                             "story_id": project_id,
                                         }
                                         supabase.table("entity_relations").insert(payload).execute()
+                                    invalidate_answer_rows(project_id, "relation", [entry["id"], target_options[rel_target]])
+                                    invalidate_relation_graph(project_id)
                                     st.success("Đã thêm quan hệ.")
                                 except Exception as ex:
                                     st.error(f"Lỗi: {ex}")
@@ -651,6 +672,7 @@ def render_bible_tab(project_id, persona):
                         try:
                             if can_write:
                                 supabase.table("story_bible").update(upd).eq("id", edit_id).execute()
+                                schedule_entity_mentions(project_id, [edit_id])
                                 st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
                                 st.success("Updated!")
                                 del st.session_state['editing_bible_entry']
@@ -3,7 +3,7 @@ from datetime import datetime
 
 import streamlit as st
 
-from config import Config, init_services, CostManager
+from config import Config, init_services
 from ai_engine import (
     AIService,
     ContextManager,
@@ -15,6 +15,10 @@ from ai_engine import (
 )
 from ai.evaluate import is_answer_sufficient
 from ai.context_helpers import get_related_chapter_nums
+from ai.router_cache import bump_data_version, get_router_cache_note
+from ai.answer_cache import answer_cache, build_answer_scope, new_used_rows
+from core.cost_ledger import record_usage, request_flush, set_cost_actor
+from core.post_turn import merge_add_count, post_turn_pipeline
 from ai_verifier import run_verification_loop
 from core.executor_v7 import execute_plan
 from core.command_parser import is_command_message, parse_command, get_fallback_clarification
@@ -56,8 +60,8 @@ def _get_crystallize_count(project_id, user_id):
     return 0
 
 
-def _increment_crystallize_count(project_id, user_id):
-    """Tăng messages_since_crystallize lên 1 (sau khi lưu tin nhắn V Work)."""
+def _increment_crystallize_count(project_id, user_id, by=1):
+    """Tăng messages_since_crystallize thêm by (sau khi lưu tin nhắn V Work; pipeline gộp nhiều lượt thành 1 lần)."""
     try:
         services = init_services()
         if not services:
@@ -70,14 +74,14 @@ def _increment_crystallize_count(project_id, user_id):
         if r.data and len(r.data) > 0:
             cur = int(r.data[0].get("messages_since_crystallize", 0) or 0)
             sb.table("chat_crystallize_state").update({
-                "messages_since_crystallize": cur + 1,
+                "messages_since_crystallize": cur + by,
                 "updated_at": now,
             }).eq("story_id", project_id).eq("user_id", str(user_id) or "").execute()
         else:
             sb.table("chat_crystallize_state").upsert({
                 "story_id": project_id,
                 "user_id": str(user_id) or "",
-                "messages_since_crystallize": 1,
+                "messages_since_crystallize": by,
                 "updated_at": now,
             }, on_conflict="story_id,user_id").execute()
     except Exception:
@@ -101,17 +105,47 @@ def _reset_crystallize_count(project_id, user_id):
         pass
 
 
+# (project_id, user_id) đang crystallize: chỉ 1 lần crystallize cho mỗi đợt vượt ngưỡng.
+_crystallize_running = set()
+_crystallize_lock = threading.Lock()
+
+
+def _run_crystallize_counter(project_id, user_id, persona_role, count=1):
+    """Task pipeline: tăng counter thêm count (đã gộp), nếu >= 30 và chưa chạy thì crystallize (sẽ reset về 0)."""
+    _increment_crystallize_count(project_id, user_id, by=count)
+    if _get_crystallize_count(project_id, user_id) < 30:
+        return
+    key = (str(project_id), str(user_id))
+    with _crystallize_lock:
+        if key in _crystallize_running:
+            return
+        _crystallize_running.add(key)
+
+    def _crystallize_once():
+        try:
+            _auto_crystallize_background(project_id, user_id, persona_role)
+        finally:
+            with _crystallize_lock:
+                _crystallize_running.discard(key)
+
+    threading.Thread(target=_crystallize_once, daemon=True).start()
+
+
 def _after_save_history_v_work(project_id, user_id, persona_role):
-    """Sau khi lưu tin nhắn V Work: tăng counter, nếu >= 30 thì chạy crystallize (sẽ reset về 0)."""
+    """Sau khi lưu tin nhắn V Work: đưa việc tăng counter / crystallize vào pipeline ngầm (gộp theo project + user)."""
     if not project_id or not user_id:
         return
-    _increment_crystallize_count(project_id, user_id)
-    if _get_crystallize_count(project_id, user_id) >= 30:
-        threading.Thread(
-            target=_auto_crystallize_background,
-            args=(project_id, user_id, persona_role),
-            daemon=True,
-        ).start()
+    post_turn_pipeline.submit(
+        project_id,
+        "crystallize_counter",
+        _run_crystallize_counter,
+        project_id,
+        user_id,
+        persona_role,
+        coalesce_key=f"crystallize:{user_id}",
+        merge=merge_add_count,
+        count=1,
+    )
 
 
 def _start_data_operation_background(
@@ -141,6 +175,12 @@ def _start_data_operation_background(
     else:
         return
     running_msg = f"⏳ Running in background: **{user_request[:100]}**. {desc} Check **Background Jobs** tab for status."
+    if steps:
+        # Xem trước kế hoạch lô LLM (số lần gọi, token, chi phí ước tính) trước khi job chạy.
+        from core.data_operation_jobs import preview_data_operation_plan
+        plan_preview = preview_data_operation_plan(project_id, steps)
+        if plan_preview:
+            running_msg += "\n\n📋 Kế hoạch:\n" + "\n".join(f"- {line}" for line in plan_preview.splitlines())
     try:
         services = init_services()
         if not services:
@@ -193,6 +233,133 @@ def _start_data_operation_background(
         st.error(f"Lỗi khi bắt đầu thao tác: {e}")
 
 
+# --- V Work: lịch sử chat tăng dần theo cursor created_at (giữ trong session, không tải lại mỗi rerun) ---
+CHAT_HISTORY_PAGE_SIZE = 50
+# Không lấy metadata (router output, V7 plan) khi list; chỉ tải khi bấm Details.
+CHAT_HISTORY_LIST_COLUMNS = "id, role, content, created_at"
+# Trả lời chưa đủ ý -> fallback đọc khoảng chương (token, không phải ký tự); khoảng dài dùng map-reduce trên cây tóm tắt.
+CHAT_FALLBACK_TOKEN_LIMIT = 4000
+
+
+def _chat_history_store(project_id, user_id):
+    """Store lịch sử trong session cho (project, user). Reset khi chat_cutoff đổi (Clear Screen / Show All)."""
+    stores = st.session_state.setdefault("chat_history_store", {})
+    key = f"{project_id}:{user_id or ''}"
+    cutoff = st.session_state.get("chat_cutoff", "1970-01-01")
+    store = stores.get(key)
+    if store is None or store.get("cutoff") != cutoff:
+        store = {"cutoff": cutoff, "msgs": [], "ids": set(), "loaded": False, "has_more": False, "metadata": {}, "pending": []}
+        stores[key] = store
+    return store
+
+
+def _chat_history_query(supabase, project_id, user_id, cutoff):
+    q = supabase.table("chat_history").select(CHAT_HISTORY_LIST_COLUMNS).eq("story_id", project_id).gt("created_at", cutoff)
+    if user_id:
+        q = q.eq("user_id", str(user_id))
+    return q
+
+
+def _chat_history_sync(store, supabase, project_id, user_id):
+    """Lần đầu: lấy trang mới nhất. Các lần sau: chỉ lấy dòng có created_at >= tin mới nhất đã có (dedupe theo id)."""
+    cutoff = store["cutoff"]
+    if not store["loaded"]:
+        r = _chat_history_query(supabase, project_id, user_id, cutoff).order("created_at", desc=True).limit(CHAT_HISTORY_PAGE_SIZE).execute()
+        rows = list(r.data or [])[::-1]
+        store["msgs"] = rows
+        store["ids"] = {m.get("id") for m in rows}
+        store["has_more"] = len(rows) >= CHAT_HISTORY_PAGE_SIZE
+        store["loaded"] = True
+        return
+    newest = store["msgs"][-1]["created_at"] if store["msgs"] else cutoff
+    r = _chat_history_query(supabase, project_id, user_id, cutoff).gte("created_at", newest).order("created_at").limit(CHAT_HISTORY_PAGE_SIZE).execute()
+    for m in (r.data or []):
+        if m.get("id") not in store["ids"]:
+            store["ids"].add(m.get("id"))
+            store["msgs"].append(m)
+    _chat_history_drop_saved_pending(store)
+
+
+def _chat_history_add_pending(project_id, user_id, rows):
+    """Tin vừa gửi nhưng pipeline chưa ghi DB: hiển thị tạm (không có id) cho tới khi sync thấy."""
+    store = _chat_history_store(project_id, user_id)
+    store.setdefault("pending", []).extend(
+        {"role": m.get("role"), "content": m.get("content"), "created_at": m.get("created_at")} for m in rows
+    )
+
+
+def _chat_history_drop_saved_pending(store):
+    pending = store.get("pending") or []
+    if not pending:
+        return
+    saved = {(m.get("role"), m.get("content")) for m in store["msgs"][-CHAT_HISTORY_PAGE_SIZE:]}
+    store["pending"] = [m for m in pending if (m.get("role"), m.get("content")) not in saved]
+
+
+def _chat_history_load_older(store, supabase, project_id, user_id):
+    """Tải thêm một trang tin cũ hơn tin cũ nhất đang có."""
+    if not store["msgs"]:
+        return
+    oldest = store["msgs"][0]["created_at"]
+    r = _chat_history_query(supabase, project_id, user_id, store["cutoff"]).lt("created_at", oldest).order("created_at", desc=True).limit(CHAT_HISTORY_PAGE_SIZE).execute()
+    rows = [m for m in list(r.data or [])[::-1] if m.get("id") not in store["ids"]]
+    store["ids"].update(m.get("id") for m in rows)
+    store["msgs"] = rows + store["msgs"]
+    store["has_more"] = len(r.data or []) >= CHAT_HISTORY_PAGE_SIZE
+
+
+def _chat_history_metadata(store, supabase, msg_id):
+    """Metadata của một tin (tải khi cần, cache trong store)."""
+    if msg_id not in store["metadata"]:
+        try:
+            r = supabase.table("chat_history").select("metadata").eq("id", msg_id).limit(1).execute()
+            store["metadata"][msg_id] = (r.data[0].get("metadata") if r.data else None) or {}
+        except Exception:
+            return {}
+    return store["metadata"][msg_id]
+
+
+# --- Pipeline sau lượt chat (core/post_turn): lưu history, rule mining, semantic-add chạy ngầm ---
+def _post_turn_result_key(project_id, user_id):
+    return f"{user_id or ''}:{project_id}"
+
+
+def _persist_turn_history(rows):
+    """Task pipeline: ghi cặp tin user/model của một lượt vào chat_history."""
+    services = init_services()
+    if not services:
+        return
+    services["supabase"].table("chat_history").insert(rows).execute()
+
+
+def _mine_rules_after_turn(project_id, user_id, prompt, response_text, context_text, intent):
+    """Task pipeline: trích luật mới + gợi ý thêm Semantic Intent; kết quả hiện ở lần rerun sau."""
+    set_cost_actor(user_id, project_id)
+    result_key = _post_turn_result_key(project_id, user_id)
+    new_rules = RuleMiningSystem.extract_rules_raw(prompt, response_text)
+    if new_rules:
+        post_turn_pipeline.post_result(result_key, "pending_new_rules", [{"content": r, "analysis": None} for r in new_rules])
+    # Offer add to Semantic Intent (nếu bật auto-create và không phải chat phiếm)
+    try:
+        r = init_services()["supabase"].table("settings").select("value").eq("key", "semantic_intent_no_auto_create").execute()
+        no_auto = r.data and r.data[0] and int(r.data[0].get("value", 0)) == 1
+    except Exception:
+        no_auto = False
+    if not no_auto and intent != "chat_casual":
+        post_turn_pipeline.post_result(result_key, "pending_semantic_add", {"prompt": prompt, "response": response_text, "context": context_text, "intent": intent})
+
+
+def _apply_post_turn_results(project_id, user_id):
+    """Đưa kết quả pipeline (luật mới, gợi ý semantic) vào session_state để các expander bên dưới hiển thị."""
+    for res in post_turn_pipeline.pop_results(_post_turn_result_key(project_id, user_id)):
+        kind, value = res.get("kind"), res.get("value")
+        if kind == "pending_new_rules":
+            existing = st.session_state.get("pending_new_rules")
+            st.session_state["pending_new_rules"] = (existing if isinstance(existing, list) else []) + value
+        elif kind:
+            st.session_state[kind] = value
+
+
 # --- V Home: lưu/load theo topic (không dùng chat_history) ---
 V_HOME_CONTEXT_MESSAGES = 10
 
@@ -290,6 +457,7 @@ def _v_home_save_message(user_id, role, content, topic_start_at):
 
 def _auto_crystallize_background(project_id, user_id, persona_role):
     """Chạy ngầm: crystallize 25 tin (30 - 5) và lưu vào Bible [CHAT] (ngày-stt). Reset counter v7.1 về 0."""
+    set_cost_actor(user_id, project_id)
     try:
         services = init_services()
         if not services:
@@ -327,6 +495,7 @@ def _auto_crystallize_background(project_id, user_id, persona_role):
             "source_chapter": 0,
         }
         ins = supabase.table("story_bible").insert(payload).execute()
+        bump_data_version(project_id)
         bible_id = ins.data[0].get("id") if ins.data else None
         try:
             supabase.table("chat_crystallize_log").insert({
@@ -355,6 +524,8 @@ def _auto_crystallize_background(project_id, user_id, persona_role):
                         }).execute()
                     except Exception:
                         pass
+            from core.relation_graph import invalidate_relation_graph
+            invalidate_relation_graph(project_id)
         except Exception:
             pass
     except Exception as e:
@@ -427,6 +598,12 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                 help="V sẽ tư duy để tìm câu trả lời tốt nhất.",
                 key=f"chat_toggle_v7_{chat_mode}",
             )
+            st.session_state['use_answer_cache'] = st.toggle(
+                "⚡ Answer cache",
+                value=st.session_state.get('use_answer_cache', True),
+                help="Câu hỏi gần giống câu đã trả lời (cùng persona/model) và dữ liệu nguồn chưa đổi: trả lời ngay từ cache, không gọi LLM.",
+                key=f"chat_toggle_answer_cache_{chat_mode}",
+            )
             st.session_state['auto_extract_rules_chat'] = st.toggle(
                 "🧐 Tự động trích xuất luật từ chat",
                 value=st.session_state.get('auto_extract_rules_chat', False),
@@ -444,6 +621,10 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                 help="Bao nhiêu tin gần nhất được đưa vào Router và V7 Planner để chọn intent và lên kế hoạch. Trả lời cuối dựa trên context từ Bible/chương đã thu thập, không nhồi thêm lịch sử chat.",
                 key=f"chat_history_depth_{chat_mode}",
             )
+            _apply_post_turn_results(project_id, user_id)
+            pending_tasks = post_turn_pipeline.pending(project_id) if project_id else 0
+            if pending_tasks:
+                st.caption(f"⏳ {pending_tasks} việc sau lượt chat đang chạy ngầm.")
             crystallize_count = _get_crystallize_count(project_id, user_id) if project_id and user_id else 0
             st.caption(f"💎 Crystallize: **{crystallize_count} / 30** tin (sau 30 → tóm tắt & lưu Bible [CHAT], xem tại **Knowledge > Bible** hoặc **Memory**).")
         else:
@@ -461,28 +642,29 @@ def render_chat_tab(project_id, persona, chat_mode=None):
             try:
                 services = init_services()
                 supabase = services["supabase"]
-                q = (
-                    supabase.table("chat_history")
-                    .select("*")
-                    .eq("story_id", project_id)
-                )
-                if user_id:
-                    q = q.eq("user_id", str(user_id))
-                msgs_data = (
-                    q.order("created_at", desc=True)
-                    .limit(50)
-                    .execute()
-                )
-                msgs = msgs_data.data[::-1] if msgs_data.data else []
-                visible_msgs = [m for m in msgs if m["created_at"] > st.session_state.get("chat_cutoff", "1970-01-01")]
+                history_store = _chat_history_store(project_id, user_id)
+                _chat_history_sync(history_store, supabase, project_id, user_id)
+                visible_msgs = history_store["msgs"] + history_store.get("pending", [])
+                open_details = st.session_state.setdefault("chat_details_open", set())
                 # Hiển thị càng mới càng ở trên cao (newest first)
                 for m in reversed(visible_msgs):
                     role_icon = active_persona["icon"] if m["role"] == "model" else None
                     with st.chat_message(m["role"], avatar=role_icon):
                         st.markdown(m["content"])
-                        if m.get("metadata"):
-                            with st.expander("📊 Details"):
-                                st.json(m["metadata"], expanded=False)
+                        msg_id = m.get("id")
+                        if msg_id is not None:
+                            if st.button("📊 Details", key=f"chat_details_{msg_id}"):
+                                open_details.symmetric_difference_update({msg_id})
+                            if msg_id in open_details:
+                                meta = _chat_history_metadata(history_store, supabase, msg_id)
+                                if meta:
+                                    st.json(meta, expanded=False)
+                                else:
+                                    st.caption("(Không có metadata)")
+                if history_store["has_more"]:
+                    if st.button("⬆️ Tải tin cũ hơn", key="chat_load_older"):
+                        _chat_history_load_older(history_store, supabase, project_id, user_id)
+                        st.rerun()
             except Exception as e:
                 st.error(f"Error loading history: {e}")
         history_depth = st.session_state.get("history_depth", 5)
@@ -702,6 +884,9 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                                 _placeholder.markdown(final_response)
                                 with st.expander("📊 V7 Details"):
                                     st.caption(f"Steps: {len(step_results)} | Verification retries: {retries_used}")
+                                    _cache_note = get_router_cache_note(plan_result)
+                                    if _cache_note:
+                                        st.caption(_cache_note)
                                     if replan_events:
                                         st.caption("🔄 Re-plan: " + "; ".join([f"Step {e.get('step_id')} → {e.get('action')}" for e in replan_events]))
                                     st.json({
@@ -725,6 +910,9 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                             v7_handled = True
                     elif router_out is None:
                         router_out = SmartAIRouter.ai_router_pro_v2(prompt, recent_history_text, project_id)
+                        _cache_note = get_router_cache_note(router_out)
+                        if _cache_note:
+                            debug_notes.append(_cache_note)
                     if router_out is not None:
                         debug_notes = [f"Intent: {router_out.get('intent', 'chat_casual')}"] + debug_notes
 
@@ -845,12 +1033,42 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                             if exec_result:
                                 context_text += f"\n\n--- KẾT QUẢ TÍNH TOÁN (Python Executor) ---\n{exec_result}"
 
+                        # Answer cache: chỉ search_context (trả lời dựa trên dữ liệu dự án), không V Home / chat tự do / semantic data
+                        used_rows = new_used_rows()
+                        cached_answer = None
+                        answer_scope = None
+                        prompt_vec = None
+                        # Tra / lưu theo câu hỏi độc lập router đã viết lại ("hắn là ai?" -> "Lý Long là ai?").
+                        cache_query = (router_out.get("rewritten_query") or "").strip() or prompt
+                        use_answer_cache = (
+                            not is_v_home
+                            and not free_chat_mode
+                            and intent == "search_context"
+                            and st.session_state.get('use_answer_cache', True)
+                            and not router_out.get("_semantic_data")
+                        )
+                        if use_answer_cache:
+                            answer_scope = build_answer_scope(
+                                active_persona.get("role", ""),
+                                st.session_state.get('selected_model', Config.DEFAULT_MODEL),
+                                st.session_state.get('strict_mode', False),
+                                st.session_state.get('current_arc_id'),
+                                st.session_state.get("context_size", "medium"),
+                                router_out=router_out,
+                            )
+                            prompt_vec = AIService.get_embedding(cache_query)
+                            cached_answer = answer_cache.lookup(project_id, prompt_vec, answer_scope)
+
                         if is_v_home:
                             context_text = "\n".join([
                                 f"{m.get('role', 'user')}: {m.get('content', '')}"
                                 for m in visible_msgs[-V_HOME_CONTEXT_MESSAGES:]
                             ])
                             sources = []
+                        elif cached_answer:
+                            context_text = ""
+                            sources = cached_answer.get("sources") or []
+                            debug_notes.append(f"⚡ Answer cache {int(cached_answer.get('similarity', 0) * 100)}%")
                         elif exec_result is None:
                             context_text, sources, context_tokens = ContextManager.build_context(
                                 router_out,
@@ -861,6 +1079,7 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                 session_state=dict(st.session_state),
                                 free_chat_mode=free_chat_mode,
                                 max_context_tokens=max_context_tokens,
+                                used_rows=used_rows,
                             )
                             if not free_chat_mode and router_out.get("_semantic_data"):
                                 context_text = f"[SEMANTIC INTENT - Data]\n{router_out['_semantic_data']}\n\n{context_text}"
@@ -897,13 +1116,15 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                         try:
                             model = st.session_state.get('selected_model', Config.DEFAULT_MODEL)
 
-                            response = AIService.call_openrouter(
-                                messages=messages,
-                                model=model,
-                                temperature=run_temperature,
-                                max_tokens=active_persona.get('max_tokens', 4000),
-                                stream=True
-                            )
+                            response = None
+                            if not cached_answer:
+                                response = AIService.call_openrouter(
+                                    messages=messages,
+                                    model=model,
+                                    temperature=run_temperature,
+                                    max_tokens=active_persona.get('max_tokens', 4000),
+                                    stream=True
+                                )
 
                             with st.chat_message("assistant", avatar=active_persona['icon']):
                                 if debug_notes:
@@ -914,17 +1135,21 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                 full_response_text = ""
                                 placeholder = st.empty()
 
-                                for chunk in response:
-                                    if chunk.choices[0].delta.content is not None:
-                                        content = chunk.choices[0].delta.content
-                                        full_response_text += content
-                                        placeholder.markdown(full_response_text + "▌")
+                                if cached_answer:
+                                    full_response_text = cached_answer.get("answer") or ""
+                                else:
+                                    for chunk in response:
+                                        if chunk.choices[0].delta.content is not None:
+                                            content = chunk.choices[0].delta.content
+                                            full_response_text += content
+                                            placeholder.markdown(full_response_text + "▌")
 
                                 placeholder.markdown(full_response_text)
 
                             # search_context: thẩm định câu trả lời; nếu chưa đủ ý thì fallback đọc full content các chương reverse lookup
                             if (
                                 not is_v_home
+                                and not cached_answer
                                 and intent == "search_context"
                                 and full_response_text
                                 and not is_answer_sufficient(
@@ -946,12 +1171,15 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                     if related_nums:
                                         start, end = min(related_nums), max(related_nums)
                                 if start is not None and end is not None:
-                                    fallback_text, _ = ContextManager.load_chapters_by_range(
-                                        project_id, start, end,
-                                        token_limit=ContextManager.DEFAULT_CHAPTER_TOKEN_LIMIT,
+                                    # Khoảng dài: map-reduce trên cây tóm tắt thay vì cắt nội dung ở ký tự thứ 8000.
+                                    from core.summary_tree import build_range_context
+                                    fallback_text, _ = build_range_context(
+                                        project_id, prompt, start, end,
+                                        token_limit=CHAT_FALLBACK_TOKEN_LIMIT,
+                                        used_rows=used_rows,
                                     )
                                     if fallback_text:
-                                        extended_context = (context_text or "") + "\n\n--- NỘI DUNG CHƯƠNG (FALLBACK - đọc đầy đủ để trả lời đủ ý) ---\n" + fallback_text[:8000]
+                                        extended_context = (context_text or "") + "\n\n--- NỘI DUNG CHƯƠNG (FALLBACK - đọc đầy đủ để trả lời đủ ý) ---\n" + fallback_text
                                         retry_messages = [
                                             {"role": "system", "content": run_instruction + "\n\nTHÔNG TIN NGỮ CẢNH (CONTEXT):\n" + extended_context + "\n\nTrả lời ĐẦY ĐỦ dựa trên context, đặc biệt nội dung chương vừa bổ sung."},
                                             {"role": "user", "content": prompt},
@@ -976,15 +1204,32 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                     full_response_text += reminder
                                     placeholder.markdown(full_response_text)
 
-                            input_tokens = AIService.estimate_tokens(system_message + prompt)
-                            output_tokens = AIService.estimate_tokens(full_response_text)
-                            cost = AIService.calculate_cost(input_tokens, output_tokens, model)
+                            if use_answer_cache and not cached_answer and full_response_text:
+                                answer_cache.store(
+                                    project_id, cache_query, prompt_vec, answer_scope,
+                                    full_response_text, used_rows, sources,
+                                )
 
-                            if 'user' in st.session_state:
-                                CostManager.update_budget(st.session_state.user.id, cost)
+                            # Chi phí: usage thật từ stream (cost ledger đã ghi và sẽ cộng budget khi flush).
+                            # Provider không trả usage -> ghi bản ước lượng (len//4) vào ledger.
+                            usage_record = getattr(response, "usage_record", None) if response is not None else None
+                            if cached_answer:
+                                input_tokens, output_tokens, cost = 0, 0, 0.0
+                            elif usage_record:
+                                input_tokens = usage_record["prompt_tokens"]
+                                output_tokens = usage_record["completion_tokens"]
+                                cost = usage_record["cost"]
+                            else:
+                                input_tokens = AIService.estimate_tokens(system_message + prompt)
+                                output_tokens = AIService.estimate_tokens(full_response_text)
+                                cost = AIService.calculate_cost(input_tokens, output_tokens, model)
+                                record_usage(model, input_tokens, output_tokens, cost, call_site="chat_answer", estimated=True)
+
+                            if 'user' in st.session_state and cost > 0:
+                                request_flush()
                                 try:
                                     from utils.cache_helpers import invalidate_cache
-                                    invalidate_cache()
+                                    invalidate_cache(data_changed=False)
                                 except Exception:
                                     pass
 
@@ -994,10 +1239,8 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                     _v_home_save_message(user_id, "user", prompt, topic_start)
                                     _v_home_save_message(user_id, "model", full_response_text, topic_start)
                                 elif st.session_state.get('enable_history', True):
-                                    services = init_services()
-                                    supabase = services['supabase']
-
-                                    supabase.table("chat_history").insert([
+                                    # Lưu history ngầm (pipeline theo project); hiển thị ngay qua pending cho tới khi sync thấy dòng trong DB.
+                                    turn_rows = [
                                         {
                                             "story_id": project_id,
                                             "user_id": str(user_id) if user_id else None,
@@ -1008,7 +1251,8 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                                 "intent": intent,
                                                 "router_output": router_out,
                                                 "model": model,
-                                                "temperature": run_temperature
+                                                "temperature": run_temperature,
+                                                "answer_cache_hit": bool(cached_answer),
                                             }
                                         },
                                         {
@@ -1023,7 +1267,9 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                                 "tokens": input_tokens + output_tokens
                                             }
                                         }
-                                    ]).execute()
+                                    ]
+                                    _chat_history_add_pending(project_id, user_id, turn_rows)
+                                    post_turn_pipeline.submit(project_id, "save_history", _persist_turn_history, turn_rows)
 
                                 # update_data (ghi nhớ quy tắc): lưu pending xác nhận trước khi ghi Bible (chỉ V Work; thao tác theo chương xử lý ở nhánh khác)
                                 op_t = (router_out.get("data_operation_target") or "").strip()
@@ -1040,19 +1286,13 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                 if not is_v_home and can_write and user_id:
                                     _after_save_history_v_work(project_id, user_id, active_persona.get("role", ""))
 
-                                # Rule mining (chỉ V Work, chỉ khi bật toggle)
+                                # Rule mining + gợi ý Semantic Intent (chỉ V Work, chỉ khi bật toggle): chạy ngầm, hiện ở lần rerun sau
                                 if not is_v_home and can_write and st.session_state.get('auto_extract_rules_chat', False):
-                                    new_rules = RuleMiningSystem.extract_rules_raw(prompt, full_response_text)
-                                    if new_rules:
-                                        st.session_state['pending_new_rules'] = [{"content": r, "analysis": None} for r in new_rules]
-                                    # Offer add to Semantic Intent (nếu bật auto-create và không phải chat phiếm)
-                                    try:
-                                        r = init_services()["supabase"].table("settings").select("value").eq("key", "semantic_intent_no_auto_create").execute()
-                                        no_auto = r.data and r.data[0] and int(r.data[0].get("value", 0)) == 1
-                                    except Exception:
-                                        no_auto = False
-                                    if not no_auto and intent != "chat_casual":
-                                        st.session_state["pending_semantic_add"] = {"prompt": prompt, "response": full_response_text, "context": context_text, "intent": intent}
+                                    post_turn_pipeline.submit(
+                                        project_id, "rule_mining", _mine_rules_after_turn,
+                                        project_id, user_id, prompt, full_response_text, context_text, intent,
+                                    )
+                                    st.caption("🧐 Đang tìm luật mới trong hội thoại (chạy ngầm, hiện ở lần tải sau).")
 
                             elif not st.session_state.get('enable_history', True):
                                 st.caption("👻 Anonymous mode: History not saved & Rule mining disabled.")
@@ -1200,19 +1440,19 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                     if st.button("✅ Lưu tất cả", key=f"rule_save_all_{chat_mode}"):
                         services = init_services()
                         supabase = services.get("supabase") if services else None
+                        rows = []
                         for item in pending_list:
                             rule_content = item.get("content") or ""
                             analysis = item.get("analysis")
                             final_content = (analysis.get('merged_content') if analysis and analysis.get('status') == "MERGE" else rule_content) or rule_content
-                            vec = AIService.get_embedding(final_content)
-                            if supabase:
-                                try:
-                                    supabase.table("story_bible").insert({
-                                        "story_id": project_id, "entity_name": f"[RULE] {datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                                        "description": final_content, "embedding": vec, "source_chapter": 0
-                                    }).execute()
-                                except Exception:
-                                    pass
+                            rows.append({
+                                "story_id": project_id, "entity_name": f"[RULE] {datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                                "description": final_content, "source_chapter": 0
+                            })
+                        if supabase and rows:
+                            # Một lần embed cho cả danh sách luật, insert kèm vector.
+                            from core.embedding_backfill import insert_rows_with_embeddings
+                            insert_rows_with_embeddings(supabase, "story_bible", rows)
                         st.toast("Đã lưu tất cả luật.")
                         del st.session_state['pending_new_rules']
                 with col_all_b:
@@ -63,12 +63,12 @@ def render_chunking_tab(project_id):
             st.rerun()
     with c2:
         if st.button("🔄 Đồng bộ vector (Chunks)", key="chunking_sync_vec_btn", disabled=(chunks_no_vec == 0)):
-            import threading
-            from core.background_jobs import run_embedding_backfill
-            def _run():
-                run_embedding_backfill(project_id, bible_limit=0, chunks_limit=200)
-            threading.Thread(target=_run, daemon=True).start()
-            st.toast("Đã bắt đầu đồng bộ vector. Bấm Refresh sau vài giây để xem kết quả.")
+            from core.embedding_backfill import start_embedding_backfill_job
+            uid = getattr(st.session_state.get("user"), "id", None)
+            if start_embedding_backfill_job(project_id, str(uid) if uid else None, tables=["chunks"]):
+                st.toast("Đã bắt đầu đồng bộ vector. Xem tiến độ (dòng/s, ETA) ở tab Background Jobs.")
+            else:
+                st.toast("Project đang đồng bộ vector. Xem tiến độ ở tab Background Jobs.")
 
     r = supabase.table("chunks").select(
         "id, content, raw_content, source_type, meta_json, arc_id, chapter_id, sort_order"
@@ -1,9 +1,14 @@
+from datetime import datetime, timedelta
+
 import pandas as pd
 import streamlit as st
 
 from config import Config, init_services
 from utils.cache_helpers import get_user_budget_cached
 
+# Số ngày hiển thị trong Usage History (đọc từ rollup cost_usage_daily).
+USAGE_HISTORY_DAYS = 30
+
 
 def render_cost_tab():
     """Tab Cost Management"""
@@ -64,43 +69,86 @@ def render_cost_tab():
     st.markdown("---")
     st.subheader("📈 Usage History")
 
+    try:
+        from core.cost_ledger import flush_cost_ledger
+        flush_cost_ledger()
+    except Exception:
+        pass
+
     try:
         services = init_services()
         supabase = services['supabase']
+        since = (datetime.utcnow().date() - timedelta(days=USAGE_HISTORY_DAYS)).isoformat()
 
-        chat_history = supabase.table("chat_history") \
-            .select("created_at, metadata") \
-            .eq("story_id", st.session_state.get('project_id', '')) \
-            .order("created_at", desc=True) \
-            .limit(100) \
+        rollup = supabase.table("cost_usage_daily") \
+            .select("day, story_key, model, calls, prompt_tokens, completion_tokens, cached_tokens, cost, latency_ms_total") \
+            .eq("user_key", str(user_id)) \
+            .gte("day", since) \
+            .order("day") \
             .execute()
 
-        if chat_history.data:
-            costs = []
-            for chat in chat_history.data:
-                if chat.get('metadata') and 'cost' in chat['metadata']:
-                    try:
-                        cost_str = chat['metadata']['cost']
-                        if cost_str.startswith('$'):
-                            cost = float(cost_str[1:])
-                            costs.append({
-                                'date': chat['created_at'][:10],
-                                'cost': cost
-                            })
-                    except Exception:
-                        pass
-
-            if costs:
-                df_costs = pd.DataFrame(costs)
-                df_grouped = df_costs.groupby('date').sum().reset_index()
-                st.line_chart(df_grouped.set_index('date'))
+        if rollup.data:
+            df_usage = pd.DataFrame(rollup.data)
+            df_usage["cost"] = df_usage["cost"].astype(float)
+            project_id = st.session_state.get('project_id') or ""
+            scope = st.radio(
+                "Phạm vi",
+                ["Tất cả project", "Project hiện tại"],
+                horizontal=True,
+                key="cost_usage_scope",
+            )
+            if scope == "Project hiện tại":
+                df_usage = df_usage[df_usage["story_key"] == str(project_id)]
+            if df_usage.empty:
+                st.info("No cost data for this project")
             else:
-                st.info("No cost data available in recent history")
+                df_daily = df_usage.groupby("day")["cost"].sum().reset_index()
+                st.line_chart(df_daily.set_index("day"))
+                df_model = df_usage.groupby("model").agg({
+                    "calls": "sum",
+                    "prompt_tokens": "sum",
+                    "completion_tokens": "sum",
+                    "cached_tokens": "sum",
+                    "cost": "sum",
+                    "latency_ms_total": "sum",
+                }).reset_index()
+                df_model["avg_latency_ms"] = (df_model["latency_ms_total"] / df_model["calls"].clip(lower=1)).round(0)
+                df_model["cost"] = df_model["cost"].map(lambda c: f"${c:.4f}")
+                df_model = df_model.drop(columns=["latency_ms_total"]).sort_values("calls", ascending=False)
+                st.caption(f"{USAGE_HISTORY_DAYS} ngày gần nhất (usage thật từ API).")
+                st.dataframe(df_model, use_container_width=True, hide_index=True)
         else:
-            st.info("No chat history available")
+            st.info("No cost data available in recent history")
 
     except Exception as e:
         st.error(f"Error loading usage history: {e}")
+        st.caption("Bảng cost_usage_daily chưa tồn tại? Chạy schema_v7.9_migration.sql trên Supabase.")
+
+    st.markdown("---")
+    st.subheader("♻️ LLM Response Cache")
+    try:
+        from ai.llm_cache import llm_response_cache
+        cache_stats = llm_response_cache.stats()
+        rows = cache_stats.get("by_call_site") or []
+        hits = sum(r["hits"] for r in rows)
+        misses = sum(r["misses"] for r in rows)
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Hit rate", f"{(hits / (hits + misses) * 100) if (hits + misses) else 0:.1f}%")
+        c2.metric("Saved tokens", f"{sum(r['saved_prompt_tokens'] + r['saved_completion_tokens'] for r in rows):,}")
+        c3.metric("Saved cost", f"${sum(r['saved_cost'] for r in rows):.4f}")
+        if rows:
+            df_cache = pd.DataFrame(rows)
+            df_cache["hit_rate"] = df_cache["hit_rate"].map(lambda r: f"{r * 100:.1f}%")
+            df_cache["saved_cost"] = df_cache["saved_cost"].map(lambda c: f"${c:.4f}")
+            st.dataframe(df_cache, use_container_width=True, hide_index=True)
+        st.caption(f"{cache_stats.get('entries', 0)} mục, {cache_stats.get('bytes', 0) / 1024 / 1024:.1f} MB trên đĩa.")
+        # Cache dùng chung mọi user: nút chỉ xóa mục do chính user này tạo, giữ thống kê chung.
+        if st.button("🗑️ Xóa cache LLM của tôi", key="clear_llm_cache"):
+            removed = llm_response_cache.clear(user_id=user_id)
+            st.toast(f"Đã xóa {removed} mục cache.")
+            st.rerun()
+    except Exception as e:
+        st.caption(f"Không đọc được thống kê cache: {e}")
 
     st.markdown("---")
     st.subheader("💳 Add Credits")
@@ -114,6 +114,7 @@ def render_dashboard_tab(project_id):
                     # 2) Xóa Bible [CHAT] đã crystallize từ chat của user này + reset crystallize state
                     if user_id:
                         _clean_crystallize_for_user(supabase, project_id, str(user_id))
+                    st.session_state.pop("chat_history_store", None)
                     st.success("✅ Đã xóa lịch sử chat và điểm nhớ [CHAT] (crystallize) của bạn trong dự án. Bấm Refresh để cập nhật.")
                     from utils.cache_helpers import invalidate_cache
                     invalidate_cache()
@@ -17,6 +17,7 @@ from utils.auth_manager import check_permission
 from utils.cache_helpers import get_chapters_cached, get_chapter_content_cached
 from persona import PersonaSystem
 from core.background_jobs import create_job, run_job_worker
+from core.entity_name_index import entity_name_key
 
 
 def _get_existing_bible_entity_names_for_chapter(project_id, chap_num, supabase):
@@ -54,7 +55,7 @@ def _get_entity_ids_for_chapter(project_id, chap_num, supabase):
 def _run_extract_on_content(content, ext_persona, project_id, chap_num, exclude_existing=False, supabase=None):
     """Chạy extract Bible trên content; nếu exclude_existing thì loại item trùng với Bible hiện có của chương."""
     from ai_engine import AIService
-    strategy = analyze_split_strategy(content, file_type="story", context_hint="")
+    strategy = analyze_split_strategy(content, file_type="story", context_hint="", project_id=project_id)
     parts = execute_split_logic(content, strategy.get("split_type", "by_length"), strategy.get("split_value", "50000"))
     if not parts:
         parts = execute_split_logic(content, "by_length", "50000")
@@ -100,36 +101,23 @@ Nếu không tìm thấy: {{ "items": [] }}. Chỉ trả về JSON."""
             pass
     if exclude_existing and supabase:
         existing = _get_existing_bible_entity_names_for_chapter(project_id, chap_num, supabase)
-        def _norm(s):
-            return (s or "").strip().lower()
-        new_items = []
-        for item in all_items:
-            name = (item.get("entity_name") or "").strip()
-            if not name:
-                continue
-            if _norm(name) in {_norm(n) for n in existing}:
-                continue
-            if name in existing:
-                continue
-            # Check without prefix
-            if "]" in name and name.startswith("["):
-                rest = name[name.index("]") + 1:].strip()
-                if _norm(rest) in {_norm(n) for n in existing}:
-                    continue
-            new_items.append(item)
-        return new_items
+        # Khóa chuẩn hóa (bỏ prefix, dấu, hoa/thường): "[CHARACTER] Lý Long" trùng "ly long".
+        existing_keys = {entity_name_key(n) for n in existing}
+        all_items = [it for it in all_items if entity_name_key(it.get("entity_name") or "") not in existing_keys]
     unique_dict = {}
     for item in all_items:
-        name = item.get("entity_name", "").strip()
-        if name and (name not in unique_dict or len(item.get("description", "")) > len(unique_dict[name].get("description", ""))):
-            unique_dict[name] = item
+        key = entity_name_key(item.get("entity_name") or "")
+        if key and (key not in unique_dict or len(item.get("description", "")) > len(unique_dict[key].get("description", ""))):
+            unique_dict[key] = item
     return list(unique_dict.values())
 
 
-def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=None):
+def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=None, raise_errors=False):
     """
     Extract Bible cho nhiều chương trong một lần gọi API.
-    contents_list: [(ch_num, content), ...]. Trả về {ch_num: [item, ...]} (mỗi item có entity_name, type, description).
+    contents_list: [(key, content), ...]; key = số chương hoặc "N-pK" (phần K của chương N, xem core.batch_planner).
+    Trả về {key: [item, ...]} (mỗi item có entity_name, type, description); key model bỏ sót -> None.
+    raise_errors=True: lần gọi lỗi / không có phản hồi / JSON hỏng -> raise (job chương giữ dữ liệu cũ) thay vì trả rỗng.
     """
     if not contents_list:
         return {}
@@ -151,12 +139,14 @@ def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=No
         prompt_parts.append("")
     prompt_parts.append("---")
     prompt_parts.append(
-        f'⛔️ Trả về ĐÚNG MỘT JSON với key "chapters", value là mảng object: mỗi object có "chapter" (số chương) và "items" (mảng thực thể). '
+        f'⛔️ Trả về ĐÚNG MỘT JSON với key "chapters", value là mảng object: mỗi object có "chapter" (giữ nguyên key sau chữ CHƯƠNG, VD 12 hoặc "12-p2") và "items" (mảng thực thể). '
         f'Mỗi thực thể: "entity_name", "type" (đúng MỘT trong: {prefix_list_str}), "description" (tóm tắt dưới 50 từ). '
         'Ví dụ: {"chapters": [{"chapter": 1, "items": [{"entity_name": "A", "type": "CHARACTER", "description": "..."}]}, {"chapter": 2, "items": []}]}. Chỉ trả về JSON.'
     )
     full_prompt = "\n".join(prompt_parts)
-    out = {ch_num: [] for ch_num, _ in contents_list}
+    out = {ch_num: None for ch_num, _ in contents_list}
+    key_by_str = {str(ch_num): ch_num for ch_num in out}
+    resp = None
     try:
         resp = AIService.call_openrouter(
             messages=[{"role": "user", "content": full_prompt}],
@@ -166,6 +156,8 @@ def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=No
             response_format={"type": "json_object"},
         )
         if not resp or not resp.choices:
+            if raise_errors:
+                raise ValueError("Không có phản hồi từ LLM")
             return out
         raw = resp.choices[0].message.content.strip()
         obj = json.loads(AIService.clean_json_text(raw))
@@ -173,10 +165,14 @@ def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=No
         for block in chapters or []:
             ch = block.get("chapter")
             items = block.get("items")
-            if ch is not None and isinstance(items, list):
-                out[int(ch)] = items
+            key = key_by_str.get(str(ch).strip()) if ch is not None else None
+            if key is not None and isinstance(items, list):
+                out[key] = items
     except Exception:
-        pass
+        from ai.llm_cache import drop_cached_response
+        drop_cached_response(resp)
+        if raise_errors:
+            raise
     return out
 
 
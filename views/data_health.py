@@ -2,6 +2,7 @@
 """
 - Validation conflicts (validation_logs): Force Sync | Keep Exception.
 - Lỗi logic theo chương: chọn chương -> Soát chương (5 dimensions); hiển thị active + đã khắc phục.
+- Soát cả khoảng chương: tạo job nền (chapter_logic_check_range), tiến độ ở tab Background Jobs.
 """
 import streamlit as st
 
@@ -51,6 +52,44 @@ def render_data_health_tab(project_id):
         st.info("Chưa có chương nào. Tạo chương trong Workstation trước khi soát.")
         return
 
+    nums = sorted(int(f.get("chapter_number") or 0) for f in file_list if f.get("chapter_number") is not None)
+    if nums:
+        with st.expander("🧾 Soát cả khoảng chương (chạy nền, song song)"):
+            c1, c2 = st.columns(2)
+            with c1:
+                range_start = st.number_input("Từ chương", min_value=nums[0], max_value=nums[-1], value=nums[0], key="data_health_range_start")
+            with c2:
+                range_end = st.number_input("Đến chương", min_value=nums[0], max_value=nums[-1], value=nums[-1], key="data_health_range_end")
+            stale_only = st.checkbox(
+                "Chỉ soát lại chương đã thay đổi (nội dung hoặc Bible / quan hệ / timeline / rule liên quan)",
+                value=True,
+                key="data_health_range_stale_only",
+            )
+            c3, c4 = st.columns(2)
+            with c3:
+                if st.button("🔎 Xem chương cần soát lại", key="data_health_range_stale_btn", use_container_width=True):
+                    from core.chapter_logic_check import find_stale_chapters
+                    with st.spinner("Đang so sánh với lần soát gần nhất..."):
+                        st.session_state["data_health_stale_preview"] = find_stale_chapters(project_id, int(range_start), int(range_end))
+            with c4:
+                run_range = st.button("🚀 Soát khoảng này", key="data_health_range_btn", use_container_width=True)
+            stale_preview = st.session_state.get("data_health_stale_preview")
+            if stale_preview is not None:
+                if not stale_preview:
+                    st.success("Không có chương nào thay đổi kể từ lần soát gần nhất.")
+                else:
+                    st.caption("%s chương cần soát lại:" % len(stale_preview))
+                    for item in stale_preview[:50]:
+                        st.caption("• #%s %s — %s" % (item["chapter_number"], item["title"], ", ".join(item["reasons"])))
+            if run_range:
+                from core.chapter_logic_check import start_logic_check_job
+                uid = getattr(st.session_state.get("user"), "id", None)
+                st.session_state.pop("data_health_stale_preview", None)
+                if start_logic_check_job(project_id, str(uid) if uid else None, int(range_start), int(range_end), stale_only=stale_only):
+                    st.toast("Đã tạo job soát logic. Xem tiến độ từng chương ở tab Background Jobs.")
+                else:
+                    st.error("Không tạo được job.")
+
     chapter_options = {}
     for f in file_list:
         ch_id = f.get("id")
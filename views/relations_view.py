@@ -7,6 +7,8 @@ import streamlit as st
 from config import init_services
 from utils.auth_manager import check_permission
 from utils.cache_helpers import get_bible_list_cached, invalidate_cache, full_refresh
+from ai.answer_cache import invalidate_answer_rows
+from core.relation_graph import invalidate_relation_graph
 
 
 def render_relations_tab(project_id, persona):
@@ -72,6 +74,8 @@ def render_relations_tab(project_id, persona):
                                 "description": (new_desc or "").strip(),
                             }).eq("id", rel_id).execute()
                             st.session_state.pop("rel_editing_id", None)
+                            invalidate_answer_rows(project_id, "relation", [src_id, tgt_id])
+                            invalidate_relation_graph(project_id)
                             invalidate_cache()
                         except Exception as ex:
                             st.error(f"Lỗi: {ex}")
@@ -88,6 +92,8 @@ def render_relations_tab(project_id, persona):
                 if st.button("🗑️ Xóa", key=f"rel_del_{rel_id}"):
                     try:
                         supabase.table("entity_relations").delete().eq("id", rel_id).execute()
+                        invalidate_answer_rows(project_id, "relation", [src_id, tgt_id])
+                        invalidate_relation_graph(project_id)
                         invalidate_cache()
                     except Exception as ex:
                         st.error(f"Lỗi xóa: {ex}")
@@ -95,6 +95,7 @@ def render_review_tab(project_id, persona=None):
                     chap_num,
                     arc_id=chapter_arc_id,
                     include_archived=False,
+                    chapter_content=content or "",
                 ) if chapter_id else "(Chưa có chương.)"
                 prompt = f"""{review_prompt_template}
 
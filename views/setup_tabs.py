@@ -4,6 +4,7 @@ import streamlit as st
 from config import Config, init_services
 from persona import PersonaSystem, PERSONAS
 from utils.cache_helpers import invalidate_cache
+from ai.router_cache import bump_data_version
 
 
 def render_prefix_setup():
@@ -49,6 +50,7 @@ def render_prefix_setup():
                         supabase.table("bible_prefix_config").update(upd).eq("id", row["id"]).execute()
                         st.success("Đã cập nhật.")
                         invalidate_cache()
+                        bump_data_version()
                     except Exception as ex:
                         st.error(str(ex))
             with col_del:
@@ -61,6 +63,7 @@ def render_prefix_setup():
                             supabase.table("bible_prefix_config").delete().eq("id", row["id"]).execute()
                             st.success("Đã xóa tiền tố.")
                             invalidate_cache()
+                            bump_data_version()
                         except Exception as ex:
                             st.error(str(ex))
     st.caption("Prefix đặc biệt (không chỉnh trong bảng): RULE, CHAT, OTHER. OTHER chỉ dùng khi tạo Bible mà không gán được prefix từ danh sách trên.")
@@ -79,6 +82,7 @@ def render_prefix_setup():
                         "description": new_desc or "",
                         "sort_order": int(new_order),
                     }).execute()
+                    bump_data_version()
                     st.success("Đã thêm.")
                 except Exception as ex:
                     st.error(str(ex))
@@ -6,6 +6,7 @@ from config import init_services
 from ai_engine import get_timeline_events
 from utils.auth_manager import check_permission
 from utils.cache_helpers import full_refresh
+from core.timeline_index import timeline_events_deleted, timeline_events_written
 
 
 def render_timeline_tab(project_id):
@@ -66,6 +67,7 @@ def render_timeline_tab(project_id):
         if st.button("✅ Xóa", key="tl_confirm_del_yes"):
             try:
                 supabase.table("timeline_events").delete().eq("id", del_id).execute()
+                timeline_events_deleted(project_id, ids=[del_id])
                 st.session_state.pop("tl_confirm_delete_id", None)
                 st.toast("Đã xóa.")
             except Exception as e:
@@ -92,13 +94,14 @@ def render_timeline_tab(project_id):
         with c1:
             if st.button("💾 Lưu thay đổi", key="tl_edit_save"):
                 try:
-                    supabase.table("timeline_events").update({
+                    upd = supabase.table("timeline_events").update({
                         "title": new_title.strip() or "Sự kiện",
                         "description": new_desc.strip(),
                         "raw_date": new_date.strip(),
                         "event_type": new_type,
                         "event_order": new_order,
                     }).eq("id", edit_id).execute()
+                    timeline_events_written(project_id, upd.data)
                     for k in ["tl_editing_id", "tl_edit_title", "tl_edit_description", "tl_edit_raw_date", "tl_edit_event_type", "tl_edit_event_order"]:
                         st.session_state.pop(k, None)
                     st.toast("Đã lưu.")
@@ -125,7 +128,7 @@ def render_timeline_tab(project_id):
             if st.form_submit_button("Thêm"):
                 if new_title and new_title.strip():
                     try:
-                        supabase.table("timeline_events").insert({
+                        ins = supabase.table("timeline_events").insert({
                             "story_id": project_id,
                             "event_order": new_order,
                             "title": new_title.strip(),
@@ -133,6 +136,7 @@ def render_timeline_tab(project_id):
                             "raw_date": (new_date or "").strip(),
                             "event_type": new_type,
                         }).execute()
+                        timeline_events_written(project_id, ins.data)
                         st.toast("Đã thêm sự kiện.")
                     except Exception as e:
                         st.error(str(e))
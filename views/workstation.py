@@ -8,9 +8,68 @@ import streamlit as st
 
 from config import Config, init_services
 from ai_engine import AIService, HybridSearch, ContextManager, generate_chapter_metadata, analyze_split_strategy, execute_split_logic
+from utils.chunk_tools import iter_chunks_from_segments, load_file_text
 from utils.file_importer import UniversalLoader
 from utils.auth_manager import check_permission, submit_pending_change
 from utils.cache_helpers import get_chapters_cached, invalidate_cache, full_refresh
+from core.mention_index import schedule_chapter_mentions
+from core.summary_tree import schedule_summary_refresh
+
+# Import file: quá số ký tự này thì không dựng text toàn file trong session; chỉ cho cắt theo độ dài (đọc luồng, lưu dần).
+WORKSTATION_IMPORT_MAX_CHARS = 2_000_000
+WORKSTATION_STREAM_CHAPTER_CHARS = 20000
+WORKSTATION_STREAM_INSERT_BATCH = 20
+
+
+def _render_streaming_import(uploaded, project_id, preview_text):
+    """File lớn hơn WORKSTATION_IMPORT_MAX_CHARS: xem trước phần đầu, cắt theo độ dài thành nhiều chương (đọc lại file theo luồng)."""
+    st.warning(
+        f"File lớn hơn {WORKSTATION_IMPORT_MAX_CHARS:,} ký tự: không nạp toàn bộ vào chương hiện tại. "
+        "Có thể cắt theo độ dài thành nhiều chương mới (đọc và lưu dần, không giữ cả file trong bộ nhớ)."
+    )
+    st.text_area("Nội dung đầu file (xem trước)", value=preview_text[:50000], height=200, disabled=True, key="import_preview_stream")
+    chapter_chars = st.number_input(
+        "Số ký tự mỗi chương", min_value=2000, max_value=200000, value=WORKSTATION_STREAM_CHAPTER_CHARS, step=1000,
+        key="imp_stream_chapter_chars",
+    )
+    if not st.button("✂️ Cắt theo độ dài thành nhiều chương", type="primary", key="imp_stream_split"):
+        return
+    try:
+        svc = init_services()
+        if not svc:
+            st.error("Không kết nối được dịch vụ.")
+            return
+        supabase = svc["supabase"]
+        segments, err = UniversalLoader.load_segments(uploaded)
+        if err:
+            st.error(err)
+            return
+        r = supabase.table("chapters").select("chapter_number").eq("story_id", project_id).order("chapter_number", desc=True).limit(1).execute()
+        start_num = (r.data[0]["chapter_number"] + 1) if r.data else 1
+        status_text = st.empty()
+        batch = []
+        saved = 0
+        for part in iter_chunks_from_segments(segments, int(chapter_chars), 0):
+            num = start_num + saved + len(batch)
+            batch.append({"story_id": project_id, "chapter_number": num, "title": f"Phần {num - start_num + 1}", "content": part["content"]})
+            if len(batch) >= WORKSTATION_STREAM_INSERT_BATCH:
+                supabase.table("chapters").insert(batch).execute()
+                saved += len(batch)
+                batch = []
+                status_text.text(f"Đã lưu {saved} chương...")
+        if batch:
+            supabase.table("chapters").insert(batch).execute()
+            saved += len(batch)
+        status_text.empty()
+        if saved:
+            schedule_chapter_mentions(project_id, range(start_num, start_num + saved))
+            st.success(f"✅ Đã tạo {saved} chương (số {start_num} → {start_num + saved - 1}).")
+            st.session_state["workstation_import_mode"] = False
+            invalidate_cache()
+        else:
+            st.warning("File không có nội dung.")
+    except Exception as e:
+        st.error(f"Lỗi lưu: {e}")
 
 
 def render_workstation_tab(project_id, persona):
@@ -146,6 +205,8 @@ def render_workstation_tab(project_id, persona):
                     sb.table("chapters").update(payload).eq("story_id", pid).eq(
                         "chapter_number", num
                     ).execute()
+                    if payload.get("summary"):
+                        schedule_summary_refresh(pid, [num])
             except Exception as e:
                 print(f"Background metadata update error: {e}")
 
@@ -164,6 +225,7 @@ def render_workstation_tab(project_id, persona):
                             if chapter_arc_id:
                                 payload["arc_id"] = chapter_arc_id
                             supabase.table("chapters").upsert(payload, on_conflict="story_id, chapter_number").execute()
+                            schedule_chapter_mentions(project_id, [chap_num])
                             st.session_state["update_trigger"] = st.session_state.get("update_trigger", 0) + 1
                             st.toast("Đã lưu & Đang cập nhật metadata...", icon="💾")
                             st.session_state.current_file_content = current_content
@@ -205,7 +267,7 @@ def render_workstation_tab(project_id, persona):
                     if chap_arc_id:
                         try:
                             from core.arc_service import ArcService
-                            arc_row = ArcService.get_arc(chap_arc_id)
+                            arc_row = ArcService.get_arc(chap_arc_id, story_id=project_id)
                             arc_archived = arc_row and arc_row.get("status") == "archived"
                         except Exception:
                             pass
@@ -263,9 +325,11 @@ def render_workstation_tab(project_id, persona):
                 key="workstation_file_upload",
             )
             if uploaded:
-                text, err = UniversalLoader.load(uploaded)
+                text, truncated, err = load_file_text(uploaded, WORKSTATION_IMPORT_MAX_CHARS)
                 if err:
                     st.error(err)
+                elif text and truncated:
+                    _render_streaming_import(uploaded, project_id, text)
                 elif text:
                     st.session_state["workstation_imported_text"] = text
                     # Lưu phần mở rộng để áp logic cắt: PDF không cắt, CSV/XLS dùng sheet/row
@@ -338,9 +402,10 @@ def render_workstation_tab(project_id, persona):
                         # AI Analyzer: phân tích mẫu rải rác
                         if st.button("🤖 AI tìm quy luật phân cách", type="primary", key="split_analyze"):
                             with st.spinner("AI đang phân tích mẫu rải rác (80 đầu + 80 giữa + 80 cuối)..."):
-                                strategy = analyze_split_strategy(text_for_split, file_type=file_type_choice, context_hint=context_hint)
+                                strategy = analyze_split_strategy(text_for_split, file_type=file_type_choice, context_hint=context_hint, project_id=project_id)
                                 st.session_state["workstation_split_strategy"] = strategy
                             st.success(f"Tìm thấy quy luật: **{strategy['split_type']}** = `{strategy['split_value']}`")
+                            st.caption(f"Nguồn: {strategy.get('source', 'llm')} · độ tin cậy {float(strategy.get('confidence', 0) or 0):.2f} (heuristic đủ chắc thì không gọi LLM).")
                         
                         strategy = st.session_state.get("workstation_split_strategy")
                         if strategy:
@@ -387,6 +452,7 @@ def render_workstation_tab(project_id, persona):
                                                 }).execute()
                                                 progress_bar.progress((i + 1) / total)
                                             
+                                            schedule_chapter_mentions(project_id, range(start_num, start_num + total))
                                             status_text.empty()
                                             progress_bar.empty()
                                             st.success(f"✅ Đã tạo {len(preview)} chương (số {start_num} → {start_num + len(preview) - 1}).")